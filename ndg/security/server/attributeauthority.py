@@ -34,6 +34,7 @@ from ndg.security.common.utils.classfactory import instantiateClass
 from ndg.security.common.utils.factory import importModuleObject
 from ndg.security.common.utils.configfileparsers import (
     CaseSensitiveConfigParser)
+from ndg.security.server.utils import metrics
 
 
 class AttributeAuthorityError(Exception):
@@ -92,6 +93,10 @@ class AttributeAuthority(object):
 
     CONFIG_LIST_SEP_PAT = re.compile(',\s*')
 
+    ATTRIBUTE_QUERY_TIMER_NAME = 'ndg_security_attributeauthority_query_seconds'
+    ATTRIBUTE_QUERY_TIMER_DOC = ('Time taken by the attribute interface to '
+                                 'respond to SAML attribute queries')
+
 
     ATTRIBUTE_INTERFACE_PROPERTY_DEFAULTS = {
         ATTRIBUTE_INTERFACE_MOD_FILEPATH_OPTNAME:  '',
@@ -482,7 +487,13 @@ class AttributeAuthority(object):
 
         try:
             # Return a dictionary of name, value pairs
-            self.attributeInterface.getAttributes(attributeQuery, samlResponse)
+            with metrics.registry.timer(
+                    self.__class__.ATTRIBUTE_QUERY_TIMER_NAME,
+                    self.__class__.ATTRIBUTE_QUERY_TIMER_DOC,
+                    attributeInterface=type(self.attributeInterface).__name__
+                    ).time():
+                self.attributeInterface.getAttributes(attributeQuery,
+                                                      samlResponse)
 
         except InvalidUserId as e:
             log.exception(e)
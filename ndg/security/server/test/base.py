@@ -33,7 +33,43 @@ def set_config_dir_envvar():
 def set_integration_dir_envvar():
     if INTEGRATION_DIR_ENVVARNAME not in os.environ:
         os.environ[INTEGRATION_DIR_ENVVARNAME] = TEST_INTEGRATION_DIR
-    
+
+def make_pem_cert(commonName='localhost', lifetime=86400, age=0):
+    '''Make a self-signed certificate and private key.  Use for tests which
+    need credentials valid at the current time rather than the test PKI files
+
+    @param commonName: certificate subject common name
+    @type commonName: basestring
+    @param lifetime: validity period of the certificate in seconds
+    @type lifetime: int
+    @param age: time in seconds since the certificate became valid.  Set it
+    greater than lifetime for an expired certificate
+    @type age: int
+    @return: PEM encoded certificate and private key
+    @rtype: tuple
+    '''
+    from datetime import datetime, timedelta, timezone
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, commonName)])
+    notBefore = datetime.now(timezone.utc) - timedelta(seconds=age)
+    builder = x509.CertificateBuilder()
+    builder = builder.subject_name(name).issuer_name(name)
+    builder = builder.public_key(key.public_key())
+    builder = builder.serial_number(x509.random_serial_number())
+    builder = builder.not_valid_before(notBefore)
+    builder = builder.not_valid_after(notBefore + timedelta(seconds=lifetime))
+    cert = builder.sign(key, hashes.SHA256())
+
+    return (cert.public_bytes(serialization.Encoding.PEM),
+            key.private_bytes(serialization.Encoding.PEM,
+                              serialization.PrivateFormat.TraditionalOpenSSL,
+                              serialization.NoEncryption()))
+
         
 class BaseTestCase(unittest.TestCase):
     '''Convenience base class from which other unit tests can extend.  Its
@@ -0,0 +1,13 @@
+"""End-to-end benchmarks for the PEP -> authorisation service -> PIP ->
+Attribute Authority chain.  Run with:
+
+python -m ndg.security.server.test.benchmark.runner --help
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
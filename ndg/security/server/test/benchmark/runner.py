@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+"""Drive a mix of requests through a PEP protected application backed by the
+test authorisation service and attribute service and report throughput and
+latency percentiles for each scenario and each instrumented stage.  Results
+are written to a JSON file for comparison between revisions e.g.
+
+python -m ndg.security.server.test.benchmark.runner -n 2000 -c 4 \\
+    -m permit:cached=4,attribute_permit:uncached=2,deny:uncached=1 \\
+    -o results-$(git rev-parse --short HEAD).json
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import logging
+log = logging.getLogger(__name__)
+
+import json
+import optparse
+import platform
+import random
+import subprocess
+import sys
+from collections import Counter
+from datetime import datetime
+from os import path
+from threading import Thread
+from time import perf_counter
+
+import webob
+
+from ndg.security.server.utils import metrics
+from ndg.security.server.test.test_util import TestUserDatabase
+from ndg.security.server.test.benchmark import services
+from ndg.security.server.test.benchmark.stats import (summarise,
+                                                      RecordingRegistry)
+
+SESSION_KEYNAME = 'beaker.session.ndg.security'
+BASE_URI = 'http://localhost'
+
+# Scenario name -> (path, remote user).  URIs and outcomes are determined by
+# test/config/authorisationservice/policy.xml
+SCENARIOS = {
+    # Permitted by a rule with no subject conditions - no attribute query
+    'permit': ('/test_200', TestUserDatabase.OPENID_URI),
+
+    # Permitted following a PIP attribute query to the attribute service
+    'attribute_permit': ('/test_accessGrantedToSecuredURI',
+                         TestUserDatabase.OPENID_URI),
+
+    # Denied - anonymous user requesting a secured URI
+    'deny': ('/test_accessGrantedToSecuredURI', ''),
+}
+CACHED, UNCACHED = 'cached', 'uncached'
+
+DEFAULT_MIX = 'permit:cached=4,attribute_permit:uncached=2,deny:uncached=1'
+
+
+class BenchmarkSession(dict):
+    """Stand in for a beaker session.  The PEP decision cache is held here so
+    reusing an instance between requests gives cached decisions
+    """
+    def save(self):
+        pass
+
+    def delete(self):
+        self.clear()
+
+
+def parse_mix(mix):
+    '''Parse a request mix specification of the form
+    <scenario>:<cached|uncached>=<weight>,...
+
+    @return: list of (scenario, caching, weight) tuples
+    @rtype: list
+    @raise ValueError: invalid specification
+    '''
+    entries = []
+    for item in mix.split(','):
+        item = item.strip()
+        if not item:
+            continue
+
+        try:
+            name, weight = item.split('=')
+            scenario, caching = name.strip().split(':')
+            weight = float(weight)
+
+        except ValueError:
+            raise ValueError('Expecting <scenario>:<cached|uncached>=<weight> '
+                             'for request mix item; got %r' % item)
+
+        if scenario not in SCENARIOS:
+            raise ValueError('Unknown scenario %r; expecting one of %r' %
+                             (scenario, sorted(SCENARIOS.keys())))
+
+        if caching not in (CACHED, UNCACHED):
+            raise ValueError('Expecting %r or %r for caching; got %r' %
+                             (CACHED, UNCACHED, caching))
+
+        entries.append((scenario, caching, weight))
+
+    if not entries:
+        raise ValueError('Empty request mix')
+
+    return entries
+
+
+def make_plan(entries, nRequests, seed=0):
+    '''Make a reproducible sequence of requests drawn from the mix
+
+    @return: list of "<scenario>:<caching>" labels
+    @rtype: list
+    '''
+    labels = ['%s:%s' % (scenario, caching)
+              for scenario, caching, weight in entries]
+    weights = [weight for scenario, caching, weight in entries]
+    return random.Random(seed).choices(labels, weights=weights, k=nRequests)
+
+
+class Worker(object):
+    """Send requests to its own copy of the secured application"""
+    def __init__(self, plan):
+        self.plan = plan
+        self.app = services.load_secured_app()
+        self.sessions = {}
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = Counter()
+
+    def _start_response(self, status, headers, exc_info=None):
+        self._status = status
+
+    def request(self, label):
+        '''Make a single request for the scenario given by label'''
+        scenario, caching = label.split(':')
+        pathInfo, remoteUser = SCENARIOS[scenario]
+
+        if caching == CACHED:
+            session = self.sessions.setdefault(label, BenchmarkSession())
+        else:
+            session = BenchmarkSession()
+
+        environ = webob.Request.blank(BASE_URI + pathInfo).environ
+        environ[SESSION_KEYNAME] = session
+        if remoteUser:
+            environ['REMOTE_USER'] = remoteUser
+
+        self._status = None
+        start = perf_counter()
+        try:
+            response = self.app(environ, self._start_response)
+            for _ in response:
+                pass
+
+            if hasattr(response, 'close'):
+                response.close()
+
+        except Exception:
+            log.exception('Error calling secured app for %r', label)
+            self.errors[label] += 1
+            return
+
+        elapsed = perf_counter() - start
+
+        self.latencies.setdefault(label, []).append(elapsed)
+        status = (self._status or '').split(' ', 1)[0]
+        self.statuses.setdefault(label, Counter())[status] += 1
+
+    def run(self):
+        for label in self.plan:
+            self.request(label)
+
+
+def git_revision():
+    '''Get the current commit if running from a git working copy'''
+    try:
+        return subprocess.check_output(
+                    ['git', 'rev-parse', 'HEAD'],
+                    cwd=path.dirname(path.abspath(__file__)),
+                    stderr=subprocess.DEVNULL).decode('utf-8').strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(nRequests=1000, concurrency=1, mix=DEFAULT_MIX, warmup=50,
+        mode='inprocess', workers=None, seed=0):
+    '''Run benchmark and return results dictionary
+
+    @param nRequests: total number of timed requests
+    @type nRequests: int
+    @param concurrency: number of driver threads
+    @type concurrency: int
+    @param mix: request mix specification - see parse_mix
+    @type mix: string
+    @param warmup: number of untimed requests per driver thread
+    @type warmup: int
+    @param mode: 'inprocess' or 'gunicorn'
+    @type mode: string
+    @param workers: number of gunicorn workers per service
+    @type workers: int
+    @param seed: random seed for request plan
+    @type seed: int
+    @rtype: dict
+    '''
+    entries = parse_mix(mix)
+
+    if mode == 'inprocess':
+        launcher = services.InProcessServices()
+    elif mode == 'gunicorn':
+        launcher = services.GunicornServices(workers=workers)
+    else:
+        raise ValueError('Expecting "inprocess" or "gunicorn" mode; got %r' %
+                         mode)
+
+    # Record every timing so that exact percentiles can be calculated
+    registry = RecordingRegistry()
+    metrics.registry = registry
+
+    launcher.start()
+    try:
+        plan = make_plan(entries, nRequests, seed=seed)
+        drivers = [Worker(plan[i::concurrency]) for i in range(concurrency)]
+
+        # Warm up connections, policy and caches then reset recorded timings
+        warmupPlan = make_plan(entries, warmup, seed=seed + 1)
+        for driver in drivers:
+            for label in warmupPlan:
+                driver.request(label)
+
+            driver.latencies = {}
+            driver.statuses = {}
+            driver.errors = Counter()
+
+        registry.clear()
+
+        threads = [Thread(target=driver.run) for driver in drivers]
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        elapsed = perf_counter() - start
+
+    finally:
+        launcher.stop()
+
+    scenarios = {}
+    for scenario, caching, weight in entries:
+        label = '%s:%s' % (scenario, caching)
+        latencies = []
+        statuses = Counter()
+        errors = 0
+        for driver in drivers:
+            latencies += driver.latencies.get(label, [])
+            statuses.update(driver.statuses.get(label, {}))
+            errors += driver.errors[label]
+
+        scenarios[label] = {
+            'weight': weight,
+            'errors': errors,
+            'statuses': dict(statuses),
+            'throughput': len(latencies) / elapsed,
+            'latency': summarise(latencies)
+        }
+
+    allLatencies = []
+    for driver in drivers:
+        for latencies in driver.latencies.values():
+            allLatencies += latencies
+
+    return {
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'mode': mode,
+        'requests': nRequests,
+        'concurrency': concurrency,
+        'warmup': warmup,
+        'mix': mix,
+        'elapsed': elapsed,
+        'throughput': len(allLatencies) / elapsed,
+        'latency': summarise(allLatencies),
+        'scenarios': scenarios,
+        'stages': registry.stages()
+    }
+
+
+def main(argv=sys.argv[1:]):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option("-n",
+                      "--requests",
+                      dest="nRequests",
+                      default=1000,
+                      type='int',
+                      help="total number of timed requests")
+
+    parser.add_option("-c",
+                      "--concurrency",
+                      dest="concurrency",
+                      default=1,
+                      type='int',
+                      help="number of concurrent driver threads")
+
+    parser.add_option("-m",
+                      "--mix",
+                      dest="mix",
+                      default=DEFAULT_MIX,
+                      help="request mix as comma separated "
+                           "<scenario>:<cached|uncached>=<weight> items where "
+                           "scenario is one of %s [default: %%default]" %
+                           ', '.join(sorted(SCENARIOS.keys())))
+
+    parser.add_option("-w",
+                      "--warmup",
+                      dest="warmup",
+                      default=50,
+                      type='int',
+                      help="number of untimed requests per driver thread")
+
+    parser.add_option("--mode",
+                      dest="mode",
+                      default='inprocess',
+                      choices=('inprocess', 'gunicorn'),
+                      help="run services in-process in threads or under "
+                           "local gunicorn servers.  Per stage timings for the "
+                           "authorisation and attribute services are only "
+                           "available in-process")
+
+    parser.add_option("--workers",
+                      dest="workers",
+                      default=None,
+                      type='int',
+                      help="gunicorn workers per service")
+
+    parser.add_option("-s",
+                      "--seed",
+                      dest="seed",
+                      default=0,
+                      type='int',
+                      help="random seed for the request sequence")
+
+    parser.add_option("-o",
+                      "--output",
+                      dest="output",
+                      default='benchmark-results.json',
+                      help="JSON results file path")
+
+    parser.add_option("-v",
+                      "--verbose",
+                      dest="verbose",
+                      action="store_true",
+                      default=False,
+                      help="log at INFO level")
+
+    opt = parser.parse_args(argv)[0]
+
+    # Debug logging would dominate the timings
+    logging.basicConfig(level=opt.verbose and logging.INFO or logging.WARNING)
+
+    results = run(nRequests=opt.nRequests,
+                  concurrency=opt.concurrency,
+                  mix=opt.mix,
+                  warmup=opt.warmup,
+                  mode=opt.mode,
+                  workers=opt.workers,
+                  seed=opt.seed)
+
+    with open(opt.output, 'w') as resultsFile:
+        json.dump(results, resultsFile, indent=2, sort_keys=True)
+
+    print('%d requests in %.2fs: %.1f requests/s' % (
+                        results['latency']['count'], results['elapsed'],
+                        results['throughput']))
+    for name, result in sorted(results['scenarios'].items()) + \
+                        sorted(results['stages'].items()):
+        latency = result.get('latency', result)
+        if latency['count']:
+            print('%-60s n=%-6d p50=%.2fms p95=%.2fms p99=%.2fms' % (
+                        name, latency['count'], latency['p50_ms'],
+                        latency['p95_ms'], latency['p99_ms']))
+
+    print('Results written to %s' % opt.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""Start the test attribute and authorisation services for benchmarking either
+in-process in background threads or as local gunicorn servers
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import logging
+log = logging.getLogger(__name__)
+
+from os import path
+import socket
+import time
+import multiprocessing
+from threading import Thread
+
+import paste.httpserver
+from paste.deploy import loadapp
+from OpenSSL import SSL
+
+from ndg.security.server.test.base import BaseTestCase, NDGSEC_TEST_CONFIG_DIR
+from ndg.security.server.test.test_util import TestUserDatabase
+
+THIS_DIR = path.dirname(path.abspath(__file__))
+SECURED_APP_INI_FILEPATH = path.join(THIS_DIR, 'securedapp.ini')
+
+ATTRIBUTE_SERVICE_INI_FILEPATH = path.join(NDGSEC_TEST_CONFIG_DIR,
+                                           'attributeauthority',
+                                           'sitea',
+                                           'attribute-service.ini')
+AUTHORISATION_SERVICE_INI_FILEPATH = path.join(NDGSEC_TEST_CONFIG_DIR,
+                                               'authorisationservice',
+                                               'authorisation-service.ini')
+
+# Service name, ini file and port.  Ports match those expected by the
+# authorisation service PIP mapping file and the secured app PEP settings
+SERVICES = (
+    ('attribute-service', ATTRIBUTE_SERVICE_INI_FILEPATH,
+     BaseTestCase.SITEA_SSL_ATTRIBUTEAUTHORITY_PORTNUM),
+    ('authorisation-service', AUTHORISATION_SERVICE_INI_FILEPATH,
+     BaseTestCase.AUTHORISATION_SERVICE_PORTNUM)
+)
+
+
+class SecuredApp(object):
+    '''Trivial application protected by the PEP in securedapp.ini'''
+    RESPONSE = b'Benchmark secured application'
+
+    def __call__(self, environ, start_response):
+        start_response('200 OK',
+                       [('Content-type', 'text/plain'),
+                        ('Content-length', str(len(self.__class__.RESPONSE)))])
+        return [self.__class__.RESPONSE]
+
+    @classmethod
+    def app_factory(cls, global_conf, **app_conf):
+        return cls()
+
+
+def load_secured_app(cfgFilePath=SECURED_APP_INI_FILEPATH):
+    '''Load the PEP protected application.  Nb. the PEP keeps a reference to
+    the current session as an instance attribute so each driver thread needs
+    its own copy of the application
+
+    @param cfgFilePath: ini file for the secured application
+    @type cfgFilePath: string
+    @return: WSGI application
+    @rtype: callable
+    '''
+    return loadapp('config:%s' % cfgFilePath)
+
+
+def wait_for_port(port, host='localhost', timeout=30.):
+    '''Wait until a server is accepting connections on the given port
+
+    @raise IOError: timeout reached
+    '''
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1.).close()
+            return
+
+        except socket.error:
+            if time.time() > deadline:
+                raise IOError('Timed out waiting for server on %s:%d' %
+                              (host, port))
+            time.sleep(.1)
+
+
+def _make_ssl_context(certFilePath=BaseTestCase.SSL_CERT_FILEPATH,
+                      priKeyFilePath=BaseTestCase.SSL_PRIKEY_FILEPATH):
+    ssl_context = SSL.Context(SSL.SSLv23_METHOD)
+    ssl_context.set_options(SSL.OP_NO_SSLv2)
+
+    ssl_context.use_privatekey_file(priKeyFilePath)
+    ssl_context.use_certificate_file(certFilePath)
+    return ssl_context
+
+
+def _run_gunicorn(cfgFilePath, port, workers, logLevel):
+    '''Target for gunicorn service processes'''
+    from ndg.security.server.utils.wsgi_utils import GunicornServerApp
+
+    logging.basicConfig(level=logLevel)
+    app = loadapp('config:%s' % cfgFilePath)
+    options = {
+        'bind': '127.0.0.1:%d' % port,
+        'keyfile': BaseTestCase.SSL_PRIKEY_FILEPATH,
+        'certfile': BaseTestCase.SSL_CERT_FILEPATH,
+        'workers': workers,
+        'loglevel': logging.getLevelName(logLevel).lower()
+    }
+    GunicornServerApp(app, options).run()
+
+
+class InProcessServices(object):
+    """Run the attribute and authorisation services in background threads of
+    this process.  All stages of the chain then record into the same metrics
+    registry so per stage timings are available
+    """
+    def __init__(self, services=SERVICES):
+        self._services = services
+        self._servers = []
+        self._threads = []
+
+    def start(self):
+        TestUserDatabase.init_db()
+
+        for name, cfgFilePath, port in self._services:
+            log.info('Starting %s on port %d ...', name, port)
+            app = loadapp('config:%s' % cfgFilePath)
+            server = paste.httpserver.serve(app, host='127.0.0.1', port=port,
+                                            start_loop=False,
+                                            ssl_context=_make_ssl_context())
+            thread = Thread(target=server.serve_forever, name=name)
+            thread.daemon = True
+            thread.start()
+
+            self._servers.append(server)
+            self._threads.append(thread)
+
+        for name, cfgFilePath, port in self._services:
+            wait_for_port(port)
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+        for thread in self._threads:
+            thread.join(5.)
+
+        self._servers = []
+        self._threads = []
+
+
+class GunicornServices(object):
+    """Run the attribute and authorisation services as local gunicorn servers.
+    Only the PEP stages running in the benchmark process are timed per stage
+    """
+    def __init__(self, services=SERVICES, workers=None,
+                 logLevel=logging.WARNING):
+        self._services = services
+        self._workers = workers or (multiprocessing.cpu_count() * 2) + 1
+        self._logLevel = logLevel
+        self._processes = []
+
+    def start(self):
+        TestUserDatabase.init_db()
+
+        for name, cfgFilePath, port in self._services:
+            log.info('Starting %s under gunicorn on port %d with %d '
+                     'workers ...', name, port, self._workers)
+            process = multiprocessing.Process(target=_run_gunicorn,
+                                              args=(cfgFilePath, port,
+                                                    self._workers,
+                                                    self._logLevel),
+                                              name=name)
+            process.start()
+            self._processes.append(process)
+
+        for name, cfgFilePath, port in self._services:
+            wait_for_port(port)
+
+    def stop(self):
+        for process in self._processes:
+            process.terminate()
+
+        for process in self._processes:
+            process.join(10.)
+
+        self._processes = []
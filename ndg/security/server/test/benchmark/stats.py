@@ -0,0 +1,71 @@
+"""Latency statistics for benchmarks
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+from ndg.security.server.utils.metrics import (MetricsRegistry, Timer,
+                                               summarise)
+
+
+class RecordingTimer(Timer):
+    """Timer which also keeps every observation so that exact percentiles can
+    be calculated
+    """
+    __slots__ = ('observations',)
+
+    def __init__(self, *arg, **kw):
+        super(RecordingTimer, self).__init__(*arg, **kw)
+        self.observations = []
+
+    def observe(self, elapsed):
+        if not self.registry.enabled:
+            return
+
+        self.observations.append(elapsed)
+        super(RecordingTimer, self).observe(elapsed)
+
+
+class RecordingRegistry(MetricsRegistry):
+    """Metrics registry creating RecordingTimer instances.  Install in place of
+    ndg.security.server.utils.metrics.registry before the benchmark starts
+    """
+    def timer(self, name, doc='', buckets=None, **labels):
+        if buckets is None:
+            buckets = self.__class__.DEFAULT_BUCKETS
+
+        return self._getChild(name, self.__class__.TIMER_TYPE, doc, labels,
+                              lambda key: RecordingTimer(self, key,
+                                                         tuple(buckets)))
+
+    def stages(self):
+        '''Summarise all timers keyed by stage name e.g.
+        "pep_phase{phase=cache_lookup}"
+        '''
+        with self._lock:
+            metrics = [(name, list(children.values()))
+                       for name, (metricType, doc, children)
+                       in self._metrics.items()
+                       if metricType == self.__class__.TIMER_TYPE]
+
+        stages = {}
+        for name, children in metrics:
+            stageName = name.replace('ndg_security_', '', 1)
+            if stageName.endswith('_seconds'):
+                stageName = stageName[:-len('_seconds')]
+
+            for timer in children:
+                if timer.labels:
+                    label = '%s{%s}' % (stageName,
+                                        ','.join(['%s=%s' % i
+                                                  for i in timer.labels]))
+                else:
+                    label = stageName
+
+                stages[label] = summarise(timer.observations)
+
+        return stages
@@ -0,0 +1,153 @@
+"""Unit tests for replay of authorisation traffic captured by the PEP
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import unittest
+import io
+import json
+import shutil
+import tempfile
+from os import path
+from unittest import mock
+
+import webob
+
+from ndg.saml.saml2.core import AuthzDecisionStatement, DecisionType
+from ndg.saml.saml2.binding.soap.client.authzdecisionquery import \
+                                            AuthzDecisionQuerySslSOAPBinding
+
+from ndg.security.server.test.unit.wsgi.authz.test_authz import \
+                                                            BeakerSessionStub
+from ndg.security.server.test.unit.wsgi.authz.test_pep import (app,
+                                                               make_response)
+from ndg.security.server.utils.capture import hashSubject, readCaptureLog
+from ndg.security.server.wsgi.authz.pep import SamlPepFilter
+from ndg.security.server.xacml.ctx_handler import replay
+
+
+PERMITTED_URI = 'http://localhost/data/permitted'
+DENIED_URI = 'http://localhost/data/denied'
+
+
+def make_decision_response(resource, decision):
+    """Make a SAML response with a single decision for the resource"""
+    statement = AuthzDecisionStatement()
+    statement.resource = resource
+    statement.decision = DecisionType(decision)
+
+    response = make_response()
+    response.assertions[0].authzDecisionStatements.append(statement)
+    return response
+
+
+class AuthzServiceBindingStub(AuthzDecisionQuerySslSOAPBinding):
+    """Authorisation decision query binding returning the decision set for
+    each resource without calling an authorisation service
+    """
+    def __init__(self, decisions, **kw):
+        super(AuthzServiceBindingStub, self).__init__(**kw)
+        self.decisions = decisions
+
+    def send(self, query, uri=None):
+        return make_decision_response(query.resource,
+                                      self.decisions[query.resource])
+
+
+class CtxHandlerStub(object):
+    """Stand-in for the context handler and PDP replayed against, returning
+    the decision set for each resource
+    """
+    def __init__(self, decisions):
+        self.decisions = decisions
+
+    def handlePEPRequest(self, pepRequest):
+        resource = pepRequest.authzDecisionQuery.resource
+        return make_decision_response(resource, self.decisions[resource])
+
+
+class ReplayTestCase(unittest.TestCase):
+    '''Capture requests made through the PEP and replay them'''
+    USERNAME = 'https://openid.localhost/philip.kershaw'
+    SALT = 'salt'
+    DECISIONS = {
+        PERMITTED_URI: DecisionType.PERMIT_STR,
+        DENIED_URI: DecisionType.DENY_STR
+    }
+
+    def setUp(self):
+        self.captureDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.captureDir)
+        self.captureFilePath = path.join(self.captureDir, 'pep-capture.log')
+
+        pep = SamlPepFilter(app)
+        pep.client_binding = AuthzServiceBindingStub(
+                                                dict(self.__class__.DECISIONS))
+        pep.authzServiceURI = 'https://localhost:9443/authorisation-service'
+        pep.sessionKey = 'beaker.session.ndg.security'
+        pep.captureSubjectSalt = self.__class__.SALT
+        pep.captureFilePath = self.captureFilePath
+        self.addCleanup(pep.captureLog.close)
+
+        for uri, username in ((PERMITTED_URI, self.__class__.USERNAME),
+                              (DENIED_URI, self.__class__.USERNAME),
+                              (PERMITTED_URI, None)):
+            environ = {pep.sessionKey: BeakerSessionStub()}
+            if username is not None:
+                environ['REMOTE_USER'] = username
+
+            webob.Request.blank(uri, environ=environ).get_response(pep)
+
+        self.records = list(readCaptureLog(self.captureFilePath))
+
+    def test01Capture(self):
+        self.assertEqual([(record['r'], record['d'])
+                          for record in self.records],
+                         [(PERMITTED_URI, 'Permit'),
+                          (DENIED_URI, 'Deny'),
+                          (PERMITTED_URI, 'Permit')])
+
+        self.assertEqual(self.records[0]['s'],
+                         hashSubject(self.__class__.USERNAME,
+                                     salt=self.__class__.SALT))
+        self.assertEqual(self.records[2]['s'], '')
+
+    def test02ReplayDecisionsMatch(self):
+        handler = CtxHandlerStub(dict(self.__class__.DECISIONS))
+        results = list(replay.replay(handler, self.records))
+        self.assertEqual(len(results), 3)
+        for record, decision, elapsed in results:
+            self.assertEqual(decision, record['d'])
+
+    def test03ChangedDecisionReported(self):
+        handler = CtxHandlerStub(dict(self.__class__.DECISIONS))
+        handler.decisions[DENIED_URI] = DecisionType.PERMIT_STR
+
+        outputFilePath = path.join(self.captureDir, 'replay.json')
+        argv = ['-p', 'policy.xml', '-m', 'pip-mapping.txt',
+                '-c', self.captureFilePath, '-a', 'pip-capture.log',
+                '-o', outputFilePath]
+
+        with mock.patch.object(replay, 'makeCtxHandler',
+                               return_value=handler), \
+             mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            status = replay.main(argv)
+
+        self.assertEqual(status, 1)
+        self.assertIn('Deny -> Permit GET %s' % DENIED_URI, stdout.getvalue())
+
+        with open(outputFilePath) as outputFile:
+            summary = json.load(outputFile)['summary']
+
+        self.assertEqual(summary['mismatches'], 1)
+        self.assertEqual(summary['transitions'],
+                         {'Permit->Permit': 2, 'Deny->Permit': 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
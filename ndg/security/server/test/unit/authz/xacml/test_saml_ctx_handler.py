@@ -16,8 +16,13 @@ from os import path
 import unittest
 
 from configparser import SafeConfigParser
+
+from ndg.saml.saml2.core import Issuer
+from ndg.saml.utils.factory import AuthzDecisionQueryFactory
+
 from ndg.security.server.test.base import BaseTestCase
-from ndg.security.server.xacml.ctx_handler.saml_ctx_handler import SamlCtxHandler
+from ndg.security.server.xacml.ctx_handler.saml_ctx_handler import (
+                                                SamlCtxHandler, SamlPEPRequest)
 
 
 class SamlCtxHandlerTestCase(BaseTestCase):
@@ -57,6 +62,40 @@ class SamlCtxHandlerTestCase(BaseTestCase):
         self.assertTrue(handler.assertionLifetime)
         self.assertTrue(handler.xacmlExtFunc)
         
+    def test04ProfilePolicyEvaluation(self):
+        cfg = SafeConfigParser(defaults={'here': self.__class__.THIS_DIR})
+        cfg.optionxform = str
+        cfg.read(self.__class__.CONFIG_FILEPATH)
+        kw = dict(cfg.items('DEFAULT'))
+        kw['saml_ctx_handler.profile'] = 'True'
+        
+        handler = SamlCtxHandler.fromKeywords(**kw)
+        self.assertTrue(handler.profiler)
+        
+        query = AuthzDecisionQueryFactory.create()
+        query.subject.nameID.format = 'urn:esg:openid'
+        query.subject.nameID.value = 'https://localhost/openid/someone'
+        query.issuer.format = Issuer.X509_SUBJECT
+        query.issuer.value = handler.issuerName
+        query.resource = 'http://localhost/test_200'
+        
+        request = SamlPEPRequest()
+        request.authzDecisionQuery = query
+        handler.handlePEPRequest(request)
+        
+        report = handler.profiler.report()
+        self.assertIsNone(report['previous'])
+        
+        elements = dict([(element['path'], element) 
+                         for element in report['current']['elements']])
+        policyId = handler.pdp.policy.policyId
+        self.assertEqual(elements[policyId]['evaluations'], 1)
+        
+        publicRule = elements[policyId + ' / urn:ndg:security:public-uri']
+        self.assertEqual(publicRule['type'], 'Rule')
+        self.assertEqual(publicRule['decisions'], {'Permit': 1})
+        self.assertEqual(publicRule['pip_queries'], 0)
+        
         
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -15,6 +15,8 @@ log = logging.getLogger(__name__)
 from os import path
 from urllib.error import URLError
 import unittest
+import tempfile
+import shutil
 
 from ndg.xacml.core.attributedesignator import SubjectAttributeDesignator
 from ndg.xacml.core.attribute import Attribute
@@ -26,7 +28,10 @@ from ndg.saml.saml2.core import Issuer as SamlIssuer
 
 from ndg.security.server.test.base import BaseTestCase
 from ndg.security.server.test.test_util import TestUserDatabase
+from ndg.security.server.utils.capture import hashSubject, readCaptureLog
 from ndg.security.server.xacml.pip.saml_pip import PIP
+from ndg.security.server.xacml.ctx_handler.replay import \
+                                                    StubAttributeQueryBinding
 
 
 class SamlPipTestCase(BaseTestCase):
@@ -94,6 +99,43 @@ class SamlPipTestCase(BaseTestCase):
                      pip.attribute2AttributeAuthorityMap)
         print((pip.attribute2AttributeAuthorityMap))
         
+    def test03CaptureAndReplayAttributes(self):
+        # Query through a stub Attribute Authority recording the attributes
+        # returned then check a stub made from the capture log serves the same
+        # attributes
+        captureDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, captureDir)
+        captureFilePath = path.join(captureDir, 'pip-capture.log')
+
+        pip, designator, ctx = self.__class__._initQuery()
+        pip.cacheSessions = False
+        pip.captureSubjectSalt = 'salt'
+        pip.captureFilePath = captureFilePath
+
+        attributeAuthorityURI = pip.attribute2AttributeAuthorityMap[
+                                                    self.__class__.NDGS_ATTR_ID]
+        stub = StubAttributeQueryBinding()
+        stub.attributes[(attributeAuthorityURI, self.__class__.OPENID_URI)] = {
+            self.__class__.NDGS_ATTR_ID: (
+                'http://www.w3.org/2001/XMLSchema#string', ['staff'])
+        }
+        pip.attribute_query_binding = stub
+
+        attributeValues = pip.attributeQuery(ctx, designator)
+        self.assertEqual([i.value for i in attributeValues], ['staff'])
+
+        records = list(readCaptureLog(captureFilePath))
+        self.assertEqual(len(records), 1)
+        subjectHash = hashSubject(self.__class__.OPENID_URI, salt='salt')
+        self.assertEqual(records[0]['s'], subjectHash)
+        self.assertEqual(records[0]['v'], ['staff'])
+
+        replayStub = StubAttributeQueryBinding.fromCaptureLog(captureFilePath)
+        self.assertEqual(
+            replayStub.attributes[(attributeAuthorityURI, subjectHash)],
+            stub.attributes[(attributeAuthorityURI,
+                             self.__class__.OPENID_URI)])
+
     @classmethod
     def _createXacmlRequestCtx(cls):
         """Helper to create a XACML request context"""
@@ -0,0 +1,53 @@
+"""Unit tests for the benchmark runner request mix
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import unittest
+from collections import Counter
+
+from ndg.security.server.test.benchmark.runner import (parse_mix, make_plan,
+                                                       DEFAULT_MIX)
+
+
+class RequestMixTestCase(unittest.TestCase):
+
+    def test01ParseMix(self):
+        self.assertEqual(parse_mix(DEFAULT_MIX),
+                         [('permit', 'cached', 4.),
+                          ('attribute_permit', 'uncached', 2.),
+                          ('deny', 'uncached', 1.)])
+
+        # Whitespace and empty items are ignored
+        self.assertEqual(parse_mix(' deny:cached = 0.5 ,'),
+                         [('deny', 'cached', .5)])
+
+    def test02InvalidMix(self):
+        for mix in ('', 'permit:cached', 'permit=1', 'permit:cached=x',
+                    'unknown:cached=1', 'permit:sometimes=1'):
+            self.assertRaises(ValueError, parse_mix, mix)
+
+    def test03MakePlan(self):
+        entries = parse_mix('permit:cached=3,deny:uncached=1')
+        plan = make_plan(entries, 1000, seed=1)
+        self.assertEqual(len(plan), 1000)
+
+        # Reproducible for a given seed
+        self.assertEqual(plan, make_plan(entries, 1000, seed=1))
+
+        counts = Counter(plan)
+        self.assertEqual(set(counts), set(['permit:cached', 'deny:uncached']))
+        self.assertGreater(counts['permit:cached'], counts['deny:uncached'])
+
+        # Items with zero weight are never drawn
+        plan = make_plan(parse_mix('permit:cached=1,deny:uncached=0'), 100)
+        self.assertEqual(set(plan), set(['permit:cached']))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,22 +12,33 @@ __revision__ = '$Id$'
 import unittest
       
 from ndg.security.server.test.test_util import TestUserDatabase
+from ndg.security.server.wsgi.openid.provider.authninterface import (
+    AuthNInterfaceInvalidCredentials)
 from ndg.security.server.wsgi.openid.provider.authninterface.sqlalchemy_authn \
     import SQLAlchemyAuthnInterface
 
 
-class SQLAlchemyAuthnInterfaceTestCase(TestUserDatabase):
+class SQLAlchemyAuthnInterfaceTestCase(TestUserDatabase, unittest.TestCase):
+    # Credentials are passed to the interface as strings as they would be 
+    # from the login form
+    USERNAME = TestUserDatabase.USERNAME.decode('utf-8')
+    PASSWORD = TestUserDatabase.PASSWORD.decode('utf-8')
+    
     LOGON_SQLQUERY = ("select count(*) from users where username = "
                       "'${username}' and md5password = '${password}'")
     
     USERNAME2USERIDENTIFIER_SQLQUERY = ("select openid_identifier from users "
                                         "where username = '${username}'")
     
+    AUTHENTICATE_AND_RESOLVE_SQLQUERY = ("select openid_identifier from users "
+                                         "where username = '${username}' and "
+                                         "md5password = '${password}'")
+    
     def __init__(self, *arg, **kw):
         super(SQLAlchemyAuthnInterfaceTestCase, self).__init__(*arg, **kw)
         self.__interface = None
         
-        self.__class__.init_db()
+        TestUserDatabase.init_db()
          
     def setUp(self):
         self.__interface = SQLAlchemyAuthnInterface(
@@ -48,6 +59,31 @@ class SQLAlchemyAuthnInterfaceTestCase(TestUserDatabase):
         self.__interface.username2UserIdentifiers({}, 
                                SQLAlchemyAuthnInterfaceTestCase.USERNAME)
         
+    def test03AuthenticateAndResolve(self):
+        # Logon and identifier queries on the same connection
+        userIdentifiers = self.__interface.authenticateAndResolve({}, 
+                               None, 
+                               SQLAlchemyAuthnInterfaceTestCase.USERNAME, 
+                               SQLAlchemyAuthnInterfaceTestCase.PASSWORD)
+        self.assertEqual(userIdentifiers, 
+                         (SQLAlchemyAuthnInterfaceTestCase.OPENID_IDENTIFIER,))
+        
+        # Single query
+        self.__interface.authenticateAndResolveSqlQuery = \
+            SQLAlchemyAuthnInterfaceTestCase.AUTHENTICATE_AND_RESOLVE_SQLQUERY
+            
+        userIdentifiers = self.__interface.authenticateAndResolve({}, 
+                               None, 
+                               SQLAlchemyAuthnInterfaceTestCase.USERNAME, 
+                               SQLAlchemyAuthnInterfaceTestCase.PASSWORD)
+        self.assertEqual(userIdentifiers, 
+                         (SQLAlchemyAuthnInterfaceTestCase.OPENID_IDENTIFIER,))
+        
+        self.assertRaises(AuthNInterfaceInvalidCredentials,
+                          self.__interface.authenticateAndResolve, {}, None,
+                          SQLAlchemyAuthnInterfaceTestCase.USERNAME,
+                          'invalid password')
+        
                                                         
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,86 @@
+"""Unit tests for OpenID Provider password verifiers
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import unittest
+import pickle
+from threading import Event, Thread
+
+from ndg.security.server.wsgi.openid.provider.authninterface import (
+    AuthNInterfaceInvalidCredentials, AuthNInterfaceUnavailable)
+from ndg.security.server.wsgi.openid.provider.authninterface.password import (
+    PasswordChecker, PasswordVerifier, PBKDF2PasswordVerifier,
+    MD5PasswordVerifier)
+
+
+class BlockingPasswordVerifier(PasswordVerifier):
+    """Verifier which waits until released so that the pool can be filled"""
+    started = Event()
+    release = Event()
+
+    def verify(self, password, encodedPassword):
+        BlockingPasswordVerifier.started.set()
+        BlockingPasswordVerifier.release.wait(5.)
+        return password == encodedPassword
+
+
+class PasswordCheckerTestCase(unittest.TestCase):
+    USERNAME = 'pjk'
+    PASSWORD = 'testpassword'
+
+    def test01PBKDF2(self):
+        verifier = PBKDF2PasswordVerifier(iterations=1000)
+        encodedPassword = verifier.encode(self.PASSWORD)
+
+        self.assertTrue(encodedPassword.startswith('pbkdf2_sha256$1000$'))
+        self.assertTrue(verifier.verify(self.PASSWORD, encodedPassword))
+        self.assertFalse(verifier.verify('wrong', encodedPassword))
+        self.assertFalse(verifier.verify(self.PASSWORD, 'not a hash'))
+
+        # Settings are taken from the stored hash, not the verifier
+        self.assertTrue(PBKDF2PasswordVerifier().verify(self.PASSWORD,
+                                                        encodedPassword))
+
+    def test02Check(self):
+        checker = PasswordChecker('md5')
+        encodedPassword = MD5PasswordVerifier().encode(self.PASSWORD)
+
+        checker.check(self.USERNAME, self.PASSWORD, encodedPassword)
+        self.assertRaises(AuthNInterfaceInvalidCredentials, checker.check,
+                          self.USERNAME, 'wrong', encodedPassword)
+
+        self.assertIsNone(PasswordChecker.fromProperties({}))
+        checker = PasswordChecker.fromProperties({
+            PasswordChecker.PASSWORD_VERIFIER_OPTNAME: 'plain'})
+        checker = pickle.loads(pickle.dumps(checker))
+        checker.check(self.USERNAME, self.PASSWORD, self.PASSWORD)
+
+    def test03PoolSaturation(self):
+        checker = PasswordChecker(__name__ + '.BlockingPasswordVerifier',
+                                  poolSize=1, queueSize=0)
+        BlockingPasswordVerifier.started.clear()
+        BlockingPasswordVerifier.release.clear()
+
+        thread = Thread(target=checker.check,
+                        args=(self.USERNAME, self.PASSWORD, self.PASSWORD))
+        thread.start()
+        try:
+            self.assertTrue(BlockingPasswordVerifier.started.wait(5.))
+            self.assertRaises(AuthNInterfaceUnavailable, checker.check,
+                              self.USERNAME, self.PASSWORD, self.PASSWORD)
+        finally:
+            BlockingPasswordVerifier.release.set()
+            thread.join()
+
+        # Worker is free again
+        checker.check(self.USERNAME, self.PASSWORD, self.PASSWORD)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,13 +8,18 @@ __copyright__ = "(C) 2009 Science and Technology Facilities Council"
 __license__ = "BSD - see LICENSE file in top-level directory"
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = '$Id$'
+import unittest
+import time
+
 from openid.extensions.ax import FetchRequest, FetchResponse, AttrInfo
         
 from ndg.security.server.test.test_util import TestUserDatabase
 from ndg.security.server.wsgi.openid.provider.axinterface import (
-                                                        AXInterfaceConfigError)
+                                            AXInterface, AXInterfaceConfigError)
 from ndg.security.server.wsgi.openid.provider.axinterface.sqlalchemy_ax import (
                                                         SQLAlchemyAXInterface)
+from ndg.security.server.wsgi.openid.provider.axinterface.caching import (
+                                                        CachingAXInterface)
 
 
 
@@ -73,4 +78,59 @@ class SQLAlchemyAXInterfaceTestCase(TestUserDatabase):
         axData = axResp.getExtensionArgs()
         self.assertTrue(len(list(axData.keys())) > 0)
         print(axData)
-                              
\ No newline at end of file
+                              
+
+
+class _CountingAXInterface(AXInterface):
+    """Return a fixed e-mail address and count calls"""
+    __slots__ = ('calls',)
+    EMAIL_TYPE_URI = 'http://openid.net/schema/contact/internet/email'
+
+    def __init__(self, **cfg):
+        self.calls = 0
+
+    def __call__(self, ax_req, ax_resp, authnInterface, authnCtx):
+        self.calls += 1
+        ax_resp.addValue(self.EMAIL_TYPE_URI,
+                         '%s@somewhere.ac.uk' % authnCtx['username'])
+
+
+class CachingAXInterfaceTestCase(unittest.TestCase):
+    EMAIL_TYPE_URI = _CountingAXInterface.EMAIL_TYPE_URI
+
+    def _request(self, interface, authnCtx):
+        axReq = FetchRequest()
+        axReq.add(AttrInfo(self.EMAIL_TYPE_URI, required=True))
+        axResp = FetchResponse(request=axReq)
+        interface(axReq, axResp, None, authnCtx)
+        return axResp.get(self.EMAIL_TYPE_URI)
+
+    def test01CacheAndInvalidate(self):
+        wrapped = _CountingAXInterface()
+        interface = CachingAXInterface(wrapped, timeout='60')
+        authnCtx = {'username': 'pjk', 'identityURI': 'https://x/openid/pjk'}
+
+        self.assertEqual(self._request(interface, authnCtx),
+                         ['pjk@somewhere.ac.uk'])
+        self.assertEqual(self._request(interface, authnCtx),
+                         ['pjk@somewhere.ac.uk'])
+        self.assertEqual(wrapped.calls, 1)
+
+        # Different user
+        self._request(interface, {'username': 'another'})
+        self.assertEqual(wrapped.calls, 2)
+
+        interface.invalidate(authnCtx)
+        self._request(interface, authnCtx)
+        self.assertEqual(wrapped.calls, 3)
+
+    def test02Expiry(self):
+        wrapped = _CountingAXInterface()
+        interface = CachingAXInterface(wrapped, timeout=0.05)
+        authnCtx = {'username': 'pjk'}
+
+        self._request(interface, authnCtx)
+        time.sleep(0.1)
+        self._request(interface, authnCtx)
+        self.assertEqual(wrapped.calls, 2)
+
@@ -0,0 +1,168 @@
+"""OpenID Provider association and nonce store unit tests
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import unittest
+import time
+import tempfile
+import shutil
+from os import path
+
+from openid.association import Association
+
+from ndg.security.server.wsgi.openid.provider import OpenIDProviderMiddleware
+from ndg.security.server.wsgi.openid.provider.store import (
+                                                        OpenIDStoreConfigError)
+from ndg.security.server.wsgi.openid.provider.store.memory import (
+                                                        LRUOpenIDStore)
+from ndg.security.server.wsgi.openid.provider.store.sqlalchemy_store import (
+                                                        SQLAlchemyOpenIDStore)
+
+
+class OpenIDStoreTestCaseBase(object):
+    """Tests common to all store types.  Derived classes implement
+    _createStore
+    """
+    SERVER_URL = 'https://localhost:7443/openid/openidserver'
+    ASSOC_TYPE = 'HMAC-SHA1'
+
+    def _createStore(self, **kw):
+        raise NotImplementedError()
+
+    @classmethod
+    def _createAssociation(cls, handle, issuedAgo=0, lifetime=3600):
+        return Association(handle, b'0123456789abcdef0123',
+                           int(time.time()) - issuedAgo, lifetime,
+                           cls.ASSOC_TYPE)
+
+    def test01StoreAndGetAssociation(self):
+        store = self._createStore()
+        store.storeAssociation(self.SERVER_URL, self._createAssociation('h1'))
+
+        association = store.getAssociation(self.SERVER_URL, 'h1')
+        self.assertEqual(association.handle, 'h1')
+        self.assertEqual(association.secret, b'0123456789abcdef0123')
+        self.assertIsNone(store.getAssociation(self.SERVER_URL, 'h2'))
+        self.assertEqual(store.getAssociation(self.SERVER_URL).handle, 'h1')
+
+    def test02RemoveAssociation(self):
+        store = self._createStore()
+        store.storeAssociation(self.SERVER_URL, self._createAssociation('h1'))
+
+        self.assertTrue(store.removeAssociation(self.SERVER_URL, 'h1'))
+        self.assertFalse(store.removeAssociation(self.SERVER_URL, 'h1'))
+        self.assertIsNone(store.getAssociation(self.SERVER_URL, 'h1'))
+
+    def test03ExpiredAssociation(self):
+        store = self._createStore()
+        store.storeAssociation(self.SERVER_URL,
+                               self._createAssociation('h1', issuedAgo=120,
+                                                       lifetime=60))
+
+        store.storeAssociation(self.SERVER_URL, self._createAssociation('h2'))
+
+        self.assertIsNone(store.getAssociation(self.SERVER_URL, 'h1'))
+        self.assertEqual(store.getAssociation(self.SERVER_URL).handle, 'h2')
+
+        store.cleanupAssociations()
+        self.assertEqual(store.cleanupAssociations(), 0)
+        self.assertTrue(store.getAssociation(self.SERVER_URL, 'h2'))
+
+    def test04UseNonce(self):
+        store = self._createStore()
+        now = int(time.time())
+
+        self.assertTrue(store.useNonce(self.SERVER_URL, now, 'salt'))
+        self.assertFalse(store.useNonce(self.SERVER_URL, now, 'salt'))
+        self.assertTrue(store.useNonce(self.SERVER_URL, now, 'salt2'))
+
+        # Outside of allowed clock skew
+        self.assertFalse(store.useNonce(self.SERVER_URL, now - 86400, 'salt'))
+
+    def test05BackgroundCleanup(self):
+        store = self._createStore(cleanupInterval=.1)
+        self.addCleanup(store.stopCleanup)
+
+        store.storeAssociation(self.SERVER_URL,
+                               self._createAssociation('h1', issuedAgo=120,
+                                                       lifetime=60))
+        time.sleep(.5)
+        self.assertEqual(store.cleanupAssociations(), 0)
+
+
+class LRUOpenIDStoreTestCase(OpenIDStoreTestCaseBase, unittest.TestCase):
+
+    def _createStore(self, **kw):
+        kw.setdefault('cleanupInterval', 0)
+        return LRUOpenIDStore(**kw)
+
+    def test06EvictLeastRecentlyUsed(self):
+        store = self._createStore(maxAssociations='2')
+        store.storeAssociation(self.SERVER_URL, self._createAssociation('h1'))
+        store.storeAssociation(self.SERVER_URL, self._createAssociation('h2'))
+
+        # Use h1 so that h2 is evicted in favour of h3
+        self.assertTrue(store.getAssociation(self.SERVER_URL, 'h1'))
+        store.storeAssociation(self.SERVER_URL, self._createAssociation('h3'))
+
+        self.assertTrue(store.getAssociation(self.SERVER_URL, 'h1'))
+        self.assertIsNone(store.getAssociation(self.SERVER_URL, 'h2'))
+        self.assertTrue(store.getAssociation(self.SERVER_URL, 'h3'))
+
+
+class SQLAlchemyOpenIDStoreTestCase(OpenIDStoreTestCaseBase,
+                                    unittest.TestCase):
+
+    def setUp(self):
+        self.dbDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dbDir)
+
+    def _createStore(self, **kw):
+        kw.setdefault('cleanupInterval', 0)
+        connectionString = 'sqlite:///%s' % path.join(self.dbDir, 'openid.db')
+        return SQLAlchemyOpenIDStore(connectionString=connectionString, **kw)
+
+    def test06MissingConnectionString(self):
+        self.assertRaises(OpenIDStoreConfigError, SQLAlchemyOpenIDStore)
+
+    def test07InMemoryDatabase(self):
+        # Pool size settings don't apply to the SQLite in-memory pool
+        store = SQLAlchemyOpenIDStore(connectionString='sqlite://',
+                                      poolSize='2', cleanupInterval=0)
+        store.storeAssociation(self.SERVER_URL, self._createAssociation('h1'))
+        self.assertEqual(store.getAssociation(self.SERVER_URL).handle, 'h1')
+
+
+class OpenIDProviderStoreTestCase(unittest.TestCase):
+    """Test the Provider uses the store set with the store_class option"""
+    BASE_URL = 'https://localhost:7443/openid'
+    AUTHN_INTERFACE = ('ndg.security.server.wsgi.openid.provider.'
+                       'authninterface:AbstractAuthNInterface')
+    STORE_CLASS = ('ndg.security.server.wsgi.openid.provider.store.'
+                   'sqlalchemy_store.SQLAlchemyOpenIDStore')
+
+    def test01SQLAlchemyStoreClass(self):
+        provider = OpenIDProviderMiddleware(None,
+                            base_url=self.__class__.BASE_URL,
+                            identityUriTemplate=self.__class__.BASE_URL +
+                                                '/id/${userIdentifier}',
+                            trace='false',
+                            authNInterface=self.__class__.AUTHN_INTERFACE,
+                            store_class=self.__class__.STORE_CLASS,
+                            store_connectionString='sqlite://',
+                            store_poolSize='2',
+                            store_cleanupInterval='0')
+
+        store = provider.oidserver.store
+        self.assertIsInstance(store, SQLAlchemyOpenIDStore)
+        self.assertEqual(store.cleanupInterval, 0.)
+
+
+if __name__ == "__main__":
+    unittest.main()
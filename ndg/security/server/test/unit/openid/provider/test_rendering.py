@@ -0,0 +1,77 @@
+"""OpenID Provider rendering interface unit tests
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import unittest
+
+from ndg.security.server.wsgi.openid.provider import RenderingInterface
+
+
+class RenderingInterfaceTestCase(unittest.TestCase):
+    """Test caching of Yadis documents and conditional GET"""
+    BASE_URL = 'https://localhost:7443/openid'
+    URLS = {
+        'url_openidserver': BASE_URL + '/openidserver',
+        'url_id': BASE_URL + '/id',
+        'url_yadis': BASE_URL + '/yadis'
+    }
+
+    def setUp(self):
+        self.responses = []
+
+    def _startResponse(self, status, headers):
+        self.responses.append((status, dict(headers)))
+
+    def _createRendering(self, **opt):
+        return RenderingInterface(None, self.BASE_URL, self.URLS, **opt)
+
+    def test01YadisETag(self):
+        rendering = self._createRendering(xrdsMaxAge='60')
+        environ = {'PATH_INFO': '/yadis/pjk'}
+        response = rendering.yadis(environ, self._startResponse)
+        status, headers = self.responses[-1]
+
+        self.assertEqual(status, '200 OK')
+        self.assertIn(self.URLS['url_id'] + '/pjk', response)
+        self.assertEqual(headers['Cache-Control'], 'public, max-age=60')
+
+        environ['HTTP_IF_NONE_MATCH'] = 'W/"stale", ' + headers['ETag']
+        response = rendering.yadis(environ, self._startResponse)
+        status, notModifiedHeaders = self.responses[-1]
+
+        self.assertTrue(status.startswith('304'))
+        self.assertEqual(response, '')
+        self.assertEqual(notModifiedHeaders['ETag'], headers['ETag'])
+
+        # A different user has a different document
+        rendering.yadis({'PATH_INFO': '/yadis/another',
+                         'HTTP_IF_NONE_MATCH': headers['ETag']},
+                        self._startResponse)
+        self.assertEqual(self.responses[-1][0], '200 OK')
+
+    def test02ServerYadisCaching(self):
+        rendering = self._createRendering()
+        response = rendering.serverYadis({}, self._startResponse)
+        etag = self.responses[-1][1]['ETag']
+
+        self.assertIs(rendering.serverYadis({}, self._startResponse), response)
+
+        rendering.clearXrdsCache()
+        self.assertIsNot(rendering.serverYadis({}, self._startResponse),
+                         response)
+        self.assertEqual(self.responses[-1][1]['ETag'], etag)
+
+        rendering.xrdsCacheSize = 0
+        rendering.serverYadis({'HTTP_IF_NONE_MATCH': etag},
+                              self._startResponse)
+        self.assertTrue(self.responses[-1][0].startswith('304'))
+
+
+if __name__ == "__main__":
+    unittest.main()
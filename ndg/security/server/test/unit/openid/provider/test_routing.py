@@ -0,0 +1,136 @@
+"""OpenID Provider request routing unit tests
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import unittest
+import io
+import shutil
+import tempfile
+
+from beaker.session import SessionObject
+
+from ndg.security.server.wsgi.openid.provider import (
+                                                    OpenIDProviderMiddleware,
+                                                    RenderingInterface)
+
+
+class SessionRenderingInterface(RenderingInterface):
+    """Rendering interface accepting the session set for each request"""
+
+
+class RoutingTestProvider(OpenIDProviderMiddleware):
+    """Provider recording the actions called instead of rendering them"""
+    def _action(self, name, start_response):
+        self.actions.append(name)
+        start_response('200 OK', [('Content-type', 'text/plain')])
+        return [name]
+
+    def do_id(self, environ, start_response):
+        return self._action('do_id', start_response)
+
+    def do_yadis(self, environ, start_response):
+        return self._action('do_yadis', start_response)
+
+    def do_login(self, environ, start_response):
+        return self._action('do_login', start_response)
+
+    def do_mainpage(self, environ, start_response):
+        return self._action('do_mainpage', start_response)
+
+    def do_loginsubmit(self, environ, start_response):
+        # Read the form twice to check it's parsed once only
+        self.queries = (self.query, self.query)
+        return self._action('do_loginsubmit', start_response)
+
+
+class OpenIDProviderRoutingTestCase(unittest.TestCase):
+    BASE_URL = 'https://localhost:7443/openid'
+    AUTHN_INTERFACE = ('ndg.security.server.wsgi.openid.provider.'
+                       'authninterface:AbstractAuthNInterface')
+    RENDERING_CLASS = ('ndg.security.server.test.unit.openid.provider.'
+                       'test_routing:SessionRenderingInterface')
+
+    def setUp(self):
+        self.storeDir = tempfile.mkdtemp()
+        self.provider = self._createProvider()
+
+    def tearDown(self):
+        shutil.rmtree(self.storeDir)
+
+    def _createProvider(self, **kw):
+        provider = RoutingTestProvider(None,
+                            base_url=self.__class__.BASE_URL,
+                            identityUriTemplate=self.__class__.BASE_URL +
+                                                '/id/${userIdentifier}',
+                            consumer_store_dirpath=self.storeDir,
+                            trace='false',
+                            authNInterface=self.__class__.AUTHN_INTERFACE,
+                            renderingClass=self.__class__.RENDERING_CLASS,
+                            **kw)
+        provider.actions = []
+        return provider
+
+    def _request(self, path, provider=None, method='GET', body=b''):
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body)
+        }
+        environ['beaker.session'] = SessionObject(environ, type='memory')
+        provider = provider or self.provider
+        response = provider(environ, lambda status, headers: None)
+        return environ, response
+
+    def test01IdentityURIPattern(self):
+        pat = OpenIDProviderMiddleware._compileIdentityURIPat(
+                                        OpenIDProviderMiddleware.defPaths)
+
+        self.assertEqual(pat.search('/id/pjk').lastgroup, 'path_id')
+        self.assertEqual(pat.search('/yadis/pjk').lastgroup, 'path_yadis')
+        self.assertIsNone(pat.search('/login'))
+        self.assertIsNone(OpenIDProviderMiddleware._compileIdentityURIPat(
+                                                {'path_login': '/login'}))
+
+    def test02Dispatch(self):
+        for path, action in (('/id/pjk', 'do_id'),
+                             ('/yadis/pjk', 'do_yadis'),
+                             ('/login', 'do_login'),
+                             ('', 'do_mainpage')):
+            environ, response = self._request(path)
+            self.assertEqual(response, [action.encode('utf-8')])
+
+        self.assertEqual(self.provider.actions,
+                         ['do_id', 'do_yadis', 'do_login', 'do_mainpage'])
+
+    def test03IdentityURITakesPrecedence(self):
+        provider = self._createProvider(path_login='/id/login')
+        self._request('/id/login', provider=provider)
+        self.assertEqual(provider.actions, ['do_id'])
+
+    def test04QueryParsedLazily(self):
+        environ, response = self._request('/yadis/pjk', method='POST',
+                                          body=b'a=1')
+        self.assertEqual(environ['wsgi.input'].tell(), 0)
+
+        environ, response = self._request('/loginsubmit', method='POST',
+                                          body=b'a=1&b=2')
+        query, queryAgain = self.provider.queries
+        self.assertEqual(query, {'a': '1', 'b': '2'})
+        self.assertIs(queryAgain, query)
+
+        # Parsed again for the next request
+        self._request('/loginsubmit', method='POST', body=b'c=3')
+        self.assertEqual(self.provider.queries[0], {'c': '3'})
+
+
+if __name__ == "__main__":
+    unittest.main()
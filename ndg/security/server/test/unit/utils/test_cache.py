@@ -0,0 +1,99 @@
+"""Unit tests for in-memory LRU cache and Genshi template loading helpers
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import unittest
+import time
+import tempfile
+import shutil
+from os import path
+
+from ndg.security.server.utils.cache import LRUCache
+from ndg.security.server.utils.genshi_utils import (createTemplateLoader,
+                                                    listTemplateNames)
+
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test01GetAndSet(self):
+        cache = LRUCache(maxSize=2)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('b', 2), 2)
+        self.assertTrue('a' in cache)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertFalse('a' in cache)
+
+    def test02EvictLeastRecentlyUsed(self):
+        cache = LRUCache(maxSize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test03Timeout(self):
+        cache = LRUCache(timeout='0.1')
+        cache.set('a', 1)
+        cache.set('b', 2, timeout=60)
+        time.sleep(.2)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.removeExpired(), 0)
+        self.assertEqual(cache.get('b'), 2)
+
+    def test04Disabled(self):
+        cache = LRUCache(maxSize=0)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+
+class GenshiUtilsTestCase(unittest.TestCase):
+    TEMPLATES = {
+        'base.html': '<div xmlns:py="http://genshi.edgewall.org/" '
+                     'py:strip="">${title}</div>',
+        'page.html': '<html xmlns:xi="http://www.w3.org/2001/XInclude">'
+                     '<xi:include href="base.html"/></html>',
+        'README': 'not a template'
+    }
+
+    def setUp(self):
+        self.templateDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.templateDir, True)
+        for name, content in self.__class__.TEMPLATES.items():
+            with open(path.join(self.templateDir, name), 'w') as templateFile:
+                templateFile.write(content)
+
+    def test01PreloadTemplates(self):
+        self.assertEqual(listTemplateNames(self.templateDir),
+                         ['base.html', 'page.html'])
+
+        loader = createTemplateLoader(self.templateDir)
+        self.assertFalse(loader.auto_reload)
+        self.assertEqual(len(loader._cache), 2)
+
+        # Rendering uses the compiled templates even if the files are removed
+        shutil.rmtree(self.templateDir)
+        rendering = loader.load('page.html').generate(title='Test').render(
+                                                                        'html')
+        self.assertTrue('Test' in rendering)
+
+    def test02AutoReload(self):
+        loader = createTemplateLoader(self.templateDir, autoReload=True)
+        self.assertTrue(loader.auto_reload)
+        self.assertEqual(len(loader._cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
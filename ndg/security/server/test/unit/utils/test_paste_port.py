@@ -0,0 +1,75 @@
+"""Unit tests for Cascade request body handling
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import unittest
+import io
+
+from ndg.security.server.utils.paste_port import Cascade, non_static_method
+
+
+class CascadeTestCase(unittest.TestCase):
+    BODY = b'line1\nline2\n' + b'x' * 10000
+
+    def setUp(self):
+        self.read = []
+
+    def _make_environ(self, method='POST'):
+        return {
+            'REQUEST_METHOD': method,
+            'CONTENT_LENGTH': str(len(self.BODY)),
+            # Trailing bytes beyond the content length must not be read
+            'wsgi.input': io.BytesIO(self.BODY + b'trailing')
+        }
+
+    def _not_found_app(self, environ, start_response):
+        self.read.append(environ['wsgi.input'].readline())
+        self.read.append(environ['wsgi.input'].read(3))
+        start_response('404 Not Found', [('Content-type', 'text/plain')])
+        return [b'']
+
+    def _ok_app(self, environ, start_response):
+        self.read.append(environ['wsgi.input'].read())
+        start_response('200 OK', [('Content-type', 'text/plain')])
+        return [b'ok']
+
+    @staticmethod
+    def _start_response(status, headers, exc_info=None):
+        pass
+
+    def test01BodyReplayed(self):
+        app = Cascade([self._not_found_app, self._ok_app], spool_threshold=100)
+        response = app(self._make_environ(), self._start_response)
+
+        self.assertEqual(list(response), [b'ok'])
+        self.assertEqual(self.read, [b'line1\n', b'lin', self.BODY])
+
+    def test02BodyNotCopiedIfUnread(self):
+        not_found_app = lambda environ, start_response: (
+                start_response('404 Not Found', []) or [])
+        app = Cascade([not_found_app, self._ok_app])
+        environ = self._make_environ()
+        wsgi_input = environ['wsgi.input']
+        app(environ, self._start_response)
+
+        self.assertIs(environ['wsgi.input'], wsgi_input)
+
+    def test03Passthrough(self):
+        app = Cascade([self._ok_app, self._not_found_app],
+                      passthrough=non_static_method)
+        environ = self._make_environ()
+        wsgi_input = environ['wsgi.input']
+        app(environ, self._start_response)
+
+        self.assertEqual(self.read, [self.BODY + b'trailing'])
+        self.assertIs(environ['wsgi.input'], wsgi_input)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,11 +11,17 @@ __revision__ = "$Id$"
 import logging
 log = logging.getLogger(__name__)
 import os
+import json
 import unittest
 
 import paste.fixture
 from paste.deploy import loadapp
 
+from ndg.saml.saml2.core import StatusCode
+from ndg.security.common.saml_utils.esgf import ESGFSamlNamespaces
+from ndg.security.server.test.config.attributeauthority.sitea.\
+    sitea_attributeinterface import TestUserRoles
+
 
 class TestAttributeAuthorityApp(object):
     '''Test harness for Attribute Authority'''
@@ -48,5 +54,102 @@ class AttributeAuthorityMiddlewareTestCase(unittest.TestCase):
         print(response)      
         
 
+class AttributeAuthorityJsonQueryMiddlewareTestCase(unittest.TestCase):
+    JSON_QUERY_PATH = '/attribute-service/json'
+    VALID_REQUESTOR_ID = "/O=Site A/CN=Authorisation Service"
+    
+    def setUp(self):
+        here_dir = os.path.dirname(os.path.abspath(__file__))
+        app = loadapp('config:test.ini', relative_to=here_dir)
+        self.app = paste.fixture.TestApp(app)
+        
+    def _query(self, status=200, extra_environ=None, **query):
+        return self.app.post(self.__class__.JSON_QUERY_PATH, 
+                             params=json.dumps(query),
+                             headers={'Content-type': 'application/json'},
+                             extra_environ=extra_environ,
+                             status=status)
+        
+    def test01BatchQuery(self):
+        subjects = list(TestUserRoles.VALID_USER_IDS) + [
+                                        'https://openid.localhost/unknown']
+        response = self._query(issuer=self.__class__.VALID_REQUESTOR_ID,
+                               subjects=subjects,
+                               attributes=[
+                                    ESGFSamlNamespaces.FIRSTNAME_ATTRNAME,
+                                    ESGFSamlNamespaces.EMAILADDRESS_ATTRNAME])
+        content = json.loads(response.body)
+        results = content['results']
+        self.assertEqual(len(results), len(subjects))
+        
+        for subject in TestUserRoles.VALID_USER_IDS:
+            self.assertEqual(results[subject]['status'], 
+                             StatusCode.SUCCESS_URI)
+            self.assertEqual(results[subject]['attributes'][
+                                    ESGFSamlNamespaces.FIRSTNAME_ATTRNAME], 
+                             ['Philip'])
+            self.assertIn('notOnOrAfter', results[subject])
+            
+        self.assertEqual(results[subjects[-1]]['status'], 
+                         StatusCode.UNKNOWN_PRINCIPAL_URI)
+        
+    def test02InvalidRequestor(self):
+        subject = TestUserRoles.VALID_USER_IDS[0]
+        response = self._query(issuer='/O=Site X/CN=Unknown',
+                               subjects=[subject],
+                               attributes=[
+                                    ESGFSamlNamespaces.FIRSTNAME_ATTRNAME])
+        result = json.loads(response.body)['results'][subject]
+        self.assertEqual(result['status'], StatusCode.REQUEST_DENIED_URI)
+        self.assertEqual(result['attributes'], {})
+        
+    def test03AttributeReleaseDenied(self):
+        subject = TestUserRoles.VALID_USER_IDS[0]
+        response = self._query(
+                        issuer=str(
+                            TestUserRoles.INSUFFICIENT_PRIVILEGES_REQUESTOR_ID),
+                        subjects=[subject],
+                        attributes=[ESGFSamlNamespaces.FIRSTNAME_ATTRNAME])
+        result = json.loads(response.body)['results'][subject]
+        self.assertEqual(result['status'], 
+                         StatusCode.INVALID_ATTR_NAME_VALUE_URI)
+        
+    def test04BadRequest(self):
+        self.app.post(self.__class__.JSON_QUERY_PATH, params='not JSON',
+                      status=400)
+        self._query(status=400, issuer=self.__class__.VALID_REQUESTOR_ID,
+                    subjects=[], 
+                    attributes=[ESGFSamlNamespaces.FIRSTNAME_ATTRNAME])
+        
+    def test05TooManySubjects(self):
+        subjects = ['https://openid.localhost/user%d' % i for i in range(11)]
+        self._query(status=413, issuer=self.__class__.VALID_REQUESTOR_ID,
+                    subjects=subjects, 
+                    attributes=[ESGFSamlNamespaces.FIRSTNAME_ATTRNAME])
+        
+    def test06GetNotAllowed(self):
+        self.app.get(self.__class__.JSON_QUERY_PATH, status=405)
+        
+    def test07SslClientIssuer(self):
+        subject = TestUserRoles.VALID_USER_IDS[0]
+        environ = {'SSL_CLIENT_S_DN': self.__class__.VALID_REQUESTOR_ID}
+        for issuer in (None, self.__class__.VALID_REQUESTOR_ID):
+            query = {'subjects': [subject],
+                     'attributes': [ESGFSamlNamespaces.FIRSTNAME_ATTRNAME]}
+            if issuer is not None:
+                query['issuer'] = issuer
+                
+            response = self._query(extra_environ=environ, **query)
+            result = json.loads(response.body)['results'][subject]
+            self.assertEqual(result['status'], StatusCode.SUCCESS_URI)
+        
+        # An issuer in the body can't override the SSL client identity
+        self._query(status=400, extra_environ=environ, 
+                    issuer='/O=Site X/CN=Unknown',
+                    subjects=[subject],
+                    attributes=[ESGFSamlNamespaces.FIRSTNAME_ATTRNAME])
+        
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
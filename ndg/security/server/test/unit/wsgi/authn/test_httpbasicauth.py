@@ -19,7 +19,8 @@ import paste.fixture
 from paste.httpexceptions import HTTPUnauthorized
 
 from ndg.security.server.test.base import BaseTestCase
-from ndg.security.server.wsgi.httpbasicauth import HttpBasicAuthMiddleware
+from ndg.security.server.wsgi.httpbasicauth import (HttpBasicAuthMiddleware,
+                                              HttpBasicAuthCredentialCache)
     
 
 class TestAuthnApp(object):
@@ -87,6 +88,120 @@ class HttpBasicAuthMiddlewareTestCase(BaseTestCase):
         
         response = self.app.get(url, headers=headers, status=200)
         print(response)
+
+
+class CredentialsFromEnvironMiddleware(HttpBasicAuthMiddleware):
+    """Filter taking credentials from environ instead of the Authorization
+    header"""
+    CREDENTIALS_ENV_KEYNAME = 'test.credentials'
+
+    @classmethod
+    def parse_credentials(cls, environ):
+        return environ.get(cls.CREDENTIALS_ENV_KEYNAME, (None, None))
+
+
+class HttpBasicAuthCredentialCacheTestCase(unittest.TestCase):
+    USERNAME = 'testuser'
+    PASSWORD = 'password'
+    
+    def test01GetAndSet(self):
+        cache = HttpBasicAuthCredentialCache()
+        self.assertIsNone(cache.get(self.USERNAME, self.PASSWORD))
+        
+        cache.set(self.USERNAME, self.PASSWORD, ('testuser-id',))
+        self.assertEqual(cache.get(self.USERNAME, self.PASSWORD), 
+                         ('testuser-id',))
+        self.assertIsNone(cache.get(self.USERNAME, 'wrong'))
+        
+        # Fields are delimited so that they can't be shifted
+        self.assertIsNone(cache.get(self.USERNAME + 'p', 'assword'))
+        
+        # The password is not held in the cache
+        entry = cache.cache.get(self.USERNAME)
+        self.assertNotIn(self.PASSWORD.encode(), entry[0])
+        
+        cache.invalidate(self.USERNAME)
+        self.assertIsNone(cache.get(self.USERNAME, self.PASSWORD))
+        
+    def test02Expiry(self):
+        cache = HttpBasicAuthCredentialCache(timeout=0.)
+        cache.set(self.USERNAME, self.PASSWORD, 1)
+        self.assertIsNone(cache.get(self.USERNAME, self.PASSWORD))
+        
+    def test03ParseConfig(self):
+        middleware = HttpBasicAuthMiddleware.filter_app_factory(None, {}, 
+                                        prefix='',
+                                        credential_cache='True',
+                                        credential_cache_timeout='30')
+        self.assertIsInstance(middleware.credential_cache, 
+                              HttpBasicAuthCredentialCache)
+        self.assertEqual(middleware.credential_cache.cache.timeout, 30.)
+        
+        middleware = HttpBasicAuthMiddleware.filter_app_factory(None, {}, 
+                                                                prefix='')
+        self.assertIsNone(middleware.credential_cache)
+
+    def _make_cached_filter(self, authenticate):
+        self.remote_users = []
+        def app(environ, start_response):
+            self.remote_users.append(environ.get('REMOTE_USER'))
+            start_response('200 OK', [])
+            return [b'']
+        
+        middleware = CredentialsFromEnvironMiddleware.filter_app_factory(app,
+                                        {},
+                                        prefix='',
+                                        re_path_match_list='/data',
+                                        http_hdr_field_match='X-Test: 1',
+                                        realm='test',
+                                        credential_cache='True')
+        middleware.authentication_callback = authenticate
+        return middleware
+    
+    def _call(self, middleware, password):
+        environ = {
+            'PATH_INFO': '/data',
+            'HTTP_X_TEST': '1',
+            CredentialsFromEnvironMiddleware.CREDENTIALS_ENV_KEYNAME: (
+                                                    self.USERNAME, password)
+        }
+        return middleware(environ, lambda status, headers: None)
+    
+    def test04FilterCachesPassThrough(self):
+        calls = []
+        def authenticate(environ, start_response, username, password):
+            calls.append(username)
+            if password != self.PASSWORD:
+                raise HTTPUnauthorized()
+            
+            environ['REMOTE_USER'] = username
+            
+        middleware = self._make_cached_filter(authenticate)
+        for i in range(3):
+            self._call(middleware, self.PASSWORD)
+            
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.remote_users, [self.USERNAME] * 3)
+        
+        # A failure discards the cached credentials
+        self.assertRaises(HTTPUnauthorized, self._call, middleware, 'wrong')
+        self._call(middleware, self.PASSWORD)
+        self.assertEqual(len(calls), 3)
+        
+    def test05FilterDoesNotCacheResponses(self):
+        calls = []
+        def authenticate(environ, start_response, username, password):
+            calls.append(username)
+            start_response('200 OK', [])
+            return [b'callback response']
+        
+        middleware = self._make_cached_filter(authenticate)
+        for i in range(2):
+            self.assertEqual(self._call(middleware, self.PASSWORD), 
+                             [b'callback response'])
+            
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.remote_users, [])
             
 
 if __name__ == "__main__":
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""Unit tests for compact authorisation decision records
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import unittest
+import pickle
+from datetime import datetime, timedelta
+
+from ndg.saml.saml2.core import (Assertion, AuthzDecisionStatement,
+                                 Conditions, DecisionType, Issuer)
+
+from ndg.security.server.wsgi.authz.decision import (DecisionRecord,
+                                                     DecisionRecordWallet)
+
+
+class DecisionRecordTestCase(unittest.TestCase):
+    RESOURCE_URI = 'http://localhost/dap/data/'
+    ISSUER_DN = '/O=Test/OU=Authorisation/CN=Service Stub'
+
+    def _make_assertion(self, decision, lifetime=28800):
+        assertion = Assertion()
+        assertion.issuer = Issuer()
+        assertion.issuer.value = self.__class__.ISSUER_DN
+
+        now = datetime.utcnow()
+        assertion.conditions = Conditions()
+        assertion.conditions.notBefore = now
+        assertion.conditions.notOnOrAfter = now + timedelta(seconds=lifetime)
+
+        statement = AuthzDecisionStatement()
+        statement.resource = self.__class__.RESOURCE_URI
+        statement.decision = DecisionType(decision)
+        assertion.authzDecisionStatements.append(statement)
+        return assertion
+
+    def test01FromAssertions(self):
+        assertions = [self._make_assertion(DecisionType.PERMIT_STR),
+                      self._make_assertion(DecisionType.DENY_STR,
+                                           lifetime=60)]
+        record = DecisionRecord.fromAssertions(self.__class__.RESOURCE_URI,
+                                               assertions)
+        self.assertEqual(record.decision, DecisionType.DENY_STR)
+        self.assertFalse(record.permit)
+        self.assertEqual(record.issuer, self.__class__.ISSUER_DN)
+        self.assertEqual(record.notOnOrAfter,
+                         assertions[1].conditions.notOnOrAfter)
+
+        self.assertIsNone(DecisionRecord.fromAssertions(
+                                            self.__class__.RESOURCE_URI, []))
+
+    def test02WalletExpiry(self):
+        wallet = DecisionRecordWallet(clockSkewTolerance=1.)
+        for decision, lifetime in ((DecisionType.PERMIT_STR, 28800),
+                                   (DecisionType.PERMIT_STR, -60)):
+            record = DecisionRecord.fromAssertions(
+                            self.__class__.RESOURCE_URI + str(lifetime),
+                            [self._make_assertion(decision, lifetime)])
+            wallet.addRecord(record)
+
+        # Pickled as the session is saved
+        wallet = pickle.loads(pickle.dumps(wallet, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(len(wallet), 2)
+
+        record = wallet.retrieveRecord(self.__class__.RESOURCE_URI + '28800')
+        self.assertTrue(record.permit)
+        self.assertIsNone(wallet.retrieveRecord(
+                                        self.__class__.RESOURCE_URI + '-60'))
+        self.assertEqual(len(wallet), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""Unit tests for caching of decisions by the Policy Enforcement Points
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import unittest
+from datetime import datetime, timedelta
+
+import webob
+
+from ndg.saml.saml2.core import (Assertion, AuthzDecisionStatement,
+                                 Conditions, DecisionType, Issuer, Response)
+from ndg.saml.saml2.binding.soap.client.authzdecisionquery import \
+                                            AuthzDecisionQuerySslSOAPBinding
+from ndg.saml.saml2.xacml_profile import (XACMLAuthzDecisionQuery,
+                                          XACMLAuthzDecisionStatement)
+from ndg.xacml.core.context.response import Response as XacmlResponse
+from ndg.xacml.core.context.result import (Decision as XacmlDecision,
+                                           Result as XacmlResult)
+
+from ndg.security.common.credentialwallet import SAMLAssertionWallet
+from ndg.security.server.test.unit.wsgi.authz.test_authz import \
+                                                            BeakerSessionStub
+from ndg.security.server.wsgi.authz.pep import SamlPepFilter
+from ndg.security.server.wsgi.authz.pep_xacml_profile import \
+                                                            XacmlSamlPepFilter
+
+
+SESSION_KEYNAME = 'beaker.session.ndg.security'
+AUTHZ_SERVICE_URI = 'https://localhost:9443/authorisation-service'
+ISSUER_DN = '/O=Test/OU=Authorisation/CN=Service Stub'
+
+
+def app(environ, start_response):
+    start_response('200 OK', [('Content-type', 'text/plain')])
+    return [b'Access granted']
+
+
+def make_response(lifetime=28800):
+    """Make a SAML response with an assertion valid for lifetime seconds.  Set
+    a negative lifetime for an expired assertion.  Callers add the decision
+    statement
+    """
+    now = datetime.utcnow()
+    assertion = Assertion()
+    assertion.issueInstant = now
+    assertion.issuer = Issuer()
+    assertion.issuer.value = ISSUER_DN
+    assertion.conditions = Conditions()
+    assertion.conditions.notBefore = now - timedelta(seconds=abs(lifetime))
+    assertion.conditions.notOnOrAfter = now + timedelta(seconds=lifetime)
+
+    response = Response()
+    response.assertions.append(assertion)
+    return response
+
+
+class AuthzServiceBindingStub(AuthzDecisionQuerySslSOAPBinding):
+    """Authorisation decision query binding returning permit decisions
+    without calling an authorisation service.  Queries made are counted
+    """
+    def __init__(self, **kw):
+        super(AuthzServiceBindingStub, self).__init__(**kw)
+        self.nQueries = 0
+        self.lifetime = 28800
+
+    def send(self, query, uri=None):
+        self.nQueries += 1
+
+        statement = AuthzDecisionStatement()
+        statement.resource = query.resource
+        statement.decision = DecisionType(DecisionType.PERMIT_STR)
+
+        response = make_response(lifetime=self.lifetime)
+        response.assertions[0].authzDecisionStatements.append(statement)
+        return response
+
+
+class XacmlAuthzServiceStub(object):
+    """XACML profile authorisation decision query binding returning permit
+    decisions without calling an authorisation service.  Queries made are
+    counted
+    """
+    def __init__(self):
+        self.nQueries = 0
+
+    def makeQuery(self):
+        return XACMLAuthzDecisionQuery()
+
+    def send(self, query, uri=None):
+        self.nQueries += 1
+
+        xacmlResponse = XacmlResponse()
+        xacmlResponse.results.append(
+            XacmlResult.createInitialised(decision=XacmlDecision.PERMIT))
+
+        statement = XACMLAuthzDecisionStatement()
+        statement.xacmlContextResponse = xacmlResponse
+
+        response = make_response()
+        response.assertions[0].statements.append(statement)
+        return response
+
+
+class SamlPepFilterAnonymousCacheTestCase(unittest.TestCase):
+    '''Test decisions for anonymous requests are cached in memory shared
+    between requests and not in the session'''
+    RESOURCE_URI = 'http://localhost/dap/data/'
+    USERNAME = 'https://openid.localhost/philip.kershaw'
+
+    def setUp(self):
+        self.pep = SamlPepFilter(app)
+        self.pep.client_binding = AuthzServiceBindingStub()
+        self.pep.authzServiceURI = AUTHZ_SERVICE_URI
+        self.pep.sessionKey = SESSION_KEYNAME
+        self.pep.cacheDecisions = True
+
+    def _request(self, session, username=None):
+        environ = {SESSION_KEYNAME: session}
+        if username is not None:
+            environ['REMOTE_USER'] = username
+
+        request = webob.Request.blank(self.__class__.RESOURCE_URI,
+                                      environ=environ)
+        return request.get_response(self.pep)
+
+    def test01AnonymousPermitCached(self):
+        for i in range(2):
+            session = BeakerSessionStub()
+            response = self._request(session)
+            self.assertEqual(response.status_int, 200)
+
+            # Nothing is written to the session
+            self.assertEqual(session, {})
+
+        self.assertEqual(self.pep.client_binding.nQueries, 1)
+        self.assertIn(self.__class__.RESOURCE_URI,
+                      self.pep.anonymousDecisionCache)
+
+    def test02AuthenticatedUserIgnoresAnonymousCache(self):
+        self._request(BeakerSessionStub())
+        self.assertEqual(self.pep.client_binding.nQueries, 1)
+
+        session = BeakerSessionStub()
+        for i in range(2):
+            response = self._request(session,
+                                     username=self.__class__.USERNAME)
+            self.assertEqual(response.status_int, 200)
+
+        # The decision for the user is made and cached in their session
+        self.assertEqual(self.pep.client_binding.nQueries, 2)
+        self.assertIn(SamlPepFilter.CREDENTIAL_WALLET_SESSION_KEYNAME,
+                      session)
+
+    def test03ExpiredAnonymousDecisionEvicted(self):
+        self.pep.client_binding.lifetime = -3600
+        self._request(BeakerSessionStub())
+        self.assertIn(self.__class__.RESOURCE_URI,
+                      self.pep.anonymousDecisionCache)
+
+        self.assertIsNone(self.pep._retrieveCachedDecision(
+                                            self.__class__.RESOURCE_URI,
+                                            anonymous=True))
+        self.assertNotIn(self.__class__.RESOURCE_URI,
+                         self.pep.anonymousDecisionCache)
+
+        self._request(BeakerSessionStub())
+        self.assertEqual(self.pep.client_binding.nQueries, 2)
+
+
+class XacmlSamlPepFilterTestCase(unittest.TestCase):
+    '''Test decisions from the XACML profile PEP are cached in the session'''
+    RESOURCE_URI = 'http://localhost/dap/data/'
+    USERNAME = 'https://openid.localhost/philip.kershaw'
+
+    def setUp(self):
+        self.pep = XacmlSamlPepFilter(app)
+        self.pep.client = XacmlAuthzServiceStub()
+        self.pep.authzServiceURI = AUTHZ_SERVICE_URI
+        self.pep.sessionKey = SESSION_KEYNAME
+        self.pep.subjectIdFormat = 'urn:esg:openid'
+        self.pep.cacheDecisions = True
+
+    def _request(self, session):
+        request = webob.Request.blank(self.__class__.RESOURCE_URI, environ={
+            'REMOTE_USER': self.__class__.USERNAME,
+            SESSION_KEYNAME: session
+        })
+        return request.get_response(self.pep)
+
+    def test01CachedDecision(self):
+        session = BeakerSessionStub()
+        for i in range(2):
+            response = self._request(session)
+            self.assertEqual(response.status_int, 200)
+
+        self.assertEqual(self.pep.client.nQueries, 1)
+        self.assertIsInstance(
+            session[XacmlSamlPepFilter.CREDENTIAL_WALLET_SESSION_KEYNAME],
+            SAMLAssertionWallet)
+
+
+if __name__ == "__main__":
+    unittest.main()
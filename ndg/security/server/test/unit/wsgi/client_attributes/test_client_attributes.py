@@ -0,0 +1,165 @@
+"""Unit tests for caching in the attribute request middleware
+
+NERC DataGrid Project
+"""
+__author__ = "R B Wilkinson"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+import unittest
+import threading
+import time
+from time import monotonic
+from unittest import mock
+
+from ndg.security.server.wsgi.client_attributes.middleware import \
+                                                    AttributeRequestMiddleware
+
+
+ATTRIBUTE_SERVICE_URL = 'https://openid.example.org/AttributeService'
+ATTRIBUTES = {'firstname': 'Alice', 'lastname': 'Smith'}
+
+# OpenID host for which Yadis discovery fails
+UNKNOWN_HOST = 'unknown.example.org'
+
+
+class AttributeRequestMiddlewareStub(AttributeRequestMiddleware):
+    """Middleware with Yadis discovery and attribute queries replaced by
+    stubs which count the calls made.  Queries signal when they start and
+    block until the test releases them
+    """
+    def __init__(self, app):
+        super(AttributeRequestMiddlewareStub, self).__init__(app)
+        self.nDiscoveries = 0
+        self.nQueries = 0
+        self.queryStarted = threading.Event()
+        self.queryRelease = threading.Event()
+        self.queryRelease.set()
+
+    def _discoverAttributeService(self, subject):
+        self.nDiscoveries += 1
+        if UNKNOWN_HOST in subject:
+            return None
+
+        return ATTRIBUTE_SERVICE_URL
+
+    def _queryAttributes(self, subject):
+        self.nQueries += 1
+        self.queryStarted.set()
+        self.queryRelease.wait(5.)
+        if subject.endswith('error'):
+            raise Exception('Attribute query for %r failed' % subject)
+
+        return dict(ATTRIBUTES)
+
+
+class AttributeRequestMiddlewareTestCase(unittest.TestCase):
+    '''Test discovery and attribute query calls are shared'''
+
+    def setUp(self):
+        self.middleware = AttributeRequestMiddlewareStub(None)
+
+    @staticmethod
+    def _clock(offset):
+        '''Move the discovery cache's clock forward by offset seconds'''
+        return mock.patch('ndg.security.server.utils.cache.monotonic',
+                          return_value=monotonic() + offset)
+
+    def test01DiscoveryCachedByHost(self):
+        for subject in ('https://openid.example.org/openid/alice',
+                        'https://openid.example.org/openid/bob',
+                        'https://openid.example.org/openid/alice'):
+            self.assertEqual(self.middleware._getAttributeService(subject),
+                             ATTRIBUTE_SERVICE_URL)
+
+        self.assertEqual(self.middleware.nDiscoveries, 1)
+
+        self.middleware._getAttributeService(
+                                        'https://other.example.org/carol')
+        self.assertEqual(self.middleware.nDiscoveries, 2)
+
+        # No discovery for subjects which aren't URLs
+        self.assertIsNone(self.middleware._getAttributeService('alice'))
+        self.assertEqual(self.middleware.nDiscoveries, 2)
+
+        with self._clock(self.middleware.discoveryCacheTimeout + 1):
+            self.middleware._getAttributeService(
+                                    'https://openid.example.org/openid/bob')
+            self.assertEqual(self.middleware.nDiscoveries, 3)
+
+    def test02NegativeCachePerSubject(self):
+        alice = 'https://%s/openid/alice' % UNKNOWN_HOST
+        bob = 'https://%s/openid/bob' % UNKNOWN_HOST
+        for i in range(3):
+            self.assertIsNone(self.middleware._getAttributeService(alice))
+
+        self.assertEqual(self.middleware.nDiscoveries, 1)
+
+        # Failures don't apply to other subjects on the same host
+        self.assertIsNone(self.middleware._getAttributeService(bob))
+        self.assertEqual(self.middleware.nDiscoveries, 2)
+
+        # Failures expire before attribute service URLs
+        self.middleware._getAttributeService(
+                                    'https://openid.example.org/openid/carol')
+        self.assertEqual(self.middleware.nDiscoveries, 3)
+
+        with self._clock(self.middleware.discoveryCacheNegativeTimeout + 1):
+            self.middleware._getAttributeService(
+                                    'https://openid.example.org/openid/carol')
+            self.assertEqual(self.middleware.nDiscoveries, 3)
+
+            self.assertIsNone(self.middleware._getAttributeService(alice))
+            self.assertEqual(self.middleware.nDiscoveries, 4)
+
+    def _getAttributesConcurrently(self, subject, nThreads=5):
+        '''Call _getAttributes from several threads while the first query
+        is held in progress'''
+        results = []
+        def getAttributes():
+            try:
+                results.append(self.middleware._getAttributes(subject))
+            except Exception as e:
+                results.append(e)
+
+        self.middleware.queryRelease.clear()
+        threads = [threading.Thread(target=getAttributes)
+                   for i in range(nThreads)]
+        for thread in threads:
+            thread.start()
+
+        self.assertTrue(self.middleware.queryStarted.wait(5.))
+        time.sleep(.2)
+        self.middleware.queryRelease.set()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def test03ConcurrentQueriesMerged(self):
+        subject = 'https://openid.example.org/openid/alice'
+        results = self._getAttributesConcurrently(subject)
+        self.assertEqual(self.middleware.nQueries, 1)
+        self.assertEqual(results, [ATTRIBUTES] * 5)
+
+        # Callers get their own copy of the attributes
+        results[0]['firstname'] = 'Bob'
+        self.assertEqual(results[1], ATTRIBUTES)
+
+        # Results aren't kept once the query has completed
+        self.middleware._getAttributes(subject)
+        self.assertEqual(self.middleware.nQueries, 2)
+
+    def test04ConcurrentQueryErrorShared(self):
+        results = self._getAttributesConcurrently(
+                                    'https://openid.example.org/openid/error')
+        self.assertEqual(self.middleware.nQueries, 1)
+        self.assertEqual(len(results), 5)
+        for result in results:
+            self.assertIsInstance(result, Exception)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+"""Unit tests for connection pool used by the NDG Security HTTP Proxy
+
+MashMyData Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+import unittest
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from ndg.security.server.wsgi.client_proxy.connection_pool import (
+                                                    HTTPConnectionPool,
+                                                    HTTPConnectionPoolHandler,
+                                                    PooledResponseIterator)
+
+
+class TestRequestHandler(BaseHTTPRequestHandler):
+    '''Keep-alive test server returning a fixed response body'''
+    protocol_version = 'HTTP/1.1'
+    response = b'x' * 100000
+    client_ports = set()
+
+    def log_message(self, *arg):
+        pass
+
+    def do_GET(self):
+        self.__class__.client_ports.add(self.client_address[1])
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain')
+        self.send_header('Content-length', str(len(self.response)))
+        self.end_headers()
+        self.wfile.write(self.response)
+
+
+class TestServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class HTTPConnectionPoolTestCase(unittest.TestCase):
+    '''Test reuse of pooled connections'''
+
+    def setUp(self):
+        TestRequestHandler.client_ports.clear()
+        self.server = TestServer(('localhost', 0), TestRequestHandler)
+        self.host = 'localhost:%d' % self.server.server_address[1]
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.pool = HTTPConnectionPool()
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _get(self, n_blocks=None):
+        key, conn, response = self.pool.request('http', self.host, 'GET',
+                                                '/')
+        body = b''
+        response_iter = PooledResponseIterator(self.pool, key, conn,
+                                               response)
+        for i, block in enumerate(response_iter):
+            body += block
+            if n_blocks is not None and i + 1 >= n_blocks:
+                break
+
+        response_iter.close()
+        return body
+
+    def test01ConnectionReused(self):
+        for i in range(3):
+            self.assertEqual(self._get(), TestRequestHandler.response)
+
+        self.assertEqual(len(TestRequestHandler.client_ports), 1)
+        self.assertEqual(len(self.pool), 1)
+
+    def test02PartialResponseClosesConnection(self):
+        body = self._get(n_blocks=1)
+        self.assertTrue(len(body) < len(TestRequestHandler.response))
+        self.assertEqual(len(self.pool), 0)
+
+        self.assertEqual(self._get(), TestRequestHandler.response)
+        self.assertEqual(len(TestRequestHandler.client_ports), 2)
+
+    def test03URLOpenerHandler(self):
+        opener = urllib.request.build_opener(
+                                        HTTPConnectionPoolHandler(self.pool))
+        for i in range(3):
+            response = opener.open('http://%s/' % self.host)
+            self.assertEqual(response.read(), TestRequestHandler.response)
+            response.close()
+
+        self.assertEqual(len(TestRequestHandler.client_ports), 1)
+        self.assertEqual(self.pool.occupancy, {'idle': 1, 'keys': 1})
+
+    def test04ReleasedWhenReadWithoutClose(self):
+        opener = urllib.request.build_opener(
+                                        HTTPConnectionPoolHandler(self.pool))
+        response = opener.open('http://%s/' % self.host)
+        response.read(10)
+        self.assertEqual(len(self.pool), 0)
+
+        # Parsers read to the end of the body and leave the response open
+        response.read()
+        self.assertEqual(len(self.pool), 1)
+
+        response = opener.open('http://%s/' % self.host)
+        response.read(10)
+        response.close()
+        self.assertEqual(len(self.pool), 0)
+        self.assertEqual(len(TestRequestHandler.client_ports), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
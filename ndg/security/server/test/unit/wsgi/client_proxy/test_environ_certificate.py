@@ -0,0 +1,196 @@
+"""Unit tests for host name resolution in the NDG Security proxy middleware
+
+MashMyData Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+import unittest
+import socket
+import threading
+from time import monotonic
+from unittest import mock
+
+from webob import Request
+
+from ndg.security.server.wsgi.client_proxy.environ_certificate import (
+                                                    NDGSecurityProxyMiddleware,
+                                                    NDGSecurityProxy)
+from ndg.security.server.test.unit.wsgi.client_proxy.test_connection_pool \
+    import TestRequestHandler, TestServer
+
+
+class NDGSecurityProxyMiddlewareTestCase(unittest.TestCase):
+    '''Test classification of requests as local or to be proxied'''
+    HOSTS = {
+        '192.0.2.1': 'host.example.org',
+        '192.0.2.2': 'www.example.org'
+    }
+    PROXY_CONFIG = {
+        'ndg_security_proxy.proxy.http_proxy': '',
+        'ndg_security_proxy.proxy.https_proxy': '',
+        'ndg_security_proxy.proxy.no_proxy': ''
+    }
+
+    def setUp(self):
+        self.middleware = NDGSecurityProxyMiddleware(None)
+        self.middleware.initialise({}, **self.__class__.PROXY_CONFIG)
+
+        patcher = mock.patch.object(socket, 'gethostbyaddr',
+                                    side_effect=self._gethostbyaddr)
+        self.gethostbyaddr = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _gethostbyaddr(self, host):
+        if host not in self.__class__.HOSTS:
+            raise socket.herror(1, 'Unknown host')
+
+        return self.__class__.HOSTS[host], [], [host]
+
+    @staticmethod
+    def _clock(offset):
+        '''Move the DNS cache's clock forward by offset seconds'''
+        return mock.patch('ndg.security.server.utils.cache.monotonic',
+                          return_value=monotonic() + offset)
+
+    def test01ResolveCached(self):
+        for i in range(3):
+            self.assertEqual(self.middleware._resolve_host('192.0.2.1'),
+                             'host.example.org')
+
+        self.assertEqual(self.gethostbyaddr.call_count, 1)
+
+        # Expires after the cache timeout
+        with self._clock(self.middleware.dnsCacheTimeout + 1):
+            self.middleware._resolve_host('192.0.2.1')
+
+        self.assertEqual(self.gethostbyaddr.call_count, 2)
+
+    def test02FailedResolveCached(self):
+        for i in range(3):
+            self.assertEqual(self.middleware._resolve_host('192.0.2.3'),
+                             '192.0.2.3')
+
+        self.assertEqual(self.gethostbyaddr.call_count, 1)
+
+        # Failures expire sooner than successful resolutions
+        self.middleware._resolve_host('192.0.2.1')
+        with self._clock(self.middleware.dnsCacheNegativeTimeout + 1):
+            self.middleware._resolve_host('192.0.2.1')
+            self.assertEqual(self.gethostbyaddr.call_count, 2)
+
+            self.middleware._resolve_host('192.0.2.3')
+            self.assertEqual(self.gethostbyaddr.call_count, 3)
+
+    def test03LocalAddresses(self):
+        self.middleware.initialise({},
+            **dict(self.__class__.PROXY_CONFIG, **{
+                'ndg_security_proxy.localAddresses':
+                    'host.example.org:8080, www.example.org'
+            }))
+        for url, isLocal in (('http://192.0.2.1:8080/', True),
+                             ('http://192.0.2.1:9090/', False),
+                             ('http://192.0.2.1/', False),
+                             ('http://192.0.2.2/', True),
+                             ('https://192.0.2.2/', True),
+                             ('http://192.0.2.2:8443/', False),
+                             ('http://192.0.2.3:8080/', False)):
+            self.assertEqual(
+                        self.middleware._is_local_call(Request.blank(url)),
+                        isLocal, url)
+
+        # Each host name is resolved once only
+        self.assertEqual(self.gethostbyaddr.call_count, 3)
+
+    def test04LocalFQDN(self):
+        with mock.patch.object(socket, 'getfqdn',
+                               return_value='host.example.org'):
+            middleware = NDGSecurityProxyMiddleware(None)
+
+        middleware.initialise({}, **self.__class__.PROXY_CONFIG)
+        request = Request.blank('http://192.0.2.1:8080/')
+        self.assertTrue(middleware._is_local_call(request))
+
+        request = Request.blank('http://192.0.2.2:8080/')
+        self.assertFalse(middleware._is_local_call(request))
+
+        # Port differs from the one the request was received on
+        request = Request.blank('http://192.0.2.1:8080/',
+                                environ={'SERVER_PORT': '9090'})
+        self.assertFalse(middleware._is_local_call(request))
+
+
+class ErrorRequestHandler(TestRequestHandler):
+    '''Keep-alive test server returning an error for paths other than /'''
+    def do_GET(self):
+        if self.path == '/':
+            return TestRequestHandler.do_GET(self)
+
+        self.__class__.client_ports.add(self.client_address[1])
+        body = b'Not found'
+        self.send_response(404)
+        self.send_header('Content-type', 'text/plain')
+        self.send_header('Content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class NDGSecurityProxyTestCase(unittest.TestCase):
+    '''Test pooling of connections made by the proxy'''
+
+    def setUp(self):
+        ErrorRequestHandler.client_ports = set()
+        self.server = TestServer(('localhost', 0), ErrorRequestHandler)
+        self.host = 'localhost:%d' % self.server.server_address[1]
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.proxy = NDGSecurityProxy(ctxEnvKeyName='', http_proxy='',
+                                      https_proxy='', no_proxy='localhost')
+
+    def tearDown(self):
+        self.proxy.connectionPool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _get(self, path):
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'wsgi.url_scheme': 'http',
+            'HTTP_HOST': self.host,
+            'PATH_INFO': path
+        }
+        status = []
+        response = self.proxy(environ,
+                              lambda *arg: status.append(arg[0]))
+        body = b''.join(response)
+        if hasattr(response, 'close'):
+            response.close()
+
+        return status[0], body
+
+    def test01ConnectionReused(self):
+        for i in range(3):
+            status, body = self._get('/')
+            self.assertTrue(status.startswith('200'))
+            self.assertEqual(body, ErrorRequestHandler.response)
+
+        self.assertEqual(len(ErrorRequestHandler.client_ports), 1)
+        self.assertEqual(self.proxy.connectionPool.occupancy,
+                         {'idle': 1, 'keys': 1})
+
+    def test02ErrorResponseReleased(self):
+        for path in ('/missing', '/', '/missing'):
+            self._get(path)
+            self.assertEqual(len(self.proxy.connectionPool), 1)
+
+        self.assertEqual(len(ErrorRequestHandler.client_ports), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,228 @@
+"""Unit tests for renewal of MyProxy credentials in the session
+
+MashMyData Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+import unittest
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+
+from webob import Request
+from paste import httpexceptions
+
+from ndg.security.server.test.base import make_pem_cert
+from ndg.security.server.wsgi.client_proxy import middleware
+from ndg.security.server.wsgi.client_proxy.middleware import (
+                                        MyProxyProvisionedSessionMiddleware,
+                                        myproxy_client_installed)
+if myproxy_client_installed:
+    from myproxy.client import MyProxyClient, MyProxyClientError
+else:
+    MyProxyClient = object
+
+
+class MyProxyClientStub(MyProxyClient):
+    """MyProxy client returning credentials generated locally.  Logon calls
+    are counted, signal when they start and block until the test releases
+    them.  If a password is set, logons with any other password fail
+    """
+    def __init__(self, lifetime=12*3600, age=0):
+        super(MyProxyClientStub, self).__init__()
+        self.lifetime = lifetime
+        self.age = age
+        self.fail = False
+        self.password = None
+        self.nLogons = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def logon(self, username, password, **kw):
+        self.nLogons += 1
+        self.started.set()
+        self.release.wait(5.)
+        if self.fail or (self.password is not None and
+                         password != self.password):
+            raise MyProxyClientError('Logon for user %r failed' % username)
+
+        return make_pem_cert(commonName=username, lifetime=self.lifetime,
+                             age=self.age)
+
+
+class ShiftedDatetime(datetime):
+    """Clock for the middleware set a fixed time ahead"""
+    OFFSET = timedelta(hours=10)
+
+    @classmethod
+    def utcnow(cls):
+        return datetime.utcnow() + cls.OFFSET
+
+
+class FastRetryMiddleware(MyProxyProvisionedSessionMiddleware):
+    REFRESH_RETRY_INTERVAL = timedelta(seconds=.2)
+
+
+class PasswordLogonMiddleware(MyProxyProvisionedSessionMiddleware):
+    """Make logon calls with a password set in the environ"""
+    PASSWORD_ENVIRON_KEYNAME = 'test.password'
+
+    def _getMyProxyLogonCallCreds(self, request):
+        return (request.environ.get('REMOTE_USER'),
+                request.environ.get(self.__class__.PASSWORD_ENVIRON_KEYNAME))
+
+
+@unittest.skipIf(not myproxy_client_installed, 'Need MyProxyClient to run '
+                 'MyProxyProvisionedSessionTestCase')
+class MyProxyProvisionedSessionTestCase(unittest.TestCase):
+    '''Test MyProxy logon calls made to provision sessions with credentials'''
+    USERNAME = 'https://localhost:7443/openid/pjk'
+    SESSION_KEYNAME = \
+        MyProxyProvisionedSessionMiddleware.DEFAULT_ENVIRON_SESSION_KEYNAME
+    CERT_NOT_AFTER_KEYNAME = \
+        MyProxyProvisionedSessionMiddleware.CERT_NOT_AFTER_SESSION_KEYNAME
+
+    def setUp(self):
+        self.myProxyClient = MyProxyClientStub()
+        self.middleware = self._createMiddleware()
+
+    def _createMiddleware(self, middlewareClass=
+                          MyProxyProvisionedSessionMiddleware):
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-type', 'text/plain')])
+            return [b'Hello']
+
+        middleware = middlewareClass(app)
+        middleware.myProxyClient = self.myProxyClient
+        return middleware
+
+    def _request(self, session, password=None):
+        request = Request.blank('/', environ={
+            'REMOTE_USER': self.__class__.USERNAME,
+            PasswordLogonMiddleware.PASSWORD_ENVIRON_KEYNAME: password,
+            self.__class__.SESSION_KEYNAME: session
+        })
+        response = request.get_response(self.middleware)
+        self.assertEqual(response.status_int, 200)
+        return request
+
+    def test01ShortLifetimeNotDueOnIssue(self):
+        # 12 hour certificates are shorter than the 1 day expiry offset
+        session = {}
+        self._request(session)
+        self.assertEqual(self.myProxyClient.nLogons, 1)
+        self.assertFalse(self.middleware._is_cert_due_for_renewal(session))
+
+        for i in range(5):
+            self._request(session)
+
+        self.assertEqual(self.myProxyClient.nLogons, 1)
+
+    def test02BackgroundRefresh(self):
+        session = {}
+        request = self._request(session)
+        notAfter = session[self.__class__.CERT_NOT_AFTER_KEYNAME]
+
+        # 10 hours on the certificate is due for renewal.  The request
+        # doesn't wait for the new logon
+        self.myProxyClient.age = -ShiftedDatetime.OFFSET.seconds
+        self.myProxyClient.started.clear()
+        self.myProxyClient.release.clear()
+        with mock.patch.object(middleware, 'datetime', ShiftedDatetime):
+            self.assertTrue(self.middleware._is_cert_due_for_renewal(session))
+            self._request(session)
+            self.assertTrue(self.myProxyClient.started.wait(5.))
+            self.assertEqual(self.myProxyClient.nLogons, 2)
+            self.assertEqual(session[self.__class__.CERT_NOT_AFTER_KEYNAME],
+                             notAfter)
+
+            # A later request picks up the credentials from the same logon
+            self.myProxyClient.release.set()
+            self.middleware._refresh_credentials(request)
+            self.assertEqual(self.myProxyClient.nLogons, 2)
+            self.assertTrue(session[self.__class__.CERT_NOT_AFTER_KEYNAME] >
+                            notAfter)
+            self.assertFalse(
+                        self.middleware._is_cert_due_for_renewal(session))
+
+            self._request(session)
+            self.assertEqual(self.myProxyClient.nLogons, 2)
+
+    def test03ConcurrentRefreshesMerged(self):
+        self.myProxyClient.release.clear()
+        sessions = [{} for i in range(5)]
+        threads = [threading.Thread(target=self._request, args=(session,))
+                   for session in sessions]
+        for thread in threads:
+            thread.start()
+
+        time.sleep(.2)
+        self.myProxyClient.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.myProxyClient.nLogons, 1)
+        certs = [session[MyProxyProvisionedSessionMiddleware.
+                         CERTS_SESSION_KEYNAME] for session in sessions]
+        for cert in certs[1:]:
+            self.assertEqual(cert, certs[0])
+
+    def test04DueOnIssueNotRepeated(self):
+        # The MyProxy server returns certificates which are already due for
+        # renewal e.g. ones limited by the lifetime of a stored credential
+        self.myProxyClient.age = 11*3600
+        session = {}
+        for i in range(5):
+            self._request(session)
+
+        self.assertEqual(self.myProxyClient.nLogons, 1)
+
+    def test05FailureBackoff(self):
+        self.middleware = self._createMiddleware(
+                                        middlewareClass=FastRetryMiddleware)
+        self.myProxyClient.fail = True
+        session = {}
+        for i in range(3):
+            self.assertRaises(httpexceptions.HTTPUnauthorized, self._request,
+                              session)
+        self.assertEqual(self.myProxyClient.nLogons, 1)
+
+        # Retried after the backoff interval
+        time.sleep(.3)
+        self.myProxyClient.fail = False
+        self._request(session)
+        self.assertEqual(self.myProxyClient.nLogons, 2)
+        self.assertFalse(self.middleware._is_cert_due_for_renewal(session))
+
+    def test06LogonsNotSharedBetweenPasswords(self):
+        self.middleware = self._createMiddleware(
+                                    middlewareClass=PasswordLogonMiddleware)
+        self.myProxyClient.password = 'secret'
+
+        # A wrong password doesn't lock out the user
+        self.assertRaises(httpexceptions.HTTPUnauthorized, self._request, {},
+                          password='guess')
+        session = {}
+        self._request(session, password='secret')
+        self.assertEqual(self.myProxyClient.nLogons, 2)
+
+        # A wrong password doesn't get the credentials from another logon
+        guessSession = {}
+        self.assertRaises(httpexceptions.HTTPUnauthorized, self._request,
+                          guessSession, password='guess')
+        self.assertNotIn(MyProxyProvisionedSessionMiddleware.
+                         CERTS_SESSION_KEYNAME, guessSession)
+
+        # The same password shares the logon
+        self._request({}, password='secret')
+        self.assertEqual(self.myProxyClient.nLogons, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
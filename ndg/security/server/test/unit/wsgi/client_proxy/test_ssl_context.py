@@ -0,0 +1,61 @@
+"""Unit tests for SSL context cache used by the NDG Security HTTP Proxy
+
+MashMyData Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+import unittest
+
+from OpenSSL import SSL
+
+from ndg.security.server.test.base import BaseTestCase, make_pem_cert
+from ndg.security.server.wsgi.client_proxy.ssl_context import SSLContextCache
+
+
+class SSLContextCacheTestCase(BaseTestCase):
+    '''Test caching of SSL contexts'''
+    SSL_VERSION = SSL.SSLv23_METHOD
+
+    def setUp(self):
+        # Contexts are cached until the client certificate expires so make
+        # one which is valid rather than use the test PKI certificates
+        cert, private_key = make_pem_cert()
+        self.cert = cert.decode('utf-8')
+        self.private_key = private_key.decode('utf-8')
+
+    def test01CACertsLoadedOnce(self):
+        SSLContextCache.clearCACerts()
+        ca_certs = SSLContextCache.getCACerts(
+                                    caCertDir=self.__class__.CACERT_DIR)
+        self.assertTrue(len(ca_certs) > 0)
+        self.assertIs(SSLContextCache.getCACerts(
+                                    caCertDir=self.__class__.CACERT_DIR),
+                      ca_certs)
+
+    def test02ContextCached(self):
+        cache = SSLContextCache()
+        ctx = cache.getContext(self.__class__.SSL_VERSION,
+                               caCertDir=self.__class__.CACERT_DIR)
+        self.assertIs(cache.getContext(self.__class__.SSL_VERSION,
+                                       caCertDir=self.__class__.CACERT_DIR),
+                      ctx)
+
+        client_ctx = cache.getContext(self.__class__.SSL_VERSION,
+                                      caCertDir=self.__class__.CACERT_DIR,
+                                      cert=self.cert,
+                                      privateKey=self.private_key)
+        self.assertIsNot(client_ctx, ctx)
+        self.assertIs(cache.getContext(self.__class__.SSL_VERSION,
+                                       caCertDir=self.__class__.CACERT_DIR,
+                                       cert=self.cert,
+                                       privateKey=self.private_key),
+                      client_ctx)
+        self.assertEqual(len(cache.contexts), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
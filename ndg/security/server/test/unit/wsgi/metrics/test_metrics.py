@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Unit tests for metrics registry and WSGI metrics middleware
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import unittest
+
+import paste.fixture
+
+from ndg.security.server.utils.metrics import MetricsRegistry
+from ndg.security.server.wsgi.metrics import MetricsMiddleware
+
+
+class TestApp(object):
+    '''Dummy application downstream of the metrics middleware'''
+    response = b'Test application'
+
+    def __call__(self, environ, start_response):
+        start_response('200 OK',
+                       [('Content-type', 'text/plain'),
+                        ('Content-length', str(len(self.__class__.response)))])
+        return [self.__class__.response]
+
+
+class MetricsRegistryTestCase(unittest.TestCase):
+
+    def test01_counter(self):
+        registry = MetricsRegistry()
+        registry.counter('test_total', 'Test counter', result='hit').inc()
+        registry.counter('test_total', result='hit').inc(2)
+        registry.counter('test_total', result='miss').inc()
+
+        text = registry.render()
+        self.assertIn('# HELP test_total Test counter', text)
+        self.assertIn('# TYPE test_total counter', text)
+        self.assertIn('test_total{result="hit"} 3', text)
+        self.assertIn('test_total{result="miss"} 1', text)
+
+    def test02_timer(self):
+        registry = MetricsRegistry()
+        timer = registry.timer('test_seconds', buckets=(.1, 1.), phase='a')
+        timer.observe(.05)
+        timer.observe(.5)
+        timer.observe(5.)
+        with timer.time():
+            pass
+
+        text = registry.render()
+        self.assertIn('# TYPE test_seconds histogram', text)
+        self.assertIn('test_seconds_bucket{phase="a",le="0.1"} 2', text)
+        self.assertIn('test_seconds_bucket{phase="a",le="1.0"} 3', text)
+        self.assertIn('test_seconds_bucket{phase="a",le="+Inf"} 4', text)
+        self.assertIn('test_seconds_count{phase="a"} 4', text)
+
+    def test03_label_escaping(self):
+        registry = MetricsRegistry()
+        registry.counter('test_total', uri='a"b\\c').inc()
+        self.assertIn('test_total{uri="a\\"b\\\\c"} 1', registry.render())
+
+    def test04_disabled(self):
+        registry = MetricsRegistry(enabled=False)
+        registry.counter('test_total').inc()
+        registry.timer('test_seconds').observe(1.)
+
+        text = registry.render()
+        self.assertIn('test_total 0', text)
+        self.assertIn('test_seconds_count 0', text)
+
+    def test05_type_mismatch(self):
+        registry = MetricsRegistry()
+        registry.counter('test_total')
+        self.assertRaises(TypeError, registry.timer, 'test_total')
+
+
+class MetricsMiddlewareTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.registry.counter('test_total').inc()
+
+        mware = MetricsMiddleware(TestApp(), registry=self.registry)
+        mware.initialise({}, **{'metrics.path': '/metrics/'})
+        self.app = paste.fixture.TestApp(mware)
+
+    def test01_get_metrics(self):
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status, 200)
+        self.assertTrue(response.header('Content-type').startswith(
+                                                                'text/plain'))
+        self.assertIn(b'test_total 1', response.body)
+
+    def test02_pass_through(self):
+        response = self.app.get('/other')
+        self.assertEqual(response.body, TestApp.response)
+
+    def test03_post_not_allowed(self):
+        response = self.app.post('/metrics', params='', status=405)
+        self.assertEqual(response.status, 405)
+
+    def test04_disable(self):
+        mware = MetricsMiddleware(TestApp(), registry=self.registry)
+        mware.initialise({}, **{'metrics.enabled': 'False'})
+        self.assertFalse(self.registry.enabled)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -16,7 +16,9 @@ import paste.fixture
 from paste.deploy import loadapp
 from OpenSSL import crypto
 
-from ndg.security.server.test.base import CONFIG_DIR_ENVVARNAME, BaseTestCase
+from ndg.security.server.test.base import (CONFIG_DIR_ENVVARNAME, BaseTestCase,
+                                           make_pem_cert)
+from ndg.security.server.wsgi.ssl import ApacheSSLAuthnMiddleware
 
 
 class TestSSLClientAuthnApp(BaseTestCase):
@@ -87,6 +89,26 @@ class SSLClientAuthNTestCase(BaseTestCase):
         response = self.app.get('/secured/uri',
                                 extra_environ=extra_environ,
                                 status=200)
+        
+    def test04ClientCertCached(self):
+        middleware = ApacheSSLAuthnMiddleware(TestSSLClientAuthnApp({}), {},
+                                              prefix='ssl.',
+                                              **{'ssl.rePathMatchList': 
+                                                 '^/secured/.*$'})
+        app = paste.fixture.TestApp(middleware)
+        pem_cert, pem_key = make_pem_cert()
+        extra_environ = {'HTTPS':'1', 
+                         'SSL_CLIENT_CERT': pem_cert.decode('UTF-8')}
+        
+        for i in range(2):
+            app.get('/secured/uri', extra_environ=extra_environ, status=200)
+            self.assertEqual(len(middleware.certCache), 1)
+            
+        # Expired certificates are rejected and not cached
+        pem_cert, pem_key = make_pem_cert(lifetime=60, age=120)
+        extra_environ['SSL_CLIENT_CERT'] = pem_cert.decode('UTF-8')
+        app.get('/secured/uri', extra_environ=extra_environ, status=401)
+        self.assertEqual(len(middleware.certCache), 1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""Unit tests for NDG Security session write behind middleware
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import unittest
+
+from beaker.middleware import SessionMiddleware
+from beaker.session import Session
+
+from ndg.security.server.wsgi.session import (SessionHandlerMiddleware,
+                                              SessionWriteBehindMiddleware,
+                                              WriteBehindSession, LazySession)
+
+
+class CountingSession(Session):
+    '''Count the number of times the session is written'''
+    nSaves = 0
+
+    def save(self, *arg, **kw):
+        if not kw.get('accessed_only'):
+            CountingSession.nSaves += 1
+        return super(CountingSession, self).save(*arg, **kw)
+
+
+class SessionWriteBehindMiddlewareTestCase(unittest.TestCase):
+    SESSION_KEY = 'beaker.session.ndg.security'
+
+    def setUp(self):
+        CountingSession.nSaves = 0
+
+    def _app(self, environ, start_response):
+        session = environ[self.SESSION_KEY]
+        self.assertIsInstance(session, WriteBehindSession)
+        for i in range(3):
+            session['key%d' % i] = i
+            session.save()
+
+        start_response('200 OK', [('Content-type', 'text/plain')])
+        return [b'ok']
+
+    def test01SaveCoalesced(self):
+        app = SessionMiddleware(SessionWriteBehindMiddleware(self._app, {}),
+                                {'session.type': 'memory',
+                                 'session.session_class': CountingSession},
+                                environ_key=self.SESSION_KEY)
+        headers = []
+        start_response = lambda status, header, exc_info=None: \
+            headers.extend(header)
+
+        response = app({}, start_response)
+        self.assertEqual(list(response), [b'ok'])
+        response.close()
+
+        self.assertEqual(CountingSession.nSaves, 1)
+        self.assertIn('Set-cookie', dict(headers))
+
+    def test02DeleteThenSet(self):
+        session = WriteBehindSession(Session({}, use_cookies=False,
+                                             type='memory'))
+        session['username'] = 'abc'
+        session.delete()
+        self.assertNotIn('username', session)
+        self.assertTrue(session.dirty)
+
+        session['username'] = 'def'
+        self.assertEqual(session.dirtyKeys, frozenset(['username']))
+        self.assertTrue(session.flush())
+        self.assertFalse(session.dirty)
+        self.assertFalse(session.flush())
+        self.assertEqual(session['username'], 'def')
+
+    def test03LazyAnonymousSession(self):
+        sessions = []
+        def app(environ, start_response):
+            sessions.append(environ[self.SESSION_KEY])
+            start_response('200 OK', [('Content-type', 'text/plain')])
+            return [b'ok']
+
+        app_conf = {
+            'sessionHandler.signoutPath': '/logout',
+            'sessionHandler.lazyAnonymousSession': 'True'
+        }
+        app = SessionMiddleware(SessionHandlerMiddleware(app, {}, **app_conf),
+                                {'session.type': 'memory',
+                                 'session.session_class': CountingSession},
+                                environ_key=self.SESSION_KEY)
+        headers = []
+        start_response = lambda status, header, exc_info=None: \
+            headers.extend(header)
+
+        environ = {'PATH_INFO': '/', 'QUERY_STRING': ''}
+        self.assertEqual(list(app(environ, start_response)), [b'ok'])
+
+        # The session backend wasn't used and no cookie was set
+        self.assertIsInstance(sessions[0], LazySession)
+        self.assertFalse(sessions[0].materialised)
+        self.assertEqual(CountingSession.nSaves, 0)
+        self.assertNotIn('Set-cookie', dict(headers))
+
+        # Writing creates the session
+        sessions[0]['key'] = 'value'
+        self.assertTrue(sessions[0].materialised)
+        self.assertEqual(sessions[0]['key'], 'value')
+
+
+if __name__ == "__main__":
+    unittest.main()
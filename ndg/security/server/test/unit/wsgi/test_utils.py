@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""Unit tests for NDG Security WSGI utilities
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import unittest
+import io
+
+from ndg.security.server.wsgi.utils import FileObjResponseIterator
+
+
+class FileObjResponseIteratorTestCase(unittest.TestCase):
+    CONTENT = bytes(range(256)) * 4096
+
+    def _make_iter(self, request_range=None, **kw):
+        return FileObjResponseIterator(io.BytesIO(self.CONTENT),
+                                       file_size=len(self.CONTENT),
+                                       request_range=request_range, **kw)
+
+    def test01ReadAll(self):
+        response_iter = self._make_iter(block_size=1024,
+                                        max_block_size=65536)
+        blocks = list(response_iter)
+        self.assertEqual(b''.join(blocks), self.CONTENT)
+
+        # Block size increases up to the maximum
+        self.assertEqual(len(blocks[0]), 1024)
+        self.assertEqual(max([len(block) for block in blocks]), 65536)
+
+    def test02SingleRange(self):
+        response_iter = self._make_iter('bytes=10-19')
+        self.assertEqual(b''.join(response_iter), self.CONTENT[10:20])
+        self.assertEqual(response_iter.content_length, 10)
+        self.assertEqual(response_iter.content_range_hdr[1],
+                         'bytes 10-19/%d' % len(self.CONTENT))
+
+        response_iter = self._make_iter('bytes=-5')
+        self.assertEqual(b''.join(response_iter), self.CONTENT[-5:])
+
+        self.assertRaises(FileObjResponseIterator.InvalidRangeRequest,
+                          self._make_iter, 'bytes=20-10')
+        self.assertRaises(FileObjResponseIterator.InvalidRangeRequestSyntax,
+                          self._make_iter, 'bytes=a-b')
+
+    def test03MultipleRanges(self):
+        response_iter = self._make_iter('bytes=0-1,100-102',
+                                        content_type='text/plain')
+        body = b''.join(response_iter)
+        self.assertEqual(len(body), response_iter.content_length)
+        self.assertTrue(response_iter.content_type_hdr[1].endswith(
+                                                    response_iter.boundary))
+        self.assertIn(b'Content-range: bytes 100-102/%d\r\n\r\n%s\r\n' %
+                      (len(self.CONTENT), self.CONTENT[100:103]), body)
+        self.assertTrue(body.endswith(
+                        b'--%s--\r\n' % response_iter.boundary.encode()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+"""Bounded in-memory cache with least recently used eviction and optional
+expiry of entries
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class LRUCache(object):
+    """Thread safe mapping of keys to values bounded by a maximum number of
+    entries.  When full, the least recently used entry is discarded.  Entries
+    may optionally expire a fixed time after they were set
+
+    @cvar DEFAULT_MAX_SIZE: default maximum number of entries
+    @type DEFAULT_MAX_SIZE: int
+    """
+    DEFAULT_MAX_SIZE = 1000
+
+    __slots__ = ('__maxSize', '__timeout', '__entries', '__lock')
+
+    def __init__(self, maxSize=DEFAULT_MAX_SIZE, timeout=None):
+        '''
+        @param maxSize: maximum number of entries.  Set to zero to disable
+        caching
+        @type maxSize: int / basestring
+        @param timeout: time in seconds after which entries expire or None for
+        no expiry
+        @type timeout: int / float / basestring / None
+        '''
+        self.__maxSize = None
+        self.maxSize = maxSize
+        self.__timeout = None
+        self.timeout = timeout
+
+        # key -> (expiry time or None, value), least recently used first
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+    def _getMaxSize(self):
+        return self.__maxSize
+
+    def _setMaxSize(self, value):
+        if isinstance(value, (int, str)):
+            self.__maxSize = int(value)
+        else:
+            raise TypeError('Expecting int or string type for "maxSize"; got '
+                            '%r' % type(value))
+
+    maxSize = property(_getMaxSize, _setMaxSize,
+                       doc="Maximum number of entries")
+
+    def _getTimeout(self):
+        return self.__timeout
+
+    def _setTimeout(self, value):
+        if value is None or value == '':
+            self.__timeout = None
+
+        elif isinstance(value, (int, float, str)):
+            self.__timeout = float(value)
+        else:
+            raise TypeError('Expecting int, float, string or None type for '
+                            '"timeout"; got %r' % type(value))
+
+    timeout = property(_getTimeout, _setTimeout,
+                       doc="Time in seconds after which entries expire or "
+                           "None for no expiry")
+
+    def get(self, key, default=None):
+        '''Get a value, marking it as most recently used
+
+        @param key: cache key
+        @param default: value to return if there is no entry for key or it
+        has expired
+        @return: cached value or default
+        '''
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return default
+
+            expires, value = entry
+            if expires is not None and expires <= monotonic():
+                del self.__entries[key]
+                return default
+
+            self.__entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        '''Add or replace an entry
+
+        @param key: cache key
+        @param value: value to cache
+        @param timeout: override default expiry time in seconds for this
+        entry
+        @type timeout: int / float / None
+        '''
+        if self.__maxSize <= 0:
+            return
+
+        if timeout is None:
+            timeout = self.__timeout
+
+        if timeout is None:
+            expires = None
+        else:
+            expires = monotonic() + timeout
+
+        with self.__lock:
+            self.__entries[key] = (expires, value)
+            self.__entries.move_to_end(key)
+
+            while len(self.__entries) > self.__maxSize:
+                self.__entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        '''Remove an entry
+
+        @param key: cache key
+        @param default: value to return if there is no entry for key
+        @return: value removed or default
+        '''
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+
+        if entry is None:
+            return default
+
+        return entry[1]
+
+    def removeExpired(self):
+        '''Remove all expired entries
+
+        @return: number of entries removed
+        @rtype: int
+        '''
+        now = monotonic()
+        with self.__lock:
+            expired = [key for key, (expires, value) in self.__entries.items()
+                       if expires is not None and expires <= now]
+            for key in expired:
+                del self.__entries[key]
+
+        return len(expired)
+
+    def clear(self):
+        '''Remove all entries'''
+        with self.__lock:
+            self.__entries.clear()
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self.__entries)
@@ -0,0 +1,107 @@
+"""Append-only capture logs for recording authorisation traffic so that it can
+be replayed offline - see ndg.security.server.xacml.ctx_handler.replay
+
+Each record is written as a single line of compact JSON.  Subject identities
+are replaced with a keyed hash so that logs do not contain user identifiers
+but records for the same subject can still be correlated between the PEP and
+PIP logs provided both use the same salt.
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import logging
+log = logging.getLogger(__name__)
+
+import hmac
+import json
+from hashlib import sha256
+from os import path
+from threading import Lock
+from time import time
+
+
+def hashSubject(subject, salt=''):
+    '''Make a keyed hash of a subject identifier.  An empty subject (anonymous
+    access) is returned unchanged
+
+    @param subject: subject identifier e.g. OpenID
+    @type subject: basestring
+    @param salt: key for hash
+    @type salt: basestring
+    @return: hex digest
+    @rtype: basestring
+    '''
+    if not subject:
+        return ''
+
+    return hmac.new(salt.encode('utf-8'), subject.encode('utf-8'),
+                    sha256).hexdigest()[:32]
+
+
+def readCaptureLog(filePath):
+    '''Iterate over records in a capture log.  Incomplete or corrupt lines e.g.
+    from a log truncated while being written are skipped
+
+    @param filePath: capture log file path
+    @type filePath: basestring
+    @return: generator of record dictionaries
+    '''
+    with open(filePath) as captureFile:
+        for lineNum, line in enumerate(captureFile, 1):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                yield json.loads(line)
+
+            except ValueError:
+                log.warning('Skipping invalid record at line %d of capture '
+                            'log %r', lineNum, filePath)
+
+
+class CaptureLog(object):
+    """Thread safe append-only log of JSON records
+
+    @cvar TIMESTAMP_KEYNAME: record key for the time the record was written
+    @type TIMESTAMP_KEYNAME: string
+    """
+    TIMESTAMP_KEYNAME = 't'
+
+    __slots__ = ('__filePath', '__file', '__lock')
+
+    def __init__(self, filePath):
+        '''
+        @param filePath: log file path.  The file is created if it doesn't
+        exist and appended to if it does
+        @type filePath: basestring
+        '''
+        self.__filePath = path.expandvars(filePath)
+        self.__file = open(self.__filePath, 'a', buffering=1)
+        self.__lock = Lock()
+
+    @property
+    def filePath(self):
+        """Path to log file"""
+        return self.__filePath
+
+    def write(self, **record):
+        '''Append a record.  A timestamp is added with key "t"
+
+        @param record: JSON serialisable items
+        @type record: dict
+        '''
+        record[self.__class__.TIMESTAMP_KEYNAME] = round(time(), 3)
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+
+        with self.__lock:
+            self.__file.write(line)
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
@@ -0,0 +1,63 @@
+"""Genshi template loading helpers
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import logging
+log = logging.getLogger(__name__)
+
+import os
+
+from genshi.template import TemplateLoader
+
+# File extensions of templates to load and compile at start up
+TEMPLATE_EXTENSIONS = ('.html', '.xml')
+
+
+def listTemplateNames(templateRootDir, extensions=TEMPLATE_EXTENSIONS):
+    '''List template file names in a directory
+
+    @param templateRootDir: template directory
+    @type templateRootDir: basestring
+    @param extensions: template file extensions
+    @type extensions: tuple
+    @return: template file names
+    @rtype: list
+    '''
+    return sorted([name for name in os.listdir(templateRootDir)
+                   if name.endswith(extensions) and
+                   os.path.isfile(os.path.join(templateRootDir, name))])
+
+
+def createTemplateLoader(templateRootDir, autoReload=False):
+    '''Create a Genshi template loader.  Unless auto reload is set, all
+    templates in the directory are loaded and compiled now and held in memory
+    so that rendering doesn't touch the file system.  With auto reload, files
+    are loaded on first use and checked for modification on every load
+
+    @param templateRootDir: template directory
+    @type templateRootDir: basestring
+    @param autoReload: reload templates when the files change
+    @type autoReload: bool
+    @return: template loader
+    @rtype: genshi.template.TemplateLoader
+    '''
+    if autoReload:
+        return TemplateLoader(templateRootDir, auto_reload=True)
+
+    templateNames = listTemplateNames(templateRootDir)
+
+    # Make the loader cache big enough to hold every template
+    loader = TemplateLoader(templateRootDir,
+                            auto_reload=False,
+                            max_cache_size=max(25, len(templateNames)))
+    for templateName in templateNames:
+        loader.load(templateName)
+
+    log.debug('Compiled templates %r from %r', templateNames, templateRootDir)
+    return loader
@@ -0,0 +1,336 @@
+"""In-process metrics registry for timing and counting NDG Security hot paths
+
+Metrics are held in memory and rendered in the Prometheus text exposition
+format by ndg.security.server.wsgi.metrics.MetricsMiddleware.  Recording a
+measurement costs a dictionary lookup, a lock acquisition and a bisect over
+the bucket boundaries so collection can be left on in production.  Set
+registry.enabled = False to disable it altogether.
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import logging
+log = logging.getLogger(__name__)
+
+from bisect import bisect_left
+from math import ceil
+from threading import Lock
+from time import perf_counter
+
+PERCENTILES = (50, 95, 99)
+
+
+def _format_labels(labels, extra=None):
+    '''Format a label tuple as a Prometheus label set string'''
+    items = list(labels)
+    if extra is not None:
+        items.append(extra)
+
+    if not items:
+        return ''
+
+    return '{%s}' % ','.join(
+        ['%s="%s"' % (name, value.replace('\\', '\\\\').replace('"', '\\"'
+                                                    ).replace('\n', '\\n'))
+         for name, value in items])
+
+
+def _format_value(value):
+    '''Format a sample value - avoid spurious decimal places for integers'''
+    if isinstance(value, int):
+        return str(value)
+
+    return repr(float(value))
+
+
+def percentile(sortedSamples, pc):
+    '''Nearest rank percentile
+
+    @param sortedSamples: samples in ascending order
+    @type sortedSamples: list
+    @param pc: percentile 0-100
+    @type pc: int / float
+    '''
+    if not sortedSamples:
+        return None
+
+    rank = max(int(ceil(pc / 100. * len(sortedSamples))), 1)
+    return sortedSamples[rank - 1]
+
+
+def summarise(samples):
+    '''Summarise latency samples in seconds as a dictionary of count, mean,
+    max and percentiles in milliseconds.  Used by offline benchmarking and
+    replay tools where every sample is kept
+    '''
+    sortedSamples = sorted(samples)
+    summary = {'count': len(sortedSamples)}
+    if not sortedSamples:
+        return summary
+
+    summary['mean_ms'] = sum(sortedSamples) * 1e3 / len(sortedSamples)
+    for pc in PERCENTILES:
+        summary['p%d_ms' % pc] = percentile(sortedSamples, pc) * 1e3
+
+    summary['max_ms'] = sortedSamples[-1] * 1e3
+    return summary
+
+
+class Counter(object):
+    """Monotonically increasing count
+
+    @ivar value: current count
+    @type value: int / float
+    """
+    __slots__ = ('registry', 'labels', 'value', '_lock')
+
+    def __init__(self, registry, labels):
+        '''
+        @param registry: parent registry
+        @type registry: MetricsRegistry
+        @param labels: sorted tuple of (name, value) label pairs
+        @type labels: tuple
+        '''
+        self.registry = registry
+        self.labels = labels
+        self.value = 0
+        self._lock = Lock()
+
+    def inc(self, amount=1):
+        '''Increment the counter
+
+        @param amount: amount to increment by
+        @type amount: int / float
+        '''
+        if not self.registry.enabled:
+            return
+
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name):
+        '''Yield exposition lines for this counter'''
+        yield '%s%s %s' % (name, _format_labels(self.labels),
+                           _format_value(self.value))
+
+
+class _TimerContext(object):
+    """Context manager returned by Timer.time()"""
+    __slots__ = ('timer', 'start')
+
+    def __init__(self, timer):
+        self.timer = timer
+        self.start = None
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.observe(perf_counter() - self.start)
+
+
+class Timer(object):
+    """Histogram of elapsed times in seconds
+
+    @ivar count: number of observations
+    @type count: int
+    @ivar sum: total of all observations in seconds
+    @type sum: float
+    @ivar bucketCounts: non-cumulative count of observations falling in each
+    bucket.  The final element counts observations greater than the largest
+    bucket boundary
+    @type bucketCounts: list
+    """
+    __slots__ = ('registry', 'labels', 'buckets', 'bucketCounts', 'count',
+                 'sum', '_lock')
+
+    def __init__(self, registry, labels, buckets):
+        '''
+        @param registry: parent registry
+        @type registry: MetricsRegistry
+        @param labels: sorted tuple of (name, value) label pairs
+        @type labels: tuple
+        @param buckets: ascending bucket upper bounds in seconds
+        @type buckets: tuple
+        '''
+        self.registry = registry
+        self.labels = labels
+        self.buckets = buckets
+        self.bucketCounts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+        self._lock = Lock()
+
+    def observe(self, elapsed):
+        '''Record an elapsed time
+
+        @param elapsed: time in seconds
+        @type elapsed: float
+        '''
+        if not self.registry.enabled:
+            return
+
+        i = bisect_left(self.buckets, elapsed)
+        with self._lock:
+            self.bucketCounts[i] += 1
+            self.count += 1
+            self.sum += elapsed
+
+    def time(self):
+        '''Time a block of code:
+
+        with timer.time():
+            ...
+
+        @return: context manager which records the elapsed time on exit
+        @rtype: _TimerContext
+        '''
+        return _TimerContext(self)
+
+    def samples(self, name):
+        '''Yield exposition lines for this timer'''
+        with self._lock:
+            bucketCounts = self.bucketCounts[:]
+            count = self.count
+            total = self.sum
+
+        cumulative = 0
+        for bound, bucketCount in zip(self.buckets, bucketCounts):
+            cumulative += bucketCount
+            yield '%s_bucket%s %d' % (name,
+                                      _format_labels(self.labels,
+                                                     ('le', repr(bound))),
+                                      cumulative)
+
+        yield '%s_bucket%s %d' % (name,
+                                  _format_labels(self.labels, ('le', '+Inf')),
+                                  count)
+        yield '%s_sum%s %s' % (name, _format_labels(self.labels),
+                               _format_value(total))
+        yield '%s_count%s %d' % (name, _format_labels(self.labels), count)
+
+
+class MetricsRegistry(object):
+    """Registry of named counters and timers.  Each metric name may have
+    several children distinguished by label values e.g.
+
+    registry.timer('ndg_security_pep_phase_seconds', 'PEP phase timings',
+                   phase='cache_lookup')
+
+    Children are created on first use and the same instance is returned
+    thereafter so that callers with fixed labels may keep a reference.
+
+    @cvar DEFAULT_BUCKETS: default timer bucket upper bounds in seconds
+    @type DEFAULT_BUCKETS: tuple
+    @ivar enabled: set to False to make all recording calls no-ops
+    @type enabled: bool
+    """
+    DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5,
+                       1., 2.5, 5., 10.)
+    COUNTER_TYPE = 'counter'
+    TIMER_TYPE = 'histogram'
+
+    __slots__ = ('enabled', '_metrics', '_lock')
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+
+        # Metric name -> (type, help text, {labels: Counter/Timer})
+        self._metrics = {}
+        self._lock = Lock()
+
+    def _getChild(self, name, metricType, doc, labels, factory):
+        '''Get or create a metric child for the given label values'''
+        key = tuple(sorted([(k, str(v)) for k, v in labels.items()]))
+        metric = self._metrics.get(name)
+        if metric is not None and metric[0] == metricType:
+            child = metric[2].get(key)
+            if child is not None:
+                return child
+
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = (metricType, doc, {})
+
+            elif metric[0] != metricType:
+                raise TypeError('Metric %r is already registered as a %s' %
+                                (name, metric[0]))
+
+            child = metric[2].get(key)
+            if child is None:
+                child = metric[2][key] = factory(key)
+
+        return child
+
+    def counter(self, name, doc='', **labels):
+        '''Get or create a counter
+
+        @param name: metric name
+        @type name: string
+        @param doc: help text used when the metric is first created
+        @type doc: string
+        @param labels: label values distinguishing this counter
+        @type labels: dict
+        @rtype: Counter
+        '''
+        return self._getChild(name, self.__class__.COUNTER_TYPE, doc, labels,
+                              lambda key: Counter(self, key))
+
+    def timer(self, name, doc='', buckets=None, **labels):
+        '''Get or create a timer
+
+        @param name: metric name
+        @type name: string
+        @param doc: help text used when the metric is first created
+        @type doc: string
+        @param buckets: bucket upper bounds in seconds, defaults to
+        DEFAULT_BUCKETS
+        @type buckets: tuple
+        @param labels: label values distinguishing this timer
+        @type labels: dict
+        @rtype: Timer
+        '''
+        if buckets is None:
+            buckets = self.__class__.DEFAULT_BUCKETS
+
+        return self._getChild(name, self.__class__.TIMER_TYPE, doc, labels,
+                              lambda key: Timer(self, key, tuple(buckets)))
+
+    def clear(self):
+        '''Remove all metrics'''
+        with self._lock:
+            self._metrics = {}
+
+    def render(self):
+        '''Render all metrics in the Prometheus text exposition format
+
+        @rtype: string
+        @return: exposition text
+        '''
+        with self._lock:
+            metrics = sorted([(name, metricType, doc, list(children.values()))
+                              for name, (metricType, doc, children)
+                              in self._metrics.items()])
+
+        lines = []
+        for name, metricType, doc, children in metrics:
+            if doc:
+                lines.append('# HELP %s %s' % (name, doc.replace('\\', '\\\\'
+                                                    ).replace('\n', '\\n')))
+            lines.append('# TYPE %s %s' % (name, metricType))
+
+            for child in sorted(children, key=lambda child: child.labels):
+                lines.extend(child.samples(name))
+
+        return '\n'.join(lines) + '\n'
+
+
+# Default registry shared by all NDG Security components in this process
+registry = MetricsRegistry()
@@ -6,13 +6,25 @@ __copyright__ = "(C) 2019 UKRI"
 __license__ = "license file in top-level package directory"
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __all__ = []
-from io import BytesIO 
+import tempfile
 
 from paste import httpexceptions
 from paste.util import converters
 
 
-def make_cascade(loader, global_conf, catch='404', **local_conf):
+STATIC_CONTENT_METHODS = ('GET', 'HEAD')
+
+
+def non_static_method(environ):
+    """Passthrough test for a cascade falling back to static content: only 
+    GET and HEAD requests can be served by the static content app so others
+    go straight to the first app
+    """
+    return environ.get('REQUEST_METHOD') not in STATIC_CONTENT_METHODS
+
+
+def make_cascade(loader, global_conf, catch='404', spool_threshold=None,
+                 **local_conf):
     """
     Entry point for Paste Deploy configuration
     Expects configuration like::
@@ -23,8 +35,16 @@ def make_cascade(loader, global_conf, catch='404', **local_conf):
         app2 = bar
         ...
         catch = 404 500 ...
+        # optional size in bytes above which request bodies kept for
+        # replaying to the next app are written to a temporary file
+        spool_threshold = 65536
     """
     catch = map(int, converters.aslist(catch))
+    if spool_threshold is None:
+        spool_threshold = Cascade.DEFAULT_SPOOL_THRESHOLD
+    else:
+        spool_threshold = int(spool_threshold)
+
     apps = []
     for name, value in local_conf.items():
         if not name.startswith('app'):
@@ -36,7 +56,7 @@ def make_cascade(loader, global_conf, catch='404', **local_conf):
         apps.append((name, app))
     apps.sort()
     apps = [app for name, app in apps]
-    return Cascade(apps, catch=catch)
+    return Cascade(apps, catch=catch, spool_threshold=spool_threshold)
 
 
 class Cascade(object):
@@ -49,12 +69,24 @@ class Cascade(object):
 
     If all applications fail, then the last application's failure
     response is used.
+    
+    The request body is read lazily: only what an application reads is kept
+    so that it can be replayed to the next one.  Bodies kept beyond 
+    ``spool_threshold`` bytes are written to a temporary file.  If no 
+    application before the last reads the body, the last is passed the 
+    original ``wsgi.input``.  ``passthrough`` is an optional callable taking
+    the environ which returns True for requests which should go straight to 
+    the first application with no fallback e.g. ``non_static_method``.
 
     Instances of this class are WSGI applications.
     """
+    DEFAULT_SPOOL_THRESHOLD = 65536
 
-    def __init__(self, applications, catch=(404,)):
+    def __init__(self, applications, catch=(404,), 
+                 spool_threshold=DEFAULT_SPOOL_THRESHOLD, passthrough=None):
         self.apps = applications
+        self.spool_threshold = spool_threshold
+        self.passthrough = passthrough
         self.catch_codes = {}
         self.catch_exceptions = []
         for error in catch:
@@ -74,6 +106,9 @@ class Cascade(object):
         """
         WSGI application interface
         """
+        if self.passthrough is not None and self.passthrough(environ):
+            return self.apps[0](environ, start_response)
+        
         failed = []
         def repl_start_response(status, headers, exc_info=None):
             code = int(status.split(None, 1)[0])
@@ -87,30 +122,16 @@ class Cascade(object):
         except ValueError:
             length = 0
         if length > 0:
-            # We have to copy wsgi.input
-            copy_wsgi_input = True
-            if length > 4096 or length < 0:
-                f = tempfile.TemporaryFile()
-                if length < 0:
-                    f.write(environ['wsgi.input'].read())
-                else:
-                    copy_len = length
-                    while copy_len > 0:
-                        chunk = environ['wsgi.input'].read(min(copy_len, 4096))
-                        if not chunk:
-                            raise IOError("Request body truncated")
-                        f.write(chunk)
-                        copy_len -= len(chunk)
-                f.seek(0)
-            else:
-                f = BytesIO(environ['wsgi.input'].read(length))
-            environ['wsgi.input'] = f
+            # Keep what's read of wsgi.input so that it can be replayed
+            tee_input = _TeeInput(environ['wsgi.input'], length,
+                                  self.spool_threshold)
         else:
-            copy_wsgi_input = False
+            tee_input = None
         for app in self.apps[:-1]:
             environ_copy = environ.copy()
-            if copy_wsgi_input:
-                environ_copy['wsgi.input'].seek(0)
+            if tee_input is not None:
+                tee_input.rewind()
+                environ_copy['wsgi.input'] = tee_input
             failed = []
             try:
                 v = app(environ_copy, repl_start_response)
@@ -124,10 +145,116 @@ class Cascade(object):
                         v.close()
             except self.catch_exceptions:
                 pass
-        if copy_wsgi_input:
-            environ['wsgi.input'].seek(0)
+        if tee_input is not None and tee_input.buffered > 0:
+            # No need to keep the rest as there is no further app to replay to
+            tee_input.rewind(record=False)
+            environ['wsgi.input'] = tee_input
         return self.apps[-1](environ, start_response)
 
 
+class _TeeInput(object):
+    """
+    File like wrapper for ``wsgi.input`` which keeps what is read from it so
+    that it can be read again after ``rewind``.  Reads are limited to the
+    content length.  What is kept is held in memory up to the spool threshold
+    and then written to a temporary file.
+    """
+
+    def __init__(self, source, length, spool_threshold):
+        self._source = source
+        self._remaining = length
+        self._spool_threshold = spool_threshold
+        self._buffer = None
+        self._pos = 0
+        self.buffered = 0
+        self.record = True
+
+    def rewind(self, record=True):
+        """
+        Return to the start of the input.  Set record to False if the input
+        won't be rewound again so that no more of it is kept
+        """
+        self._pos = 0
+        self.record = record
+
+    def _keep(self, data):
+        self._pos += len(data)
+        if not self.record or not data:
+            return
+
+        if self._buffer is None:
+            self._buffer = tempfile.SpooledTemporaryFile(
+                                            max_size=self._spool_threshold)
+        self._buffer.seek(self.buffered)
+        self._buffer.write(data)
+        self.buffered += len(data)
+
+    def _limit(self, size):
+        if size is None or size < 0 or size > self._remaining:
+            return self._remaining
+        return size
+
+    def _read_kept(self, read, size):
+        if self._pos >= self.buffered:
+            return b''
+
+        available = self.buffered - self._pos
+        if size is not None and size >= 0:
+            available = min(size, available)
+        self._buffer.seek(self._pos)
+        data = read(self._buffer, available)
+        self._pos += len(data)
+        return data
+
+    def read(self, size=-1):
+        kept = self._read_kept(lambda f, n: f.read(n), size)
+        if size is not None and size >= 0:
+            size -= len(kept)
+            if size == 0:
+                return kept
+
+        size = self._limit(size)
+        if size == 0:
+            return kept
+        data = self._source.read(size)
+        self._remaining -= len(data)
+        self._keep(data)
+        return kept + data
+
+    def readline(self, size=-1):
+        kept = self._read_kept(lambda f, n: f.readline(n), size)
+        if kept.endswith(b'\n'):
+            return kept
+        if size is not None and size >= 0:
+            size -= len(kept)
+            if size == 0:
+                return kept
+
+        size = self._limit(size)
+        if size == 0:
+            return kept
+        data = self._source.readline(size)
+        self._remaining -= len(data)
+        self._keep(data)
+        return kept + data
+
+    def readlines(self, hint=-1):
+        lines = []
+        total = 0
+        for line in self:
+            lines.append(line)
+            total += len(line)
+            if hint is not None and 0 < hint <= total:
+                break
+        return lines
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
 def _consuming_writer(s):
     pass
@@ -166,7 +166,7 @@ class NDGSecurityMiddlewareBase(object):
         @param start_response: standard WSGI callable to set the HTTP header
         defaults to start_response object attribute.  For the latter to be 
         available, the initCall decorator method must have been invoked.   
-        @type msg: basestring
+        @type msg: basestring / bytes
         @param msg: optional error message
         @type code: int
         @param code: standard HTTP error response code
@@ -185,11 +185,14 @@ class NDGSecurityMiddlewareBase(object):
         
         if contentType is None:
             contentType = 'text/plain'
+            
+        if isinstance(response, str):
+            response = response.encode('utf-8')
                 
         start_response(status,
                        [('Content-type', contentType),
                         ('Content-Length', str(len(response)))])
-        return [response.encode('utf-8')]
+        return [response]
         
     @staticmethod
     def getStatusMessage(statusCode):
@@ -11,9 +11,20 @@ __revision__ = "$Id$"
 import logging
 log = logging.getLogger(__name__)
 import os
+import json
+from uuid import uuid4
+from datetime import datetime
 
+from ndg.saml.common import SAMLVersion
+from ndg.saml.common.xml import SAMLConstants
+from ndg.saml.saml2.core import (Attribute, AttributeQuery, Issuer, NameID,
+                                 Response, Status, StatusCode, StatusMessage,
+                                 Subject, XSStringAttributeValue)
+
+from ndg.security.common.saml_utils.esgf import ESGFSamlNamespaces
 from ndg.security.server.attributeauthority import AttributeAuthority
-from ndg.security.server.wsgi import NDGSecurityMiddlewareBase
+from ndg.security.server.wsgi import (NDGSecurityMiddlewareBase,
+                                      NDGSecurityMiddlewareConfigError)
 
 
 class AttributeAuthorityMiddleware(NDGSecurityMiddlewareBase):
@@ -170,3 +181,432 @@ class AttributeAuthorityMiddleware(NDGSecurityMiddlewareBase):
                               fset=_set_attributeQuery, 
                               doc="Attribute Authority SAML attribute query "
                                   "function")
+
+
+class AttributeAuthorityJsonQueryMiddleware(object):
+    '''Lightweight JSON attribute query interface to an Attribute Authority.
+    It references the Attribute Authority instance set in environ by an
+    upstream AttributeAuthorityMiddleware.  Queries are mapped to in-memory
+    SAML AttributeQuery objects and passed to
+    AttributeAuthority.samlAttributeQuery so that the same attribute interface,
+    requestor checks and attribute release rules apply as for the SAML SOAP
+    interface but without the cost of XML parsing and serialisation.
+
+    A request is POSTed to the configured path with a body of the form:
+
+    {"issuer": "/O=Site A/CN=Authorisation Service",
+     "subjects": ["https://openid.localhost/philip.kershaw", ...],
+     "attributes": ["urn:esg:first:name",
+                    {"name": "urn:esg:sitea:grouprole",
+                     "nameFormat": "urn:esg:group:role"}, ...]}
+
+    The response contains a result keyed by subject for each subject in the
+    batch.  Results include the SAML status code and any attribute values
+    released for that subject.
+
+    @cvar DEFAULT_PARAM_PREFIX: default prefix for configuration items
+    @type DEFAULT_PARAM_PREFIX: string
+    @cvar DEFAULT_ATTRIBUTE_NAME_FORMAT: name format assumed for attributes
+    requested by name only
+    @type DEFAULT_ATTRIBUTE_NAME_FORMAT: string
+    '''
+    DEFAULT_PARAM_PREFIX = 'attributeAuthorityJson.'
+    DEFAULT_PATH = '/attribute-service/json'
+    DEFAULT_MAX_SUBJECTS = 100
+    DEFAULT_ATTRIBUTE_NAME_FORMAT = (SAMLConstants.XSD_NS + "#" +
+                                     XSStringAttributeValue.TYPE_LOCAL_NAME)
+
+    CONTENT_TYPE = 'application/json'
+
+    # Environ key for requestor identity set by Apache for an SSL client
+    # certificate authenticated connection.  If set, it's used as the issuer
+    # and any issuer set in the request body must match it
+    SSL_CLIENT_DN_ENVIRON_KEYNAME = 'SSL_CLIENT_S_DN'
+
+    ISSUER_FIELDNAME = 'issuer'
+    SUBJECTS_FIELDNAME = 'subjects'
+    ATTRIBUTES_FIELDNAME = 'attributes'
+
+    PARAM_NAMES = (
+        'path',
+        'attributeAuthorityKeyName',
+        'issuerName',
+        'issuerFormat',
+        'maxSubjects'
+    )
+
+    __slots__ = ('_app',) + tuple(['__' + i for i in PARAM_NAMES])
+
+    def __init__(self, app):
+        '''
+        @param app: next app/middleware in WSGI stack
+        @type app: callable
+        '''
+        self._app = app
+        self.__path = self.__class__.DEFAULT_PATH
+        self.__attributeAuthorityKeyName = \
+                                    AttributeAuthorityMiddleware.DEFAULT_KEYNAME
+        self.__issuerName = None
+        self.__issuerFormat = Issuer.X509_SUBJECT
+        self.__maxSubjects = self.__class__.DEFAULT_MAX_SUBJECTS
+
+    def initialise(self, global_conf, prefix=DEFAULT_PARAM_PREFIX, **app_conf):
+        """Set-up from PasteDeploy configuration settings
+
+        @type global_conf: dict
+        @param global_conf: PasteDeploy global configuration dictionary
+        @type prefix: basestring
+        @param prefix: prefix for configuration items
+        @type app_conf: dict
+        @param app_conf: PasteDeploy application specific configuration
+        dictionary
+        """
+        for name in self.__class__.PARAM_NAMES:
+            value = app_conf.get(prefix + name)
+            if value is not None:
+                setattr(self, name, value)
+
+        if not self.issuerName:
+            raise NDGSecurityMiddlewareConfigError('No "%sissuerName" option '
+                                                   'has been set' % prefix)
+
+    @classmethod
+    def filter_app_factory(cls, app, global_conf, **app_conf):
+        '''Wrapper to enable instantiation compatible with Paste Deploy
+        filter application factory function signature
+
+        @type app: callable following WSGI interface
+        @param app: next middleware application in the chain
+        @type global_conf: dict
+        @param global_conf: PasteDeploy global configuration dictionary
+        @type app_conf: dict
+        @param app_conf: PasteDeploy application specific configuration
+        dictionary
+        '''
+        app = cls(app)
+        app.initialise(global_conf, **app_conf)
+
+        return app
+
+    def __call__(self, environ, start_response):
+        '''Handle JSON attribute queries made to the configured path, pass
+        all other requests to the next app in the stack
+
+        @type environ: dict
+        @param environ: WSGI environment variables dictionary
+        @type start_response: function
+        @param start_response: standard WSGI start response function
+        @rtype: iterable
+        @return: response
+        '''
+        if environ.get('PATH_INFO', '').rstrip('/') != self.path:
+            return self._app(environ, start_response)
+
+        if environ.get('REQUEST_METHOD') != 'POST':
+            return self._setResponse(start_response, 405,
+                                     {'error': 'Expecting POST request'},
+                                     headers=[('Allow', 'POST')])
+
+        aa = environ.get(self.attributeAuthorityKeyName)
+        if aa is None:
+            raise NDGSecurityMiddlewareConfigError('No Attribute Authority '
+                                                   'found in environ with key '
+                                                   '%r' %
+                                                   self.attributeAuthorityKeyName)
+
+        try:
+            issuerName, subjectIds, attributes = self._parseRequest(environ)
+
+        except ValueError as e:
+            log.error('Error parsing JSON attribute query: %s', e)
+            return self._setResponse(start_response, 400, {'error': str(e)})
+
+        if len(subjectIds) > self.maxSubjects:
+            return self._setResponse(start_response, 413,
+                                     {'error': 'Maximum number of subjects per '
+                                               'query is %d' % self.maxSubjects})
+
+        results = {}
+        for subjectId in subjectIds:
+            attributeQuery = self._createAttributeQuery(issuerName, subjectId,
+                                                        attributes)
+            samlResponse = self._createSamlResponse(attributeQuery)
+
+            samlResponse = aa.samlAttributeQuery(attributeQuery, samlResponse)
+            results[subjectId] = self._samlResponse2Dict(samlResponse)
+
+        return self._setResponse(start_response, 200,
+                                 {'issuer': self.issuerName,
+                                  'results': results})
+
+    def _parseRequest(self, environ):
+        """Parse the request body into a requestor identity, the subjects to
+        query for and the attributes requested
+
+        @type environ: dict
+        @param environ: WSGI environment variables dictionary
+        @rtype: tuple
+        @return: issuer name, list of subject IDs and list of
+        (name, nameFormat, friendlyName) tuples for the attributes requested
+        @raise ValueError: invalid request content
+        """
+        cls = self.__class__
+        try:
+            contentLength = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            raise ValueError('Invalid Content-Length header')
+
+        body = environ['wsgi.input'].read(contentLength)
+        try:
+            query = json.loads(body.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError) as e:
+            raise ValueError('Error parsing JSON request body: %s' % e)
+
+        if not isinstance(query, dict):
+            raise ValueError('Expecting JSON object for request body')
+
+        # The requestor identity from an SSL client certificate can't be
+        # overridden by the request body
+        issuerName = query.get(cls.ISSUER_FIELDNAME)
+        sslClientDN = environ.get(cls.SSL_CLIENT_DN_ENVIRON_KEYNAME)
+        if sslClientDN:
+            if issuerName is not None and issuerName != sslClientDN:
+                raise ValueError('%r field %r doesn\'t match the SSL client '
+                                 'certificate subject %r' %
+                                 (cls.ISSUER_FIELDNAME, issuerName,
+                                  sslClientDN))
+            issuerName = sslClientDN
+
+        if not isinstance(issuerName, str) or not issuerName:
+            raise ValueError('No %r field set in request' %
+                             cls.ISSUER_FIELDNAME)
+
+        subjectIds = query.get(cls.SUBJECTS_FIELDNAME)
+        if (not isinstance(subjectIds, list) or len(subjectIds) == 0 or
+            not all([isinstance(i, str) for i in subjectIds])):
+            raise ValueError('Expecting a list of subject identifier strings '
+                             'for %r field' % cls.SUBJECTS_FIELDNAME)
+
+        attributeItems = query.get(cls.ATTRIBUTES_FIELDNAME)
+        if not isinstance(attributeItems, list) or len(attributeItems) == 0:
+            raise ValueError('Expecting a list of attributes for %r field' %
+                             cls.ATTRIBUTES_FIELDNAME)
+
+        attributes = []
+        for item in attributeItems:
+            if isinstance(item, str):
+                attributes.append(
+                    (item, cls.DEFAULT_ATTRIBUTE_NAME_FORMAT, None))
+
+            elif isinstance(item, dict) and isinstance(item.get('name'), str):
+                attributes.append(
+                    (item['name'],
+                     item.get('nameFormat', cls.DEFAULT_ATTRIBUTE_NAME_FORMAT),
+                     item.get('friendlyName')))
+            else:
+                raise ValueError('Expecting attribute name string or object '
+                                 'with a "name" field; got %r' % item)
+
+        # Remove duplicate subjects preserving order
+        subjectIds = list(dict.fromkeys(subjectIds))
+
+        return issuerName, subjectIds, attributes
+
+    def _createAttributeQuery(self, issuerName, subjectId, attributes):
+        """Make a SAML Attribute Query for a single subject
+
+        @type issuerName: basestring
+        @param issuerName: requestor identity
+        @type subjectId: basestring
+        @param subjectId: subject to query for
+        @type attributes: list
+        @param attributes: (name, nameFormat, friendlyName) tuples
+        @rtype: ndg.saml.saml2.core.AttributeQuery
+        @return: new attribute query
+        """
+        attributeQuery = AttributeQuery()
+        attributeQuery.version = SAMLVersion(SAMLVersion.VERSION_20)
+        attributeQuery.id = str(uuid4())
+        attributeQuery.issueInstant = datetime.utcnow()
+
+        attributeQuery.issuer = Issuer()
+        attributeQuery.issuer.format = Issuer.X509_SUBJECT
+        attributeQuery.issuer.value = issuerName
+
+        attributeQuery.subject = Subject()
+        attributeQuery.subject.nameID = NameID()
+        attributeQuery.subject.nameID.format = ESGFSamlNamespaces.NAMEID_FORMAT
+        attributeQuery.subject.nameID.value = subjectId
+
+        for name, nameFormat, friendlyName in attributes:
+            attribute = Attribute()
+            attribute.name = name
+            attribute.nameFormat = nameFormat
+            if friendlyName is not None:
+                attribute.friendlyName = friendlyName
+
+            attributeQuery.attributes.append(attribute)
+
+        return attributeQuery
+
+    def _createSamlResponse(self, attributeQuery):
+        """Make a partially completed SAML response ready for the Attribute
+        Authority to fill out.  This follows the settings made by the SAML
+        SOAP query interface
+
+        @type attributeQuery: ndg.saml.saml2.core.AttributeQuery
+        @param attributeQuery: query to respond to
+        @rtype: ndg.saml.saml2.core.Response
+        @return: new response
+        """
+        samlResponse = Response()
+        samlResponse.issueInstant = datetime.utcnow()
+        samlResponse.id = str(uuid4())
+        samlResponse.inResponseTo = attributeQuery.id
+        samlResponse.version = SAMLVersion(SAMLVersion.VERSION_20)
+
+        samlResponse.issuer = Issuer()
+        samlResponse.issuer.value = self.issuerName
+        samlResponse.issuer.format = self.issuerFormat
+
+        samlResponse.status = Status()
+        samlResponse.status.statusCode = StatusCode()
+        samlResponse.status.statusMessage = StatusMessage()
+        samlResponse.status.statusCode.value = StatusCode.SUCCESS_URI
+        samlResponse.status.statusMessage.value = ''
+
+        return samlResponse
+
+    @staticmethod
+    def _samlResponse2Dict(samlResponse):
+        """Convert a completed SAML response into a JSON serialisable
+        dictionary
+
+        @type samlResponse: ndg.saml.saml2.core.Response
+        @param samlResponse: response from the Attribute Authority
+        @rtype: dict
+        @return: status and attributes keyed by attribute name
+        """
+        result = {
+            'status': samlResponse.status.statusCode.value,
+            'message': samlResponse.status.statusMessage.value or '',
+            'attributes': {}
+        }
+
+        notOnOrAfter = None
+        for assertion in samlResponse.assertions:
+            if (assertion.conditions is not None and
+                assertion.conditions.notOnOrAfter is not None):
+                if (notOnOrAfter is None or
+                    assertion.conditions.notOnOrAfter < notOnOrAfter):
+                    notOnOrAfter = assertion.conditions.notOnOrAfter
+
+            for statement in assertion.attributeStatements:
+                for attribute in statement.attributes:
+                    values = result['attributes'].setdefault(attribute.name,
+                                                             [])
+                    values.extend([attributeValue.value
+                                   for attributeValue in
+                                   attribute.attributeValues])
+
+        if notOnOrAfter is not None:
+            result['notOnOrAfter'] = notOnOrAfter.isoformat() + 'Z'
+
+        return result
+
+    def _setResponse(self, start_response, code, content, headers=None):
+        """Set a JSON response
+
+        @type start_response: function
+        @param start_response: standard WSGI start response function
+        @type code: int
+        @param code: HTTP status code
+        @type content: dict
+        @param content: content to be serialised as JSON
+        @type headers: list
+        @param headers: additional HTTP header fields
+        @rtype: list
+        @return: response body
+        """
+        response = json.dumps(content).encode('utf-8')
+        responseHeaders = [('Content-type', self.__class__.CONTENT_TYPE),
+                           ('Content-length', str(len(response)))]
+        if headers:
+            responseHeaders += headers
+
+        start_response(NDGSecurityMiddlewareBase.getStatusMessage(code),
+                       responseHeaders)
+        return [response]
+
+    def _get_path(self):
+        return self.__path
+
+    def _set_path(self, val):
+        if not isinstance(val, str):
+            raise TypeError('Expecting %r for "path" attribute; got %r' %
+                            (str, type(val)))
+        self.__path = val.rstrip('/')
+
+    path = property(fget=_get_path,
+                    fset=_set_path,
+                    doc="URL path for the JSON attribute query interface")
+
+    def _get_attributeAuthorityKeyName(self):
+        return self.__attributeAuthorityKeyName
+
+    def _set_attributeAuthorityKeyName(self, val):
+        if not isinstance(val, str):
+            raise TypeError('Expecting %r for "attributeAuthorityKeyName" '
+                            'attribute; got %r' % (str, type(val)))
+        self.__attributeAuthorityKeyName = val
+
+    attributeAuthorityKeyName = property(fget=_get_attributeAuthorityKeyName,
+                                         fset=_set_attributeAuthorityKeyName,
+                                         doc="Key name for Attribute Authority "
+                                             "instance set in environ by "
+                                             "AttributeAuthorityMiddleware")
+
+    def _get_issuerName(self):
+        return self.__issuerName
+
+    def _set_issuerName(self, val):
+        if not isinstance(val, str):
+            raise TypeError('Expecting %r for "issuerName" attribute; got %r' %
+                            (str, type(val)))
+        self.__issuerName = val
+
+    issuerName = property(fget=_get_issuerName,
+                          fset=_set_issuerName,
+                          doc="Issuer name for responses - should match the "
+                              "SAML SOAP interface setting")
+
+    def _get_issuerFormat(self):
+        return self.__issuerFormat
+
+    def _set_issuerFormat(self, val):
+        if not isinstance(val, str):
+            raise TypeError('Expecting %r for "issuerFormat" attribute; got '
+                            '%r' % (str, type(val)))
+        self.__issuerFormat = val
+
+    issuerFormat = property(fget=_get_issuerFormat,
+                            fset=_set_issuerFormat,
+                            doc="Issuer format for responses")
+
+    def _get_maxSubjects(self):
+        return self.__maxSubjects
+
+    def _set_maxSubjects(self, val):
+        if isinstance(val, str):
+            val = int(val)
+        elif not isinstance(val, int):
+            raise TypeError('Expecting int or string type for "maxSubjects" '
+                            'attribute; got %r' % type(val))
+        if val < 1:
+            raise ValueError('"maxSubjects" must be greater than zero')
+        self.__maxSubjects = val
+
+    maxSubjects = property(fget=_get_maxSubjects,
+                           fset=_set_maxSubjects,
+                           doc="Maximum number of subjects in a single batch "
+                               "query")
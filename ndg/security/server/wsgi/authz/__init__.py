@@ -60,7 +60,8 @@ from paste.urlparser import StaticURLParser
 from authkit.authenticate.multi import MultiHandler
 
 from ndg.security.common.utils.classfactory import importClass
-from ndg.security.server.utils.paste_port import Cascade
+from ndg.security.server.utils.paste_port import (Cascade, 
+                                                   non_static_method)
 from ndg.security.server.wsgi import NDGSecurityMiddlewareBase
 from ndg.security.server.wsgi.authz.pep import SamlPepFilter
 from ndg.security.server.wsgi.authz.pep_xacml_profile import XacmlSamlPepFilter
@@ -153,7 +154,8 @@ class AuthorisationFilterBase(object):
                                     resultHandlerStaticContentDirParamName)
         if resultHandlerStaticContentDir is not None:    
             staticApp = StaticURLParser(resultHandlerStaticContentDir)
-            app = Cascade([app, staticApp], catch=(http.client.NOT_FOUND,))
+            app = Cascade([app, staticApp], catch=(http.client.NOT_FOUND,),
+                          passthrough=non_static_method)
 
         pepPrefix = prefix + cls.PEP_PARAM_PREFIX
         pepFilter = cls.PEP_FILTER.filter_app_factory(app, 
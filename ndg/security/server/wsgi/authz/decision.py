@@ -0,0 +1,188 @@
+'''Compact authorisation decision records for caching in the user session
+
+The PEP caches decisions and the last decision made in the beaker session.
+Keeping these as complete SAML objects makes each session save pickle the
+full assertion object graph.  These records keep only what is needed to
+enforce and report the decision.
+
+NERC DataGrid Project
+'''
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import logging
+log = logging.getLogger(__name__)
+
+from datetime import datetime, timedelta, timezone
+
+from ndg.saml.saml2.core import DecisionType
+
+
+class DecisionRecord(object):
+    """Authorisation decision for a resource parsed from the assertions in a
+    SAML authorisation decision response
+
+    @ivar resource: resource URI the decision applies to
+    @type resource: basestring
+    @ivar decision: decision - one of the DecisionType string values
+    @type decision: basestring
+    @ivar notOnOrAfter: expiry of the decision or None if it has no expiry
+    @type notOnOrAfter: datetime.datetime / None
+    @ivar issuer: name of authorisation service which issued the decision
+    @type issuer: basestring / None
+    """
+    __slots__ = ('resource', 'decision', 'notOnOrAfter', 'issuer')
+
+    FAIL_DECISIONS = (DecisionType.DENY_STR, DecisionType.INDETERMINATE_STR)
+
+    def __init__(self, resource, decision, notOnOrAfter=None, issuer=None):
+        self.resource = resource
+        self.decision = decision
+        self.notOnOrAfter = notOnOrAfter
+        self.issuer = issuer
+
+    def __repr__(self):
+        return '<%s resource=%r decision=%r notOnOrAfter=%r issuer=%r>' % (
+                    self.__class__.__name__, self.resource, self.decision,
+                    self.notOnOrAfter, self.issuer)
+
+    @classmethod
+    def fromAssertions(cls, resource, assertions):
+        """Make a record from SAML assertions containing authorisation
+        decision statements.  Any deny or indeterminate statement overrides
+        permit and the earliest expiry of the assertions is taken
+
+        @param resource: resource URI the decision applies to
+        @type resource: basestring
+        @param assertions: SAML assertions
+        @type assertions: iterable
+        @return: decision record or None if there are no decision statements
+        @rtype: DecisionRecord / None
+        """
+        decision = None
+        notOnOrAfter = None
+        issuer = None
+        for assertion in assertions:
+            for authzDecisionStatement in assertion.authzDecisionStatements:
+                value = authzDecisionStatement.decision.value
+                if decision not in cls.FAIL_DECISIONS:
+                    decision = value
+
+            if (assertion.conditions is not None and
+                assertion.conditions.notOnOrAfter is not None and
+                (notOnOrAfter is None or
+                 assertion.conditions.notOnOrAfter < notOnOrAfter)):
+                notOnOrAfter = assertion.conditions.notOnOrAfter
+
+            if issuer is None and assertion.issuer is not None:
+                issuer = assertion.issuer.value
+
+        if decision is None:
+            return None
+
+        return cls(resource, decision, notOnOrAfter=notOnOrAfter,
+                   issuer=issuer)
+
+    @property
+    def permit(self):
+        """True if access is permitted"""
+        return self.decision == DecisionType.PERMIT_STR
+
+    @property
+    def indeterminate(self):
+        """True if an error occurred making the decision"""
+        return self.decision == DecisionType.INDETERMINATE_STR
+
+    def isValid(self, clockSkewTolerance=timedelta(0)):
+        """Check the decision hasn't expired
+
+        @param clockSkewTolerance: allowance for differences between the
+        clock of the authorisation service and this host
+        @type clockSkewTolerance: datetime.timedelta
+        @return: True if the decision is still valid
+        @rtype: bool
+        """
+        if self.notOnOrAfter is None:
+            return True
+
+        if self.notOnOrAfter.tzinfo is None:
+            # SAML datetimes are UTC
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+        else:
+            now = datetime.now(timezone.utc)
+
+        return now < self.notOnOrAfter + clockSkewTolerance
+
+
+class DecisionRecordWallet(object):
+    """Cache of decision records keyed by resource URI.  This takes the
+    place of a SAMLAssertionWallet when the full SAML assertions don't need
+    to be kept
+
+    @ivar __records: decision records keyed by resource URI
+    @type __records: dict
+    """
+    __slots__ = ('__records', '__clockSkewTolerance')
+
+    def __init__(self, clockSkewTolerance=timedelta(0)):
+        self.__records = {}
+        self.__clockSkewTolerance = None
+        self.clockSkewTolerance = clockSkewTolerance
+
+    def __len__(self):
+        return len(self.__records)
+
+    def _getClockSkewTolerance(self):
+        return self.__clockSkewTolerance
+
+    def _setClockSkewTolerance(self, value):
+        if isinstance(value, timedelta):
+            self.__clockSkewTolerance = value
+        elif isinstance(value, (float, int)):
+            self.__clockSkewTolerance = timedelta(seconds=value)
+        elif isinstance(value, str):
+            self.__clockSkewTolerance = timedelta(seconds=float(value))
+        else:
+            raise TypeError('Expecting timedelta, float, int or string type '
+                            'for "clockSkewTolerance"; got %r' % type(value))
+
+    clockSkewTolerance = property(_getClockSkewTolerance,
+                                  _setClockSkewTolerance,
+                                  doc="Allowance for differences between the "
+                                      "clock of the authorisation service "
+                                      "and this host when checking expiry")
+
+    def addRecord(self, record):
+        """Add a decision replacing any existing one for the same resource
+
+        @param record: decision record
+        @type record: DecisionRecord
+        """
+        if not isinstance(record, DecisionRecord):
+            raise TypeError('Expecting %r type for "record"; got %r' %
+                            (DecisionRecord, type(record)))
+
+        self.__records[record.resource] = record
+
+    def retrieveRecord(self, resource):
+        """Get the decision for a resource.  Expired decisions are removed
+
+        @param resource: resource URI
+        @type resource: basestring
+        @return: decision record or None if there is no valid record for
+        the resource
+        @rtype: DecisionRecord / None
+        """
+        record = self.__records.get(resource)
+        if record is None:
+            return None
+
+        if not record.isValid(clockSkewTolerance=self.__clockSkewTolerance):
+            log.debug('Removing expired decision for %r', resource)
+            del self.__records[resource]
+            return None
+
+        return record
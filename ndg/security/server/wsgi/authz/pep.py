@@ -11,9 +11,10 @@ import logging
 log = logging.getLogger(__name__)
 
 import re
+import pickle
 import http.client
 from urllib.error import URLError
-from time import time
+from time import time, perf_counter
 
 import webob
 
@@ -40,6 +41,11 @@ from ndg.security.server.wsgi.session import (SessionMiddlewareBase,
                                               SessionHandlerMiddleware)
 from ndg.security.common.credentialwallet import SAMLAssertionWallet
 from ndg.security.common.utils import str2Bool, is_iterable
+from ndg.security.server.utils import metrics
+from ndg.security.server.utils.cache import LRUCache
+from ndg.security.server.utils.capture import CaptureLog, hashSubject
+from ndg.security.server.wsgi.authz.decision import (DecisionRecord, 
+                                                     DecisionRecordWallet)
 
 
 class SamlPepFilterConfigError(Exception):
@@ -75,29 +81,67 @@ class SamlPepFilterBase(SessionMiddlewareBase):
     CACHE_DECISIONS_PARAM_NAME = 'cacheDecisions'   
     LOCAL_POLICY_FILEPATH_PARAM_NAME = 'localPolicyFilePath'
     IGNORE_FILE_LIST_PARAM_NAME = 'ignore_file_list_pat'
+    CAPTURE_FILEPATH_PARAM_NAME = 'captureFilePath'
+    CAPTURE_SUBJECT_SALT_PARAM_NAME = 'captureSubjectSalt'
+    SAVE_SAML_OBJECTS_PARAM_NAME = 'saveSamlObjects'
+    ANONYMOUS_DECISION_CACHE_SIZE_PARAM_NAME = 'anonymousDecisionCacheSize'
+    ANONYMOUS_DECISION_CACHE_TIMEOUT_PARAM_NAME = \
+                                            'anonymousDecisionCacheTimeout'
+    
+    DEFAULT_ANONYMOUS_DECISION_CACHE_SIZE = 1000
+    DEFAULT_ANONYMOUS_DECISION_CACHE_TIMEOUT = 300.
+    
+    # Capture mode records the decision for each request in environ with this
+    # key so that it can be logged once the request is complete
+    CAPTURE_ENVIRON_KEYNAME = 'ndg.security.server.wsgi.authz.pep.capture'
+    CAPTURE_NOT_APPLICABLE = 'NotApplicable'
+    CAPTURE_PERMIT = 'Permit'
+    CAPTURE_DENY = 'Deny'
+    CAPTURE_ERROR = 'Error'
     
     CREDENTIAL_WALLET_SESSION_KEYNAME = \
         SessionHandlerMiddleware.CREDENTIAL_WALLET_SESSION_KEYNAME
     USERNAME_SESSION_KEYNAME = \
         SessionHandlerMiddleware.USERNAME_SESSION_KEYNAME
     
+    PHASE_TIMER_NAME = 'ndg_security_pep_phase_seconds'
+    PHASE_TIMER_DOC = 'Time spent in each phase of PEP request handling'
+    
+    SESSION_SIZE_HISTOGRAM_NAME = 'ndg_security_pep_session_size_bytes'
+    SESSION_SIZE_HISTOGRAM_DOC = ('Size of the pickled user session after '
+                                  'the PEP has updated it.  Recorded only '
+                                  'when debug logging is enabled')
+    SESSION_SIZE_BUCKETS = (1024, 2048, 4096, 8192, 16384, 32768, 65536, 
+                            131072)
+    
     PARAM_NAMES = (
         AUTHZ_SERVICE_URI,
         SESSION_KEY_PARAM_NAME,
         CACHE_DECISIONS_PARAM_NAME,
         LOCAL_POLICY_FILEPATH_PARAM_NAME,
-        IGNORE_FILE_LIST_PARAM_NAME
+        IGNORE_FILE_LIST_PARAM_NAME,
+        CAPTURE_FILEPATH_PARAM_NAME,
+        CAPTURE_SUBJECT_SALT_PARAM_NAME,
+        SAVE_SAML_OBJECTS_PARAM_NAME,
+        ANONYMOUS_DECISION_CACHE_SIZE_PARAM_NAME,
+        ANONYMOUS_DECISION_CACHE_TIMEOUT_PARAM_NAME
     )
     
     OPTIONAL_PARAM_NAMES = (
         LOCAL_POLICY_FILEPATH_PARAM_NAME,
-        IGNORE_FILE_LIST_PARAM_NAME                            
+        IGNORE_FILE_LIST_PARAM_NAME,
+        CAPTURE_FILEPATH_PARAM_NAME,
+        CAPTURE_SUBJECT_SALT_PARAM_NAME,
+        SAVE_SAML_OBJECTS_PARAM_NAME,
+        ANONYMOUS_DECISION_CACHE_SIZE_PARAM_NAME,
+        ANONYMOUS_DECISION_CACHE_TIMEOUT_PARAM_NAME
     )
     
     XACML_ATTRIBUTEVALUE_CLASS_FACTORY = XacmlAttributeValueClassFactory()
     
     __slots__ = (
-        '_app', '_client_binding', '_client_query', '__session', '__localPdp'
+        '_app', '_client_binding', '_client_query', '__session', '__localPdp',
+        '__captureLog', '__anonymousDecisionCache'
     ) + tuple(('__' + '$__'.join(PARAM_NAMES)).split('$'))
             
     def __init__(self, app):
@@ -115,6 +159,17 @@ class SamlPepFilterBase(SessionMiddlewareBase):
         self.__localPdp = None
         self.__localPolicyFilePath = None
         self._ignore_file_list_pat = []
+        self.__captureFilePath = None
+        self.__captureSubjectSalt = ''
+        self.__captureLog = None
+        self.__saveSamlObjects = False
+        self.__anonymousDecisionCacheSize = \
+                        self.__class__.DEFAULT_ANONYMOUS_DECISION_CACHE_SIZE
+        self.__anonymousDecisionCacheTimeout = \
+                        self.__class__.DEFAULT_ANONYMOUS_DECISION_CACHE_TIMEOUT
+        self.__anonymousDecisionCache = LRUCache(
+                                maxSize=self.__anonymousDecisionCacheSize,
+                                timeout=self.__anonymousDecisionCacheTimeout)
 
     def _getLocalPolicyFilePath(self):
         return self.__localPolicyFilePath
@@ -235,6 +290,105 @@ class SamlPepFilterBase(SessionMiddlewareBase):
                                   "authorisation decisions returned from the "
                                   "Authorisation Service")
     
+    def _getCaptureFilePath(self):
+        return self.__captureFilePath
+
+    def _setCaptureFilePath(self, value):
+        if not isinstance(value, (str, type(None))):
+            raise TypeError('Expecting string or None type for '
+                            '"captureFilePath" attribute; got %r' % 
+                            type(value))
+        self.__captureFilePath = value
+        if value:
+            self.__captureLog = CaptureLog(value)
+        else:
+            self.__captureLog = None
+
+    captureFilePath = property(_getCaptureFilePath, _setCaptureFilePath, 
+                               doc="Set to a file path to enable capture "
+                                   "mode.  A record of each request and the "
+                                   "decision made is appended to this file so "
+                                   "that traffic can be replayed offline - "
+                                   "see ndg.security.server.xacml.ctx_handler."
+                                   "replay")
+
+    def _getCaptureSubjectSalt(self):
+        return self.__captureSubjectSalt
+
+    def _setCaptureSubjectSalt(self, value):
+        if not isinstance(value, str):
+            raise TypeError('Expecting string type for "captureSubjectSalt" '
+                            'attribute; got %r' % type(value))
+        self.__captureSubjectSalt = value
+
+    captureSubjectSalt = property(_getCaptureSubjectSalt, 
+                                  _setCaptureSubjectSalt, 
+                                  doc="Key for hash of subject identifiers "
+                                      "recorded in capture mode.  Set the "
+                                      "same value for the authorisation "
+                                      "service PIP so that captured "
+                                      "attributes can be matched to subjects")
+    
+    def _getSaveSamlObjects(self):
+        return self.__saveSamlObjects
+
+    def _setSaveSamlObjects(self, value):
+        if isinstance(value, str):
+            self.__saveSamlObjects = str2Bool(value)
+        elif isinstance(value, bool):
+            self.__saveSamlObjects = value
+        else:
+            raise TypeError('Expecting bool/string type for "saveSamlObjects" '
+                            'attribute; got %r' % type(value))
+        
+    saveSamlObjects = property(_getSaveSamlObjects, _setSaveSamlObjects, 
+                               doc="Set to True to keep the complete SAML "
+                                   "assertions for cached decisions and the "
+                                   "SAML query and response for the last "
+                                   "decision in the session.  Enable only if "
+                                   "a result handler needs them.  By default "
+                                   "a compact DecisionRecord is kept instead")
+    
+    @property
+    def anonymousDecisionCacheSize(self):
+        """Maximum number of decisions for anonymous requests cached.  These
+        are cached in memory shared by all anonymous users rather than in the
+        session"""
+        return self.__anonymousDecisionCacheSize
+
+    @anonymousDecisionCacheSize.setter
+    def anonymousDecisionCacheSize(self, value):
+        if not isinstance(value, (int, str)):
+            raise TypeError('Expecting int or string type for '
+                            '"anonymousDecisionCacheSize" attribute; got %r' % 
+                            type(value))
+        self.__anonymousDecisionCacheSize = int(value)
+
+    @property
+    def anonymousDecisionCacheTimeout(self):
+        """Maximum time in seconds for which decisions for anonymous requests
+        are cached.  Decisions expire earlier if the assertion they came from
+        does"""
+        return self.__anonymousDecisionCacheTimeout
+
+    @anonymousDecisionCacheTimeout.setter
+    def anonymousDecisionCacheTimeout(self, value):
+        if not isinstance(value, (int, float, str)):
+            raise TypeError('Expecting int, float or string type for '
+                            '"anonymousDecisionCacheTimeout" attribute; got '
+                            '%r' % type(value))
+        self.__anonymousDecisionCacheTimeout = float(value)
+        
+    @property
+    def anonymousDecisionCache(self):
+        '''Cache of decisions for anonymous requests keyed by resource URI'''
+        return self.__anonymousDecisionCache
+    
+    @property
+    def captureLog(self):
+        '''Capture log - None if capture mode is disabled'''
+        return self.__captureLog
+    
     def initialise(self, prefix='', **kw):
         '''Initialise object from keyword settings
         
@@ -272,6 +426,10 @@ class SamlPepFilterBase(SessionMiddlewareBase):
                                                         prefix=query_prefix,
                                                         **kw)
 
+        self.__anonymousDecisionCache = LRUCache(
+                                maxSize=self.__anonymousDecisionCacheSize,
+                                timeout=self.__anonymousDecisionCacheTimeout)
+        
         # Initialise the local PDP  
         if self.localPolicyFilePath:
             self.__localPdp = PDP.fromPolicySource(self.localPolicyFilePath, 
@@ -307,14 +465,49 @@ class SamlPepFilterBase(SessionMiddlewareBase):
         :rtype: iterable
         :return: response
         """
-        # Get reference to session object - SessionHandler middleware must be in
-        # place upstream of this middleware in the WSGI stack
-        if self.sessionKey not in environ:
-            raise SamlPepFilterConfigError('No beaker session key "%s" found '
-                                           'in environ' % self.sessionKey)
-        self.session = environ[self.sessionKey]
+        # Get reference to session object - SessionHandler middleware should 
+        # be in place upstream of this middleware in the WSGI stack.  Without 
+        # it, decisions are made without caching them in the session
+        self.session = environ.get(self.sessionKey)
+        if self.session is None:
+            log.debug('No beaker session key "%s" found in environ: decisions '
+                      'won\'t be cached in the session', self.sessionKey)
+
+        if self.__captureLog is None:
+            return self.enforce(environ, start_response)
+        
+        start = perf_counter()
+        response = self.enforce(environ, start_response)
+        
+        capture = environ.get(self.__class__.CAPTURE_ENVIRON_KEYNAME)
+        if capture is not None:
+            decision, cached, decisionTime = capture
+            self.__captureLog.write(
+                s=hashSubject(environ.get('REMOTE_USER', ''), 
+                              salt=self.captureSubjectSalt),
+                r=webob.Request(environ).url,
+                m=environ.get('REQUEST_METHOD'),
+                d=decision,
+                c=int(cached),
+                l=round((decisionTime - start) * 1e3, 3))
+        
+        return response
 
-        return self.enforce(environ, start_response)
+    def _setCaptureResult(self, environ, decision, cached=False):
+        '''Record the decision for the current request in capture mode.  It's
+        written to the capture log when the request completes
+        
+        :param environ: WSGI environment variables dictionary
+        :type environ: dict
+        :param decision: decision made e.g. 'Permit'
+        :type decision: basestring
+        :param cached: True if the decision came from the session cache
+        :type cached: bool
+        '''
+        if self.__captureLog is not None:
+            environ[self.__class__.CAPTURE_ENVIRON_KEYNAME] = (decision, 
+                                                               cached, 
+                                                               perf_counter())
 
     def enforce(self, environ, start_response):
         """Get access control decision from PDP(s) and enforce the decision
@@ -329,6 +522,19 @@ class SamlPepFilterBase(SessionMiddlewareBase):
         raise NotImplementedError("SamlPepFilterBase must be subclassed to"
                                   " implement the enforce method.")
 
+    @classmethod
+    def phaseTimer(cls, phase):
+        '''Get the metrics timer for a given phase of request handling
+        
+        :param phase: name of phase e.g. 'cache_lookup'
+        :type phase: basestring
+        :return: timer for the given phase
+        :rtype: ndg.security.server.utils.metrics.Timer
+        '''
+        return metrics.registry.timer(cls.PHASE_TIMER_NAME, 
+                                      cls.PHASE_TIMER_DOC, 
+                                      phase=phase)
+        
     def _retrieveCachedAssertions(self, resourceId):
         """Return assertions containing authorisation decision for the given
         resource ID.
@@ -340,16 +546,74 @@ class SamlPepFilterBase(SessionMiddlewareBase):
         found matching the input resource Id
         :rtype: ndg.saml.saml2.core.Assertion / None type
         """
+        if self.session is None:
+            return None
+        
         # Get reference to wallet
         walletKeyName = self.__class__.CREDENTIAL_WALLET_SESSION_KEYNAME
         credWallet = self.session.get(walletKeyName)
-        if credWallet is None:
+        if not isinstance(credWallet, SAMLAssertionWallet):
             return None
         
         # Wallet has a dictionary of credential objects keyed by resource ID
         return credWallet.retrieveCredentials(resourceId)
+    
+    def _retrieveCachedDecision(self, resourceId, anonymous=False):
+        """Return the cached authorisation decision for the given resource ID
+        from either a decision record wallet or, if saveSamlObjects is set, a
+        SAML assertion wallet.  Decisions for anonymous requests come from 
+        the shared anonymous decision cache instead of the session.
+        
+        :param resourceId: search for decisions for this resource Id
+        :type resourceId: basestring
+        :param anonymous: True if the request has no user identity
+        :type anonymous: bool
+        :return: decision or None if no wallet has been set or no valid
+        decision was found matching the input resource Id
+        :rtype: ndg.security.server.wsgi.authz.decision.DecisionRecord / None
+        """
+        if anonymous:
+            record = self.__anonymousDecisionCache.get(resourceId)
+            if record is None:
+                return None
+            
+            if not record.isValid(
+                    clockSkewTolerance=self.client_binding.clockSkewTolerance):
+                self.__anonymousDecisionCache.pop(resourceId)
+                return None
+            
+            return record
+            
+        if self.session is None:
+            return None
+        
+        walletKeyName = self.__class__.CREDENTIAL_WALLET_SESSION_KEYNAME
+        credWallet = self.session.get(walletKeyName)
+        if credWallet is None:
+            return None
+        
+        if isinstance(credWallet, DecisionRecordWallet):
+            return credWallet.retrieveRecord(resourceId)
+        
+        assertions = credWallet.retrieveCredentials(resourceId)
+        if not assertions:
+            return None
+        
+        return DecisionRecord.fromAssertions(resourceId, assertions)
         
-    def _cacheAssertions(self, resourceId, assertions):
+    def _getWalletClass(self):
+        """Get the type of wallet for decisions cached in the session
+        
+        :return: SAMLAssertionWallet if saveSamlObjects is set, otherwise
+        DecisionRecordWallet
+        :rtype: type
+        """
+        if self.saveSamlObjects:
+            return SAMLAssertionWallet
+        else:
+            return DecisionRecordWallet
+        
+    def _cacheAssertions(self, resourceId, assertions, anonymous=False):
         """Cache an authorisation decision from a response retrieved from the 
         authorisation service.  This is invoked only if cacheDecisions boolean
         is set to True
@@ -359,19 +623,44 @@ class SamlPepFilterBase(SessionMiddlewareBase):
         :param assertions: list of SAML assertions containing authorisation 
         decision statements
         :type assertions: iterable
+        :param anonymous: True if the request has no user identity.  The
+        decision is cached in the shared anonymous decision cache so that the 
+        session isn't written to
+        :type anonymous: bool
         """
+        if anonymous:
+            record = DecisionRecord.fromAssertions(resourceId, assertions)
+            if record is not None:
+                self.__anonymousDecisionCache.set(resourceId, record)
+            return
+        
+        if self.session is None:
+            return
+        
         walletKeyName = self.__class__.CREDENTIAL_WALLET_SESSION_KEYNAME
         credWallet = self.session.get(walletKeyName)
-        if credWallet is None:
-            credWallet = SAMLAssertionWallet()
+        walletClass = self._getWalletClass()
+            
+        # Replace any wallet of the other type left from a change in the 
+        # saveSamlObjects setting
+        if not isinstance(credWallet, walletClass):
+            credWallet = walletClass()
             
             # Fix: make wallet follow the same clock skew tolerance and as the 
             # SAML authz decision query settings
             credWallet.clockSkewTolerance = self.client_binding.clockSkewTolerance
         
-        credWallet.addCredentials(resourceId, assertions)
+        if walletClass is SAMLAssertionWallet:
+            credWallet.addCredentials(resourceId, assertions)
+        else:
+            record = DecisionRecord.fromAssertions(resourceId, assertions)
+            if record is None:
+                return
+            credWallet.addRecord(record)
+            
         self.session[walletKeyName] = credWallet
         self.session.save()
+        self._observeSessionSize()
         
     def save_result_ctx(self, request, response, save=True):
         """Set PEP context information in the Beaker session using standard key
@@ -379,6 +668,9 @@ class SamlPepFilterBase(SessionMiddlewareBase):
         received.  It can be used by downstream middleware to provide contextual
         information about authorisation decisions
         
+        Unless saveSamlObjects is set, the request is not kept and the 
+        response is replaced by a DecisionRecord
+        
         :param session: beaker session
         :type session: beaker.session.SessionObject
         :param request: authorisation decision query
@@ -388,14 +680,48 @@ class SamlPepFilterBase(SessionMiddlewareBase):
         :param save: determines whether session is saved or not
         :type save: bool
         """
-        self.session[self.__class__.PEPCTX_SESSION_KEYNAME] = {
-            self.__class__.PEPCTX_REQUEST_SESSION_KEYNAME: request, 
-            self.__class__.PEPCTX_RESPONSE_SESSION_KEYNAME: response,
-            self.__class__.PEPCTX_TIMESTAMP_SESSION_KEYNAME: time()
-        }
+        if self.session is None:
+            return
+        
+        if self.saveSamlObjects:
+            self.session[self.__class__.PEPCTX_SESSION_KEYNAME] = {
+                self.__class__.PEPCTX_REQUEST_SESSION_KEYNAME: request, 
+                self.__class__.PEPCTX_RESPONSE_SESSION_KEYNAME: response,
+                self.__class__.PEPCTX_TIMESTAMP_SESSION_KEYNAME: time()
+            }
+        else:
+            self.session[self.__class__.PEPCTX_SESSION_KEYNAME] = {
+                self.__class__.PEPCTX_RESPONSE_SESSION_KEYNAME: 
+                    DecisionRecord.fromAssertions(request.resource, 
+                                                  response.assertions),
+                self.__class__.PEPCTX_TIMESTAMP_SESSION_KEYNAME: time()
+            }
         
         if save:
-            self.session.save()     
+            self.session.save()
+            self._observeSessionSize()
+            
+    def _observeSessionSize(self):
+        """Record the size of the pickled session in debug metrics.  Pickling
+        the session is expensive so this is skipped unless debug logging is
+        enabled
+        """
+        if not log.isEnabledFor(logging.DEBUG):
+            return
+        
+        try:
+            size = len(pickle.dumps(dict([(k, self.session[k]) 
+                                          for k in self.session]),
+                                    pickle.HIGHEST_PROTOCOL))
+        except Exception as e:
+            log.debug('Error pickling session to get its size: %s', e)
+            return
+        
+        log.debug('Session size after PEP update = %d bytes', size)
+        metrics.registry.timer(self.__class__.SESSION_SIZE_HISTOGRAM_NAME,
+                               self.__class__.SESSION_SIZE_HISTOGRAM_DOC,
+                               buckets=self.__class__.SESSION_SIZE_BUCKETS
+                               ).observe(size)
 
     PDP_DENY_RESPONSES = (
         XacmlDecision.DENY_STR, XacmlDecision.INDETERMINATE_STR
@@ -411,9 +737,10 @@ class SamlPepFilterBase(SessionMiddlewareBase):
         # Apply a list of regular expressions to filter out files which can be 
         # ignored
         if self.ignore_file_list_pat is not None:
-            for pat in self.ignore_file_list_pat:
-                if re.match(pat, resourceURI):
-                    return False
+            with self.phaseTimer('pattern_filter').time():
+                for pat in self.ignore_file_list_pat:
+                    if re.match(pat, resourceURI):
+                        return False
                 
             return True
 
@@ -422,8 +749,10 @@ class SamlPepFilterBase(SessionMiddlewareBase):
                       "authorisation service...")
             return True
         else:
-            xacmlRequest = self._createXacmlRequestCtx(resourceURI)
-            xacmlResponse = self.__localPdp.evaluate(xacmlRequest)
+            with self.phaseTimer('local_pdp').time():
+                xacmlRequest = self._createXacmlRequestCtx(resourceURI)
+                xacmlResponse = self.__localPdp.evaluate(xacmlRequest)
+                
             for result in xacmlResponse.results:
                 if result.decision.value != XacmlDecision.NOT_APPLICABLE_STR:
                     log.debug("Local PDP returned %s decision, passing request "
@@ -484,67 +813,77 @@ class SamlPepFilter(SamlPepFilterBase):
             # invoked.  This step is an efficiency measure to avoid multiple
             # callouts to the authorisation service for resources which 
             # obviously don't need any restrictions 
+            self._setCaptureResult(environ, 
+                                   self.__class__.CAPTURE_NOT_APPLICABLE)
             return self._app(environ, start_response)
             
-        # Check for cached decision
+        # Check for cached decision.  Only permit decisions are cached
+        anonymous = not remote_user
         if self.cacheDecisions:
-            assertions = self._retrieveCachedAssertions(requestURI)
-        else:
-            assertions = None  
-             
-        noCachedAssertion = assertions is None or len(assertions) == 0
-        if noCachedAssertion:
-            # No stored decision in cache, invoke the authorisation service
+            with self.phaseTimer('cache_lookup').time():
+                cachedDecision = self._retrieveCachedDecision(requestURI,
+                                                        anonymous=anonymous)
+                
+            if cachedDecision is not None and cachedDecision.permit:
+                self._setCaptureResult(environ, 
+                                       self.__class__.CAPTURE_PERMIT,
+                                       cached=True)
+                return self._app(environ, start_response)
             
-            # Make a new query object   
-            query = AuthzDecisionQueryFactory.create()
+        # No stored decision in cache, invoke the authorisation service
+        
+        # Make a new query object   
+        query = AuthzDecisionQueryFactory.create()
+        
+        # Copy constant settings.  These constants were set at 
+        # initialisation
+        query.subject.nameID.format = self.client_query.subject.nameID.format
+        query.issuer.value = self.client_query.issuer.value
+        query.issuer.format = self.client_query.issuer.format
+       
+        # Set dynamic settings particular to this individual request 
+        query.subject.nameID.value = remote_user
+        query.resource = request.url
+        
+        try:
+            with self.phaseTimer('authz_callout').time():
+                samlAuthzResponse = self.client_binding.send(query,
+                                                 uri=self.authzServiceURI)
             
-            # Copy constant settings.  These constants were set at 
-            # initialisation
-            query.subject.nameID.format = \
-                                        self.client_query.subject.nameID.format
-            query.issuer.value = self.client_query.issuer.value
-            query.issuer.format = self.client_query.issuer.format
-           
-            # Set dynamic settings particular to this individual request 
-            query.subject.nameID.value = remote_user
-            query.resource = request.url
+        except (SOAPClientError, URLError) as e:
+            import traceback
             
-            try:
-                samlAuthzResponse = self.client_binding.send(query,
-                                                     uri=self.authzServiceURI)
-                
-            except (SOAPClientError, URLError) as e:
-                import traceback
+            if isinstance(e, SOAPClientError):
+                log.error("Error, HTTP %s response from authorisation "
+                          "service %r requesting access to %r: %s", 
+                          e.urllib2Response.code,
+                          self.authzServiceURI, 
+                          requestURI,
+                          traceback.format_exc())
+            else:
+                log.error("Error, calling authorisation service %r "
+                          "requesting access to %r: %s", 
+                          self.authzServiceURI, 
+                          requestURI,
+                          traceback.format_exc()) 
                 
-                if isinstance(e, SOAPClientError):
-                    log.error("Error, HTTP %s response from authorisation "
-                              "service %r requesting access to %r: %s", 
-                              e.urllib2Response.code,
-                              self.authzServiceURI, 
-                              requestURI,
-                              traceback.format_exc())
-                else:
-                    log.error("Error, calling authorisation service %r "
-                              "requesting access to %r: %s", 
-                              self.authzServiceURI, 
-                              requestURI,
-                              traceback.format_exc()) 
-                    
-                response = webob.Response()
-                response.status = http.client.FORBIDDEN
-                response.text = ('An error occurred retrieving an access '
-                                 'decision for %r for user %r' % 
-                                 (requestURI, remote_user))
-                response.content_type = 'text/plain'
-                return response(environ, start_response)
-                         
-            assertions = samlAuthzResponse.assertions
-            
-            # Record the result in the user's session to enable later 
-            # interrogation by any result handler Middleware
-            self.save_result_ctx(query, samlAuthzResponse)
+            self._setCaptureResult(environ, self.__class__.CAPTURE_ERROR)
+            response = webob.Response()
+            response.status = http.client.FORBIDDEN
+            response.text = ('An error occurred retrieving an access '
+                             'decision for %r for user %r' % 
+                             (requestURI, remote_user))
+            response.content_type = 'text/plain'
+            return response(environ, start_response)
+                     
+        assertions = samlAuthzResponse.assertions
         
+        # Record the result in the user's session to enable later 
+        # interrogation by any result handler Middleware.  Result handlers 
+        # aren't used for anonymous requests as they respond 401 instead so 
+        # there's no need to write to the session
+        if not anonymous:
+            self.save_result_ctx(query, samlAuthzResponse)
         
         # Set HTTP 403 Forbidden response if any of the decisions returned are
         # deny or indeterminate status
@@ -556,6 +895,8 @@ class SamlPepFilter(SamlPepFilterBase):
         for assertion in assertions:
             for authzDecisionStatement in assertion.authzDecisionStatements:
                 if authzDecisionStatement.decision.value in failDecisions:
+                    self._setCaptureResult(environ, 
+                                        str(authzDecisionStatement.decision))
                     response = webob.Response()
                     
                     if not remote_user:
@@ -565,30 +906,33 @@ class SamlPepFilter(SamlPepFilterBase):
                         # The user is logged in but not authorised
                         response.status = http.client.FORBIDDEN
                         
-                    response.body = 'Access denied to %r for user %r' % (
+                    response.text = 'Access denied to %r for user %r' % (
                                                                  requestURI,
                                                                  remote_user)
                     response.content_type = 'text/plain'
-                    log.info(response.body)
+                    log.info(response.text)
                     return response(environ, start_response)
 
         if assertion is None:
             log.error("No assertions set in authorisation decision response "
                       "from %r", self.authzServiceURI)
             
+            self._setCaptureResult(environ, self.__class__.CAPTURE_ERROR)
             response = webob.Response()
             response.status = http.client.FORBIDDEN
-            response.body = ('An error occurred retrieving an access decision '
+            response.text = ('An error occurred retrieving an access decision '
                              'for %r for user %r' % (requestURI, remote_user))
             response.content_type = 'text/plain'
-            log.info(response.body)
+            log.info(response.text)
             return response(environ, start_response)     
                
-        # Cache assertion if flag is set and it's one that's been freshly 
-        # obtained from an authorisation decision query rather than one 
-        # retrieved from the cache
-        if self.cacheDecisions and noCachedAssertion:
-            self._cacheAssertions(request.url, [assertion])
+        # Cache assertion if flag is set - it's one that's been freshly 
+        # obtained from an authorisation decision query
+        if self.cacheDecisions:
+            self._cacheAssertions(request.url, [assertion], 
+                                  anonymous=anonymous)
+            
+        self._setCaptureResult(environ, self.__class__.CAPTURE_PERMIT)
             
         # If got through to here then all is well, call next WSGI middleware/app
         return self._app(environ, start_response)
@@ -16,7 +16,7 @@ import webob
 
 from ndg.security.common.config import importElementTree
 ElementTree = importElementTree()
-from ndg.security.common.utils import str2Bool
+from ndg.security.common.credentialwallet import SAMLAssertionWallet
 
 from ndg.saml.saml2.core import DecisionType
 from ndg.saml.saml2.binding.soap.client.xacmlauthzdecisionquery import \
@@ -80,20 +80,15 @@ class XacmlSamlPepFilter(SamlPepFilterBase):
                           doc="Subject format ID to use in XACML subject "
                           "attribute")
 
-    def _setCacheDecisions(self, value):
-        """Override method from SamlPepFilterBase to prevent decision caching
-        from being enabled since it doesn't work with the XACML profile request.
+    def _getWalletClass(self):
+        """Override method from SamlPepFilterBase to always cache the SAML
+        assertions.  Decision records can't be made from the XACML 
+        authorisation decision statements in XACML profile responses
+        
+        :return: SAMLAssertionWallet
+        :rtype: type
         """
-        if isinstance(value, str):
-            newValue = str2Bool(value)
-        elif isinstance(value, bool):
-            newValue = value
-        else:
-            raise TypeError('Expecting bool/string type for "cacheDecisions" '
-                            'attribute; got %r' % type(value))
-        if newValue != False:
-            raise AttributeError('Caching of decisions cannot be enabled since '
-                                 'it does not work in this version.')
+        return SAMLAssertionWallet
 
     def initialise(self, prefix='', **kw):
         '''Initialise object from keyword settings
@@ -144,12 +139,15 @@ class XacmlSamlPepFilter(SamlPepFilterBase):
             # invoked.  This step is an efficiency measure to avoid multiple
             # callouts to the authorisation service for resources which 
             # obviously don't need any restrictions 
+            self._setCaptureResult(environ, 
+                                   self.__class__.CAPTURE_NOT_APPLICABLE)
             return self._app(environ, start_response)
 
         # Check for cached decision
         # Note: this must be False if request can contain ResourceContent.
         if self.cacheDecisions:
-            assertions = self._retrieveCachedAssertions(requestURI)
+            with self.phaseTimer('cache_lookup').time():
+                assertions = self._retrieveCachedAssertions(requestURI)
         else:
             assertions = None  
 
@@ -166,8 +164,9 @@ class XacmlSamlPepFilter(SamlPepFilterBase):
             request.body_file_seekable.seek(0)
             query = self.client.makeQuery()
             query.xacmlContextRequest = xacmlContextRequest
-            samlAuthzResponse = self.client.send(query,
-                                                 uri=self.authzServiceURI)
+            with self.phaseTimer('authz_callout').time():
+                samlAuthzResponse = self.client.send(query,
+                                                     uri=self.authzServiceURI)
             assertions = samlAuthzResponse.assertions
             
             # SamlPepFilter has the following, which cannot be used here as
@@ -182,11 +181,20 @@ class XacmlSamlPepFilter(SamlPepFilterBase):
                                                     requestURI,
                                                     self.authzServiceURI)
         if error_status is not None:
+            # Deny and Indeterminate decisions aren't distinguished here
+            if error_status in (http.client.UNAUTHORIZED, 
+                                http.client.FORBIDDEN):
+                decision = self.__class__.CAPTURE_DENY
+            else:
+                decision = self.__class__.CAPTURE_ERROR
+                
+            self._setCaptureResult(environ, decision, 
+                                   cached=not noCachedAssertion)
             response = webob.Response()
             response.status = error_status
-            response.body = error_message
+            response.text = error_message
             response.content_type = 'text/plain'
-            log.info(response.body)
+            log.info(response.text)
             return response(environ, start_response)
 
         log.debug('Response contains permit assertion')
@@ -196,6 +204,9 @@ class XacmlSamlPepFilter(SamlPepFilterBase):
         # retrieved from the cache
         if self.cacheDecisions and noCachedAssertion:
             self._cacheAssertions(request.url, [assertion])
+
+        self._setCaptureResult(environ, self.__class__.CAPTURE_PERMIT,
+                               cached=not noCachedAssertion)
             
         # If got through to here then all is well, call next WSGI middleware/app
         return self._app(environ, start_response)
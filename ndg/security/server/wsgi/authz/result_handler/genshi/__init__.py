@@ -21,7 +21,10 @@ from paste.urlparser import StaticURLParser
 from genshi.template import TemplateLoader
 
 from ndg.saml.saml2.core import DecisionType
+from ndg.security.common.utils import str2Bool
 from ndg.security.server.utils.paste_port import Cascade
+from ndg.security.server.utils.genshi_utils import createTemplateLoader
+from ndg.security.server.wsgi.authz.decision import DecisionRecord
 from ndg.security.server.wsgi.authz.result_handler import \
     PEPResultHandlerMiddlewareBase
 
@@ -53,7 +56,8 @@ class GenshiPEPResultHandlerMiddleware(PEPResultHandlerMiddlewareBase):
         'rightLink': '',
         'rightImage': '',
         'rightAlt': '',
-        'helpIcon': ''
+        'helpIcon': '',
+        'templateAutoReload': 'False'
     }
     __slots__ = PROPERTY_DEFAULTS
     
@@ -81,7 +85,17 @@ class GenshiPEPResultHandlerMiddleware(PEPResultHandlerMiddlewareBase):
                 attrName = i.rsplit(prefix, 2)[-1]
                 setattr(self, attrName, app_conf[i])
             
-        self.__loader = TemplateLoader(self.templateRootDir, auto_reload=True)
+        # Templates are compiled up front and held in memory unless reloading
+        # of modified template files has been explicitly enabled.  Without 
+        # reloading, the rendered page depends only on the message so keep a
+        # copy for each one
+        self.__renderCache = None
+        autoReload = str2Bool(self.templateAutoReload)
+        if not autoReload:
+            self.__renderCache = {}
+            
+        self.__loader = createTemplateLoader(self.templateRootDir,
+                                             autoReload=autoReload)
 
     @PEPResultHandlerMiddlewareBase.initCall
     def __call__(self, environ, start_response):
@@ -106,7 +120,16 @@ class GenshiPEPResultHandlerMiddleware(PEPResultHandlerMiddlewareBase):
             cls = self.__class__
             pepCtx = session.get(cls.PEPCTX_SESSION_KEYNAME, {})
             pdpResponse = pepCtx.get(cls.PEPCTX_RESPONSE_SESSION_KEYNAME)
-            if pdpResponse is not None:
+            if isinstance(pdpResponse, DecisionRecord):
+                # Compact record saved by the PEP in place of the SAML 
+                # response
+                if pdpResponse.indeterminate:
+                    pdpResponseMsg = ("An error occurred making an access "
+                                      "decision.")
+                else:
+                    pdpResponseMsg = ("The authorisation policy has set "
+                                      "access denied for this resource.")
+            elif pdpResponse is not None:
                 # Expecting a SAML response - parse decision values from this
                 pdpResponseMsg = ("The authorisation policy has set "
                                   "access denied for this resource.")
@@ -124,7 +147,13 @@ class GenshiPEPResultHandlerMiddleware(PEPResultHandlerMiddlewareBase):
             msg = Template(self.messageTemplate).substitute(
                                                 pdpResponseMsg=pdpResponseMsg)
 
-            response = self._render(xml=msg)
+            if self.__renderCache is None:
+                response = self._render(xml=msg)
+            else:
+                response = self.__renderCache.get(msg)
+                if response is None:
+                    response = self._render(xml=msg)
+                    self.__renderCache[msg] = response
             start_response(cls.getStatusMessage(FORBIDDEN),
                            [('Content-type', 'text/html'),
                             ('Content-Length', str(len(response)))])
@@ -11,6 +11,8 @@ __revision__ = '$Id$'
 import logging
 log = logging.getLogger(__name__)
 
+import json
+
 from ndg.security.server.xacml.ctx_handler import saml_ctx_handler
 from ndg.security.common.utils.factory import importModuleObject
 
@@ -44,11 +46,13 @@ class AuthorisationServiceMiddleware(object):
     }
     
     POLICY_FILEPATH_OPTNAME = 'policyFilePath'
+    PROFILE_REPORT_PATH_OPTNAME = 'profileReportPath'
     
     __slots__ = (
         '__xacmlCtxHandler',
         '__queryInterface', 
         '__' + ENVIRON_KEYNAME_QUERY_IFACE_OPTNAME,
+        '__' + PROFILE_REPORT_PATH_OPTNAME,
         '_app',
     )
         
@@ -62,6 +66,7 @@ class AuthorisationServiceMiddleware(object):
         self.__xacmlCtxHandler = saml_ctx_handler.SamlCtxHandler()
         self.__queryInterface = None
         self.__queryInterfaceKeyName = None
+        self.__profileReportPath = None
         
     def initialise(self, prefix=DEFAULT_PARAM_PREFIX, **app_conf):
         """Set-up Authorization Service middleware from keyword settings
@@ -86,8 +91,13 @@ class AuthorisationServiceMiddleware(object):
         ctxHandlerPrefix = prefix + cls.XACML_CTX_HANDLER_PARAM_PREFIX
         self.__xacmlCtxHandler = saml_ctx_handler.SamlCtxHandler.fromKeywords(
                                                 ctxHandlerPrefix, **app_conf)
-            
-        # Initialise the XACML Context handler
+        
+        # Optional path at which to serve a report from the policy evaluation
+        # profiler - requires ctx_handler.profile = True
+        profileReportPath = app_conf.get(
+                                prefix + cls.PROFILE_REPORT_PATH_OPTNAME)
+        if profileReportPath:
+            self.profileReportPath = profileReportPath
         
     @classmethod
     def filter_app_factory(cls, app, global_conf, **app_conf):
@@ -119,8 +129,54 @@ class AuthorisationServiceMiddleware(object):
         @rtype: iterable
         @return: next application in the WSGI stack
         '''
+        if (self.__profileReportPath is not None and 
+            environ.get('PATH_INFO') == self.__profileReportPath):
+            return self._profileReport(start_response)
+            
         environ[self.queryInterfaceKeyName] = self.queryInterface
         return self._app(environ, start_response)
+    
+    def _profileReport(self, start_response):
+        """Respond with the policy evaluation profiler report as JSON
+        
+        @type start_response: function
+        @param start_response: standard WSGI start response function
+        @rtype: list
+        @return: JSON report
+        """
+        profiler = self.__xacmlCtxHandler.profiler
+        if profiler is None:
+            response = b'Policy evaluation profiling is not enabled'
+            start_response('404 Not Found', 
+                           [('Content-type', 'text/plain'),
+                            ('Content-length', str(len(response)))])
+            return [response]
+        
+        response = json.dumps(profiler.report(), indent=2).encode('utf-8')
+        start_response('200 OK', 
+                       [('Content-type', 'application/json'),
+                        ('Content-length', str(len(response)))])
+        return [response]
+
+    @property
+    def xacmlCtxHandler(self):
+        """XACML Context handler"""
+        return self.__xacmlCtxHandler
+
+    def _get_profileReportPath(self):
+        return self.__profileReportPath
+
+    def _set_profileReportPath(self, val):
+        if not isinstance(val, (str, type(None))):
+            raise TypeError('Expecting %r or None for "profileReportPath" '
+                            'attribute; got %r' % (str, type(val)))
+        self.__profileReportPath = val
+        
+    profileReportPath = property(fget=_get_profileReportPath, 
+                                 fset=_set_profileReportPath, 
+                                 doc="URI path at which to serve the policy "
+                                     "evaluation profiler report as JSON or "
+                                     "None to disable")
 
 
     def _get_queryInterfaceKeyName(self):
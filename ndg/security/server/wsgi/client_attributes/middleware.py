@@ -9,6 +9,8 @@ __revision__ = "$Id$"
 
 import logging
 import urllib.parse
+from concurrent.futures import Future
+from threading import Lock
 
 import ndg.httpsclient.utils as httpsclient_utils
 import ndg.httpsclient.ssl_context_util as  ssl_context_util
@@ -19,13 +21,104 @@ from ndg.security.common.config import importElementTree
 ElementTree = importElementTree()
 from ndg.security.common.saml_utils.esgf import ESGFDefaultQueryAttributes
 from ndg.security.common.utils.etree import prettyPrint
+from ndg.security.server.utils.cache import LRUCache
 from ndg.security.server.wsgi import NDGSecurityMiddlewareBase
+from ndg.security.server.wsgi.client_proxy.connection_pool import (
+                                                    HTTPConnectionPool,
+                                                    HTTPConnectionPoolHandler)
 
 log = logging.getLogger(__name__)
 
+
+class AttributeServiceConnectionPoolHandler(HTTPConnectionPoolHandler):
+    """Pooled connection handler for attribute queries.  The SSL context for
+    each request is taken from a callable so that a context verifying the
+    attribute service host name can be used for each host
+    """
+    # Ahead of the default HTTP handler of the SOAP client opener
+    handler_order = 400
+
+    def __init__(self, pool, getSslContext, debuglevel=0):
+        '''
+        @param pool: connection pool
+        @type pool: HTTPConnectionPool
+        @param getSslContext: callable taking the request host and returning
+        the SSL context for it
+        @type getSslContext: callable
+        @param debuglevel: debug level for handler
+        @type debuglevel: int
+        '''
+        super(AttributeServiceConnectionPoolHandler, self).__init__(pool,
+                                                        debuglevel=debuglevel)
+        self._getSslContext = getSslContext
+
+    def _get_ssl_context(self, req):
+        return self._getSslContext(req.host)
+
+
+class PooledAttributeQuerySslSOAPBinding(AttributeQuerySslSOAPBinding):
+    """Attribute query binding making queries with connections from a pool.
+    AttributeQuerySslSOAPBinding adds a new HTTPS handler to the SOAP client
+    for each query.  This installs a single pooled handler instead and keeps
+    an SSL context for each attribute service host, set to verify the host
+    name
+    """
+    DEFAULT_SSL_CONTEXT_CACHE_SIZE = 100
+
+    __slots__ = ('__connectionPool', '__sslContexts', '__sslContextLock')
+
+    def __init__(self, connectionPool, **kw):
+        '''
+        @param connectionPool: connection pool for queries
+        @type connectionPool: HTTPConnectionPool
+        '''
+        super(PooledAttributeQuerySslSOAPBinding, self).__init__(**kw)
+        self.__connectionPool = connectionPool
+        self.__sslContexts = LRUCache(
+                        maxSize=self.__class__.DEFAULT_SSL_CONTEXT_CACHE_SIZE)
+        self.__sslContextLock = Lock()
+
+        self.client.openerDirector.add_handler(
+                AttributeServiceConnectionPoolHandler(connectionPool,
+                                                      self._getSslContext))
+
+    @property
+    def connectionPool(self):
+        """Connection pool for queries"""
+        return self.__connectionPool
+
+    def _getSslContext(self, host):
+        """Get the SSL context for an attribute service host
+        @type host: basestring
+        @param host: host name with optional port number appended
+        @rtype: OpenSSL.SSL.Context
+        @return: SSL context verifying the host name
+        """
+        hostname = host.split(':')[0]
+        with self.__sslContextLock:
+            sslCtx = self.__sslContexts.get(hostname)
+            if sslCtx is None:
+                self.sslCtxProxy.ssl_valid_hostname = hostname
+                sslCtx = self.sslCtxProxy()
+                self.__sslContexts.set(hostname, sslCtx)
+
+        return sslCtx
+
+    def send(self, query, **kw):
+        """Make the query with the pooled handler, bypassing
+        AttributeQuerySslSOAPBinding.send which adds a handler for each query
+        """
+        return super(AttributeQuerySslSOAPBinding, self).send(query, **kw)
+
 class AttributeRequestMiddleware(NDGSecurityMiddlewareBase):
     """Makes an attribute request to obtain ESG attributes corresponding to the
     username stored in the environ.
+
+    Attribute service URLs found by Yadis discovery are cached by OpenID host
+    for discoveryCacheTimeout seconds.  Subjects for which discovery fails are
+    cached for discoveryCacheNegativeTimeout seconds.  Discovery requests and
+    attribute queries share a connection pool.  Concurrent requests for the
+    same subject share a single attribute query.
     """
     DEFAULT_PARAM_PREFIX = 'attr_req.'
     ATTRIBUTE_QUERY_PARAMS_PREFIX = 'attributeQuery.'
@@ -44,6 +137,14 @@ class AttributeRequestMiddleware(NDGSecurityMiddlewareBase):
     XRDS_TYPE_PATH = ('{%s}Type' % XRDS_NS)
     XRDS_URI_PATH = ('{%s}URI' % XRDS_NS)
     XRDS_ATTRIBUTE_SERVICE_TYPE = 'urn:esg:security:attribute-service'
+
+    DEFAULT_DISCOVERY_CACHE_SIZE = 1000
+    DEFAULT_DISCOVERY_CACHE_TIMEOUT = 3600.
+    DEFAULT_DISCOVERY_CACHE_NEGATIVE_TIMEOUT = 60.
+    CONNECTION_POOL_NAME = 'attribute_request'
+
+    # Discovery cache value for subjects with no attribute service found
+    NO_ATTRIBUTE_SERVICE = ''
     
     PARAM_NAMES = (
         'attributeServiceUrl',
@@ -51,17 +152,23 @@ class AttributeRequestMiddleware(NDGSecurityMiddlewareBase):
         'sslCertFilePath',
         'sslPriKeyFilePath',
         'sessionAttributeKey',
-        'sessionKey'
+        'sessionKey',
+        'discoveryCacheSize',
+        'discoveryCacheTimeout',
+        'discoveryCacheNegativeTimeout'
     )
 
     __slots__ = (
         '_app',
         '_attributeQueryClient',
-        '_httpsClientConfig'
+        '_httpsClientConfig',
+        '_connectionPool',
+        '_discoveryCache',
+        '_fetches',
+        '_fetchLock'
     )
 
     __slots__ += tuple(['__' + i for i in PARAM_NAMES])
-    del i
 
     def __init__(self, app):
         self._app = app
@@ -69,6 +176,23 @@ class AttributeRequestMiddleware(NDGSecurityMiddlewareBase):
         self.__attributeServiceUrl = None
         self.__sessionAttributeKey = self.__class__.SESSION_ATTRIBUTE_KEY_OPTION_DEFAULT
         self.__sessionKey = self.__class__.SESSION_KEY_OPTION_DEFAULT
+        self.__discoveryCacheSize = \
+            self.__class__.DEFAULT_DISCOVERY_CACHE_SIZE
+        self.__discoveryCacheTimeout = \
+            self.__class__.DEFAULT_DISCOVERY_CACHE_TIMEOUT
+        self.__discoveryCacheNegativeTimeout = \
+            self.__class__.DEFAULT_DISCOVERY_CACHE_NEGATIVE_TIMEOUT
+
+        # Attribute service URLs keyed by OpenID host and subjects for which
+        # discovery failed
+        self._discoveryCache = LRUCache(maxSize=self.__discoveryCacheSize,
+                                        timeout=self.__discoveryCacheTimeout)
+        self._connectionPool = HTTPConnectionPool(
+                                    name=self.__class__.CONNECTION_POOL_NAME)
+
+        # Attribute queries in progress keyed by subject
+        self._fetches = {}
+        self._fetchLock = Lock()
 
     def initialise(self, app_conf, prefix=DEFAULT_PARAM_PREFIX, **local_conf):
         """Initialise attributes from the given local configuration settings
@@ -98,7 +222,11 @@ class AttributeRequestMiddleware(NDGSecurityMiddlewareBase):
             if paramName in AttributeRequestMiddleware.PARAM_NAMES:
                 setattr(self, paramName, local_conf[k])
 
-        self._attributeQueryClient = AttributeQuerySslSOAPBinding()
+        self._discoveryCache = LRUCache(maxSize=self.__discoveryCacheSize,
+                                        timeout=self.__discoveryCacheTimeout)
+
+        self._attributeQueryClient = PooledAttributeQuerySslSOAPBinding(
+                                                        self._connectionPool)
 
         # Parse authorisation decision query options
         self._attributeQueryClient.parseKeywords(prefix=queryPrefix,
@@ -152,7 +280,8 @@ class AttributeRequestMiddleware(NDGSecurityMiddlewareBase):
         return (parts.scheme in ['http', 'https']) and bool(parts.netloc)
 
     def _getAttributeService(self, subject):
-        """
+        """Get the attribute service for a subject from the discovery cache
+        or by making a Yadis request
         @type subject: basestring
         @param subject: subject for which the query is to be made
         @rtype: basestring
@@ -162,17 +291,49 @@ class AttributeRequestMiddleware(NDGSecurityMiddlewareBase):
             log.debug("Subject is not a HTTP URL - not making Yadis request to"
                       " obtain attribute service: %s", subject)
             return None
+
+        # Attribute services are shared by all the subjects of an OpenID
+        # provider.  Failures are cached for the subject only so that an
+        # invalid OpenID doesn't prevent discovery for others on the host.
+        host = urllib.parse.urlsplit(subject).netloc
+        for key in (host, subject):
+            attributeServiceUrl = self._discoveryCache.get(key)
+            if attributeServiceUrl is not None:
+                log.debug("Using cached attribute service URL for subject "
+                          "%s: %r", subject, attributeServiceUrl)
+                return attributeServiceUrl or None
+
+        attributeServiceUrl = self._discoverAttributeService(subject)
+        if attributeServiceUrl is None:
+            self._discoveryCache.set(subject,
+                            self.__class__.NO_ATTRIBUTE_SERVICE,
+                            timeout=self.__discoveryCacheNegativeTimeout)
+        else:
+            self._discoveryCache.set(host, attributeServiceUrl)
+
+        return attributeServiceUrl
+
+    def _discoverAttributeService(self, subject):
+        """Make a Yadis request to find the attribute service for a subject
+        @type subject: basestring
+        @param subject: subject for which the query is to be made
+        @rtype: basestring
+        @return: URL of attribute service or None if none was found
+        """
+        handler = HTTPConnectionPoolHandler(self._connectionPool,
+                                ssl_context=self._httpsClientConfig.ssl_context)
         try:
             log.debug("Making Yadis request to obtain attribute service for"
                       " subject %s", subject)
             xrdsStr = httpsclient_utils.fetch_from_url(subject,
-                                                       self._httpsClientConfig)
+                                                       self._httpsClientConfig,
+                                                       handlers=[handler])
+            xrdsEl = ElementTree.XML(xrdsStr)
         except Exception as exc:
             log.error(
                     "Unable to determine attribute service for subject %s: %s",
                     subject, exc.__str__())
             return None
-        xrdsEl = ElementTree.XML(xrdsStr)
         for svcEl in xrdsEl.findall(self.__class__.XRDS_SERVICE_PATH):
             isAttrService = False
             for typeEl in svcEl.findall(self.__class__.XRDS_TYPE_PATH):
@@ -187,6 +348,41 @@ class AttributeRequestMiddleware(NDGSecurityMiddlewareBase):
         return None
 
     def _getAttributes(self, subject):
+        """Get the attributes for a subject.  If a query for the subject is
+        already in progress, wait for it and share its result
+        @type subject: basestring
+        @param subject: subject for which the query is to be made
+        @rtype: dict of basestring
+        @return: attribute names and values
+        """
+        with self._fetchLock:
+            fetch = self._fetches.get(subject)
+            if fetch is None:
+                fetch = Future()
+                self._fetches[subject] = fetch
+                inProgress = False
+            else:
+                inProgress = True
+
+        if inProgress:
+            log.debug("Waiting for attribute query in progress for subject "
+                      "%s", subject)
+            return dict(fetch.result())
+
+        try:
+            attributes = self._queryAttributes(subject)
+            fetch.set_result(attributes)
+            return attributes
+
+        except Exception as e:
+            fetch.set_exception(e)
+            raise
+
+        finally:
+            with self._fetchLock:
+                del self._fetches[subject]
+
+    def _queryAttributes(self, subject):
         """Makes a query for the attributes and returns them.
         The attribute names used in the SAML query are mapped to keys to use in
         the session.
@@ -304,3 +500,47 @@ class AttributeRequestMiddleware(NDGSecurityMiddlewareBase):
                             'attribute; got %r' % type(val))
 
         self.__sessionKey = val
+
+    @property
+    def discoveryCacheSize(self):
+        """Maximum number of attribute service discovery results cached"""
+        return self.__discoveryCacheSize
+
+    @discoveryCacheSize.setter
+    def discoveryCacheSize(self, val):
+        if not isinstance(val, (int, str)):
+            raise TypeError('Expecting int or string type for '
+                            '"discoveryCacheSize" attribute; got %r' %
+                            type(val))
+
+        self.__discoveryCacheSize = int(val)
+
+    @property
+    def discoveryCacheTimeout(self):
+        """Time in seconds for which discovered attribute service URLs are
+        cached"""
+        return self.__discoveryCacheTimeout
+
+    @discoveryCacheTimeout.setter
+    def discoveryCacheTimeout(self, val):
+        if not isinstance(val, (int, float, str)):
+            raise TypeError('Expecting int, float or string type for '
+                            '"discoveryCacheTimeout" attribute; got %r' %
+                            type(val))
+
+        self.__discoveryCacheTimeout = float(val)
+
+    @property
+    def discoveryCacheNegativeTimeout(self):
+        """Time in seconds for which subjects with no attribute service found
+        are cached"""
+        return self.__discoveryCacheNegativeTimeout
+
+    @discoveryCacheNegativeTimeout.setter
+    def discoveryCacheNegativeTimeout(self, val):
+        if not isinstance(val, (int, float, str)):
+            raise TypeError('Expecting int, float or string type for '
+                            '"discoveryCacheNegativeTimeout" attribute; got %r'
+                            % type(val))
+
+        self.__discoveryCacheNegativeTimeout = float(val)
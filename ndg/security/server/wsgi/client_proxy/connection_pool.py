@@ -0,0 +1,514 @@
+"""HTTP connection pool for NDG Security HTTP Proxy middleware
+
+Connections are kept open between requests and reused for the same host, port
+and SSL context.  SSL contexts are shared between requests for the same client
+credentials (see ssl_context) so pooling by context pools by credentials and
+saves a TLS handshake for each request.
+
+MashMyData Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+import logging
+log = logging.getLogger(__name__)
+
+import http.client
+import urllib.request
+from urllib.error import URLError
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from OpenSSL import SSL
+from ndg.httpsclient.https import HTTPSConnection, HTTPSContextHandler
+
+from ndg.security.server.utils import metrics
+
+
+class PooledHTTPResponse(http.client.HTTPResponse):
+    """HTTP response which returns its connection to the pool when closed or
+    read in full.  Used where the response is passed to code which only calls
+    close() or reads to the end of the body without closing it such as urllib
+    handlers and parsers
+    
+    @ivar release: callable taking a flag set to True if the response was 
+    read in full, called once when the response is closed
+    @type release: callable / None
+    """
+    release = None
+    
+    def _close_conn(self):
+        # Called by http.client once the end of the body has been read
+        super(PooledHTTPResponse, self)._close_conn()
+        
+        release, self.release = self.release, None
+        if release is not None:
+            release(True)
+            
+    def close(self):
+        complete = self.isclosed()
+        release, self.release = self.release, None
+        super(PooledHTTPResponse, self).close()
+        
+        if release is not None:
+            release(complete)
+
+
+class HTTPConnectionPool(object):
+    """Pool of idle keep-alive HTTP and HTTPS connections keyed by scheme,
+    host, port and SSL context.  Connections are taken from the pool for the
+    duration of a request and its response and returned when the response has
+    been read in full.  Connections idle for longer than the idle timeout are
+    closed.
+
+    @cvar DEFAULT_MAX_SIZE: default maximum number of idle connections kept
+    @type DEFAULT_MAX_SIZE: int
+    @cvar DEFAULT_MAX_SIZE_PER_KEY: default maximum number of idle connections
+    kept for each host, port and SSL context
+    @type DEFAULT_MAX_SIZE_PER_KEY: int
+    @cvar DEFAULT_IDLE_TIMEOUT: default time in seconds after which idle
+    connections are closed
+    @type DEFAULT_IDLE_TIMEOUT: float
+    """
+    DEFAULT_MAX_SIZE = 100
+    DEFAULT_MAX_SIZE_PER_KEY = 10
+    DEFAULT_IDLE_TIMEOUT = 30.
+    DEFAULT_NAME = 'client_proxy'
+    
+    CONNECTION_COUNTER_NAME = 'ndg_security_proxy_connections_total'
+    CONNECTION_COUNTER_DOC = ('Upstream connections made by the security '
+                              'proxy by pool and whether they were opened or '
+                              'reused from the pool')
+
+    # Errors from sending a request on a connection closed by the peer while
+    # idle in the pool
+    STALE_CONNECTION_ERRORS = (http.client.BadStatusLine,
+                               http.client.CannotSendRequest,
+                               ConnectionError,
+                               SSL.Error)
+
+    __slots__ = (
+        '__maxSize',
+        '__maxSizePerKey',
+        '__idleTimeout',
+        '__name',
+        '__idle',
+        '__nIdle',
+        '__lock'
+    )
+
+    def __init__(self, maxSize=DEFAULT_MAX_SIZE,
+                 maxSizePerKey=DEFAULT_MAX_SIZE_PER_KEY,
+                 idleTimeout=DEFAULT_IDLE_TIMEOUT,
+                 name=DEFAULT_NAME):
+        '''
+        @param maxSize: maximum number of idle connections kept.  Set to zero
+        to disable pooling
+        @type maxSize: int / basestring
+        @param maxSizePerKey: maximum number of idle connections kept for
+        each host, port and SSL context
+        @type maxSizePerKey: int / basestring
+        @param idleTimeout: time in seconds after which idle connections are
+        closed
+        @type idleTimeout: int / float / basestring
+        @param name: name for the pool in metrics
+        @type name: basestring
+        '''
+        self.__maxSize = int(maxSize)
+        self.__maxSizePerKey = int(maxSizePerKey)
+        self.__idleTimeout = float(idleTimeout)
+        self.__name = name
+
+        # key -> list of (idle expiry time, connection), least recently used
+        # key first
+        self.__idle = OrderedDict()
+        self.__nIdle = 0
+        self.__lock = Lock()
+
+    @property
+    def maxSize(self):
+        """Maximum number of idle connections kept"""
+        return self.__maxSize
+
+    @property
+    def maxSizePerKey(self):
+        """Maximum number of idle connections kept for each host, port and
+        SSL context"""
+        return self.__maxSizePerKey
+
+    @property
+    def idleTimeout(self):
+        """Time in seconds after which idle connections are closed"""
+        return self.__idleTimeout
+
+    @property
+    def name(self):
+        """Name for the pool in metrics"""
+        return self.__name
+
+    def __len__(self):
+        return self.__nIdle
+
+    @property
+    def occupancy(self):
+        """Number of idle connections and the number of distinct hosts, 
+        ports and SSL contexts they are kept for"""
+        with self.__lock:
+            return {'idle': self.__nIdle, 'keys': len(self.__idle)}
+
+    def _makeConnection(self, scheme, host, port=None, sslCtx=None, 
+                        tunnel=None):
+        '''Make a new connection
+
+        @param scheme: URI scheme - http or https
+        @type scheme: basestring
+        @param host: host name with optional port number appended
+        @type host: basestring
+        @param port: port number
+        @type port: int / None
+        @param sslCtx: SSL context for HTTPS connections
+        @type sslCtx: OpenSSL.SSL.Context / None
+        @param tunnel: host and tuple of header name, value pairs for the 
+        CONNECT request when connecting through a proxy
+        @type tunnel: tuple / None
+        @rtype: http.client.HTTPConnection
+        @return: connection
+        '''
+        if scheme == 'http':
+            conn = http.client.HTTPConnection(host, port=port)
+
+        elif scheme == 'https':
+            conn = HTTPSConnection(host, port=port, ssl_context=sslCtx)
+
+        else:
+            raise ValueError("Unknown scheme for %r: %r" % (host, scheme))
+        
+        if tunnel is not None:
+            tunnelHost, tunnelHeaders = tunnel
+            conn.set_tunnel(tunnelHost, headers=dict(tunnelHeaders))
+            
+        conn.response_class = PooledHTTPResponse
+        
+        metrics.registry.counter(self.__class__.CONNECTION_COUNTER_NAME,
+                                 self.__class__.CONNECTION_COUNTER_DOC,
+                                 pool=self.__name,
+                                 result='opened').inc()
+        return conn
+
+    def getConnection(self, scheme, host, port=None, sslCtx=None, 
+                      tunnel=None):
+        '''Get an idle connection from the pool or make a new one
+
+        @param scheme: URI scheme - http or https
+        @type scheme: basestring
+        @param host: host name with optional port number appended
+        @type host: basestring
+        @param port: port number
+        @type port: int / None
+        @param sslCtx: SSL context for HTTPS connections
+        @type sslCtx: OpenSSL.SSL.Context / None
+        @param tunnel: host and tuple of header name, value pairs for the 
+        CONNECT request when connecting through a proxy
+        @type tunnel: tuple / None
+        @rtype: tuple
+        @return: pool key, connection and a flag set to True if the
+        connection was reused from the pool
+        '''
+        key = (scheme, host, port, sslCtx, tunnel)
+        now = monotonic()
+        expired = []
+        conn = None
+        with self.__lock:
+            idle = self.__idle.get(key)
+            while idle:
+                expires, _conn = idle.pop()
+                self.__nIdle -= 1
+                if expires > now:
+                    conn = _conn
+                    break
+
+                expired.append(_conn)
+
+            if idle is not None and not idle:
+                del self.__idle[key]
+
+        for _conn in expired:
+            _conn.close()
+
+        if conn is not None:
+            metrics.registry.counter(self.__class__.CONNECTION_COUNTER_NAME,
+                                     self.__class__.CONNECTION_COUNTER_DOC,
+                                     pool=self.__name,
+                                     result='reused').inc()
+            return key, conn, True
+
+        return key, self._makeConnection(scheme, host, port=port,
+                                         sslCtx=sslCtx, tunnel=tunnel), False
+
+    def releaseConnection(self, key, conn, response):
+        '''Return a connection to the pool.  It's closed instead if the
+        response hasn't been read in full or the peer isn't keeping the
+        connection alive
+
+        @param key: pool key returned from getConnection
+        @type key: tuple
+        @param conn: connection
+        @type conn: http.client.HTTPConnection
+        @param response: response to the last request made with the
+        connection
+        @type response: http.client.HTTPResponse
+        '''
+        if (self.__maxSize <= 0 or not response.isclosed() or
+            response.will_close or conn.sock is None):
+            conn.close()
+            return
+
+        now = monotonic()
+        discarded = []
+        with self.__lock:
+            idle = self.__idle.setdefault(key, [])
+            self.__idle.move_to_end(key)
+            idle.append((now + self.__idleTimeout, conn))
+            self.__nIdle += 1
+
+            if len(idle) > self.__maxSizePerKey:
+                discarded.append(idle.pop(0)[1])
+                self.__nIdle -= 1
+
+            # Discard connections for the least recently used keys until
+            # within the size limit
+            while self.__nIdle > self.__maxSize:
+                lruKey, lruIdle = next(iter(self.__idle.items()))
+                discarded.append(lruIdle.pop(0)[1])
+                self.__nIdle -= 1
+                if not lruIdle:
+                    del self.__idle[lruKey]
+
+        for _conn in discarded:
+            _conn.close()
+            
+    def releaseOnClose(self, key, conn, response):
+        '''Return a connection to the pool when its response is closed
+
+        @param key: pool key returned from getConnection
+        @type key: tuple
+        @param conn: connection
+        @type conn: http.client.HTTPConnection
+        @param response: response to the last request made with the
+        connection
+        @type response: PooledHTTPResponse
+        '''
+        def release(complete):
+            if complete:
+                self.releaseConnection(key, conn, response)
+            else:
+                conn.close()
+                
+        response.release = release
+
+    def request(self, scheme, host, method, path, body=None, headers={},
+                port=None, sslCtx=None, tunnel=None):
+        '''Make a request with a pooled connection.  Requests which fail
+        because a reused connection was closed by the peer are retried once
+        with a new connection provided the body can be sent again
+
+        @param scheme: URI scheme - http or https
+        @type scheme: basestring
+        @param host: host name with optional port number appended
+        @type host: basestring
+        @param method: HTTP method
+        @type method: basestring
+        @param path: request path
+        @type path: basestring
+        @param body: request body
+        @type body: bytes / file like object / None
+        @param headers: request headers
+        @type headers: dict
+        @param port: port number
+        @type port: int / None
+        @param sslCtx: SSL context for HTTPS connections
+        @type sslCtx: OpenSSL.SSL.Context / None
+        @param tunnel: host and tuple of header name, value pairs for the 
+        CONNECT request when connecting through a proxy
+        @type tunnel: tuple / None
+        @rtype: tuple
+        @return: pool key, connection and response.  Pass these to
+        releaseConnection once the response has been read
+        '''
+        key, conn, reused = self.getConnection(scheme, host, port=port,
+                                               sslCtx=sslCtx, tunnel=tunnel)
+        try:
+            conn.request(method, path, body, headers)
+            return key, conn, conn.getresponse()
+
+        except self.__class__.STALE_CONNECTION_ERRORS as e:
+            conn.close()
+
+            # A body read from a stream can't be sent again
+            if not reused or hasattr(body, 'read'):
+                raise
+
+            log.debug('Retrying %s request for %r with a new connection: '
+                      'pooled connection failed with %r', method, path, e)
+
+        except Exception:
+            conn.close()
+            raise
+
+        conn = self._makeConnection(scheme, host, port=port, sslCtx=sslCtx,
+                                    tunnel=tunnel)
+        try:
+            conn.request(method, path, body, headers)
+            return key, conn, conn.getresponse()
+
+        except Exception:
+            conn.close()
+            raise
+
+    def clear(self):
+        '''Close all idle connections'''
+        with self.__lock:
+            idle = [conn for _idle in self.__idle.values()
+                    for expires, conn in _idle]
+            self.__idle.clear()
+            self.__nIdle = 0
+
+        for conn in idle:
+            conn.close()
+
+
+class PooledResponseIterator(object):
+    """WSGI response iterator streaming a response body from a pooled
+    connection.  The connection is returned to the pool when the iterator is
+    closed if the body was read in full and closed otherwise
+    """
+    DEFAULT_BLK_SIZE = 16384
+
+    __slots__ = ('__pool', '__key', '__conn', '__response', '__blockSize')
+
+    def __init__(self, pool, key, conn, response,
+                 blockSize=DEFAULT_BLK_SIZE):
+        '''
+        @param pool: pool the connection was taken from
+        @type pool: HTTPConnectionPool
+        @param key: pool key
+        @type key: tuple
+        @param conn: connection
+        @type conn: http.client.HTTPConnection
+        @param response: response to stream
+        @type response: http.client.HTTPResponse
+        @param blockSize: maximum size of blocks read from the response
+        @type blockSize: int
+        '''
+        self.__pool = pool
+        self.__key = key
+        self.__conn = conn
+        self.__response = response
+        self.__blockSize = blockSize
+
+    def __iter__(self):
+        while True:
+            block = self.__response.read(self.__blockSize)
+            if not block:
+                break
+
+            yield block
+
+    def close(self):
+        '''Return the connection to the pool'''
+        if self.__conn is None:
+            return
+
+        self.__pool.releaseConnection(self.__key, self.__conn,
+                                      self.__response)
+        self.__conn = None
+
+
+class HTTPConnectionPoolHandler(urllib.request.HTTPHandler, 
+                                HTTPSContextHandler):
+    """urllib handler making HTTP and HTTPS requests with connections from a
+    pool.  Responses return their connection to the pool when closed.  Pass
+    it to an opener in place of the default HTTP and HTTPS handlers
+    """
+    def __init__(self, pool, ssl_context=None, debuglevel=0):
+        '''
+        @param pool: connection pool
+        @type pool: HTTPConnectionPool
+        @param ssl_context: SSL context for HTTPS connections
+        @type ssl_context: OpenSSL.SSL.Context / None
+        @param debuglevel: debug level for handler
+        @type debuglevel: int
+        '''
+        HTTPSContextHandler.__init__(self, ssl_context, debuglevel=debuglevel)
+        
+        # Connections with no context set are pooled under None rather than
+        # the default context made for this handler
+        self._pool = pool
+        self._pool_ssl_context = ssl_context
+        
+    def http_open(self, req):
+        return self._pool_open('http', req)
+    
+    def https_open(self, req):
+        return self._pool_open('https', req)
+    
+    def _get_ssl_context(self, req):
+        '''Get the SSL context for an HTTPS request.  Override to select a
+        context for each request
+        
+        @param req: request
+        @type req: urllib.request.Request
+        @rtype: OpenSSL.SSL.Context / None
+        @return: SSL context
+        '''
+        return self._pool_ssl_context
+    
+    def _pool_open(self, scheme, req):
+        '''Make a request with a pooled connection following 
+        urllib.request.AbstractHTTPHandler.do_open
+        
+        @param scheme: URI scheme - http or https
+        @type scheme: basestring
+        @param req: request
+        @type req: urllib.request.Request
+        @rtype: PooledHTTPResponse
+        @return: response
+        '''
+        if not req.host:
+            raise URLError('no host given')
+        
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict([(k, v) for k, v in req.headers.items()
+                             if k not in headers]))
+        headers = dict([(name.title(), val) for name, val in headers.items()])
+        
+        tunnel = None
+        if req._tunnel_host:
+            tunnelHeaders = []
+            proxyAuthHdr = "Proxy-Authorization"
+            if proxyAuthHdr in headers:
+                tunnelHeaders.append((proxyAuthHdr, headers.pop(proxyAuthHdr)))
+                
+            tunnel = (req._tunnel_host, tuple(tunnelHeaders))
+        
+        sslCtx = self._get_ssl_context(req) if scheme == 'https' else None
+        try:
+            key, conn, response = self._pool.request(scheme, req.host,
+                                            req.get_method(),
+                                            req.selector,
+                                            body=req.data,
+                                            headers=headers,
+                                            sslCtx=sslCtx,
+                                            tunnel=tunnel)
+        except OSError as e:
+            raise URLError(e)
+        
+        self._pool.releaseOnClose(key, conn, response)
+        
+        response.url = req.get_full_url()
+        response.msg = response.reason
+        return response
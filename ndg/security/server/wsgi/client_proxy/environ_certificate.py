@@ -11,7 +11,9 @@ import logging
 log = logging.getLogger(__name__)
 
 import socket
+import traceback
 import http.client
+from http.cookiejar import CookieJar
 import urllib.request, urllib.parse, urllib.error
 import urllib.request, urllib.error, urllib.parse
 import urllib.parse
@@ -22,7 +24,13 @@ from webob.dec import wsgify
 from OpenSSL import SSL, crypto
 
 import ndg.httpsclient.utils as httpsclientutils
+from ndg.httpsclient.urllib2_build_opener import build_opener
+from ndg.security.server.utils.cache import LRUCache
 from ndg.security.server.wsgi.utils import FileObjResponseIterator
+from ndg.security.server.wsgi.client_proxy.ssl_context import SSLContextCache
+from ndg.security.server.wsgi.client_proxy.connection_pool import (
+                                                    HTTPConnectionPool,
+                                                    HTTPConnectionPoolHandler)
 
 
 class SSLCtxEnvironMiddleware(object):
@@ -39,10 +47,10 @@ class SSLCtxEnvironMiddleware(object):
 
     __slots__ = (
         '_app',
+        '__ctxCache'
     )
 
     __slots__ += tuple(['__' + i for i in PARAM_NAMES])
-    del i
     DEFAULT_CTX_ENV_KEYNAME = "ssl_ctx"
     DEFAULT_PARAM_PREFIX = 'ssl_ctx.'
 
@@ -60,6 +68,7 @@ class SSLCtxEnvironMiddleware(object):
         self.__caCertDir = None
         self.__certEnvKeyName = None
         self.__verifyPeer = True
+        self.__ctxCache = SSLContextCache()
 
     def initialise(self, app_conf, prefix=DEFAULT_PARAM_PREFIX, **local_conf):
         """Initialise attributes from the given local configuration settings
@@ -103,6 +112,18 @@ class SSLCtxEnvironMiddleware(object):
                             'attribute; got %r' % type(val))
         self.__certEnvKeyName = val
 
+    @property
+    def ctxCache(self):
+        """Cache of SSL contexts shared between requests"""
+        return self.__ctxCache
+
+    @ctxCache.setter
+    def ctxCache(self, val):
+        if not isinstance(val, SSLContextCache):
+            raise TypeError('Expecting %r type for "ctxCache" attribute; got '
+                            '%r' % (SSLContextCache, type(val)))
+        self.__ctxCache = val
+
     @property
     def ctxEnvKeyName(self):
         return self.__ctxEnvKeyName
@@ -157,41 +178,33 @@ class SSLCtxEnvironMiddleware(object):
                              'got %s' % val)
 
     def _create_ssl_ctx(self, environ):
-        """Create SSL Context object"""
-        ctx = SSL.Context(self.__class__.SSL_VERSION)
-
-        def _callback(conn, x509, errnum, errdepth, ok):
-            return ok
-
-        if self.verifyPeer:
-            ctx.set_verify(SSL.VERIFY_PEER, _callback)
-            ctx.set_verify_depth(9)
-        else:
-            ctx.set_verify(SSL.VERIFY_NONE, _callback)
-        if self.caCertFilePath or self.caCertDir:
-            ctx.load_verify_locations(self.caCertFilePath, self.caCertDir)
-
+        """Set SSL Context object in environ.  Contexts are taken from a cache
+        keyed by the CA settings and client credentials so that CA
+        certificates and credentials aren't parsed again for every request
+        """
+        ctx = None
         if self.certEnvKeyName in environ:
             # Get certificate and key that have been set in the environ by
             # upstream middleware.
             try:
                 credentials = environ.get(self.certEnvKeyName)
-    
-                clientKey = crypto.load_privatekey(crypto.FILETYPE_PEM,
-                                                   credentials[0])
-                clientCert = crypto.load_certificate(crypto.FILETYPE_PEM, 
-                                                     credentials[1])
-    
-                if log.getEffectiveLevel() <= logging.DEBUG:
-                    log.debug('Got certificate with subject %r',
-                              clientCert.get_subject())
-    
-                ctx.use_privatekey(clientKey)
-                ctx.use_certificate(clientCert)
+                ctx = self.__ctxCache.getContext(
+                                            self.__class__.SSL_VERSION,
+                                            verifyPeer=self.verifyPeer,
+                                            caCertFilePath=self.caCertFilePath,
+                                            caCertDir=self.caCertDir,
+                                            cert=credentials[1],
+                                            privateKey=credentials[0])
             except Exception as exc:
                 log.error("Exception setting certificate in environ: %s",
                           exc.__str__())
 
+        if ctx is None:
+            ctx = self.__ctxCache.getContext(self.__class__.SSL_VERSION,
+                                             verifyPeer=self.verifyPeer,
+                                             caCertFilePath=self.caCertFilePath,
+                                             caCertDir=self.caCertDir)
+
         environ[self.ctxEnvKeyName] = ctx
 
 
@@ -208,7 +221,6 @@ class CertificateSubjectEnvironMiddleware(object):
     )
 
     __slots__ += tuple(['__' + i for i in PARAM_NAMES])
-    del i
     DEFAULT_PARAM_PREFIX = 'cert_subject.'
     DEFAULT_REMOTE_USER_ENV_KEYNAME = 'REMOTE_USER'
 
@@ -322,30 +334,53 @@ class NDGSecurityProxyMiddleware(object):
     configured using the configuration parameters:
     ndg_security_proxy.proxy.http_proxy, ndg_security_proxy.proxy.https_proxy
     and ndg_security_proxy.proxy.no_proxy.
+    
+    Host names are resolved with a reverse DNS lookup to compare them with 
+    the local addresses.  Results are cached for dnsCacheTimeout seconds. 
+    Names which can't be resolved are compared as given and cached for
+    dnsCacheNegativeTimeout seconds.
     """
     DEFAULT_PARAM_PREFIX = 'ndg_security_proxy.'
     DEFAULT_PASTE_PROXY_PARAM_PREFIX = 'proxy.'
+    DEFAULT_DNS_CACHE_SIZE = 1000
+    DEFAULT_DNS_CACHE_TIMEOUT = 300.
+    DEFAULT_DNS_CACHE_NEGATIVE_TIMEOUT = 30.
+    DEFAULT_PORTS = {
+        'http': http.client.HTTP_PORT,
+        'https': http.client.HTTPS_PORT
+    }
 
     PARAM_NAMES = (
         'localAddresses',
-        'proxyPrefix'
+        'proxyPrefix',
+        'dnsCacheSize',
+        'dnsCacheTimeout',
+        'dnsCacheNegativeTimeout'
     )
     __slots__ = (
         '_app',
         '__fqdn',
         '__localAddressComponents',
+        '__localAddressSet',
+        '__dnsCache',
         '__proxy'
     )
     __slots__ += tuple(['__' + i for i in PARAM_NAMES])
-    del i
 
     def __init__(self, app):
         self._app = app
         self.__fqdn = socket.getfqdn()
         self.__localAddresses = None
         self.__localAddressComponents = None
+        self.__localAddressSet = None
         self.__proxy = None
         self.__proxyPrefix = None
+        self.__dnsCacheSize = self.__class__.DEFAULT_DNS_CACHE_SIZE
+        self.__dnsCacheTimeout = self.__class__.DEFAULT_DNS_CACHE_TIMEOUT
+        self.__dnsCacheNegativeTimeout = \
+            self.__class__.DEFAULT_DNS_CACHE_NEGATIVE_TIMEOUT
+        self.__dnsCache = LRUCache(maxSize=self.__dnsCacheSize,
+                                   timeout=self.__dnsCacheTimeout)
 
     def initialise(self, app_conf,
                    prefix=DEFAULT_PARAM_PREFIX,
@@ -390,6 +425,17 @@ class NDGSecurityProxyMiddleware(object):
                 parts = addr.partition(':')
                 self.__localAddressComponents.append(
                     (parts[0], parts[2] if len(parts) >= 3 else None))
+                
+            # Addresses with no port set match the default port for the 
+            # request scheme
+            self.__localAddressSet = frozenset([
+                (host, int(port) if port else None) 
+                for host, port in self.__localAddressComponents
+            ])
+            
+        self.__dnsCache = LRUCache(maxSize=self.__dnsCacheSize,
+                                   timeout=self.__dnsCacheTimeout)
+        
         if self.proxyPrefix:
             proxyKw['proxyPrefix'] = self.proxyPrefix
         self.__proxy = NDGSecurityProxy(**proxyKw)
@@ -416,6 +462,44 @@ class NDGSecurityProxyMiddleware(object):
                             'attribute; got %r' % type(val))
         self.__proxyPrefix = val
 
+    @property
+    def dnsCacheSize(self):
+        """Maximum number of host name resolutions cached"""
+        return self.__dnsCacheSize
+
+    @dnsCacheSize.setter
+    def dnsCacheSize(self, val):
+        if not isinstance(val, (int, str)):
+            raise TypeError('Expecting int or string type for "dnsCacheSize" '
+                            'attribute; got %r' % type(val))
+        self.__dnsCacheSize = int(val)
+
+    @property
+    def dnsCacheTimeout(self):
+        """Time in seconds for which host name resolutions are cached"""
+        return self.__dnsCacheTimeout
+
+    @dnsCacheTimeout.setter
+    def dnsCacheTimeout(self, val):
+        if not isinstance(val, (int, float, str)):
+            raise TypeError('Expecting int, float or string type for '
+                            '"dnsCacheTimeout" attribute; got %r' % type(val))
+        self.__dnsCacheTimeout = float(val)
+
+    @property
+    def dnsCacheNegativeTimeout(self):
+        """Time in seconds for which failed host name resolutions are cached
+        """
+        return self.__dnsCacheNegativeTimeout
+
+    @dnsCacheNegativeTimeout.setter
+    def dnsCacheNegativeTimeout(self, val):
+        if not isinstance(val, (int, float, str)):
+            raise TypeError('Expecting int, float or string type for '
+                            '"dnsCacheNegativeTimeout" attribute; got %r' % 
+                            type(val))
+        self.__dnsCacheNegativeTimeout = float(val)
+
     @classmethod
     def filter_app_factory(cls, app, app_conf, **kw):
         """Configure filter.
@@ -439,6 +523,30 @@ class NDGSecurityProxyMiddleware(object):
             # Proxy request
             return request.get_response(self.__proxy)
 
+    def _resolve_host(self, host):
+        """Get the fully qualified domain name for a host name or address
+        using a reverse DNS lookup.  Results are cached.
+        @type host: basestring
+        @param host: host name or IP address
+        @rtype: basestring
+        @return: fully qualified domain name or the host as given if it can't
+        be resolved
+        """
+        fqdn = self.__dnsCache.get(host)
+        if fqdn is not None:
+            return fqdn
+
+        try:
+            fqdn = socket.gethostbyaddr(host)[0]
+            timeout = None
+        except (socket.herror, socket.gaierror) as e:
+            log.warning('Error resolving host name %r: %s', host, e)
+            fqdn = host
+            timeout = self.__dnsCacheNegativeTimeout
+
+        self.__dnsCache.set(host, fqdn, timeout=timeout)
+        return fqdn
+
     def _is_local_call(self, request):
         """Determines whether a request is a call to the local server or a
         proxy request.
@@ -447,36 +555,27 @@ class NDGSecurityProxyMiddleware(object):
         @rtype: bool
         @return: True if the request is one to the local server, otherwise False
         """
-        if self.__localAddressComponents:
-            addresses =  self.__localAddressComponents
-        else:
-            server_port = request.server_port
-            addresses = [(self.__fqdn, server_port)]
-
         request_host_parts = request.host.partition(':')
         request_host = request_host_parts[0]
-        request_fqdn = socket.gethostbyaddr(request_host)[0]
+        request_fqdn = self._resolve_host(request_host)
         if hasattr(request, 'host_port'):
             request_port = request.host_port
         elif len(request_host_parts) == 3:
             request_port = request_host_parts[2]
         else:
             request_port = None
+        default_port = self.__class__.DEFAULT_PORTS.get(request.scheme)
         if not request_port:
-            request_port = {'http': http.client.HTTP_PORT,
-                            'https': http.client.HTTPS_PORT}.get(request.scheme)
+            request_port = default_port
         request_port = int(request_port)
 
-        result = False
-        for (server_host, server_port) in addresses:
-            if not server_port:
-                server_port = {'http': http.client.HTTP_PORT,
-                               'https': http.client.HTTPS_PORT}.get(request.scheme)
-            server_port = int(server_port)
-            result = ((request_fqdn == server_host) and
-                      (request_port == server_port))
-            if result:
-                break
+        if self.__localAddressSet:
+            result = ((request_fqdn, request_port) in self.__localAddressSet or
+                      (request_port == default_port and
+                       (request_fqdn, None) in self.__localAddressSet))
+        else:
+            result = ((request_fqdn == self.__fqdn) and
+                      (request_port == int(request.server_port)))
         log.debug("Call for %s is %s", request.url,
                   ("local" if result else "proxied"))
         #log.debug("Call for %s://%s:%s is %s", request.scheme, request_fqdn,
@@ -509,19 +608,27 @@ class NDGSecurityProxy(object):
     compatible.) The HTTPS context is used when a redirect occurs to a HTTPS URL
     for a security service.
     This is partly based on paste.proxy.TransparentProxy.
+    Connections are kept alive and reused for requests with the same SSL
+    context and proxy settings.  Pool occupancy is available from the 
+    connectionPool property.
     """
     DEFAULT_CTX_ENV_KEYNAME = "ssl_ctx"
+    POOL_NAME = 'environ_certificate'
     __slots__ = (
         '__ctxEnvKeyName',
         '__http_proxy',
         '__https_proxy',
         '__no_proxy',
         '__proxies',
-        '__proxyPrefix'
+        '__proxyPrefix',
+        '__connectionPool'
     )
 
     def __init__(self, ctxEnvKeyName=None, proxyPrefix=None,
-                 http_proxy=None, https_proxy=None, no_proxy=None):
+                 http_proxy=None, https_proxy=None, no_proxy=None,
+                 pool_size=HTTPConnectionPool.DEFAULT_MAX_SIZE,
+                 pool_size_per_host=HTTPConnectionPool.DEFAULT_MAX_SIZE_PER_KEY,
+                 pool_idle_timeout=HTTPConnectionPool.DEFAULT_IDLE_TIMEOUT):
         self.__ctxEnvKeyName = (self.__class__.DEFAULT_CTX_ENV_KEYNAME
                                 if ctxEnvKeyName is None else ctxEnvKeyName)
         self.__proxies = None
@@ -529,6 +636,16 @@ class NDGSecurityProxy(object):
         self.http_proxy = http_proxy
         self.https_proxy = https_proxy
         self.no_proxy = no_proxy
+        self.__connectionPool = HTTPConnectionPool(
+                                            maxSize=pool_size,
+                                            maxSizePerKey=pool_size_per_host,
+                                            idleTimeout=pool_idle_timeout,
+                                            name=self.__class__.POOL_NAME)
+
+    @property
+    def connectionPool(self):
+        """Pool of connections to target servers"""
+        return self.__connectionPool
 
     @property
     def ctxEnvKeyName(self):
@@ -651,18 +768,17 @@ class NDGSecurityProxy(object):
         if environ.get('CONTENT_TYPE'):
             headers['content-type'] = environ['CONTENT_TYPE']
 
+        data = None
         if environ.get('CONTENT_LENGTH'):
             if environ['CONTENT_LENGTH'] != '-1':
                 headers['content-length'] = environ['CONTENT_LENGTH']
+                data = environ['wsgi.input']
 
-        request = urllib.request.Request(url, headers=headers)
-        config = httpsclientutils.Configuration(sslCtx,
-                                                log.isEnabledFor(logging.DEBUG),
-                                                proxies=self.__proxies,
-                                                no_proxy=self.no_proxy)
         log.debug("Making request to %s", url)
-        (return_code, return_message, response) = httpsclientutils.open_url(
-                                                                request, config)
+        (return_code, return_message, response) = self._open_url(
+                                                            url, sslCtx,
+                                                            data=data,
+                                                            headers=headers)
         status = '%s %s' % (return_code, return_message)
         log.debug("Response status: %s", status)
 
@@ -680,11 +796,59 @@ class NDGSecurityProxy(object):
 
         start_response(status, headers_out)
 
-
-        # Detach HTTPResponse from the urllib response otherwise the former will
-        # be closed by the urllib response's __del__ method.
-        httpresponse = response.fp._sock
-        response.fp._sock = None
-        responseIter = FileObjResponseIterator(httpresponse,
-                file_size=int(httpresponse.getheader('content-length', '-1')))
+        # Stream the body from the connection.  Closing the iterator closes
+        # the response returning the connection to the pool
+        responseIter = FileObjResponseIterator(response,
+                file_size=int(response.getheader('content-length', '-1')))
         return responseIter
+
+    def _open_url(self, url, sslCtx, data=None, headers=None):
+        """Open the target URL with a connection from the pool.  This follows
+        ndg.httpsclient.utils.open_url except that no debug handlers are
+        added, as they would bypass the pool, and error responses are read
+        so that their connections are returned to the pool.
+        @type url: basestring
+        @param url: target URL
+        @type sslCtx: OpenSSL.SSL.Context / None
+        @param sslCtx: SSL context for HTTPS connections
+        @type data: file object / None
+        @param data: request body
+        @type headers: dict / None
+        @param headers: request headers
+        @rtype: tuple
+        @return: HTTP status code or 0 if an error occurred, the message or
+        error description and the response or None for an error
+        """
+        # Connections for this SSL context are taken from the pool.  The
+        # cookie processor keeps cookies set across redirects
+        handlers = [
+            HTTPConnectionPoolHandler(self.__connectionPool,
+                                      ssl_context=sslCtx),
+            httpsclientutils.AccumulatingHTTPCookieProcessor(CookieJar())
+        ]
+
+        # urllib doesn't apply the no_proxy setting itself
+        hostname = urllib.parse.urlparse(url).hostname
+        if hostname in [h.strip() for h in self.no_proxy.split(',')]:
+            handlers.append(urllib.request.ProxyHandler({}))
+        elif self.__proxies:
+            handlers.append(urllib.request.ProxyHandler(self.__proxies))
+
+        opener = build_opener(*handlers)
+        request = urllib.request.Request(url, data, headers or {})
+        try:
+            response = opener.open(request)
+
+        except urllib.error.HTTPError as e:
+            # Read the body to the end so that the connection is returned to
+            # the pool
+            e.read()
+            e.close()
+            log.debug("%s %s", e.code, e.msg)
+            return e.code, "Error: %s" % e.msg, None
+
+        except Exception as e:
+            log.debug("Error opening %s: %s", url, traceback.format_exc())
+            return 0, "Error: %s" % e, None
+
+        return response.code, response.msg, response
@@ -12,6 +12,7 @@ import logging
 log = logging.getLogger(__name__)
 
 import traceback
+import hashlib
 import socket
 import http.client
 from http.cookiejar import CookieJar
@@ -19,6 +20,8 @@ import urllib.request, urllib.parse, urllib.error
 from urllib.parse import urlparse, urljoin
 import os
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 
 from paste import httpexceptions
 from paste.proxy import Proxy, parse_headers
@@ -32,9 +35,12 @@ try:
 except ImportError:
     myproxy_client_installed = False
     
-from ndg.httpsclient.https import HTTPSConnection
 from ndg.security.common.utils import FakeUrllib2HTTPRequest
-from ndg.security.server.wsgi.utils import FileObjResponseIterator    
+from ndg.security.server.utils.cache import LRUCache
+from ndg.security.server.wsgi.client_proxy.ssl_context import SSLContextCache
+from ndg.security.server.wsgi.client_proxy.connection_pool import (
+                                                    HTTPConnectionPool,
+                                                    PooledResponseIterator)
 
 
 class SSLCtxSessionMiddleware(object):
@@ -47,6 +53,7 @@ class SSLCtxSessionMiddleware(object):
     
     __slots__ = (
         '_app',
+        '__ctxCache'
     )
     
     __slots__ += tuple(['__' + i for i in PARAM_NAMES])
@@ -70,6 +77,7 @@ class SSLCtxSessionMiddleware(object):
             
         self.__caCertFilePath = None
         self.__caCertDir = None
+        self.__ctxCache = SSLContextCache()
         
     def initialise(self, app_conf, prefix=DEFAULT_PARAM_PREFIX, **local_conf):
         """Initialise attributes from the given local configuration settings
@@ -156,6 +164,18 @@ class SSLCtxSessionMiddleware(object):
             
         self.__caCertDir = val
     
+    @property
+    def ctxCache(self):
+        """Cache of SSL contexts shared between sessions"""
+        return self.__ctxCache
+    
+    @ctxCache.setter
+    def ctxCache(self, val):
+        if not isinstance(val, SSLContextCache):
+            raise TypeError('Expecting %r type for "ctxCache" attribute; got '
+                            '%r' % (SSLContextCache, type(val)))
+        self.__ctxCache = val
+    
     def getSession(self, request):
         '''Get beaker session
         @param request: WSGI request object
@@ -167,21 +187,34 @@ class SSLCtxSessionMiddleware(object):
         return session
     
     def _create_ssl_ctx(self, session):
-        """Create or refresh SSL Context object"""
-        # TODO: refresh existing context if client credentials are near expiry
+        """Set an SSL Context object in the session if not already present.
+        Contexts come from a cache shared between sessions and so must not be
+        modified.  Use _get_ssl_ctx to get a context with client credentials
+        """
         ctx = session.get(self.__ctxSessionKeyName)
         if ctx is None:
-            ctx = SSL.Context(self.__class__.SSL_VERSION)
+            session[self.__ctxSessionKeyName] = self._get_ssl_ctx()
             
-            def _callback(conn, x509, errnum, errdepth, ok):
-                return ok
-
-            ctx.set_verify(SSL.VERIFY_PEER, _callback)
-            ctx.set_verify_depth(9)
-            if self.caCertFilePath or self.caCertDir:
-                ctx.load_verify_locations(self.caCertFilePath, self.caCertDir)
-                
-            session[self.__ctxSessionKeyName] = ctx
+    def _get_ssl_ctx(self, cert=None, privateKey=None, chain=()):
+        """Get SSL Context object from the cache for the CA settings and
+        given client credentials
+        
+        @param cert: PEM encoded client certificate
+        @type cert: basestring / bytes / None
+        @param privateKey: PEM encoded client private key
+        @type privateKey: basestring / bytes / None
+        @param chain: PEM encoded certificates in the chain of trust for the
+        client certificate
+        @type chain: iterable
+        @rtype: OpenSSL.SSL.Context
+        @return: SSL context
+        """
+        return self.__ctxCache.getContext(self.__class__.SSL_VERSION,
+                                          caCertFilePath=self.caCertFilePath,
+                                          caCertDir=self.caCertDir,
+                                          cert=cert,
+                                          privateKey=privateKey,
+                                          chain=chain)
         
 
 class MyProxyProvisionedSessionMiddlewareError(Exception):
@@ -201,6 +234,39 @@ class MyProxyRetrievalSocketError(MyProxyProvisionedSessionMiddlewareError):
     MyProxyProvisionedSessionMiddleware"""
     
     
+class MyProxyLogonRefresh(object):
+    """MyProxy logon for a user shared by all the requests and sessions for
+    that user
+
+    @ivar future: result of the logon call
+    @type future: concurrent.futures.Future
+    @ivar failures: number of consecutive logons, up to and including this
+    one, which failed or returned credentials already due for renewal
+    @type failures: int
+    @ivar retryTime: time (UTC) after which a new logon may be made.  Set
+    when the logon completes
+    @type retryTime: datetime / None
+    """
+    __slots__ = ('future', 'failures', 'retryTime')
+
+    def __init__(self, previous=None):
+        '''
+        @param previous: logon this one replaces
+        @type previous: MyProxyLogonRefresh / None
+        '''
+        self.future = None
+        self.failures = 0 if previous is None else previous.failures
+        self.retryTime = None
+
+    def canRetry(self):
+        '''
+        @return: True if the logon has completed and a new one may be made
+        @rtype: bool
+        '''
+        return (self.future.done() and self.retryTime is not None and
+                datetime.utcnow() >= self.retryTime)
+
+
 class MyProxyProvisionedSessionMiddleware(SSLCtxSessionMiddleware):
     """Provisions a session object with PKI credentials from a MyProxy server.
     Call MyProxy logon to populate a session based SSL context object with
@@ -211,6 +277,29 @@ class MyProxyProvisionedSessionMiddleware(SSLCtxSessionMiddleware):
     and the certificate will expiry within one day then certificate renewal
     is invoked with a fresh MyProxy logon call.
     @type DEFAULT_CERT_EXPIRY_OFFSET: timedelta
+    @cvar RENEWAL_LIFETIME_FRACTION: the expiry offset is capped at this
+    fraction of the certificate's lifetime so that short lived certificates
+    aren't due for renewal as soon as they're issued
+    @type RENEWAL_LIFETIME_FRACTION: float
+    
+    Once within the expiry offset, credentials are renewed in the background
+    and requests carry on with the current ones until the new ones are ready.
+    Requests only wait for a logon if there are no credentials or they have
+    expired.  There is at most one logon in progress for each user and
+    password: other requests with the same credentials share its result.
+    Results and failures are never shared between different passwords.
+    
+    @cvar REFRESH_POOL_SIZE: number of threads making MyProxy logon calls
+    @type REFRESH_POOL_SIZE: int
+    @cvar REFRESH_CACHE_TIMEOUT: time in seconds for which logon results are
+    kept for other sessions for the same user to pick up
+    @type REFRESH_CACHE_TIMEOUT: float
+    @cvar REFRESH_RETRY_INTERVAL: delay before a failed logon is retried.
+    It doubles with each consecutive failure up to REFRESH_MAX_RETRY_INTERVAL
+    @type REFRESH_RETRY_INTERVAL: timedelta
+    @cvar REFRESH_MAX_RETRY_INTERVAL: maximum delay before a failed logon is
+    retried
+    @type REFRESH_MAX_RETRY_INTERVAL: timedelta
     """
     __slots__ = (
         '__myProxyClient',
@@ -220,11 +309,30 @@ class MyProxyProvisionedSessionMiddleware(SSLCtxSessionMiddleware):
         '__myProxyClientSSLKeyFilePassphrase'
     )
     PARAM_NAMES = tuple([i[2:] for i in __slots__])
+    
+    __slots__ += (
+        '__refreshExecutor',
+        '__refreshes',
+        '__refreshLock'
+    )
 
     DEFAULT_ENVIRON_SESSION_KEYNAME = "ndg.security.session"
     DEFAULT_PARAM_PREFIX = 'myproxy_provision_session.'
     MYPROXY_CLIENT_PARAM_PREFIX = 'myproxy_client.'
     DEFAULT_CERT_EXPIRY_OFFSET = timedelta(days=1)
+    RENEWAL_LIFETIME_FRACTION = 0.25
+
+    CERTS_SESSION_KEYNAME = 'certs'
+    PRIKEY_SESSION_KEYNAME = 'privateKey'
+    CERT_NOT_BEFORE_SESSION_KEYNAME = 'certNotBefore'
+    CERT_NOT_AFTER_SESSION_KEYNAME = 'certNotAfter'
+    CERT_TIME_FORMAT = '%Y%m%d%H%M%SZ'
+    
+    REFRESH_POOL_SIZE = 4
+    REFRESH_CACHE_SIZE = 1000
+    REFRESH_CACHE_TIMEOUT = 3600.
+    REFRESH_RETRY_INTERVAL = timedelta(seconds=30)
+    REFRESH_MAX_RETRY_INTERVAL = timedelta(hours=1)
     
     def __init__(self, app):
         super(MyProxyProvisionedSessionMiddleware, self).__init__(app)
@@ -234,6 +342,16 @@ class MyProxyProvisionedSessionMiddleware(SSLCtxSessionMiddleware):
         self.__myProxyClientSSLKeyFile = None
         self.__myProxyClientSSLKeyFilePassphrase = None
         
+        # MyProxy logon calls in progress or completed keyed by username and
+        # password hash
+        self.__refreshExecutor = ThreadPoolExecutor(
+                            max_workers=self.__class__.REFRESH_POOL_SIZE,
+                            thread_name_prefix='myproxy-refresh')
+        self.__refreshes = LRUCache(
+                            maxSize=self.__class__.REFRESH_CACHE_SIZE,
+                            timeout=self.__class__.REFRESH_CACHE_TIMEOUT)
+        self.__refreshLock = Lock()
+        
     @property
     def myProxyClient(self):
         '''MyProxy client used to make calls to MyProxy server to retrieve 
@@ -382,11 +500,14 @@ class MyProxyProvisionedSessionMiddleware(SSLCtxSessionMiddleware):
         session = self.getSession(request)
 
         # if not certificate has been set or if it is present but expired,
-        # renew        
+        # wait for renewal.  If it's due to expire, renew in the background
         if (not self.__class__._is_cert_set(session) or 
             self._is_cert_expired(session)):
             self._refresh_credentials(request)
             
+        elif self._is_cert_due_for_renewal(session):
+            self._refresh_credentials(request, wait=False)
+            
         return resp
     
     def _getMyProxyLogonCallCreds(self, request):
@@ -400,10 +521,130 @@ class MyProxyProvisionedSessionMiddleware(SSLCtxSessionMiddleware):
         """        
         return (request.environ.get('REMOTE_USER'), None)
 
-    def _refresh_credentials(self, request):
-        """Refresh credentials by making a MyProxy server logon request"""
-        
+    def _refresh_credentials(self, request, wait=True):
+        """Refresh credentials by making a MyProxy server logon request.  If
+        a logon is already in progress for the user, share its result.  A
+        completed logon is only repeated once its credentials are due for
+        renewal or, if it failed, after a backoff delay
+
+        @param request: WSGI request object
+        @type request: WebOb.Request
+        @param wait: wait for the logon to complete.  If False, the logon 
+        is started in the background and its credentials set in the session 
+        by a later request
+        @type wait: bool
+        """
         username, password = self._getMyProxyLogonCallCreds(request)
+        session = self.getSession(request)
+        notAfter = self._get_cert_not_after(session)
+        
+        key = self._get_refresh_key(username, password)
+        with self.__refreshLock:
+            refresh = self.__refreshes.get(key)
+            if refresh is None or refresh.canRetry():
+                log.debug('Starting MyProxy logon for user %r', username)
+                refresh = MyProxyLogonRefresh(previous=refresh)
+                refresh.future = self.__refreshExecutor.submit(self._refresh,
+                                                               refresh,
+                                                               username,
+                                                               password)
+                self.__refreshes.set(key, refresh)
+
+        if not wait and not refresh.future.done():
+            return
+
+        try:
+            credentials, newNotBefore, newNotAfter = refresh.future.result()
+
+        except Exception:
+            # Background failures have already been logged by _refresh
+            if wait:
+                raise
+            return
+
+        if notAfter is None or newNotAfter > notAfter:
+            self._set_credentials(session, credentials, newNotBefore,
+                                  newNotAfter)
+
+    @staticmethod
+    def _get_refresh_key(username, password):
+        """Get the key for logon calls with the given credentials.  A hash
+        of the password is included so that a logon with one password is 
+        never shared with a request giving another
+
+        @param username: username for logon
+        @type username: basestring
+        @param password: password for logon or None
+        @type password: basestring / bytes / None
+        @rtype: tuple
+        @return: key for logon calls
+        """
+        if password is None:
+            return username, None
+
+        if isinstance(password, str):
+            password = password.encode('utf-8')
+
+        return username, hashlib.sha256(password).hexdigest()
+
+    def _refresh(self, refresh, username, password):
+        """Make a MyProxy logon call for a refresh and set when it may be
+        repeated.  Runs in the refresh thread pool
+
+        @param refresh: refresh the logon call is made for
+        @type refresh: MyProxyLogonRefresh
+        @param username: username for logon
+        @type username: basestring
+        @param password: password for logon or None
+        @type password: basestring / None
+        @rtype: tuple
+        @return: credentials returned and the start and expiry times of the
+        certificate
+        """
+        try:
+            credentials, notBefore, notAfter = self._logon(username, password)
+
+        except Exception:
+            log.warning('MyProxy logon for user %r failed: %s', username,
+                        traceback.format_exc())
+            self._set_retry_time(refresh)
+            raise
+
+        renewalTime = notAfter - self._get_renewal_offset(notBefore, notAfter)
+        if renewalTime <= datetime.utcnow():
+            log.warning('MyProxy logon for user %r returned a certificate '
+                        'expiring at %s which is already due for renewal',
+                        username, notAfter)
+            self._set_retry_time(refresh)
+        else:
+            refresh.failures = 0
+            refresh.retryTime = renewalTime
+
+        return credentials, notBefore, notAfter
+
+    def _set_retry_time(self, refresh):
+        """Set the time after which an unsuccessful logon may be retried.  The
+        delay doubles with each consecutive failure
+
+        @param refresh: refresh which was unsuccessful
+        @type refresh: MyProxyLogonRefresh
+        """
+        interval = self.__class__.REFRESH_RETRY_INTERVAL * 2**refresh.failures
+        refresh.failures += 1
+        refresh.retryTime = datetime.utcnow() + min(interval,
+                                    self.__class__.REFRESH_MAX_RETRY_INTERVAL)
+
+    def _logon(self, username, password):
+        """Make a MyProxy server logon request
+        
+        @param username: username for logon
+        @type username: basestring
+        @param password: password for logon or None
+        @type password: basestring / None
+        @rtype: tuple
+        @return: credentials returned and the start and expiry times of the
+        certificate
+        """
         try:
             credentials = self.__myProxyClient.logon(username, password,
                                      sslCertFile=self.myProxyClientSSLCertFile,
@@ -421,44 +662,117 @@ class MyProxyProvisionedSessionMiddleware(SSLCtxSessionMiddleware):
                                         "exception calling %r: %s" %
                                         (self.__myProxyClient.hostname,
                                         traceback.format_exc()))
-            
-        session = self.getSession(request)
-           
-        # Get Context from session and update with credentials just retrieved
-        sslCtx = session[self.ctxSessionKeyName]
-        
-        # The first element is the certificate, the second the private key,
-        # the remainder, any associated certificate chain  
-        session['certs'] = [credentials[0]]
-        session['privateKey'] = credentials[1]
         
+        # The first element is the certificate
         clientCert = crypto.load_certificate(crypto.FILETYPE_PEM, 
                                              credentials[0])
-        
         if log.getEffectiveLevel() <= logging.DEBUG:
             log.debug('Got certificate with subject %r for user %r',
                       clientCert.get_subject(), username)
             
-        clientKey = crypto.load_privatekey(crypto.FILETYPE_PEM, credentials[1])
-        sslCtx.use_certificate(clientCert)
-        sslCtx.use_privatekey(clientKey)
-        
-        if len(credentials) > 2:
-            session['certs'].extend(credentials[2:])
-            for chainCertStr in credentials[2:]:
-                chainCert = crypto.load_certificate(crypto.FILETYPE_PEM, 
-                                                    chainCertStr)
-                
-                if log.getEffectiveLevel() <= logging.DEBUG:
-                    log.debug('Associated certificate in chain with subject %r '
-                              'for user %r',
-                              chainCert.get_subject(), username)
-                    
-                sslCtx.add_extra_chain_cert(chainCert)
+        return (credentials, self._parse_not_before(clientCert),
+                self._parse_not_after(clientCert))
+
+    def _set_credentials(self, session, credentials, notBefore, notAfter):
+        """Set credentials from a MyProxy logon in the session
+
+        @param session: session
+        @type session: beaker.session
+        @param credentials: PEM encoded certificate, private key and any
+        associated certificate chain
+        @type credentials: tuple
+        @param notBefore: certificate start time
+        @type notBefore: datetime
+        @param notAfter: certificate expiry time
+        @type notAfter: datetime
+        """
+        # The first element is the certificate, the second the private key,
+        # the remainder, any associated certificate chain  
+        session[self.__class__.CERTS_SESSION_KEYNAME] = [credentials[0]] + \
+                                                        list(credentials[2:])
+        session[self.__class__.PRIKEY_SESSION_KEYNAME] = credentials[1]
+        session[self.__class__.CERT_NOT_BEFORE_SESSION_KEYNAME] = notBefore
+        session[self.__class__.CERT_NOT_AFTER_SESSION_KEYNAME] = notAfter
+
+        # Replace the session's Context with one for the credentials just 
+        # retrieved.  Contexts are shared so the existing one isn't modified
+        session[self.ctxSessionKeyName] = self._get_ssl_ctx(
+                                                    cert=credentials[0],
+                                                    privateKey=credentials[1],
+                                                    chain=credentials[2:])
     
     @classmethod
     def _is_cert_set(self, session): 
-        return len(session.get('certs', [])) > 0 
+        return len(session.get(self.CERTS_SESSION_KEYNAME, [])) > 0 
+    
+    @classmethod
+    def _parse_not_after(cls, x509):
+        '''Get certificate expiry time
+        @param x509: certificate
+        @type x509: OpenSSL.crypto.X509
+        @return: expiry time (UTC)
+        @rtype: datetime
+        '''
+        return datetime.strptime(x509.get_notAfter().decode('UTF-8'), 
+                                 cls.CERT_TIME_FORMAT)
+    
+    @classmethod
+    def _parse_not_before(cls, x509):
+        '''Get certificate start time
+        @param x509: certificate
+        @type x509: OpenSSL.crypto.X509
+        @return: start time (UTC)
+        @rtype: datetime
+        '''
+        return datetime.strptime(x509.get_notBefore().decode('UTF-8'),
+                                 cls.CERT_TIME_FORMAT)
+
+    def _get_cert_validity(self, session):
+        '''Get start and expiry times of the session's certificate.  They're
+        stored in the session when the certificate is set so that it isn't
+        parsed for every request
+        @param session: session
+        @type session: beaker.session
+        @return: start and expiry times or None if no certificate is set
+        @rtype: tuple / None
+        '''
+        if not self.__class__._is_cert_set(session):
+            return None
+
+        notBefore = session.get(self.__class__.CERT_NOT_BEFORE_SESSION_KEYNAME)
+        notAfter = session.get(self.__class__.CERT_NOT_AFTER_SESSION_KEYNAME)
+        if notBefore is None or notAfter is None:
+            # Session set before the validity period was stored
+            cert = session[self.__class__.CERTS_SESSION_KEYNAME][0]
+            x509 = crypto.load_certificate(crypto.FILETYPE_PEM, cert)
+            notBefore = self._parse_not_before(x509)
+            notAfter = self._parse_not_after(x509)
+            session[self.__class__.CERT_NOT_BEFORE_SESSION_KEYNAME] = notBefore
+            session[self.__class__.CERT_NOT_AFTER_SESSION_KEYNAME] = notAfter
+
+        return notBefore, notAfter
+
+    def _get_cert_not_after(self, session):
+        '''Get expiry time of the session's certificate
+        @param session: session
+        @type session: beaker.session
+        @return: expiry time or None if no certificate is set
+        @rtype: datetime / None
+        '''
+        validity = self._get_cert_validity(session)
+        return None if validity is None else validity[1]
+
+    def _get_renewal_offset(self, notBefore, notAfter):
+        '''Get the time before expiry at which a certificate is renewed: the
+        certificate expiry offset capped at a fraction of its lifetime
+        @param notBefore: certificate start time
+        @type notBefore: datetime
+        @param notAfter: certificate expiry time
+        @type notAfter: datetime
+        @rtype: timedelta
+        '''
+        return min(self.certExpiryOffset, (notAfter - notBefore) *
+                   self.__class__.RENEWAL_LIFETIME_FRACTION)
               
     def _is_cert_expired(self, session):
         '''Check if input certificate has expired
@@ -467,20 +781,47 @@ class MyProxyProvisionedSessionMiddleware(SSLCtxSessionMiddleware):
         @return: true if expired, false otherwise
         @rtype: bool
         '''
-        cert = session['certs'][0]
-        x509 = crypto.load_certificate(crypto.FILETYPE_PEM, cert)
-        notAfter = x509.get_notAfter()
-        dtNotAfter = datetime.strptime(notAfter, '%Y%m%d%H%M%S%fZ')       
-        dtNow = datetime.utcnow()
-        
-        return dtNotAfter < dtNow - self.certExpiryOffset
+        return self._get_cert_not_after(session) < datetime.utcnow()
+              
+    def _is_cert_due_for_renewal(self, session):
+        '''Check if input certificate expires within the certificate expiry
+        offset, capped at a fraction of its lifetime
+        @param session: session
+        @type session: beaker.session
+        @return: true if the certificate should be renewed, false otherwise
+        @rtype: bool
+        '''
+        notBefore, notAfter = self._get_cert_validity(session)
+        return (notAfter < datetime.utcnow() +
+                self._get_renewal_offset(notBefore, notAfter))
 
 
 class NDGSecurityProxy(Proxy):
     """Extend paste.proxy.Proxy to enable an SSL context to be set with client
     certificate and key from a user session
+    
+    Connections to the upstream server are kept alive and reused for requests
+    with the same SSL context.  Response bodies are streamed from the 
+    connection and it's returned to the pool when the response iterator is 
+    closed
     """
-    def __init__(self, address, **kw):
+    def __init__(self, address, pool_size=HTTPConnectionPool.DEFAULT_MAX_SIZE,
+                 pool_size_per_host=HTTPConnectionPool.DEFAULT_MAX_SIZE_PER_KEY,
+                 pool_idle_timeout=HTTPConnectionPool.DEFAULT_IDLE_TIMEOUT,
+                 **kw):
+        """
+        @param address: address of upstream server
+        @type address: basestring
+        @param pool_size: maximum number of idle connections kept.  Set to 
+        zero to disable keep-alive
+        @type pool_size: int / basestring
+        @param pool_size_per_host: maximum number of idle connections kept
+        for each host and user SSL context
+        @type pool_size_per_host: int / basestring
+        @param pool_idle_timeout: time in seconds after which idle connections
+        are closed
+        @type pool_idle_timeout: int / float / basestring
+        """
         super(NDGSecurityProxy, self).__init__(address, **kw)
 
         self.__environSessionKeyName = \
@@ -488,6 +829,16 @@ class NDGSecurityProxy(Proxy):
             
         self.__ctxSessionKeyName = \
             MyProxyProvisionedSessionMiddleware.DEFAULT_CTX_SESSION_KEYNAME
+        
+        self.__connectionPool = HTTPConnectionPool(
+                                            maxSize=pool_size,
+                                            maxSizePerKey=pool_size_per_host,
+                                            idleTimeout=pool_idle_timeout)
+    
+    @property
+    def connectionPool(self):
+        """Pool of connections to the upstream server"""
+        return self.__connectionPool
                     
     def __call__(self, environ, start_response):
         if (self.allowed_request_methods and 
@@ -507,11 +858,7 @@ class NDGSecurityProxy(Proxy):
             
             sslCtx = session[self.__ctxSessionKeyName]
 
-        if self.scheme == 'http':
-            conn = http.client.HTTPConnection(self.host)
-        elif self.scheme == 'https':
-            conn = HTTPSConnection(self.host, ssl_context=sslCtx)
-        else:
+        if self.scheme not in ('http', 'https'):
             raise ValueError(
                 "Unknown scheme for %r: %r" % (self.address, self.scheme))
         
@@ -533,6 +880,14 @@ class NDGSecurityProxy(Proxy):
         if environ.get('CONTENT_LENGTH'):
             if environ['CONTENT_LENGTH'] != '-1':
                 headers['content-length'] = environ['CONTENT_LENGTH'] 
+        
+        # Only pass the input stream for requests with a body so that others
+        # can be retried if a pooled connection has been dropped
+        if (environ.get('CONTENT_LENGTH', '0') in ('', '0') and
+            'HTTP_TRANSFER_ENCODING' not in environ):
+            body = None
+        else:
+            body = environ['wsgi.input']
             
         path_info = urllib.parse.quote(environ['PATH_INFO'])
         if self.path:            
@@ -547,34 +902,65 @@ class NDGSecurityProxy(Proxy):
         if environ.get('QUERY_STRING'):
             path += '?' + environ['QUERY_STRING']
             
-        conn.request(environ['REQUEST_METHOD'],
-                     path,
-                     environ['wsgi.input'], 
-                     headers)
-        res = conn.getresponse()
-        conn.close()
+        key, conn, res = self.__connectionPool.request(
+                                                    self.scheme, 
+                                                    self.host,
+                                                    environ['REQUEST_METHOD'],
+                                                    path,
+                                                    body=body,
+                                                    headers=headers,
+                                                    sslCtx=sslCtx)
         
         # Handle a security redirect - if not handled it returns None and the
         # original response is returned
-        redirectRes = self._handleSecuredRedirect(res, sslCtx)
-        if redirectRes is None:
-            _res = res
-        else:
-            _res = redirectRes
+        try:
+            redirect = self._handleSecuredRedirect(res, sslCtx)
+        except Exception:
+            conn.close()
+            raise
             
-        headers_out = parse_headers(_res.msg)    
+        if redirect is not None:
+            self._releaseConnection(key, conn, res)
+            key, conn, res = redirect
+            
+        headers_out = parse_headers(res.msg)    
         
-        status = '%s %s' % (_res.status, _res.reason)        
+        status = '%s %s' % (res.status, res.reason)        
         start_response(status, headers_out)
         
-        length = int(_res.getheader('content-length', '-1'))
-        response = FileObjResponseIterator(_res.fp, file_size=length)
-
-        return response
+        return PooledResponseIterator(self.__connectionPool, key, conn, res)
+    
+    def _releaseConnection(self, key, conn, response):
+        '''Read the rest of a response not passed back to the client and
+        return its connection to the pool
+        
+        @param key: pool key
+        @type key: tuple
+        @param conn: connection
+        @type conn: http.client.HTTPConnection
+        @param response: response to discard
+        @type response: http.client.HTTPResponse
+        '''
+        try:
+            response.read()
+        except Exception as e:
+            log.debug('Error reading discarded response: %s', e)
+            conn.close()
+        else:
+            self.__connectionPool.releaseConnection(key, conn, response)
 
     def _handleSecuredRedirect(self, response, sslCtx):
         '''Intercept security challenges - these are inferred by checking for a
         302 response with a location header requesting a HTTPS endpoint
+        
+        @param response: response from upstream server
+        @type response: http.client.HTTPResponse
+        @param sslCtx: SSL context for the user's credentials
+        @type sslCtx: OpenSSL.SSL.Context
+        @rtype: tuple / None
+        @return: None if the redirect was not followed otherwise the pool key,
+        connection and response to return to the client.  The caller is 
+        responsible for releasing the connection
         '''
         
         if response.status != http.client.FOUND:
@@ -614,13 +1000,13 @@ class NDGSecurityProxy(Proxy):
         authn_redirect_ip_hdrs = authn_redirect_req.get_headers()
         
         # Redirect to HTTPS authentication endpoint uses GET method
-        authn_conn = HTTPSConnection(host, port=port, ssl_context=sslCtx)
-        
-        authn_conn.request('GET', authn_redirect_path, None, 
-                           authn_redirect_ip_hdrs)
-        
-        authn_response = authn_conn.getresponse()
-        authn_conn.close()
+        (authn_key, 
+         authn_conn, 
+         authn_response) = self.__connectionPool.request('https', host, 'GET', 
+                                                authn_redirect_path, 
+                                                headers=authn_redirect_ip_hdrs,
+                                                port=port, 
+                                                sslCtx=sslCtx)
         
         # Hack to make httplib response urllib2.Response-like
         authn_response.info = lambda : authn_response.msg
@@ -635,7 +1021,7 @@ class NDGSecurityProxy(Proxy):
                           authn_redirect_uri)
                 # Return the response and let the client decide what to do with
                 # it
-                return authn_response
+                return authn_key, authn_conn, authn_response
             
             # Check URI for HTTP scheme
             parsed_return_uri = urlparse(return_uri)
@@ -643,6 +1029,7 @@ class NDGSecurityProxy(Proxy):
                 # Expecting http - don't process but instead return to client
                 log.error('_handleSecuredRedirect: return URI %r is not HTTP, '
                           'passing back original response', return_uri)
+                self._releaseConnection(authn_key, authn_conn, authn_response)
                 return
             
             # Make path
@@ -659,14 +1046,15 @@ class NDGSecurityProxy(Proxy):
             return_headers = return_req.get_headers()
             
             # Invoke return URI passing headers            
-            return_conn = http.client.HTTPConnection(return_uri_host, 
-                                                 port=return_uri_port)
-            
-            return_conn.request('GET', return_uri_path, None, return_headers)
-            return_uri_res = return_conn.getresponse()
-            return_conn.close()
+            self._releaseConnection(authn_key, authn_conn, authn_response)
             
-            return return_uri_res
+            return self.__connectionPool.request('http', return_uri_host, 
+                                                 'GET', return_uri_path, 
+                                                 headers=return_headers,
+                                                 port=return_uri_port)
+        
+        # Not a redirect - pass back the original response
+        self._releaseConnection(authn_key, authn_conn, authn_response)
     
     @staticmethod
     def _make_uri_path(parsedUri):
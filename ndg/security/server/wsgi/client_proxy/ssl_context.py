@@ -0,0 +1,249 @@
+"""SSL context cache for NDG Security HTTP Proxy middleware
+
+Contexts are expensive to make: loading CA certificates means reading and
+parsing a bundle or scanning a directory, and client credentials have to be
+parsed from PEM.  Contexts are cached here keyed by their settings and by a
+digest of any client credentials so that they can be shared between requests.
+
+MashMyData Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+import logging
+log = logging.getLogger(__name__)
+
+import os
+import hashlib
+from datetime import datetime
+from threading import Lock
+
+from OpenSSL import SSL, crypto
+
+from ndg.security.server.utils.cache import LRUCache
+
+
+class SSLContextCache(object):
+    """Cache of SSL contexts keyed by SSL version, peer verification and CA
+    settings and a digest of the client credentials.  Contexts holding client
+    credentials are discarded when the client certificate expires.
+
+    CA certificates are loaded once for each CA file and directory setting
+    and shared by all the contexts made with it.
+
+    Contexts may be in use by several connections at once so they must not be
+    modified once they have been returned from getContext
+
+    @cvar DEFAULT_MAX_SIZE: default maximum number of contexts cached
+    @type DEFAULT_MAX_SIZE: int
+    @cvar VERIFY_DEPTH: maximum certificate chain depth for peer verification
+    @type VERIFY_DEPTH: int
+    """
+    DEFAULT_MAX_SIZE = 1000
+    VERIFY_DEPTH = 9
+    CERT_TIME_FORMAT = '%Y%m%d%H%M%SZ'
+    PEM_CERT_END = b'-----END CERTIFICATE-----'
+
+    __slots__ = ('__contexts',)
+
+    # CA certificates keyed by CA file path and directory
+    _caCerts = {}
+    _caCertsLock = Lock()
+
+    def __init__(self, maxSize=DEFAULT_MAX_SIZE):
+        '''
+        @param maxSize: maximum number of contexts cached
+        @type maxSize: int / basestring
+        '''
+        self.__contexts = LRUCache(maxSize=maxSize)
+
+    @property
+    def contexts(self):
+        """Cached SSL contexts"""
+        return self.__contexts
+
+    @classmethod
+    def _loadPEMCerts(cls, pemCerts, source):
+        '''Parse all the certificates in a PEM encoded string
+
+        @param pemCerts: one or more PEM encoded certificates
+        @type pemCerts: bytes
+        @param source: certificate source for log messages
+        @type source: basestring
+        @return: certificates
+        @rtype: list
+        '''
+        certs = []
+        for pemCert in pemCerts.split(cls.PEM_CERT_END)[:-1]:
+            try:
+                certs.append(crypto.load_certificate(crypto.FILETYPE_PEM,
+                                                     pemCert +
+                                                     cls.PEM_CERT_END))
+            except crypto.Error as e:
+                log.warning('Skipping invalid CA certificate in %r: %s',
+                            source, e)
+        return certs
+
+    @classmethod
+    def getCACerts(cls, caCertFilePath=None, caCertDir=None):
+        '''Get CA certificates from a file and/or directory, loading them on
+        first use
+
+        @param caCertFilePath: file containing one or more PEM encoded CA
+        certificates
+        @type caCertFilePath: basestring / None
+        @param caCertDir: directory of PEM encoded CA certificates
+        @type caCertDir: basestring / None
+        @return: CA certificates
+        @rtype: tuple
+        '''
+        key = (caCertFilePath, caCertDir)
+        with cls._caCertsLock:
+            caCerts = cls._caCerts.get(key)
+            if caCerts is not None:
+                return caCerts
+
+            filePaths = []
+            if caCertFilePath:
+                filePaths.append(caCertFilePath)
+
+            if caCertDir:
+                filePaths += [os.path.join(caCertDir, fileName)
+                              for fileName in sorted(os.listdir(caCertDir))]
+
+            caCerts = []
+            digests = set()
+            for filePath in filePaths:
+                if not os.path.isfile(filePath):
+                    continue
+
+                with open(filePath, 'rb') as caCertFile:
+                    pemCerts = caCertFile.read()
+
+                # Hashed file names in a CA directory may link to the same
+                # certificate
+                for caCert in cls._loadPEMCerts(pemCerts, filePath):
+                    digest = caCert.digest('sha256')
+                    if digest not in digests:
+                        digests.add(digest)
+                        caCerts.append(caCert)
+
+            caCerts = tuple(caCerts)
+            cls._caCerts[key] = caCerts
+
+        log.debug('Loaded %d CA certificate(s) from %r', len(caCerts), key)
+        return caCerts
+
+    @classmethod
+    def clearCACerts(cls):
+        '''Discard loaded CA certificates so that they are read again on next
+        use e.g. after updating the CA directory'''
+        with cls._caCertsLock:
+            cls._caCerts.clear()
+
+    @staticmethod
+    def _makeCredentialsDigest(cert, privateKey, chain):
+        '''Make a digest of PEM encoded client credentials for a cache key.
+        The credentials themselves are not held in the key
+
+        @rtype: bytes / None
+        @return: digest or None if no credentials are set
+        '''
+        if cert is None and privateKey is None:
+            return None
+
+        digest = hashlib.sha256()
+        for pem in (cert, privateKey) + tuple(chain):
+            if pem is None:
+                pem = b''
+            elif isinstance(pem, str):
+                pem = pem.encode('utf-8')
+
+            digest.update(b'%d:' % len(pem))
+            digest.update(pem)
+
+        return digest.digest()
+
+    def getContext(self, sslVersion, verifyPeer=True, caCertFilePath=None,
+                   caCertDir=None, cert=None, privateKey=None, chain=()):
+        '''Get an SSL context for the given settings and client credentials,
+        making it if it's not already cached
+
+        @param sslVersion: SSL method e.g. OpenSSL.SSL.TLSv1_2_METHOD
+        @type sslVersion: int
+        @param verifyPeer: verify the peer's certificate
+        @type verifyPeer: bool
+        @param caCertFilePath: file containing CA certificates
+        @type caCertFilePath: basestring / None
+        @param caCertDir: directory of CA certificates
+        @type caCertDir: basestring / None
+        @param cert: PEM encoded client certificate
+        @type cert: basestring / bytes / None
+        @param privateKey: PEM encoded client private key
+        @type privateKey: basestring / bytes / None
+        @param chain: PEM encoded certificates in the chain of trust for the
+        client certificate
+        @type chain: iterable
+        @return: SSL context
+        @rtype: OpenSSL.SSL.Context
+        @raise OpenSSL.crypto.Error: error parsing the client credentials
+        '''
+        chain = tuple(chain)
+        key = (sslVersion, verifyPeer, caCertFilePath, caCertDir,
+               self._makeCredentialsDigest(cert, privateKey, chain))
+
+        ctx = self.__contexts.get(key)
+        if ctx is not None:
+            return ctx
+
+        ctx = SSL.Context(sslVersion)
+
+        def _callback(conn, x509, errnum, errdepth, ok):
+            return ok
+
+        if verifyPeer:
+            ctx.set_verify(SSL.VERIFY_PEER, _callback)
+            ctx.set_verify_depth(self.__class__.VERIFY_DEPTH)
+        else:
+            ctx.set_verify(SSL.VERIFY_NONE, _callback)
+
+        if caCertFilePath or caCertDir:
+            store = ctx.get_cert_store()
+            for caCert in self.getCACerts(caCertFilePath, caCertDir):
+                store.add_cert(caCert)
+
+        timeout = None
+        if cert is not None:
+            clientCert = crypto.load_certificate(crypto.FILETYPE_PEM, cert)
+            if log.getEffectiveLevel() <= logging.DEBUG:
+                log.debug('Got certificate with subject %r',
+                          clientCert.get_subject())
+
+            ctx.use_certificate(clientCert)
+
+            for chainCertStr in chain:
+                chainCert = crypto.load_certificate(crypto.FILETYPE_PEM,
+                                                    chainCertStr)
+                if log.getEffectiveLevel() <= logging.DEBUG:
+                    log.debug('Associated certificate in chain with subject '
+                              '%r', chainCert.get_subject())
+
+                ctx.add_extra_chain_cert(chainCert)
+
+            # Discard the context when the client certificate expires
+            notAfter = datetime.strptime(
+                                clientCert.get_notAfter().decode('UTF-8'),
+                                self.__class__.CERT_TIME_FORMAT)
+            timeout = (notAfter - datetime.utcnow()).total_seconds()
+
+        if privateKey is not None:
+            ctx.use_privatekey(crypto.load_privatekey(crypto.FILETYPE_PEM,
+                                                      privateKey))
+
+        if timeout is None or timeout > 0:
+            self.__contexts.set(key, ctx, timeout=timeout)
+
+        return ctx
@@ -13,9 +13,15 @@ log = logging.getLogger(__name__)
 import re
 import http.client
 import base64
+import hashlib
+import hmac
+import os
     
 from paste.httpexceptions import HTTPException, HTTPUnauthorized
 
+from ndg.security.common.utils import str2Bool
+from ndg.security.server.utils.cache import LRUCache
+
 
 class HttpBasicAuthMiddlewareError(Exception):
     """Base exception type for HttpBasicAuthMiddleware"""
@@ -45,6 +51,111 @@ class HttpBasicAuthResponseException(HttpBasicAuthMiddlewareError):
         HttpBasicAuthMiddlewareError.__init__(self, *arg, **kw)
     
     
+class HttpBasicAuthCredentialCache(object):
+    """Short lived cache of successfully verified HTTP Basic Auth credentials.
+    Scripted clients send their credentials with every request so caching
+    saves a call to the user store for each one.
+    
+    Passwords are never stored.  Each user has at most one entry holding an
+    HMAC of their username and password made with a random key generated when
+    the cache is created, together with any value such as the user's OpenID
+    identifiers set by the authentication callback.  A user's entry is
+    discarded whenever their credentials fail to verify
+    
+    @cvar DEFAULT_MAX_SIZE: default maximum number of users cached
+    @type DEFAULT_MAX_SIZE: int
+    @cvar DEFAULT_TIMEOUT: default time in seconds for which verified
+    credentials are cached
+    @type DEFAULT_TIMEOUT: float
+    """
+    DEFAULT_MAX_SIZE = 1000
+    DEFAULT_TIMEOUT = 60.
+    HMAC_KEY_LENGTH = 32
+    
+    __slots__ = ('__key', '__cache')
+    
+    def __init__(self, maxSize=DEFAULT_MAX_SIZE, timeout=DEFAULT_TIMEOUT):
+        """
+        @param maxSize: maximum number of users cached
+        @type maxSize: int / basestring
+        @param timeout: time in seconds for which verified credentials are
+        cached
+        @type timeout: int / float / basestring
+        """
+        self.__key = os.urandom(self.__class__.HMAC_KEY_LENGTH)
+        self.__cache = LRUCache(maxSize=maxSize, timeout=timeout)
+        
+    @property
+    def cache(self):
+        """Cache of credential digests and values keyed by username"""
+        return self.__cache
+        
+    def _digest(self, username, password):
+        """Make a keyed hash of the username and password
+        
+        @param username: username
+        @type username: basestring / bytes
+        @param password: password
+        @type password: basestring / bytes
+        @rtype: bytes
+        @return: HMAC digest
+        """
+        mac = hmac.new(self.__key, digestmod=hashlib.sha256)
+        for field in (username, password):
+            if isinstance(field, str):
+                field = field.encode('utf-8')
+                
+            # Prefix the length so that fields can't run into each other 
+            mac.update(b'%d:' % len(field))
+            mac.update(field)
+            
+        return mac.digest()
+    
+    def get(self, username, password, default=None):
+        """Get the value cached for the given credentials
+        
+        @param username: username
+        @type username: basestring / bytes
+        @param password: password
+        @type password: basestring / bytes
+        @param default: value to return if the credentials are not cached
+        @return: value set with the credentials or default if they are not 
+        cached, have expired or don't match
+        """
+        entry = self.__cache.get(username)
+        if entry is None:
+            return default
+        
+        digest, value = entry
+        if not hmac.compare_digest(digest, self._digest(username, password)):
+            return default
+        
+        return value
+    
+    def set(self, username, password, value=None):
+        """Record credentials which have been verified
+        
+        @param username: username
+        @type username: basestring / bytes
+        @param password: password
+        @type password: basestring / bytes
+        @param value: value to return from get for these credentials
+        """
+        self.__cache.set(username, (self._digest(username, password), value))
+        
+    def invalidate(self, username):
+        """Discard any cached credentials for a user
+        
+        @param username: username
+        @type username: basestring / bytes
+        """
+        self.__cache.pop(username)
+        
+    def clear(self):
+        """Discard all cached credentials"""
+        self.__cache.clear()
+        
+    
 class HttpBasicAuthMiddleware(object):
     '''HTTP Basic Authentication Middleware 
 
@@ -84,6 +195,13 @@ class HttpBasicAuthMiddleware(object):
     @type __realm: string
     @ivar __app: next WSGI app/middleware in call chain
     @type __app: function
+    @ivar __credential_cache: optional cache of verified credentials.  Only
+    credentials for which the authentication callback passes the request on to
+    the next app are cached.  On a hit the callback is skipped and REMOTE_USER
+    is restored from the value the callback set.  Callbacks which set their
+    own response are called for every request but may share the cache - see
+    OpenIDProviderWithHttpBasicAuthMiddleware
+    @type __credential_cache: HttpBasicAuthCredentialCache / None
     '''
     AUTHN_FUNC_ENV_KEYNAME = (
     'myproxy.server.wsgi.httpbasicauth.HttpBasicAuthMiddleware.authenticate')
@@ -93,6 +211,9 @@ class HttpBasicAuthMiddleware(object):
     RE_PATH_MATCH_LIST_OPTNAME = 're_path_match_list'
     HTTP_HDR_FIELD_MATCH_OPTNAME = 'http_hdr_field_match'
     REALM_OPTNAME = 'realm'
+    CREDENTIAL_CACHE_OPTNAME = 'credential_cache'
+    CREDENTIAL_CACHE_SIZE_OPTNAME = 'credential_cache_size'
+    CREDENTIAL_CACHE_TIMEOUT_OPTNAME = 'credential_cache_timeout'
     
     PARAM_PREFIX = 'http.auth.basic.'
     
@@ -116,7 +237,8 @@ class HttpBasicAuthMiddleware(object):
         '__authn_func_environ_keyname', 
         'authentication_callback',
         '__realm',
-        '__app'
+        '__app',
+        '__credential_cache'
     )
     
     def __init__(self, app):
@@ -137,6 +259,7 @@ class HttpBasicAuthMiddleware(object):
         
         self.__realm = None
         self.__app = app
+        self.__credential_cache = None
 
     @classmethod
     def filter_app_factory(cls, app, global_conf, prefix=PARAM_PREFIX, 
@@ -191,6 +314,26 @@ class HttpBasicAuthMiddleware(object):
                     
         self.authn_func_environ_keyname = app_conf.get(paramName,
                                 self.__class__.AUTHN_FUNC_ENV_KEYNAME)
+        
+        # Optional cache of verified credentials for scripted clients which
+        # authenticate with every request
+        credential_cache_optname = prefix + \
+                                    self.__class__.CREDENTIAL_CACHE_OPTNAME
+        credential_cache_val = app_conf.pop(credential_cache_optname, False)
+        if isinstance(credential_cache_val, str):
+            credential_cache_val = str2Bool(credential_cache_val)
+        
+        credential_cache_size = app_conf.pop(
+                    prefix + self.__class__.CREDENTIAL_CACHE_SIZE_OPTNAME,
+                    HttpBasicAuthCredentialCache.DEFAULT_MAX_SIZE)
+        credential_cache_timeout = app_conf.pop(
+                    prefix + self.__class__.CREDENTIAL_CACHE_TIMEOUT_OPTNAME,
+                    HttpBasicAuthCredentialCache.DEFAULT_TIMEOUT)
+        
+        if credential_cache_val:
+            self.credential_cache = HttpBasicAuthCredentialCache(
+                                            maxSize=credential_cache_size,
+                                            timeout=credential_cache_timeout)
 
     @property
     def authn_func_environ_keyname(self):
@@ -254,6 +397,29 @@ class HttpBasicAuthMiddleware(object):
         
         self.__realm = value
 
+    @property
+    def credential_cache(self):
+        """Get credential cache
+        
+        @rtype: HttpBasicAuthCredentialCache / None
+        @return: cache of verified credentials or None if caching is disabled
+        """
+        return self.__credential_cache
+
+    @credential_cache.setter
+    def credential_cache(self, value):
+        """Set credential cache
+        
+        @type value: HttpBasicAuthCredentialCache / None
+        @param value: cache of verified credentials or None to disable
+        """
+        if not isinstance(value, (HttpBasicAuthCredentialCache, type(None))):
+            raise TypeError('Expecting %r or None type for '
+                            '"credential_cache"; got %r' % 
+                            (HttpBasicAuthCredentialCache, type(value)))
+        
+        self.__credential_cache = value
+
     def _path_match(self, environ):
         """Apply a list of regular expression matching patterns to the contents
         of environ['PATH_INFO'], if any match, return True.  This method is
@@ -378,11 +544,28 @@ class HttpBasicAuthMiddleware(object):
         
         username, password = self.parse_credentials(environ)
         
+        credential_cache = self.credential_cache
+        if username is None:
+            credential_cache = None
+            
+        if credential_cache is not None:
+            # Cached value is a tuple of the REMOTE_USER set by the callback
+            cached = credential_cache.get(username, password)
+            if cached is not None:
+                log.debug("Using cached credentials for user %r", username)
+                if cached[0] is not None:
+                    environ['REMOTE_USER'] = cached[0]
+                    
+                return self.__app(environ, start_response_wrapper)
+        
         # Call authentication middleware/application.  
         try:
             response = authenticate_func(environ, start_response_wrapper, 
                                          username, password)
         except HTTPUnauthorized:
+            if credential_cache is not None:
+                credential_cache.invalidate(username)
+                
             if username is None:
                 # If no username is set, set the HTTP Basic Auth challenge 
                 # returning an auth realm
@@ -401,5 +584,9 @@ class HttpBasicAuthMiddleware(object):
         if response is not None:
             return response
         else:
+            if credential_cache is not None:
+                credential_cache.set(username, password, 
+                                     (environ.get('REMOTE_USER'),))
+                
             return self.__app(environ, start_response_wrapper)
 
@@ -0,0 +1,149 @@
+"""WSGI middleware to expose NDG Security metrics for monitoring
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import logging
+log = logging.getLogger(__name__)
+
+from ndg.security.common.utils import str2Bool
+from ndg.security.server.utils import metrics
+
+
+class MetricsMiddleware(object):
+    '''Serve the contents of the in-process metrics registry in the
+    Prometheus text exposition format from the configured path.  All other
+    requests are passed to the next app in the stack.  Metrics are collected
+    by the instrumented components whether or not this middleware is present;
+    set "enabled = False" to switch collection off for this process.
+
+    @cvar DEFAULT_PARAM_PREFIX: default prefix for configuration items
+    @type DEFAULT_PARAM_PREFIX: string
+    @cvar CONTENT_TYPE: content type for text exposition format
+    @type CONTENT_TYPE: string
+    '''
+    DEFAULT_PARAM_PREFIX = 'metrics.'
+    DEFAULT_PATH = '/metrics'
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    PARAM_NAMES = (
+        'path',
+        'enabled'
+    )
+
+    __slots__ = ('_app', '__path', '__registry')
+
+    def __init__(self, app, registry=None):
+        '''
+        @param app: next app/middleware in WSGI stack
+        @type app: callable
+        @param registry: registry to expose, defaults to the module level
+        registry shared by NDG Security components
+        @type registry: ndg.security.server.utils.metrics.MetricsRegistry
+        '''
+        self._app = app
+        self.__path = self.__class__.DEFAULT_PATH
+        self.__registry = registry or metrics.registry
+
+    def initialise(self, global_conf, prefix=DEFAULT_PARAM_PREFIX, **app_conf):
+        """Set-up from PasteDeploy configuration settings
+
+        @type global_conf: dict
+        @param global_conf: PasteDeploy global configuration dictionary
+        @type prefix: basestring
+        @param prefix: prefix for configuration items
+        @type app_conf: dict
+        @param app_conf: PasteDeploy application specific configuration
+        dictionary
+        """
+        for name in self.__class__.PARAM_NAMES:
+            value = app_conf.get(prefix + name)
+            if value is not None:
+                setattr(self, name, value)
+
+    @classmethod
+    def filter_app_factory(cls, app, global_conf, **app_conf):
+        '''Wrapper to enable instantiation compatible with Paste Deploy
+        filter application factory function signature
+
+        @type app: callable following WSGI interface
+        @param app: next middleware application in the chain
+        @type global_conf: dict
+        @param global_conf: PasteDeploy global configuration dictionary
+        @type app_conf: dict
+        @param app_conf: PasteDeploy application specific configuration
+        dictionary
+        '''
+        app = cls(app)
+        app.initialise(global_conf, **app_conf)
+
+        return app
+
+    def __call__(self, environ, start_response):
+        '''Return metrics for GET requests to the configured path
+
+        @type environ: dict
+        @param environ: WSGI environment variables dictionary
+        @type start_response: function
+        @param start_response: standard WSGI start response function
+        @rtype: iterable
+        @return: response
+        '''
+        if environ.get('PATH_INFO', '').rstrip('/') != self.path:
+            return self._app(environ, start_response)
+
+        if environ.get('REQUEST_METHOD') not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed',
+                           [('Content-type', 'text/plain'),
+                            ('Content-length', '0'),
+                            ('Allow', 'GET, HEAD')])
+            return [b'']
+
+        body = self.registry.render().encode('utf-8')
+        start_response('200 OK',
+                       [('Content-type', self.__class__.CONTENT_TYPE),
+                        ('Content-length', str(len(body))),
+                        ('Cache-Control', 'no-cache')])
+
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return [b'']
+
+        return [body]
+
+    def _getPath(self):
+        return self.__path
+
+    def _setPath(self, value):
+        if not isinstance(value, str):
+            raise TypeError('Expecting string type for "path" attribute; got '
+                            '%r' % type(value))
+        self.__path = value.rstrip('/')
+
+    path = property(_getPath, _setPath,
+                    doc="Path at which metrics are served")
+
+    def _getRegistry(self):
+        return self.__registry
+
+    registry = property(_getRegistry,
+                        doc="Metrics registry exposed by this middleware")
+
+    def _getEnabled(self):
+        return self.__registry.enabled
+
+    def _setEnabled(self, value):
+        if isinstance(value, str):
+            self.__registry.enabled = str2Bool(value)
+        elif isinstance(value, bool):
+            self.__registry.enabled = value
+        else:
+            raise TypeError('Expecting bool or string type for "enabled" '
+                            'attribute; got %r' % type(value))
+
+    enabled = property(_getEnabled, _setEnabled,
+                       doc="Enable or disable collection for the registry")
@@ -19,6 +19,7 @@ log = logging.getLogger(__name__)
 _debugLevel = log.getEffectiveLevel() <= logging.DEBUG
 
 import re
+import hashlib
 from string import Template
 
 import paste.request
@@ -27,12 +28,17 @@ from paste.httpexceptions import HTTPUnauthorized
 import beaker.session
 from openid.extensions import sreg, ax
 from openid.server import server
+from openid.store.interface import OpenIDStore
 from openid.store.filestore import FileOpenIDStore
 from openid.consumer import discover
 
+from ndg.security.common.utils import str2Bool
 from ndg.security.common.utils.classfactory import instantiateClass
 from ndg.security.server.wsgi.httpbasicauth import HttpBasicAuthMiddleware
 from ndg.security.server.wsgi import NDGSecurityMiddlewareBase
+from ndg.security.server.wsgi.session import WriteBehindSession
+from ndg.security.server.utils import metrics
+from ndg.security.server.utils.cache import LRUCache
 
 
 class IdentityMapping(object):
@@ -87,9 +93,12 @@ class IdentityMapping(object):
 # Place here to avoid circular import error with IdentityMapping class
 from ndg.security.server.wsgi.openid.provider.authninterface import (
     AbstractAuthNInterface, AuthNInterfaceError,
-    AuthNInterfaceInvalidCredentials, AuthNInterfaceConfigError)
+    AuthNInterfaceInvalidCredentials, AuthNInterfaceConfigError,
+    AuthNInterfaceUnavailable)
 from ndg.security.server.wsgi.openid.provider.axinterface import (AXInterface,
     MissingRequiredAttrs, AXInterfaceReloginRequired)
+from ndg.security.server.wsgi.openid.provider.axinterface.caching import (
+    CachingAXInterface)
 
 
 # Aliases to AXInterface exception types
@@ -193,8 +202,14 @@ class OpenIDProviderMiddleware(NDGSecurityMiddlewareBase):
 
     PARAM_PREFIX = 'openid.provider.'
 
+    ACTION_TIMER_NAME = 'ndg_security_openid_provider_action_seconds'
+    ACTION_TIMER_DOC = 'Time taken by OpenID Provider to handle each action'
+
     IDENTITY_URI_TMPL_PARAMNAME = 'identityUriTemplate'
 
+    # Paths containing a user identifier
+    IDENTITY_URI_PATH_NAMES = ('path_id', 'path_yadis')
+
     # Approve and reject submit HTML input types for the Relying Party Approval
     # page
     APPROVE_RP_SUBMIT = "ApproveRelyingParty"
@@ -218,13 +233,14 @@ class OpenIDProviderMiddleware(NDGSecurityMiddlewareBase):
 
         self.__charset = None
         self.__paths = None
+        self.__identityUriPat = None
         self.__base_url = None
         self.__urls = None
         self.__method = None
         self.__session_mware_environ_keyname = None
         self.__session = None
         self.__oidserver = None
-        self.__query = {}
+        self.__query = None
         self.__sregResponse = None
         self.__trustedRelyingParties = ()
         self.__axResponse = None
@@ -345,6 +361,17 @@ class OpenIDProviderMiddleware(NDGSecurityMiddlewareBase):
         # Class to handle OpenID Attribute Exchange (AX) requests from
         # the Relying Party
         axResponseClassName = opt.pop('axResponse_class', None)
+
+        # Optional caching of the attributes returned by the AX interface
+        axResponseCache = opt.pop('axResponse_cache', False)
+        if isinstance(axResponseCache, str):
+            axResponseCache = str2Bool(axResponseCache)
+
+        axResponseCacheSize = opt.pop('axResponse_cacheSize',
+                                      CachingAXInterface.DEFAULT_MAX_SIZE)
+        axResponseCacheTimeout = opt.pop('axResponse_cacheTimeout',
+                                         CachingAXInterface.DEFAULT_TIMEOUT)
+
         if axResponseClassName is not None:
             axResponseModuleFilePath = opt.pop('axResponse_moduleFilePath',
                                                None)
@@ -363,13 +390,36 @@ class OpenIDProviderMiddleware(NDGSecurityMiddlewareBase):
                 log.error("Error instantiating AX interface: %s" % e)
                 raise
 
+            if axResponseCache:
+                self.__axResponse = CachingAXInterface(self.__axResponse,
+                                            maxSize=axResponseCacheSize,
+                                            timeout=axResponseCacheTimeout)
+
         self.trustedRelyingParties = opt['trustedRelyingParties']
 
-        # Instantiate OpenID consumer store and OpenID consumer.  If you
-        # were connecting to a database, you would create the database
-        # connection and instantiate an appropriate store here.
-        store = FileOpenIDStore(
+        # Store for associations and nonces.  Defaults to a file based store
+        # unless an alternative is set with store_class - see the
+        # ndg.security.server.wsgi.openid.provider.store package
+        storeClassName = opt.pop('store_class', None)
+        if storeClassName is not None:
+            storeModuleFilePath = opt.pop('store_moduleFilePath', None)
+            storeProperties = dict(
+                [(k.replace('store_', '', 1), v)
+                 for k,v in list(opt.items()) if k.startswith('store_')])
+
+            try:
+                store = instantiateClass(storeClassName,
+                                         None,
+                                         moduleFilePath=storeModuleFilePath,
+                                         objectType=OpenIDStore,
+                                         classProperties=storeProperties)
+            except Exception as e:
+                log.error("Error instantiating OpenID store: %s" % e)
+                raise
+        else:
+            store = FileOpenIDStore(
                             os.path.expandvars(opt['consumer_store_dirpath']))
+
         self.oidserver = server.Server(store, self.urls['url_openidserver'])
 
     @classmethod
@@ -390,12 +440,14 @@ class OpenIDProviderMiddleware(NDGSecurityMiddlewareBase):
         defOpt class variable
         '''
         def _isBadOptName(optName):
-            # Allow for authN.* and rendering.* properties used by the
-            # Authentication and Rendering interfaces respectively
+            # Allow for authN.*, rendering.*, axResponse.* and store.* properties
+            # used by the Authentication, Rendering, AX and store interfaces
+            # respectively
             return optName not in cls.defOpt and \
                not optName.startswith('authN_') and \
                not optName.startswith('rendering_') and \
-               not optName.startswith('axResponse_')
+               not optName.startswith('axResponse_') and \
+               not optName.startswith('store_')
 
         badOptNames = []
         for optName, optVal in list(newOpt.items()):
@@ -423,17 +475,42 @@ class OpenIDProviderMiddleware(NDGSecurityMiddlewareBase):
             raise TypeError("Invalid input option(s) set: %s" %
                             (", ".join(badOptNames)))
 
+    @classmethod
+    def _compileIdentityURIPat(cls, paths):
+        """Make a single regular expression matching any of the identity URI
+        paths.  Each alternative is a group named after its path setting so
+        that the match identifies which path was requested
+
+        @type paths: dict
+        @param paths: path settings keyed by option name e.g. path_id
+        @rtype: _sre.SRE_Pattern / None
+        @return: compiled pattern or None if no identity paths are set
+        """
+        idPatterns = [
+            '(?P<%s>%s)' % (name, Template(paths[name]).substitute(
+                                    userIdentifier=cls.userIdentifierPat))
+            for name in cls.IDENTITY_URI_PATH_NAMES if name in paths
+        ]
+        if len(idPatterns) == 0:
+            return None
+
+        return re.compile('|'.join(idPatterns))
+
     def _matchIdentityURI(self):
-        idPaths = (self.paths['path_id'], self.paths['path_yadis'])
-        idPathMatches = [Template(path).substitute(
-                    userIdentifier=OpenIDProviderMiddleware.userIdentifierPat)
-                    for path in idPaths]
+        """Match the request path against the identity URI paths
+
+        @rtype: basestring / None
+        @return: the matching path_id or path_yadis setting or None if the
+        path is not an identity URI
+        """
+        if self.__identityUriPat is None:
+            return None
 
-        for idPathMatch, idPath in zip(idPathMatches, idPaths):
-            if re.search(idPathMatch, self.path):
-                return idPath
+        match = self.__identityUriPat.search(self.path)
+        if match is None:
+            return None
 
-        return None
+        return self.paths[match.lastgroup]
 
     def _isAnIdentityURI(self):
         """Check input URI is an identity URI.  Use to determine whether a
@@ -522,18 +599,23 @@ class OpenIDProviderMiddleware(NDGSecurityMiddlewareBase):
         self.session = environ[self.session_mware_environ_keyname]
         self._render.session = self.session
 
+        # Identity URIs take precedence over the fixed paths
         pathMatch = self._matchIdentityURI()
         if not pathMatch:
             pathMatch = self.path
 
         if pathMatch in self.method:
-            # Calls to parse_formvars seem to gobble up the POST content such
-            # that a 2nd call yields nothing! (with Paste 1.7.1)
-            self.query = dict(paste.request.parse_formvars(environ))
+            # Form variables are parsed on first access to the query property
+            # so that actions which don't use them e.g. Yadis discovery
+            # don't pay for it
+            self.__query = None
             log.debug("Calling method %s ..." % self.method[pathMatch])
 
             action = getattr(self, self.method[pathMatch])
-            response = action(environ, start_response)
+            with metrics.registry.timer(self.__class__.ACTION_TIMER_NAME,
+                                        self.__class__.ACTION_TIMER_DOC,
+                                        action=self.method[pathMatch]).time():
+                response = action(environ, start_response)
             if self._trace and _debugLevel:
                 if isinstance(response, list):
                     log.debug('Output for %s:\n%s', self.method[pathMatch],
@@ -821,17 +903,33 @@ class OpenIDProviderMiddleware(NDGSecurityMiddlewareBase):
                 "you entered your OpenID.  If the problem persists "
                 "report it to your site administrator.")
 
+        # Set if the authentication interface checks the password with the
+        # look-up of user identifiers
+        authenticated = False
+
         # Get user identifier to check against credentials provided
         if oid_request.idSelect():
             # ID select mode enables the user to request specifying
             # their OpenID Provider without giving a personal user URL
             try:
-                userIdentifiers = self._authN.username2UserIdentifiers(
-                                                environ,
-                                                self.query['username'])
+                userIdentifiers, authenticated = self._getUserIdentifiers(
+                                                                environ, None)
+
+            except AuthNInterfaceUnavailable as e:
+                return self._authNUnavailable(environ, start_response, e)
+
+            except AuthNInterfaceInvalidCredentials as e:
+                # Raised for an unknown username or, if the authentication
+                # interface checks the password at the same time, an invalid
+                # password
+                log.error("Invalid credentials for username %r: %s",
+                          self.query.get('username'), e)
+                response = self._render.login(environ, start_response,
+                                          msg=e.userMsg,
+                                          success_to=self.urls['url_decide'])
+                return response
 
-            except (AuthNInterfaceInvalidCredentials,
-                    AuthNInterfaceConfigError):
+            except AuthNInterfaceConfigError:
                 log.error("No username %r matching an OpenID URL: %s",
                           self.query.get('username'),
                           traceback.format_exc())
@@ -882,12 +980,24 @@ class OpenIDProviderMiddleware(NDGSecurityMiddlewareBase):
             # given.  This check is essential otherwise a user could impersonate
             # someone else with an account with this provider
             try:
-                userIdentifiers = self._authN.username2UserIdentifiers(
-                                                environ,
-                                                self.query['username'])
+                userIdentifiers, authenticated = self._getUserIdentifiers(
+                                                        environ, identityURI)
+
+            except AuthNInterfaceUnavailable as e:
+                return self._authNUnavailable(environ, start_response, e)
+
+            except AuthNInterfaceInvalidCredentials as e:
+                # Raised for an unknown username or, if the authentication
+                # interface checks the password at the same time, an invalid
+                # password
+                log.error("Invalid credentials for username %r: %s",
+                          self.query.get('username'), e)
+                response = self._render.login(environ, start_response,
+                                          msg=e.userMsg,
+                                          success_to=self.urls['url_decide'])
+                return response
 
-            except (AuthNInterfaceInvalidCredentials,
-                    AuthNInterfaceConfigError):
+            except AuthNInterfaceConfigError:
                 log.error("No username %r matching an OpenID URL: %s",
                           self.query.get('username'),
                           traceback.format_exc())
@@ -934,10 +1044,14 @@ class OpenIDProviderMiddleware(NDGSecurityMiddlewareBase):
 
         # Invoke custom authentication interface plugin
         try:
-            self._authN.logon(environ,
-                              identityURI,
-                              self.query['username'],
-                              self.query.get('password', ''))
+            if not authenticated:
+                self._authN.logon(environ,
+                                  identityURI,
+                                  self.query['username'],
+                                  self.query.get('password', ''))
+
+        except AuthNInterfaceUnavailable as e:
+            return self._authNUnavailable(environ, start_response, e)
 
         except AuthNInterfaceError as e:
             return self._render.login(environ,
@@ -970,11 +1084,68 @@ class OpenIDProviderMiddleware(NDGSecurityMiddlewareBase):
 
         self.session.save()
 
+        # Attributes cached from a previous login may be stale
+        if isinstance(self.axResponse, CachingAXInterface):
+            self.axResponse.invalidate(self.session)
+
         log.info("user [%s] logged in", self.session[
                  OpenIDProviderMiddleware.USERNAME_SESSION_KEYNAME])
 
         return self._redirect(start_response, self.query['success_to'])
 
+    def _authNUnavailable(self, environ, start_response, e):
+        """Respond with 503 Service Unavailable when the authentication
+        interface is too busy to check the user's credentials
+
+        @type environ: dict
+        @param environ: dictionary of environment variables
+        @type start_response: callable
+        @param start_response: standard WSGI callable to set HTTP headers
+        @type e: AuthNInterfaceUnavailable
+        @param e: exception raised by the authentication interface
+        @rtype: basestring
+        @return: WSGI response
+        """
+        log.warning("Rejecting login for user %r: %s",
+                    self.query.get('username'), e)
+
+        def _start_response(status, response_headers, exc_info=None):
+            return start_response(status,
+                                  response_headers + [('Retry-After', '5')],
+                                  exc_info)
+
+        return self._render.errorPage(environ, _start_response, e.userMsg,
+                                      code=503)
+
+    def _getUserIdentifiers(self, environ, identityURI):
+        """Get the OpenID user identifiers for the username submitted at
+        login.  If the authentication interface has an authenticateAndResolve
+        method, it's used to check the password in the same call, saving a
+        separate call to logon
+
+        @type environ: dict
+        @param environ: dictionary of environment variables
+        @type identityURI: basestring
+        @param identityURI: identity URI given by the user or None for ID
+        Select mode
+        @rtype: tuple
+        @return: user identifiers and a flag set to True if the password was
+        also checked
+        """
+        authenticateAndResolve = getattr(self._authN,
+                                         'authenticateAndResolve', None)
+        if authenticateAndResolve is None:
+            return (self._authN.username2UserIdentifiers(
+                                                environ,
+                                                self.query['username']),
+                    False)
+
+        return (authenticateAndResolve(environ,
+                                       identityURI,
+                                       self.query['username'],
+                                       self.query.get('password', '')),
+                True)
+
     def __logoutSubmit(self, environ, start_response):
         """Logout helper method to do_loginsubmit - triggered when 'submit'
         field set in login POST action but no 'username' field set
@@ -994,6 +1165,9 @@ class OpenIDProviderMiddleware(NDGSecurityMiddlewareBase):
         log.info("user [%s] logging out ...", self.session[
                  OpenIDProviderMiddleware.USERNAME_SESSION_KEYNAME])
 
+        if isinstance(self.axResponse, CachingAXInterface):
+            self.axResponse.invalidate(self.session)
+
         del self.session[OpenIDProviderMiddleware.USERNAME_SESSION_KEYNAME]
         self.session.pop(OpenIDProviderMiddleware.APPROVED_FLAG_SESSION_KEYNAME,
                          None)
@@ -1522,6 +1696,7 @@ class OpenIDProviderMiddleware(NDGSecurityMiddlewareBase):
                             '"paths" attribute; got %r' %
                             type(value))
         self.__paths = value
+        self.__identityUriPat = self._compileIdentityURIPat(value)
 
     paths = property(getPaths, setPaths, None,
                      "Dictionary of Paths for the app")
@@ -1565,10 +1740,11 @@ class OpenIDProviderMiddleware(NDGSecurityMiddlewareBase):
         return self.__session
 
     def setSession(self, value):
-        if not isinstance(value, beaker.session.SessionObject):
-            raise TypeError('Expecting beaker.session.SessionObject type for '
-                            '"session" attribute; got %r' %
-                            type(value))
+        if not isinstance(value, (beaker.session.SessionObject,
+                                  WriteBehindSession)):
+            raise TypeError('Expecting beaker.session.SessionObject or '
+                            'WriteBehindSession type for "session" '
+                            'attribute; got %r' % type(value))
 
         self.__session = value
 
@@ -1629,6 +1805,12 @@ class OpenIDProviderMiddleware(NDGSecurityMiddlewareBase):
                          "OpenID server instance")
 
     def getQuery(self):
+        if self.__query is None:
+            # Calls to parse_formvars seem to gobble up the POST content such
+            # that a 2nd call yields nothing! (with Paste 1.7.1) so parse once
+            # per request only
+            self.__query = dict(paste.request.parse_formvars(self.environ))
+
         return self.__query
 
     def setQuery(self, value):
@@ -1639,7 +1821,8 @@ class OpenIDProviderMiddleware(NDGSecurityMiddlewareBase):
         self.__query = value
 
     query = property(getQuery, setQuery, None,
-                     "dictionary of HTML query parameters")
+                     "dictionary of HTML query parameters.  Parsed from the "
+                     "request form variables on first access")
 
     def getTrustedRelyingParties(self):
         return self.__trustedRelyingParties
@@ -1717,10 +1900,23 @@ class RenderingInterface(object):
     URL to Relying Party.  Derived classes can reset this or completely
     override the yadis method.
 
-    @type tmplYadis: basestring"""
+    @type tmplYadis: basestring
+
+    @cvar DEFAULT_XRDS_CACHE_SIZE: default maximum number of rendered Yadis
+    documents to keep
+    @type DEFAULT_XRDS_CACHE_SIZE: int
+
+    @cvar DEFAULT_XRDS_MAX_AGE: default time in seconds for which Relying
+    Parties may cache a Yadis document - sets the Cache-Control max-age
+    @type DEFAULT_XRDS_MAX_AGE: int"""
 
     # Enable slot support for derived classes if they require it
-    __slots__ = ('_authN', 'base_url', 'urls', 'charset')
+    __slots__ = ('_authN', 'base_url', 'urls', 'charset', '_xrdsCache',
+                 '_xrdsMaxAge')
+
+    DEFAULT_XRDS_CACHE_SIZE = 10000
+    DEFAULT_XRDS_MAX_AGE = 3600
+    XRDS_CONTENT_TYPE = 'application/xrds+xml'
 
     tmplServerYadis = """\
 <?xml version="1.0" encoding="UTF-8"?>
@@ -1771,6 +1967,147 @@ class RenderingInterface(object):
         self.urls = urls
         self.charset = ''
 
+        # Rendered Yadis documents and their entity tags
+        self._xrdsCache = LRUCache(
+                            maxSize=RenderingInterface.DEFAULT_XRDS_CACHE_SIZE)
+        self._xrdsMaxAge = RenderingInterface.DEFAULT_XRDS_MAX_AGE
+
+        for name in ('xrdsCacheSize', 'xrdsMaxAge'):
+            if name in opt:
+                setattr(self, name, opt[name])
+
+    def _getXrdsCacheSize(self):
+        return self._xrdsCache.maxSize
+
+    def _setXrdsCacheSize(self, value):
+        self._xrdsCache.maxSize = value
+
+    xrdsCacheSize = property(_getXrdsCacheSize, _setXrdsCacheSize,
+                             doc="Maximum number of rendered Yadis documents "
+                                 "to keep.  Set to zero to render on every "
+                                 "request")
+
+    def _getXrdsMaxAge(self):
+        return self._xrdsMaxAge
+
+    def _setXrdsMaxAge(self, value):
+        if isinstance(value, (int, str)):
+            self._xrdsMaxAge = int(value)
+        else:
+            raise TypeError('Expecting int or string type for "xrdsMaxAge" '
+                            'attribute; got %r' % type(value))
+
+    xrdsMaxAge = property(_getXrdsMaxAge, _setXrdsMaxAge,
+                          doc="Time in seconds for which Relying Parties may "
+                              "cache a Yadis document.  Set to zero to "
+                              "require revalidation on every request")
+
+    def clearXrdsCache(self):
+        """Discard all rendered Yadis documents e.g. following a change to
+        the templates"""
+        self._xrdsCache.clear()
+
+    def _isXrdsCacheable(self):
+        """Override in derived classes to disable caching of rendered Yadis
+        documents e.g. when templates may be modified
+
+        @rtype: bool
+        @return: True if rendered Yadis documents may be reused
+        """
+        return True
+
+    @staticmethod
+    def _makeETag(response):
+        """Make a strong entity tag from the content of a response
+
+        @type response: basestring / bytes
+        @param response: response content
+        @rtype: string
+        @return: quoted entity tag
+        """
+        if isinstance(response, str):
+            response = response.encode('utf-8')
+
+        return '"%s"' % hashlib.sha1(response).hexdigest()
+
+    @staticmethod
+    def _isNotModified(environ, etag):
+        """Check the If-None-Match request header against an entity tag
+
+        @type environ: dict
+        @param environ: dictionary of environment variables
+        @type etag: string
+        @param etag: quoted entity tag of the current document
+        @rtype: bool
+        @return: True if the client copy is current
+        """
+        ifNoneMatch = environ.get('HTTP_IF_NONE_MATCH')
+        if not ifNoneMatch:
+            return False
+
+        for tag in ifNoneMatch.split(','):
+            tag = tag.strip()
+
+            # If-None-Match uses the weak comparison function
+            if tag.startswith('W/'):
+                tag = tag[2:]
+
+            if tag == '*' or tag == etag:
+                return True
+
+        return False
+
+    def _xrdsResponse(self, environ, start_response, cacheKey, renderXrds,
+                      contentType=XRDS_CONTENT_TYPE):
+        """Respond with a Yadis document.  Documents are rendered once per
+        cache key and held with their entity tag so that a conditional
+        request from a Relying Party with a current copy gets a 304 response
+        without rendering
+
+        @type environ: dict
+        @param environ: dictionary of environment variables
+        @type start_response: callable
+        @param start_response: WSGI start response function
+        @type cacheKey: tuple
+        @param cacheKey: key identifying the document e.g. document type and
+        user identifier.  Provider URLs are added to the key so that a change
+        of base URL can't return a stale document
+        @type renderXrds: callable
+        @param renderXrds: function with no arguments returning the rendered
+        document
+        @type contentType: string
+        @param contentType: response content type
+        @rtype: basestring
+        @return: WSGI response
+        """
+        cacheable = self._isXrdsCacheable()
+        if cacheable:
+            cacheKey = (self.base_url,
+                        self.urls.get('url_openidserver')) + tuple(cacheKey)
+            entry = self._xrdsCache.get(cacheKey)
+        else:
+            entry = None
+
+        if entry is None:
+            response = renderXrds()
+            entry = (response, RenderingInterface._makeETag(response))
+            if cacheable:
+                self._xrdsCache.set(cacheKey, entry)
+
+        response, etag = entry
+        headers = [('ETag', etag),
+                   ('Cache-Control', 'public, max-age=%d' % self._xrdsMaxAge)]
+
+        if RenderingInterface._isNotModified(environ, etag):
+            start_response('%d %s' % (304, http.client.responses[304]),
+                           headers)
+            return ''
+
+        start_response('200 OK',
+                       [('Content-type', contentType),
+                        ('Content-length', str(len(response)))] + headers)
+        return response
+
     def serverYadis(self, environ, start_response):
         '''Render Yadis info for ID Select mode request
 
@@ -1783,14 +2120,14 @@ class RenderingInterface(object):
         @return: WSGI response
         '''
         endpoint_url = self.urls['url_openidserver']
-        response = RenderingInterface.tmplServerYadis % \
+
+        def renderXrds():
+            return RenderingInterface.tmplServerYadis % \
                                 {'openid20type': discover.OPENID_IDP_2_0_TYPE,
                                  'endpoint_url': endpoint_url}
 
-        start_response("200 OK",
-                       [('Content-type', 'application/xrds+xml'),
-                        ('Content-length', str(len(response)))])
-        return response
+        return self._xrdsResponse(environ, start_response, ('serveryadis',),
+                                  renderXrds)
 
     def yadis(self, environ, start_response):
         """Render Yadis document containing user URL
@@ -1816,12 +2153,13 @@ class RenderingInterface(object):
                          endpoint_url=endpoint_url,
                          user_url=user_url)
 
-        response = RenderingInterface.tmplYadis % yadisDict
+        def renderXrds():
+            return RenderingInterface.tmplYadis % yadisDict
 
-        start_response('200 OK',
-                       [('Content-type', 'application/xrds+xml' + self.charset),
-                        ('Content-length', str(len(response)))])
-        return response
+        return self._xrdsResponse(environ, start_response,
+                                  ('yadis', userIdentifier), renderXrds,
+                                  contentType=(self.XRDS_CONTENT_TYPE +
+                                               self.charset))
 
     def identityPage(self, environ, start_response):
         """Render the identity page.
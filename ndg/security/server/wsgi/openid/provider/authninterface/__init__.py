@@ -60,6 +60,13 @@ class AuthNInterfaceRetrieveError(AuthNInterfaceError):
                 "credentials")
 
 
+class AuthNInterfaceUnavailable(AuthNInterfaceError):
+    """Authentication can't be attempted now e.g. because too many logins are
+    in progress.  The OpenID Provider responds with 503 Service Unavailable"""
+    userMsg = ("The service is busy.  Please try again in a few moments")
+    errorMsg = "Authentication is temporarily unavailable"
+    
+    
 class AuthNInterfaceInitError(AuthNInterfaceError):
     """Error with initialisation of AuthNInterface.  Raise from __init__"""
     errorMsg = "AuthNInterface initialisation error"
@@ -73,7 +80,16 @@ class AuthNInterfaceConfigError(AuthNInterfaceError):
 class AbstractAuthNInterface(object):
     '''OpenID Provider abstract base class for authentication configuration.
     Derive from this class to define the authentication interface for users
-    logging into the OpenID Provider'''
+    logging into the OpenID Provider
+    
+    Derived classes may optionally implement,
+    
+        authenticateAndResolve(environ, identityURI, username, password)
+        
+    to check the user's credentials and return their user identifiers in a
+    single call.  It takes the arguments of logon and returns the result of
+    username2UserIdentifiers.  Where it's available, the OpenID Provider calls
+    it at login instead of username2UserIdentifiers followed by logon'''
     
     # Slot declaration here enables derived classes to use slots if they want to
     __slots__ = ()
@@ -20,6 +20,8 @@ from ndg.security.server.wsgi.openid.provider.authninterface import \
     AbstractAuthNInterface, AuthNInterfaceInvalidCredentials, \
     AuthNInterfaceRetrieveError, AuthNInterfaceConfigError, \
     AuthNInterfaceUsername2IdentifierMismatch
+from ndg.security.server.wsgi.openid.provider.authninterface.password import \
+    PasswordChecker
  
     
 class BasicAuthNInterface(AbstractAuthNInterface):
@@ -71,6 +73,9 @@ class BasicAuthNInterface(AbstractAuthNInterface):
             userCredsKeys = BasicAuthNInterface.USERCREDS_KEYNAMES
             self._userCreds[userCreds[0]] = dict(list(zip(userCredsKeys, 
                                                      userCreds[1:])))  
+
+        # Optionally hold passwords as hashes checked by a password verifier
+        self._passwordChecker = PasswordChecker.fromProperties(prop)
     
     def logon(self, environ, identityURI, username, password):
         """Interface login method
@@ -91,8 +96,16 @@ class BasicAuthNInterface(AbstractAuthNInterface):
         @raise AuthNInterfaceInvalidCredentials: invalid username/password
         @raise AuthNInterfaceUsername2IdentifierMismatch: no OpenID matching
         the given username
+        @raise AuthNInterfaceUnavailable: too many password checks in progress
         """
-        if self._userCreds.get(username, {}).get('password') != password:
+        storedPassword = self._userCreds.get(username, {}).get('password')
+        if self._passwordChecker is not None:
+            if storedPassword is None:
+                raise AuthNInterfaceInvalidCredentials()
+            
+            self._passwordChecker.check(username, password, storedPassword)
+            
+        elif storedPassword != password:
             raise AuthNInterfaceInvalidCredentials()
         
         # Assume identifier is at the end of the URI
@@ -0,0 +1,382 @@
+"""Password verifiers for OpenID Provider authentication interfaces
+
+Verifiers check a password against the encoded form held in the user store.
+Slow key derivation schemes such as PBKDF2 and bcrypt are run on a bounded
+pool of worker threads so that a burst of logins can't tie up every request
+thread.  When the pool and its queue are full, checks are rejected at once
+with AuthNInterfaceUnavailable.  hashlib's PBKDF2 and bcrypt release the GIL
+while hashing so threads run in parallel.
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import logging
+log = logging.getLogger(__name__)
+
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from threading import BoundedSemaphore, Lock
+
+from ndg.security.common.utils.classfactory import instantiateClass
+from ndg.security.server.wsgi.openid.provider.authninterface import (
+    AuthNInterfaceConfigError, AuthNInterfaceInvalidCredentials,
+    AuthNInterfaceUnavailable)
+
+
+class PasswordVerifier(object):
+    """Base class for password verifiers.  Derived classes check a password
+    against its encoded form and make encoded passwords for the user store
+    """
+    __slots__ = ()
+
+    def encode(self, password):
+        '''Encode a password for storage
+
+        @type password: basestring
+        @param password: password
+        @rtype: string
+        @return: encoded password
+        '''
+        raise NotImplementedError()
+
+    def verify(self, password, encodedPassword):
+        '''Check a password against its stored form
+
+        @type password: basestring
+        @param password: password entered by the user
+        @type encodedPassword: basestring
+        @param encodedPassword: password as held in the user store
+        @rtype: bool
+        @return: True if the password matches
+        '''
+        raise NotImplementedError()
+
+    @staticmethod
+    def _toBytes(value):
+        if isinstance(value, str):
+            return value.encode('utf-8')
+        return value
+
+
+class PlainPasswordVerifier(PasswordVerifier):
+    """Passwords are stored as they are.  For testing only"""
+    __slots__ = ()
+
+    def encode(self, password):
+        return password
+
+    def verify(self, password, encodedPassword):
+        return hmac.compare_digest(self._toBytes(password),
+                                   self._toBytes(encodedPassword))
+
+
+class MD5PasswordVerifier(PasswordVerifier):
+    """Passwords are stored as an unsalted MD5 hex digest.  Supported for
+    compatibility with existing user databases only"""
+    __slots__ = ()
+
+    def encode(self, password):
+        return hashlib.md5(self._toBytes(password)).hexdigest()
+
+    def verify(self, password, encodedPassword):
+        return hmac.compare_digest(self._toBytes(self.encode(password)),
+                                   self._toBytes(encodedPassword))
+
+
+class PBKDF2PasswordVerifier(PasswordVerifier):
+    """Salted PBKDF2 password hashes stored in the form,
+
+        pbkdf2_<hash name>$<iterations>$<salt>$<base64 encoded hash>
+
+    as used by Django.  The hash name and iteration count are read from the
+    stored value so settings may be changed without invalidating existing
+    passwords
+
+    @cvar DEFAULT_ITERATIONS: default number of iterations for new hashes
+    @type DEFAULT_ITERATIONS: int
+    """
+    ALGORITHM_PREFIX = 'pbkdf2_'
+    DEFAULT_HASH_NAME = 'sha256'
+    DEFAULT_ITERATIONS = 260000
+    DEFAULT_SALT_LENGTH = 16
+
+    __slots__ = ('__hashName', '__iterations')
+
+    def __init__(self, hashName=DEFAULT_HASH_NAME,
+                 iterations=DEFAULT_ITERATIONS):
+        '''
+        @type hashName: basestring
+        @param hashName: hash for new passwords
+        @type iterations: int / basestring
+        @param iterations: number of iterations for new passwords
+        '''
+        self.__hashName = hashName
+        self.__iterations = int(iterations)
+
+    def encode(self, password, salt=None):
+        if salt is None:
+            salt = base64.b64encode(os.urandom(
+                        PBKDF2PasswordVerifier.DEFAULT_SALT_LENGTH)).decode()
+
+        return '%s%s$%d$%s$%s' % (PBKDF2PasswordVerifier.ALGORITHM_PREFIX,
+                                  self.__hashName,
+                                  self.__iterations,
+                                  salt,
+                                  self._hash(self.__hashName, password, salt,
+                                             self.__iterations))
+
+    @classmethod
+    def _hash(cls, hashName, password, salt, iterations):
+        digest = hashlib.pbkdf2_hmac(hashName,
+                                     cls._toBytes(password),
+                                     cls._toBytes(salt),
+                                     iterations)
+        return base64.b64encode(digest).decode('ascii').strip()
+
+    def verify(self, password, encodedPassword):
+        try:
+            algorithm, iterations, salt, expectedHash = \
+                                                encodedPassword.split('$', 3)
+            iterations = int(iterations)
+        except (AttributeError, ValueError):
+            log.error('Stored password is not a PBKDF2 hash')
+            return False
+
+        if not algorithm.startswith(PBKDF2PasswordVerifier.ALGORITHM_PREFIX):
+            log.error('Stored password is not a PBKDF2 hash')
+            return False
+
+        hashName = algorithm[len(PBKDF2PasswordVerifier.ALGORITHM_PREFIX):]
+        try:
+            actualHash = self._hash(hashName, password, salt, iterations)
+        except ValueError as e:
+            log.error('Error making PBKDF2 hash: %s', e)
+            return False
+
+        return hmac.compare_digest(actualHash.encode('ascii'),
+                                   self._toBytes(expectedHash))
+
+
+class BcryptPasswordVerifier(PasswordVerifier):
+    """bcrypt password hashes.  Requires the bcrypt package
+
+    @cvar DEFAULT_ROUNDS: default cost factor for new hashes
+    @type DEFAULT_ROUNDS: int
+    """
+    DEFAULT_ROUNDS = 12
+
+    __slots__ = ('__rounds', '__bcrypt')
+
+    def __init__(self, rounds=DEFAULT_ROUNDS):
+        '''
+        @type rounds: int / basestring
+        @param rounds: cost factor for new passwords
+        @raise AuthNInterfaceConfigError: bcrypt package is not installed
+        '''
+        try:
+            import bcrypt
+        except ImportError as e:
+            raise AuthNInterfaceConfigError('bcrypt package is required for '
+                                            'bcrypt password hashes: %s' % e)
+        self.__bcrypt = bcrypt
+        self.__rounds = int(rounds)
+
+    def encode(self, password):
+        return self.__bcrypt.hashpw(self._toBytes(password),
+                            self.__bcrypt.gensalt(self.__rounds)).decode()
+
+    def verify(self, password, encodedPassword):
+        try:
+            return self.__bcrypt.checkpw(self._toBytes(password),
+                                         self._toBytes(encodedPassword))
+        except ValueError as e:
+            log.error('Stored password is not a bcrypt hash: %s', e)
+            return False
+
+
+class PasswordChecker(object):
+    """Run a password verifier on a bounded pool of worker threads.  At most
+    poolSize checks run at once and up to queueSize more wait for a free
+    worker.  Further checks are rejected straight away so that logins can't
+    exhaust the threads serving other requests.  Checkers with the same
+    settings share one pool so that copies unpickled from a session don't
+    each start their own threads
+
+    @cvar PASSWORD_VERIFIERS: verifier classes keyed by short name.  Other
+    verifiers may be set by giving their full class name
+    @type PASSWORD_VERIFIERS: dict
+    """
+    PASSWORD_VERIFIERS = {
+        'plain': PlainPasswordVerifier,
+        'md5': MD5PasswordVerifier,
+        'pbkdf2': PBKDF2PasswordVerifier,
+        'bcrypt': BcryptPasswordVerifier
+    }
+    DEFAULT_POOL_SIZE = 4
+    DEFAULT_QUEUE_SIZE = 16
+    DEFAULT_TIMEOUT = 30.
+
+    # Authentication interface options for the checker
+    PASSWORD_VERIFIER_OPTNAME = 'passwordVerifier'
+    POOL_SIZE_OPTNAME = 'passwordVerifierPoolSize'
+    QUEUE_SIZE_OPTNAME = 'passwordVerifierQueueSize'
+    TIMEOUT_OPTNAME = 'passwordVerifierTimeout'
+
+    __slots__ = (
+        '__verifierName',
+        '__verifier',
+        '__poolSize',
+        '__queueSize',
+        '__timeout',
+        '__executor',
+        '__workerSlots'
+    )
+
+    # Worker pools and their slots keyed by verifier, pool and queue size
+    _pools = {}
+    _poolsLock = Lock()
+
+    def __init__(self, verifier, poolSize=DEFAULT_POOL_SIZE,
+                 queueSize=DEFAULT_QUEUE_SIZE, timeout=DEFAULT_TIMEOUT):
+        '''
+        @type verifier: basestring
+        @param verifier: short name of a verifier e.g. "pbkdf2" or the full
+        class name of a PasswordVerifier derived type
+        @type poolSize: int / basestring
+        @param poolSize: number of worker threads
+        @type queueSize: int / basestring
+        @param queueSize: maximum number of checks waiting for a worker
+        @type timeout: int / float / basestring
+        @param timeout: time in seconds to wait for a check to complete
+        '''
+        self.__setup(verifier, int(poolSize), int(queueSize), float(timeout))
+
+    def __setup(self, verifierName, poolSize, queueSize, timeout):
+        verifierClass = PasswordChecker.PASSWORD_VERIFIERS.get(verifierName)
+        if verifierClass is not None:
+            verifier = verifierClass()
+        else:
+            try:
+                verifier = instantiateClass(verifierName, None,
+                                            objectType=PasswordVerifier)
+            except Exception as e:
+                raise AuthNInterfaceConfigError('Error loading password '
+                                                'verifier %r: %s' %
+                                                (verifierName, e))
+
+        if poolSize < 1:
+            raise AuthNInterfaceConfigError('Expecting a password verifier '
+                                            'pool size of at least 1; got %r'
+                                            % poolSize)
+
+        self.__verifierName = verifierName
+        self.__verifier = verifier
+        self.__poolSize = poolSize
+        self.__queueSize = queueSize
+        self.__timeout = timeout
+        self.__executor, self.__workerSlots = self._getPool(verifierName,
+                                                            poolSize,
+                                                            queueSize)
+
+    @classmethod
+    def _getPool(cls, verifierName, poolSize, queueSize):
+        '''Get the worker pool for the given settings, creating it on first
+        use
+
+        @rtype: tuple
+        @return: thread pool executor and semaphore bounding the number of
+        checks running or queued
+        '''
+        key = (verifierName, poolSize, queueSize)
+        with cls._poolsLock:
+            pool = cls._pools.get(key)
+            if pool is None:
+                pool = (ThreadPoolExecutor(
+                                    max_workers=poolSize,
+                                    thread_name_prefix='password-verifier'),
+                        BoundedSemaphore(poolSize + max(queueSize, 0)))
+                cls._pools[key] = pool
+
+        return pool
+
+    @classmethod
+    def fromProperties(cls, prop):
+        '''Make a checker from authentication interface settings
+
+        @type prop: dict
+        @param prop: authentication interface settings
+        @rtype: PasswordChecker / None
+        @return: new checker or None if no password verifier is set
+        '''
+        verifierName = prop.get(cls.PASSWORD_VERIFIER_OPTNAME)
+        if not verifierName:
+            return None
+
+        return cls(verifierName,
+                   poolSize=prop.get(cls.POOL_SIZE_OPTNAME,
+                                     cls.DEFAULT_POOL_SIZE),
+                   queueSize=prop.get(cls.QUEUE_SIZE_OPTNAME,
+                                      cls.DEFAULT_QUEUE_SIZE),
+                   timeout=prop.get(cls.TIMEOUT_OPTNAME, cls.DEFAULT_TIMEOUT))
+
+    @property
+    def verifier(self):
+        """Password verifier"""
+        return self.__verifier
+
+    def check(self, username, password, encodedPassword):
+        '''Check a password on a worker thread
+
+        @type username: basestring
+        @param username: username for log messages
+        @type password: basestring
+        @param password: password entered by the user
+        @type encodedPassword: basestring
+        @param encodedPassword: password as held in the user store
+        @raise AuthNInterfaceInvalidCredentials: password doesn't match
+        @raise AuthNInterfaceUnavailable: all workers are busy and the queue
+        is full or the check timed out
+        '''
+        if not self.__workerSlots.acquire(False):
+            log.warning('Rejecting password check for user %r: all %d '
+                        'password verifier workers are busy and %d checks '
+                        'are queued', username, self.__poolSize,
+                        self.__queueSize)
+            raise AuthNInterfaceUnavailable()
+
+        try:
+            future = self.__executor.submit(self.__verifier.verify,
+                                            password, encodedPassword)
+        except Exception:
+            self.__workerSlots.release()
+            raise
+
+        future.add_done_callback(lambda f: self.__workerSlots.release())
+
+        try:
+            verified = future.result(timeout=self.__timeout)
+
+        except TimeoutError:
+            log.error('Timed out after %r seconds checking password for '
+                      'user %r', self.__timeout, username)
+            raise AuthNInterfaceUnavailable()
+
+        if not verified:
+            raise AuthNInterfaceInvalidCredentials('Invalid password for '
+                                                   'user %r' % username)
+
+    def __getstate__(self):
+        '''Enable pickling - the worker pool is not pickled'''
+        return (self.__verifierName, self.__poolSize, self.__queueSize,
+                self.__timeout)
+
+    def __setstate__(self, state):
+        self.__setup(*state)
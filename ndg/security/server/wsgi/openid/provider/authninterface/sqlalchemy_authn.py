@@ -26,6 +26,8 @@ from ndg.security.common.utils import str2Bool as _str2Bool
 from ndg.security.server.wsgi.openid.provider.authninterface import (
     AbstractAuthNInterface, AuthNInterfaceInvalidCredentials,
     AuthNInterfaceRetrieveError, AuthNInterfaceConfigError)
+from ndg.security.server.wsgi.openid.provider.authninterface.password import \
+    PasswordChecker
 
 
 class SQLAlchemyAuthnInterface(AbstractAuthNInterface):
@@ -39,16 +41,24 @@ class SQLAlchemyAuthnInterface(AbstractAuthNInterface):
     CONNECTION_STRING_OPTNAME = 'connectionString'
     LOGON_SQLQUERY_OPTNAME = 'logonSqlQuery'
     USERNAME2USERIDENTIFIER_SQLQUERY_OPTNAME = 'username2UserIdentifierSqlQuery'
+    AUTHENTICATE_AND_RESOLVE_SQLQUERY_OPTNAME = \
+                                            'authenticateAndResolveSqlQuery'
     IS_MD5_ENCODED_PWD = 'isMD5EncodedPwd'
+    PASSWORD_SQLQUERY_OPTNAME = 'passwordSqlQuery'
 
     ATTR_NAMES = (
         CONNECTION_STRING_OPTNAME,
         LOGON_SQLQUERY_OPTNAME,
         USERNAME2USERIDENTIFIER_SQLQUERY_OPTNAME,
-        IS_MD5_ENCODED_PWD
+        AUTHENTICATE_AND_RESOLVE_SQLQUERY_OPTNAME,
+        IS_MD5_ENCODED_PWD,
+        PASSWORD_SQLQUERY_OPTNAME
     )
     __slots__ = tuple(["__%s" % name for name in ATTR_NAMES])
 
+    # Database engine is created on first use and not pickled
+    __slots__ += ('__engine', '__passwordChecker')
+
     def __init__(self, **prop):
         '''Instantiate object taking in settings from the input
         properties'''
@@ -57,7 +67,10 @@ class SQLAlchemyAuthnInterface(AbstractAuthNInterface):
         self.__connectionString = None
         self.__logonSqlQuery = None
         self.__username2UserIdentifierSqlQuery = None
+        self.__authenticateAndResolveSqlQuery = None
         self.__isMD5EncodedPwd = False
+        self.__passwordSqlQuery = None
+        self.__engine = None
 
         try:
             self.connectionString = prop[
@@ -75,6 +88,28 @@ class SQLAlchemyAuthnInterface(AbstractAuthNInterface):
             raise AuthNInterfaceConfigError("Initialisation from keywords: %s"%
                                             e)
 
+        # Optional query to check the password and get the user identifiers
+        # in one
+        authenticateAndResolveSqlQuery = prop.get(
+                SQLAlchemyAuthnInterface.AUTHENTICATE_AND_RESOLVE_SQLQUERY_OPTNAME)
+        if authenticateAndResolveSqlQuery:
+            self.authenticateAndResolveSqlQuery = \
+                                                authenticateAndResolveSqlQuery
+
+        # Optional verification of salted password hashes.  The stored
+        # password is fetched from the database and checked on a bounded
+        # pool of worker threads in place of the logon query
+        self.__passwordChecker = PasswordChecker.fromProperties(prop)
+        if self.__passwordChecker is not None:
+            try:
+                self.passwordSqlQuery = prop[
+                            SQLAlchemyAuthnInterface.PASSWORD_SQLQUERY_OPTNAME]
+            except KeyError as e:
+                raise AuthNInterfaceConfigError('"%s" option is required '
+                                                'with "%s" set' %
+                    (SQLAlchemyAuthnInterface.PASSWORD_SQLQUERY_OPTNAME,
+                     PasswordChecker.PASSWORD_VERIFIER_OPTNAME))
+
     def _getConnectionString(self):
         return self.__connectionString
 
@@ -85,6 +120,9 @@ class SQLAlchemyAuthnInterface(AbstractAuthNInterface):
                              type(value)))
         self.__connectionString = value
 
+        # Make a new engine for the new database on next use
+        self.__engine = None
+
     connectionString = property(fget=_getConnectionString,
                                 fset=_setConnectionString,
                                 doc="Database connection string")
@@ -121,6 +159,51 @@ class SQLAlchemyAuthnInterface(AbstractAuthNInterface):
                                     doc="SQL Query for OpenID user identifier "
                                         "look-up")
 
+    def _getAuthenticateAndResolveSqlQuery(self):
+        return self.__authenticateAndResolveSqlQuery
+
+    def _setAuthenticateAndResolveSqlQuery(self, value):
+        if value is not None and not isinstance(value, str):
+            raise TypeError('Expecting string or None type for "%s" '
+                            'attribute; got %r' %
+                            (SQLAlchemyAuthnInterface.
+                             AUTHENTICATE_AND_RESOLVE_SQLQUERY_OPTNAME,
+                             type(value)))
+        self.__authenticateAndResolveSqlQuery = value
+
+    authenticateAndResolveSqlQuery = property(
+                                    fget=_getAuthenticateAndResolveSqlQuery,
+                                    fset=_setAuthenticateAndResolveSqlQuery,
+                                    doc="SQL Query returning the OpenID user "
+                                        "identifiers for a given username "
+                                        "and password.  If not set, "
+                                        "authenticateAndResolve runs the "
+                                        "logon and user identifier queries "
+                                        "on the same connection")
+
+    def _getPasswordSqlQuery(self):
+        return self.__passwordSqlQuery
+
+    def _setPasswordSqlQuery(self, value):
+        if value is not None and not isinstance(value, str):
+            raise TypeError('Expecting string or None type for "%s" '
+                            'attribute; got %r' %
+                            (SQLAlchemyAuthnInterface.PASSWORD_SQLQUERY_OPTNAME,
+                             type(value)))
+        self.__passwordSqlQuery = value
+
+    passwordSqlQuery = property(fget=_getPasswordSqlQuery,
+                                fset=_setPasswordSqlQuery,
+                                doc="SQL Query returning the stored password "
+                                    "hash for a given username.  Used with "
+                                    "the passwordVerifier option")
+
+    @property
+    def passwordChecker(self):
+        """Checker for stored password hashes or None if passwords are
+        checked by the logon query"""
+        return self.__passwordChecker
+
     def _getIsMD5EncodedPwd(self):
         return self.__isMD5EncodedPwd
 
@@ -138,47 +221,54 @@ class SQLAlchemyAuthnInterface(AbstractAuthNInterface):
                                doc="Boolean set to True if password is MD5 "
                                    "encrypted")
 
-    def logon(self, environ, identityURI, username, password):
-        """Interface login method
-
-        @type environ: dict
-        @param environ: standard WSGI environ parameter
-
-        @type identityURI: basestring
-        @param identityURI: user's identity URL e.g.
-        'https://joebloggs.somewhere.ac.uk/'
-
-        @type username: basestring
-        @param username: username
+    def _getEngine(self):
+        """Get the database engine, creating it on first use.  Its connection
+        pool is shared by all queries
 
-        @type password: basestring
-        @param password: corresponding password for username given
-
-        @raise AuthNInterfaceInvalidCredentials: invalid username/password
-        @raise AuthNInterfaceUsername2IdentifierMismatch: no OpenID matching
-        the given username
+        @rtype: sqlalchemy.engine.Engine
+        @return: database engine
         @raise AuthNInterfaceConfigError: missing database engine plugin for
         SQLAlchemy
         """
-        if self.isMD5EncodedPwd:
+        if self.__engine is None:
             try:
-                _password = md5(password.encode('utf-8')).hexdigest()
-            except Exception as e:
-                raise AuthNInterfaceConfigError("%s exception raised making a "
-                                                "digest of the input "
-                                                "password: %s" %
-                                                (type(e),
-                                                 traceback.format_exc()))
-        else:
-            _password = password
+                self.__engine = create_engine(self.connectionString)
+            except ImportError as e:
+                raise AuthNInterfaceConfigError("Missing database engine for "
+                                                "SQLAlchemy: %s" % e)
+        return self.__engine
 
-        try:
-            dbEngine = create_engine(self.connectionString)
-        except ImportError as e:
-            raise AuthNInterfaceConfigError("Missing database engine for "
-                                            "SQLAlchemy: %s" % e)
-        connection = dbEngine.connect()
+    def _encodePassword(self, password):
+        """Make the password as stored in the database
 
+        @type password: basestring
+        @param password: password entered by the user
+        @rtype: basestring
+        @return: password or its MD5 digest if isMD5EncodedPwd is set
+        """
+        if not self.isMD5EncodedPwd:
+            return password
+
+        try:
+            return md5(password.encode('utf-8')).hexdigest()
+        except Exception as e:
+            raise AuthNInterfaceConfigError("%s exception raised making a "
+                                            "digest of the input "
+                                            "password: %s" %
+                                            (type(e),
+                                             traceback.format_exc()))
+
+    def _logonQuery(self, connection, username, _password):
+        """Check the username and encoded password against the database
+
+        @type connection: sqlalchemy.engine.Connection
+        @param connection: database connection
+        @type username: basestring
+        @param username: username
+        @type _password: basestring
+        @param _password: password encoded as stored in the database
+        @raise AuthNInterfaceInvalidCredentials: invalid username/password
+        """
         try:
             queryInputs = {
                 SQLAlchemyAuthnInterface.USERNAME_SQLQUERY_KEYNAME: username,
@@ -193,11 +283,11 @@ class SQLAlchemyAuthnInterface(AbstractAuthNInterface):
                  SQLAlchemyAuthnInterface.USERNAME_SQLQUERY_KEYNAME,
                  SQLAlchemyAuthnInterface.PASSWD_SQLQUERY_KEYNAME))
 
-
         try:
             filtered_query = sql.text(query)
-            result = connection.execute(filtered_query, username=username,
-                                        password=_password)
+            result = connection.execute(filtered_query,
+                                        {'username': username,
+                                         'password': _password})
             nEntries = int([r[0] for r in result][0])
 
         except (exc.ProgrammingError, exc.OperationalError):
@@ -207,8 +297,6 @@ class SQLAlchemyAuthnInterface(AbstractAuthNInterface):
             raise AuthNInterfaceRetrieveError("Expecting integer count result "
                                               "from login SQL query: %s" %
                                               traceback.format_exc())
-        finally:
-            connection.close()
 
         if nEntries < 1:
             raise AuthNInterfaceInvalidCredentials("Logon query %r: invalid "
@@ -219,6 +307,134 @@ class SQLAlchemyAuthnInterface(AbstractAuthNInterface):
                                                    "returned for query %r" %
                                                    query)
 
+    def _passwordQuery(self, connection, username):
+        """Get the user's stored password hash from the database
+
+        @type connection: sqlalchemy.engine.Connection
+        @param connection: database connection
+        @type username: basestring
+        @param username: username
+        @rtype: basestring
+        @return: password hash as stored in the database
+        @raise AuthNInterfaceInvalidCredentials: no entry for the user
+        """
+        try:
+            query = Template(self.passwordSqlQuery).substitute(
+                    {SQLAlchemyAuthnInterface.USERNAME_SQLQUERY_KEYNAME: username})
+
+        except KeyError as e:
+            raise AuthNInterfaceConfigError("Invalid key %r for password SQL "
+                "query string.  Valid key is %r" %
+                (e, SQLAlchemyAuthnInterface.USERNAME_SQLQUERY_KEYNAME))
+
+        try:
+            result = connection.execute(sql.text(query),
+                                        {'username': username})
+            rows = result.fetchall()
+
+        except (exc.ProgrammingError, exc.OperationalError):
+            raise AuthNInterfaceRetrieveError("Error with SQL: %s" %
+                                              traceback.format_exc())
+
+        if len(rows) != 1 or rows[0][0] is None:
+            raise AuthNInterfaceInvalidCredentials("Password query: expecting "
+                                                   "one entry for user %r; "
+                                                   "got %d" %
+                                                   (username, len(rows)))
+        return rows[0][0]
+
+    def _userIdentifiersQuery(self, connection, username, queryTmpl=None,
+                              _password=None):
+        """Query the database for the OpenID user identifiers for a user
+
+        @type connection: sqlalchemy.engine.Connection
+        @param connection: database connection
+        @type username: basestring
+        @param username: username
+        @type queryTmpl: basestring
+        @param queryTmpl: query to use.  Defaults to
+        username2UserIdentifierSqlQuery
+        @type _password: basestring
+        @param _password: password encoded as stored in the database for
+        queries which check it
+        @rtype: tuple
+        @return: user identifiers
+        @raise AuthNInterfaceInvalidCredentials: no identifiers found
+        """
+        if queryTmpl is None:
+            queryTmpl = self.username2UserIdentifierSqlQuery
+
+        queryInputs = {
+            SQLAlchemyAuthnInterface.USERNAME_SQLQUERY_KEYNAME: username
+        }
+        if _password is not None:
+            queryInputs[
+                SQLAlchemyAuthnInterface.PASSWD_SQLQUERY_KEYNAME] = _password
+
+        try:
+            query = Template(queryTmpl).substitute(queryInputs)
+
+        except KeyError as e:
+            raise AuthNInterfaceConfigError("Invalid key %r for user "
+                                            "identifier SQL query string.  "
+                                            "Valid keys are %r" %
+                                            (e, tuple(queryInputs.keys())))
+
+        try:
+            # Use SQL parameter substitution
+            filtered_query = sql.text(query)
+
+            result = connection.execute(filtered_query, queryInputs)
+            userIdentifiers = tuple([i[0] for i in result.fetchall()])
+
+        except (exc.ProgrammingError, exc.OperationalError):
+            raise AuthNInterfaceRetrieveError("Error with SQL query: %s" %
+                                              traceback.format_exc())
+
+        if len(userIdentifiers) == 0:
+            raise AuthNInterfaceInvalidCredentials('No entries for "%s" user' %
+                                                   username)
+
+        log.debug('username %r maps to OpenID identifiers: %r', username,
+                  userIdentifiers)
+
+        return userIdentifiers
+
+    def logon(self, environ, identityURI, username, password):
+        """Interface login method
+
+        @type environ: dict
+        @param environ: standard WSGI environ parameter
+
+        @type identityURI: basestring
+        @param identityURI: user's identity URL e.g.
+        'https://joebloggs.somewhere.ac.uk/'
+
+        @type username: basestring
+        @param username: username
+
+        @type password: basestring
+        @param password: corresponding password for username given
+
+        @raise AuthNInterfaceInvalidCredentials: invalid username/password
+        @raise AuthNInterfaceUsername2IdentifierMismatch: no OpenID matching
+        the given username
+        @raise AuthNInterfaceConfigError: missing database engine plugin for
+        SQLAlchemy
+        @raise AuthNInterfaceUnavailable: too many password checks in progress
+        """
+        if self.__passwordChecker is not None:
+            with self._getEngine().connect() as connection:
+                encodedPassword = self._passwordQuery(connection, username)
+
+            # Connection is returned to the pool before the slow check
+            self.__passwordChecker.check(username, password, encodedPassword)
+        else:
+            _password = self._encodePassword(password)
+
+            with self._getEngine().connect() as connection:
+                self._logonQuery(connection, username, _password)
+
         log.debug('Logon succeeded for user %r' % username)
 
     def logout(self):
@@ -249,54 +465,67 @@ class SQLAlchemyAuthnInterface(AbstractAuthNInterface):
         @raise AuthNInterfaceConfigError: missing database engine plugin for
         SQLAlchemy
         """
+        with self._getEngine().connect() as connection:
+            return self._userIdentifiersQuery(connection, username)
 
-        try:
-            dbEngine = create_engine(self.connectionString)
-        except ImportError as e:
-            raise AuthNInterfaceConfigError("Missing database engine for "
-                                            "SQLAlchemy: %s" % e)
-        connection = dbEngine.connect()
-
-        try:
-            queryInputs = {
-                SQLAlchemyAuthnInterface.USERNAME_SQLQUERY_KEYNAME: username,
-            }
-            queryTmpl = Template(self.username2UserIdentifierSqlQuery)
-            query = queryTmpl.substitute(queryInputs)
-
-        except KeyError as e:
-            raise AuthNInterfaceConfigError("Invalid key %r for username to "
-                                            "user identifier SQL query string. "
-                                            " The valid key is %r" % (e,
-                            SQLAlchemyAuthnInterface.USERNAME_SQLQUERY_KEYNAME))
-
-        try:
-            # Use SQL parameter substitution
-            filtered_query = sql.text(query)
-
-            result = connection.execute(filtered_query, username=username)
-            userIdentifiers = tuple([i[0] for i in result.fetchall()])
-
-        except (exc.ProgrammingError, exc.OperationalError):
-            raise AuthNInterfaceRetrieveError("Error with SQL query: %s" %
-                                              traceback.format_exc())
-        finally:
-            connection.close()
-
-        if len(userIdentifiers) == 0:
-            raise AuthNInterfaceInvalidCredentials('No entries for "%s" user' %
-                                                   username)
+    def authenticateAndResolve(self, environ, identityURI, username, password):
+        """Check the user's credentials and get their OpenID user identifiers
+        in one call.  If authenticateAndResolveSqlQuery is set, a single query
+        is made for identifiers matching the username and password, otherwise
+        the logon and user identifier queries are made on the same connection.
+        With a password verifier set, the stored password hash and the
+        identifiers are fetched together and the hash checked afterwards
 
-        log.debug('username %r maps to OpenID identifiers: %r', username,
-                  userIdentifiers)
+        @type environ: dict
+        @param environ: standard WSGI environ parameter
+        @type identityURI: basestring
+        @param identityURI: user's identity URL or None for ID Select mode
+        @type username: basestring
+        @param username: username
+        @type password: basestring
+        @param password: corresponding password for username given
+        @rtype: tuple
+        @return: identifiers to be used to make OpenID user identity URLs.
+        @raise AuthNInterfaceInvalidCredentials: invalid username/password or
+        no identifiers for the user
+        @raise AuthNInterfaceRetrieveError: error with database look-up
+        @raise AuthNInterfaceConfigError: missing database engine plugin for
+        SQLAlchemy
+        @raise AuthNInterfaceUnavailable: too many password checks in progress
+        """
+        if self.__passwordChecker is not None:
+            with self._getEngine().connect() as connection:
+                encodedPassword = self._passwordQuery(connection, username)
+                userIdentifiers = self._userIdentifiersQuery(connection,
+                                                             username)
+
+            self.__passwordChecker.check(username, password, encodedPassword)
+            log.debug('Logon succeeded for user %r' % username)
+            return userIdentifiers
+
+        _password = self._encodePassword(password)
+
+        with self._getEngine().connect() as connection:
+            if self.authenticateAndResolveSqlQuery:
+                userIdentifiers = self._userIdentifiersQuery(connection,
+                                    username,
+                                    queryTmpl=self.authenticateAndResolveSqlQuery,
+                                    _password=_password)
+            else:
+                self._logonQuery(connection, username, _password)
+                userIdentifiers = self._userIdentifiersQuery(connection,
+                                                             username)
 
+        log.debug('Logon succeeded for user %r' % username)
         return userIdentifiers
 
-
     def __getstate__(self):
         '''Enable pickling for use with beaker.session'''
         _dict = {}
         for attrName in SQLAlchemyAuthnInterface.__slots__:
+            if attrName == '__engine':
+                continue
+
             # Ugly hack to allow for derived classes setting private member
             # variables
             if attrName.startswith('__'):
@@ -308,5 +537,6 @@ class SQLAlchemyAuthnInterface(AbstractAuthNInterface):
 
     def __setstate__(self, attrDict):
         '''Enable pickling for use with beaker.session'''
+        self.__engine = None
         for attr, val in list(attrDict.items()):
             setattr(self, attr, val)
\ No newline at end of file
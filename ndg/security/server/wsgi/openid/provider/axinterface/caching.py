@@ -0,0 +1,153 @@
+"""NDG Security OpenID Provider AX Interface wrapper to cache the attributes
+returned by another AX Interface.  Use where attribute retrieval is expensive
+e.g. a database query or remote call, and users sign in to several Relying
+Parties in a short period
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import logging
+log = logging.getLogger(__name__)
+
+from openid.extensions import ax
+
+from ndg.security.server.utils.cache import LRUCache
+from ndg.security.server.wsgi.openid.provider.axinterface import AXInterface
+
+
+class CachingAXInterface(AXInterface):
+    """Cache the attribute values set by an AX Interface.  Entries are keyed
+    by the user's username and identity URI and by the attributes requested.
+    They expire after a timeout, the number of users cached is bounded and a
+    user's entries are discarded when they log in or out.  Errors raised by
+    the wrapped interface are not cached
+
+    @cvar DEFAULT_MAX_SIZE: default maximum number of users for whom
+    attributes are cached
+    @type DEFAULT_MAX_SIZE: int
+    @cvar DEFAULT_TIMEOUT: default time in seconds for which attributes are
+    cached
+    @type DEFAULT_TIMEOUT: float
+    """
+    DEFAULT_MAX_SIZE = 1000
+    DEFAULT_TIMEOUT = 300.
+
+    # Session keys - must match the OpenIDProviderMiddleware settings
+    USERNAME_SESSION_KEYNAME = 'username'
+    IDENTITY_URI_SESSION_KEYNAME = 'identityURI'
+
+    __slots__ = ('__axInterface', '__cache')
+
+    def __init__(self, axInterface, maxSize=DEFAULT_MAX_SIZE,
+                 timeout=DEFAULT_TIMEOUT):
+        '''
+        @param axInterface: AX Interface to cache the results of
+        @type axInterface: AXInterface
+        @param maxSize: maximum number of users for whom attributes are
+        cached
+        @type maxSize: int / basestring
+        @param timeout: time in seconds for which attributes are cached
+        @type timeout: int / float / basestring
+        '''
+        if not isinstance(axInterface, AXInterface):
+            raise TypeError('Expecting %r type for "axInterface"; got %r' %
+                            (AXInterface, type(axInterface)))
+
+        self.__axInterface = axInterface
+        self.__cache = LRUCache(maxSize=maxSize, timeout=timeout)
+
+    @property
+    def axInterface(self):
+        """AX Interface whose results are cached"""
+        return self.__axInterface
+
+    @property
+    def cache(self):
+        """Cache of attribute values keyed by username and identity URI"""
+        return self.__cache
+
+    @classmethod
+    def _makeUserKey(cls, authnCtx):
+        '''Make a cache key for the user from the session
+
+        @type authnCtx: dict like
+        @param authnCtx: session containing authentication context
+        @rtype: tuple / None
+        @return: cache key or None if no user is logged in
+        '''
+        username = authnCtx.get(cls.USERNAME_SESSION_KEYNAME)
+        if username is None:
+            return None
+
+        return (username, authnCtx.get(cls.IDENTITY_URI_SESSION_KEYNAME))
+
+    @staticmethod
+    def _makeRequestKey(ax_req):
+        '''Make a cache key for the attributes requested
+
+        @type ax_req: openid.extensions.ax.FetchRequest
+        @param ax_req: attribute exchange request object
+        @rtype: frozenset
+        @return: requested attribute type URIs with their required flag and
+        count
+        '''
+        return frozenset([(typeURI, attrInfo.required, attrInfo.count)
+                          for typeURI, attrInfo in
+                          ax_req.requested_attributes.items()])
+
+    def __call__(self, ax_req, ax_resp, authnInterface, authnCtx):
+        """Set the requested attributes in ax_resp from the cache or
+        otherwise by calling the wrapped AX Interface
+
+        @type ax_req: openid.extensions.ax.FetchRequest
+        @param ax_req: attribute exchange request object
+        @type ax_resp: openid.extensions.ax.FetchResponse
+        @param ax_resp: attribute exchange response object
+        @type authnInterface: AbstractAuthNInterface
+        @param authnInterface: custom authentication interface set at login
+        @type authnCtx: dict like
+        @param authnCtx: session containing authentication context information
+        such as username and OpenID user identifier URI snippet
+        """
+        userKey = self._makeUserKey(authnCtx)
+        if userKey is None:
+            # Leave the wrapped interface to report a missing user
+            return self.__axInterface(ax_req, ax_resp, authnInterface,
+                                      authnCtx)
+
+        requestKey = self._makeRequestKey(ax_req)
+        userEntries = self.__cache.get(userKey) or {}
+        data = userEntries.get(requestKey)
+        if data is None:
+            tmpResp = ax.FetchResponse(request=ax_req)
+            self.__axInterface(ax_req, tmpResp, authnInterface, authnCtx)
+
+            data = dict([(typeURI, tuple(values))
+                         for typeURI, values in tmpResp.data.items()])
+
+            # Copy so that concurrent updates for the same user can't
+            # modify an entry another thread is reading
+            userEntries = dict(userEntries)
+            userEntries[requestKey] = data
+            self.__cache.set(userKey, userEntries)
+        else:
+            log.debug("Using cached AX attributes for user %r", userKey[0])
+
+        for typeURI, values in data.items():
+            ax_resp.setValues(typeURI, list(values))
+
+    def invalidate(self, authnCtx):
+        '''Discard cached attributes for the user logged in to the given
+        session
+
+        @type authnCtx: dict like
+        @param authnCtx: session containing authentication context
+        '''
+        userKey = self._makeUserKey(authnCtx)
+        if userKey is not None:
+            self.__cache.pop(userKey)
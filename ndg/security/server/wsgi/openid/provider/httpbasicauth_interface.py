@@ -14,20 +14,28 @@ log = logging.getLogger(__name__)
 _debugLevel = log.getEffectiveLevel() <= logging.DEBUG
 
 import paste.request
-from paste.httpexceptions import HTTPUnauthorized
+from paste.httpexceptions import HTTPUnauthorized, HTTPServiceUnavailable
 
-from ndg.security.server.wsgi.httpbasicauth import HttpBasicAuthMiddleware
+from ndg.security.server.wsgi.httpbasicauth import (HttpBasicAuthMiddleware,
+                                              HttpBasicAuthCredentialCache)
 from ndg.security.server.wsgi.openid.provider import (
                                         OpenIDProviderMiddleware,
                                         OpenIDProviderReloginRequired,
                                         OpenIDProviderMissingRequiredAXAttrs,
                                         OpenIDProviderMissingAXResponseHandler,
                                         AuthNInterfaceInvalidCredentials,
+                                        AuthNInterfaceUnavailable,
                                         AuthNInterfaceError)
 
 
 class OpenIDProviderWithHttpBasicAuthMiddleware(OpenIDProviderMiddleware):
-    '''OpenID Provider with support for HTTP Basic Auth'''
+    '''OpenID Provider with support for HTTP Basic Auth
+    
+    @cvar credential_cache: optional cache of verified credentials configured
+    with the HTTP Basic Auth middleware settings.  Set by app_factory
+    @type credential_cache: HttpBasicAuthCredentialCache / None
+    '''
+    credential_cache = None
     
     @classmethod
     def app_factory(cls, app_conf, **local_conf):
@@ -45,6 +53,14 @@ class OpenIDProviderWithHttpBasicAuthMiddleware(OpenIDProviderMiddleware):
         # the same authentication settings as the OpenID Provider
         basic_auth_filter.authentication_callback = \
                                     openidprovider_app.authentication_callback
+        
+        # The authentication callback sets the OpenID response for every
+        # request so the filter can't skip it.  Move any cache of verified
+        # credentials configured for the filter to the provider instead so
+        # that it's applied when the callback authenticates the user
+        openidprovider_app.credential_cache = \
+                                    basic_auth_filter.credential_cache
+        basic_auth_filter.credential_cache = None
                                     
         # Set intercept path for HTTP Basic Auth filter - it should correspond 
         # to the OpenID provider endpoint
@@ -63,14 +79,15 @@ class OpenIDProviderWithHttpBasicAuthMiddleware(OpenIDProviderMiddleware):
             It applies the same authentication procedure as used with the 
             browser-based interface but tailored for scripted clients
             '''
-            self._authenticate(environ, username, password)
+            user_identifiers = self._authenticate(environ, username, password)
             
             query_params = dict(paste.request.parse_formvars(environ))
             oid_request = self.oidserver.decodeRequest(query_params)
             
             identity_uri = self._resolve_and_validate_identity_uri(environ, 
                                                                    oid_request, 
-                                                                   username)
+                                                                   username,
+                                            user_identifiers=user_identifiers)
             
             response = self._set_response(environ, start_response, oid_request,
                                           identity_uri)
@@ -80,20 +97,23 @@ class OpenIDProviderWithHttpBasicAuthMiddleware(OpenIDProviderMiddleware):
         return authenticate
 
     def _resolve_and_validate_identity_uri(self, environ, oid_request, 
-                                           username):
-        '''Get OpenID identity URI and check against credentials provided
+                                           username, user_identifiers=None):
+        '''Get OpenID identity URI and check against credentials provided.
+        user_identifiers may be passed if they were already retrieved at
+        authentication
         '''
-        if oid_request.idSelect():
-            # ID select mode enables the user to request specifying
-            # their OpenID Provider without giving a personal user URL 
+        if user_identifiers is None:
             try:
                 user_identifiers = self._authN.username2UserIdentifiers(
-                                                            environ, username)    
+                                                            environ, username)
             except AuthNInterfaceInvalidCredentials:
                 log.error("No username %r matching an OpenID URL: %s",
                           username, traceback.format_exc())
                 raise
 
+        if oid_request.idSelect():
+            # ID select mode enables the user to request specifying
+            # their OpenID Provider without giving a personal user URL 
             if not isinstance(user_identifiers, (list, tuple)):
                 raise TypeError("Unexpected type %r returned from %r for "
                                 "user identifiers; expecting list or tuple" % 
@@ -111,14 +131,6 @@ class OpenIDProviderWithHttpBasicAuthMiddleware(OpenIDProviderMiddleware):
             # Check the username used to login with matches the identity URI 
             # given.  This check is essential otherwise a user could impersonate
             # someone else with an account with this provider
-            try:
-                user_identifiers = self._authN.username2UserIdentifiers(
-                                                            environ, username)          
-            except AuthNInterfaceInvalidCredentials:
-                log.error("No username %r matching an OpenID URL: %s",
-                          username, traceback.format_exc())
-                raise
-                
             expected_identity_uri = self.createIdentityURI(self.identityUriTmpl,
                                                            user_identifiers[0])
             if identity_uri != expected_identity_uri:
@@ -131,22 +143,53 @@ class OpenIDProviderWithHttpBasicAuthMiddleware(OpenIDProviderMiddleware):
         return identity_uri
 
     def _authenticate(self, environ, username, password):
+        '''Log the user in.  If the authentication interface supports it, the
+        user identifiers are retrieved in the same call
+        
+        @rtype: tuple / None
+        @return: user identifiers or None if they were not retrieved
+        '''
         self.session = environ.get(self.session_mware_environ_keyname, {})
         if (OpenIDProviderMiddleware.USERNAME_SESSION_KEYNAME in self.session):
             # user is already logged in
-            return
+            return None
         
         identity_uri = None
+        user_identifiers = None
         
         if None in (username, password):
             raise HTTPUnauthorized()
         
+        credential_cache = self.credential_cache
+        if credential_cache is not None:
+            # Cached value is a tuple of the user identifiers or None if
+            # they weren't retrieved at authentication
+            cached = credential_cache.get(username, password)
+            if cached is not None:
+                log.debug("Using cached credentials for user %r", username)
+                return self._set_authenticated_user(environ, username, 
+                                                    cached[0])
+        
+        authenticate_and_resolve = getattr(self._authN, 
+                                           'authenticateAndResolve', None)
+        
         # Invoke custom authentication interface plugin
         try:
-            self._authN.logon(environ, identity_uri, username, password)
+            if authenticate_and_resolve is not None:
+                user_identifiers = authenticate_and_resolve(environ, 
+                                                            identity_uri, 
+                                                            username, 
+                                                            password)
+            else:
+                self._authN.logon(environ, identity_uri, username, password)
+            
+        except AuthNInterfaceUnavailable:
+            raise HTTPServiceUnavailable(headers=[('Retry-After', '5')])
             
         except AuthNInterfaceError as e:
             log.error("Authentication error: %s", traceback.format_exc())
+            if credential_cache is not None:
+                credential_cache.invalidate(username)
 
             raise HTTPUnauthorized()
                            
@@ -156,6 +199,18 @@ class OpenIDProviderWithHttpBasicAuthMiddleware(OpenIDProviderMiddleware):
                       traceback.format_exc())
             raise
         
+        if credential_cache is not None:
+            credential_cache.set(username, password, (user_identifiers,))
+            
+        return self._set_authenticated_user(environ, username, 
+                                            user_identifiers)
+    
+    def _set_authenticated_user(self, environ, username, user_identifiers):
+        '''Record the authenticated user in environ and the session
+        
+        @rtype: tuple / None
+        @return: user identifiers passed in
+        '''
         # Set user in environ
         environ['REMOTE_USER'] = username
         
@@ -164,6 +219,8 @@ class OpenIDProviderWithHttpBasicAuthMiddleware(OpenIDProviderMiddleware):
             ] = username
         self.session.save()
         
+        return user_identifiers
+        
     def _set_response(self, environ, start_response, oid_request, identity_uri):
         '''Add Attribute exchange parameters to the response if OpenID Relying
         Party requested them
@@ -26,6 +26,9 @@ from ndg.security.server.wsgi.openid.provider import (RenderingInterface,
     RenderingInterfaceConfigError)
     
 from ndg.security.server.wsgi.openid.provider import OpenIDProviderMiddleware
+from ndg.security.server.utils.cache import LRUCache
+from ndg.security.server.utils.genshi_utils import createTemplateLoader
+from ndg.security.common.utils import str2Bool
 
 
 class GenshiRendering(RenderingInterface):
@@ -67,7 +70,9 @@ class GenshiRendering(RenderingInterface):
         'environ',
         'identityURI',
         'oidRequest',
-        'oidResponse'
+        'oidResponse',
+        'templateAutoReload',
+        'renderCache'
     )
     __slots__ = tuple(["__%s" % name for name in ATTR_NAMES])
 
@@ -86,6 +91,10 @@ class GenshiRendering(RenderingInterface):
     REJECT_RP_SUBMIT = OpenIDProviderMiddleware.REJECT_RP_SUBMIT
 
     DEFAULT_TEMPLATES_DIR = path.join(path.dirname(__file__), 'templates')
+    
+    # Maximum number of rendered pages kept for pages which are the same for
+    # every request for a given user e.g. the main page
+    DEFAULT_RENDER_CACHE_SIZE = 1000
 
    
     def __init__(self, *arg, **opt):
@@ -98,6 +107,10 @@ class GenshiRendering(RenderingInterface):
         @param **opt: additional keywords to set-up Genshi rendering'''
         super(GenshiRendering, self).__init__(*arg, **opt)
         
+        self.__templateAutoReload = False
+        self.__renderCache = LRUCache(
+                                maxSize=GenshiRendering.DEFAULT_RENDER_CACHE_SIZE)
+        
         # Initialise attributes
         for i in self.__class__.PROPERTY_NAMES:
             setattr(self, i, self.__class__.PROPERTY_DEFAULTS[i])
@@ -109,7 +122,10 @@ class GenshiRendering(RenderingInterface):
         if not self.templateRootDir:
             self.templateRootDir = GenshiRendering.DEFAULT_TEMPLATES_DIR
          
-        self.__loader = TemplateLoader(self.templateRootDir, auto_reload=True)
+        # Templates are compiled up front and held in memory unless reloading
+        # of modified template files has been explicitly enabled
+        self.__loader = createTemplateLoader(self.templateRootDir,
+                                    autoReload=self.templateAutoReload)
         
         self.title = ''
         self.heading = ''
@@ -126,6 +142,39 @@ class GenshiRendering(RenderingInterface):
         self.__environ = None
         self.__trust_root = None
 
+    def _getTemplateAutoReload(self):
+        return self.__templateAutoReload
+
+    def _setTemplateAutoReload(self, value):
+        if isinstance(value, bool):
+            self.__templateAutoReload = value
+        elif isinstance(value, str):
+            self.__templateAutoReload = str2Bool(value)
+        else:
+            raise TypeError('Expecting bool or string type for '
+                            '"templateAutoReload" attribute; got %r' % 
+                            type(value))
+
+    templateAutoReload = property(_getTemplateAutoReload, 
+                                  _setTemplateAutoReload,
+                                  doc="Reload templates when their files are "
+                                      "modified.  Use for development only - "
+                                      "it adds a file system check to every "
+                                      "render and disables caching of "
+                                      "rendered pages.  Defaults to False")
+
+    def _getRenderCacheSize(self):
+        return self.__renderCache.maxSize
+
+    def _setRenderCacheSize(self, value):
+        self.__renderCache.maxSize = value
+        
+    renderCacheSize = property(_getRenderCacheSize, _setRenderCacheSize,
+                               doc="Maximum number of rendered pages to keep "
+                                   "for pages which are the same for every "
+                                   "request for a given user.  Set to zero "
+                                   "to disable")
+
     def getEnviron(self):
         return self.__environ
 
@@ -296,6 +345,38 @@ class GenshiRendering(RenderingInterface):
         rendering = tmpl.generate(**kw).render(method=method, doctype=doctype)
         
         return rendering
+    
+    def _isXrdsCacheable(self):
+        """Yadis documents are rendered afresh when templates may be modified
+        
+        @rtype: bool
+        @return: True if rendered Yadis documents may be reused
+        """
+        return not self.templateAutoReload
+    
+    def _renderCached(self, cacheKey, templateName, **kw):
+        '''Render a page which depends only on configuration and the given
+        cache key, reusing the last rendering for the key if available
+        
+        @type cacheKey: tuple
+        @param cacheKey: key identifying this rendering e.g. template name and
+        user identifier
+        @type templateName: basestring
+        @param templateName: name of template file to load
+        @type kw: dict
+        @param kw: keywords to pass to _render
+        @rtype: string
+        @return: rendered template
+        '''
+        if self.templateAutoReload:
+            return self._render(templateName, **kw)
+        
+        rendering = self.__renderCache.get(cacheKey)
+        if rendering is None:
+            rendering = self._render(templateName, **kw)
+            self.__renderCache.set(cacheKey, rendering)
+            
+        return rendering
 
     def yadis(self, environ, start_response):
         """Render Yadis document containing user URL - override base 
@@ -322,15 +403,18 @@ class GenshiRendering(RenderingInterface):
                          endpoint_url=self.urls['url_openidserver'], 
                          user_url=user_url)
         
-        response = self._render(self.__class__.YADIS_TMPL_NAME, 
+        def renderXrds():
+            return self._render(self.__class__.YADIS_TMPL_NAME, 
                                 method='xml',
                                 doctype=None,
                                 **yadisDict)
      
-        start_response('200 OK',
-                       [('Content-type', 'application/xrds+xml'+self.charset),
-                        ('Content-length', str(len(response)))])
-        return response
+        return self._xrdsResponse(environ, start_response,
+                                  (self.__class__.YADIS_TMPL_NAME, 
+                                   userIdentifier),
+                                  renderXrds,
+                                  contentType=(self.XRDS_CONTENT_TYPE +
+                                               self.charset))
     
     def serverYadis(self, environ, start_response):
         '''Render Yadis info for ID Select mode request - Override base 
@@ -350,15 +434,15 @@ class GenshiRendering(RenderingInterface):
             'endpoint_url': endpoint_url
         }
         
-        response = self._render(self.__class__.SERVER_YADIS_TMPL_NAME, 
+        def renderXrds():
+            return self._render(self.__class__.SERVER_YADIS_TMPL_NAME, 
                                 method='xml',
                                 doctype=None,
                                 **_dict)
              
-        start_response("200 OK",
-                       [('Content-type', 'application/xrds+xml'),
-                        ('Content-length', str(len(response)))])
-        return response 
+        return self._xrdsResponse(environ, start_response,
+                                  (self.__class__.SERVER_YADIS_TMPL_NAME,),
+                                  renderXrds)
     
     def login(self, environ, start_response, success_to=None, fail_to=None, 
               msg=''):
@@ -383,7 +467,14 @@ class GenshiRendering(RenderingInterface):
         self.headExtras = '<meta http-equiv="x-xrds-location" content="%s"/>'%\
                         self.urls['url_serveryadis']
     
-        response = self._render(GenshiRendering.MAIN_PAGE_TMPL_NAME)
+        # The main page differs only in the logged in user name
+        if self.xml:
+            response = self._render(GenshiRendering.MAIN_PAGE_TMPL_NAME)
+        else:
+            username = (self.session or {}).get('username')
+            response = self._renderCached((GenshiRendering.MAIN_PAGE_TMPL_NAME,
+                                           username),
+                                          GenshiRendering.MAIN_PAGE_TMPL_NAME)
         start_response('200 OK', 
                        [('Content-type', 'text/html'+self.charset),
                         ('Content-length', str(len(response)))])
@@ -0,0 +1,107 @@
+"""WSGI Middleware components - OpenID Provider package association and nonce
+store plugins sub-package.  Set a store with the openid.provider.store_class
+option and its settings with openid.provider.store.* options.  If none is set,
+the Provider uses a python-openid FileOpenIDStore in the directory given by
+openid.provider.consumer_store_dirpath
+
+NERC DataGrid Project"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import logging
+log = logging.getLogger(__name__)
+
+from threading import Thread, Event
+
+from openid.store.interface import OpenIDStore
+
+
+class OpenIDStoreError(Exception):
+    """Base class for OpenID Provider store errors"""
+
+
+class OpenIDStoreConfigError(OpenIDStoreError):
+    """OpenID Provider store configuration error"""
+
+
+class ExpiringOpenIDStore(OpenIDStore):
+    """Base class for OpenID stores which remove expired associations and
+    nonces in a background thread.  Derived classes implement the
+    python-openid store interface
+
+    @cvar DEFAULT_CLEANUP_INTERVAL: default time in seconds between removals
+    of expired associations and nonces
+    @type DEFAULT_CLEANUP_INTERVAL: float
+    """
+    DEFAULT_CLEANUP_INTERVAL = 300.
+    CLEANUP_INTERVAL_OPTNAME = 'cleanupInterval'
+
+    def __init__(self, cleanupInterval=DEFAULT_CLEANUP_INTERVAL):
+        '''
+        @param cleanupInterval: time in seconds between removals of expired
+        associations and nonces.  Set to zero to disable the background thread
+        @type cleanupInterval: int / float / basestring
+        '''
+        self.__cleanupInterval = None
+        self.__stopEvent = Event()
+        self.__cleanupThread = None
+
+        self.cleanupInterval = cleanupInterval
+
+    def _getCleanupInterval(self):
+        return self.__cleanupInterval
+
+    def _setCleanupInterval(self, value):
+        if isinstance(value, (int, float, str)):
+            self.__cleanupInterval = float(value)
+        else:
+            raise TypeError('Expecting int, float or string type for "%s" '
+                            'attribute; got %r' %
+                            (ExpiringOpenIDStore.CLEANUP_INTERVAL_OPTNAME,
+                             type(value)))
+
+    cleanupInterval = property(fget=_getCleanupInterval,
+                               fset=_setCleanupInterval,
+                               doc="Time in seconds between removals of "
+                                   "expired associations and nonces.  Zero "
+                                   "disables background removal")
+
+    def startCleanup(self):
+        '''Start the background thread removing expired associations and
+        nonces.  Derived classes call this at the end of their initialisation.
+        It has no effect if the cleanup interval is zero or the thread is
+        already running
+        '''
+        if self.__cleanupInterval <= 0. or self.__cleanupThread is not None:
+            return
+
+        self.__stopEvent.clear()
+        self.__cleanupThread = Thread(target=self._runCleanup,
+                                      name='%s-cleanup' %
+                                           self.__class__.__name__)
+        self.__cleanupThread.daemon = True
+        self.__cleanupThread.start()
+
+    def stopCleanup(self):
+        '''Stop the background cleanup thread'''
+        if self.__cleanupThread is None:
+            return
+
+        self.__stopEvent.set()
+        self.__cleanupThread.join(self.__cleanupInterval)
+        self.__cleanupThread = None
+
+    def _runCleanup(self):
+        while not self.__stopEvent.wait(self.__cleanupInterval):
+            try:
+                nNonces, nAssociations = self.cleanup()
+                log.debug('%s removed %d expired nonce(s) and %d expired '
+                          'association(s)', self.__class__.__name__, nNonces,
+                          nAssociations)
+
+            except Exception:
+                log.exception('Error removing expired associations and nonces '
+                              'from %s', self.__class__.__name__)
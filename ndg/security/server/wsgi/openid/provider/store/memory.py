@@ -0,0 +1,176 @@
+"""NDG Security OpenID Provider in-memory association and nonce store for
+single node deployments
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import logging
+log = logging.getLogger(__name__)
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from openid.store import nonce
+
+from ndg.security.server.wsgi.openid.provider.store import ExpiringOpenIDStore
+
+
+class LRUOpenIDStore(ExpiringOpenIDStore):
+    """Keep associations and nonces in memory.  The number of entries is
+    bounded - when full, the least recently used association or the oldest
+    nonce is discarded.  Associations are not shared between processes so
+    this store is only suitable for a Provider running in a single process
+
+    @cvar DEFAULT_MAX_ASSOCIATIONS: default maximum number of associations held
+    @type DEFAULT_MAX_ASSOCIATIONS: int
+    @cvar DEFAULT_MAX_NONCES: default maximum number of nonces held
+    @type DEFAULT_MAX_NONCES: int
+    """
+    DEFAULT_MAX_ASSOCIATIONS = 10000
+    DEFAULT_MAX_NONCES = 100000
+
+    MAX_ASSOCIATIONS_OPTNAME = 'maxAssociations'
+    MAX_NONCES_OPTNAME = 'maxNonces'
+
+    def __init__(self, maxAssociations=DEFAULT_MAX_ASSOCIATIONS,
+                 maxNonces=DEFAULT_MAX_NONCES, **kw):
+        '''
+        @param maxAssociations: maximum number of associations held
+        @type maxAssociations: int / basestring
+        @param maxNonces: maximum number of nonces held
+        @type maxNonces: int / basestring
+        @param kw: ExpiringOpenIDStore settings
+        @type kw: dict
+        '''
+        super(LRUOpenIDStore, self).__init__(**kw)
+
+        self.__lock = Lock()
+
+        # (server URL, handle) -> association, least recently used first
+        self.__associations = OrderedDict()
+
+        # (server URL, timestamp, salt) -> None, oldest first
+        self.__nonces = OrderedDict()
+
+        self.__maxAssociations = None
+        self.maxAssociations = maxAssociations
+        self.__maxNonces = None
+        self.maxNonces = maxNonces
+
+        self.startCleanup()
+
+    def _getMaxAssociations(self):
+        return self.__maxAssociations
+
+    def _setMaxAssociations(self, value):
+        if isinstance(value, (int, str)):
+            self.__maxAssociations = int(value)
+        else:
+            raise TypeError('Expecting int or string type for "%s" '
+                            'attribute; got %r' %
+                            (LRUOpenIDStore.MAX_ASSOCIATIONS_OPTNAME,
+                             type(value)))
+
+    maxAssociations = property(fget=_getMaxAssociations,
+                               fset=_setMaxAssociations,
+                               doc="Maximum number of associations held")
+
+    def _getMaxNonces(self):
+        return self.__maxNonces
+
+    def _setMaxNonces(self, value):
+        if isinstance(value, (int, str)):
+            self.__maxNonces = int(value)
+        else:
+            raise TypeError('Expecting int or string type for "%s" '
+                            'attribute; got %r' %
+                            (LRUOpenIDStore.MAX_NONCES_OPTNAME, type(value)))
+
+    maxNonces = property(fget=_getMaxNonces,
+                         fset=_setMaxNonces,
+                         doc="Maximum number of nonces held")
+
+    def storeAssociation(self, server_url, association):
+        key = (server_url, association.handle)
+        with self.__lock:
+            self.__associations[key] = association
+            self.__associations.move_to_end(key)
+
+            while len(self.__associations) > self.__maxAssociations:
+                self.__associations.popitem(last=False)
+
+    def getAssociation(self, server_url, handle=None):
+        with self.__lock:
+            if handle is not None:
+                key = (server_url, handle)
+                association = self.__associations.get(key)
+                if association is None:
+                    return None
+
+                if association.expiresIn == 0:
+                    del self.__associations[key]
+                    return None
+
+                self.__associations.move_to_end(key)
+                return association
+
+            # No handle - return the most recently issued association for the
+            # server URL.  The Provider always passes a handle so this scan is
+            # only made by consumers
+            best = None
+            for (url, _handle), association in self.__associations.items():
+                if url != server_url or association.expiresIn == 0:
+                    continue
+
+                if best is None or association.issued > best.issued:
+                    best = association
+
+            if best is not None:
+                self.__associations.move_to_end((server_url, best.handle))
+
+            return best
+
+    def removeAssociation(self, server_url, handle):
+        with self.__lock:
+            return self.__associations.pop((server_url, handle),
+                                           None) is not None
+
+    def useNonce(self, server_url, timestamp, salt):
+        if abs(timestamp - time.time()) > nonce.SKEW:
+            return False
+
+        key = (server_url, int(timestamp), salt)
+        with self.__lock:
+            if key in self.__nonces:
+                return False
+
+            self.__nonces[key] = None
+            while len(self.__nonces) > self.__maxNonces:
+                self.__nonces.popitem(last=False)
+
+            return True
+
+    def cleanupNonces(self):
+        now = time.time()
+        with self.__lock:
+            expired = [key for key in self.__nonces
+                       if abs(key[1] - now) > nonce.SKEW]
+            for key in expired:
+                del self.__nonces[key]
+
+        return len(expired)
+
+    def cleanupAssociations(self):
+        with self.__lock:
+            expired = [key for key, association in self.__associations.items()
+                       if association.expiresIn == 0]
+            for key in expired:
+                del self.__associations[key]
+
+        return len(expired)
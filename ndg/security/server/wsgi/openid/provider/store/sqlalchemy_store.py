@@ -0,0 +1,202 @@
+"""NDG Security OpenID Provider association and nonce store for the
+SQLAlchemy database toolkit.  Use with a database shared between Provider
+processes and nodes in place of the default file based store
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import logging
+log = logging.getLogger(__name__)
+
+import time
+
+from sqlalchemy import (create_engine, exc, MetaData, Table, Column, Integer,
+                        String, LargeBinary, select, and_)
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from openid.association import Association
+from openid.store import nonce
+
+from ndg.security.common.utils import str2Bool
+from ndg.security.server.wsgi.openid.provider.store import (
+    ExpiringOpenIDStore, OpenIDStoreConfigError)
+
+
+class SQLAlchemyOpenIDStore(ExpiringOpenIDStore):
+    """Keep associations and nonces in a database accessed via a pooled
+    SQLAlchemy engine.  The engine is created once and its connections reused
+    between requests
+
+    @cvar DEFAULT_POOL_SIZE: default number of connections kept in the pool
+    @type DEFAULT_POOL_SIZE: int
+    @cvar DEFAULT_MAX_OVERFLOW: default number of connections which may be
+    opened in addition to the pool size under load
+    @type DEFAULT_MAX_OVERFLOW: int
+    @cvar DEFAULT_POOL_RECYCLE: default time in seconds after which pooled
+    connections are replaced
+    @type DEFAULT_POOL_RECYCLE: int
+    """
+    DEFAULT_POOL_SIZE = 5
+    DEFAULT_MAX_OVERFLOW = 10
+    DEFAULT_POOL_RECYCLE = 3600
+    DEFAULT_ASSOCIATIONS_TABLE = 'oid_associations'
+    DEFAULT_NONCES_TABLE = 'oid_nonces'
+
+    CONNECTION_STRING_OPTNAME = 'connectionString'
+
+    def __init__(self, connectionString=None,
+                 poolSize=DEFAULT_POOL_SIZE,
+                 maxOverflow=DEFAULT_MAX_OVERFLOW,
+                 poolRecycle=DEFAULT_POOL_RECYCLE,
+                 associationsTable=DEFAULT_ASSOCIATIONS_TABLE,
+                 noncesTable=DEFAULT_NONCES_TABLE,
+                 createTables=True,
+                 **kw):
+        '''
+        @param connectionString: SQLAlchemy database URL
+        @type connectionString: basestring
+        @param poolSize: number of connections kept in the pool
+        @type poolSize: int / basestring
+        @param maxOverflow: number of connections which may be opened in
+        addition to the pool size under load
+        @type maxOverflow: int / basestring
+        @param poolRecycle: time in seconds after which pooled connections are
+        replaced
+        @type poolRecycle: int / basestring
+        @param associationsTable: name of associations table
+        @type associationsTable: basestring
+        @param noncesTable: name of nonces table
+        @type noncesTable: basestring
+        @param createTables: create the tables if they don't exist
+        @type createTables: bool / basestring
+        @param kw: ExpiringOpenIDStore settings
+        @type kw: dict
+        @raise OpenIDStoreConfigError: missing connection string or database
+        engine
+        '''
+        super(SQLAlchemyOpenIDStore, self).__init__(**kw)
+
+        if not connectionString:
+            raise OpenIDStoreConfigError('No "%s" setting for OpenID store' %
+                            SQLAlchemyOpenIDStore.CONNECTION_STRING_OPTNAME)
+
+        try:
+            # Pool size settings apply only to engines with a queue pool.
+            # Others such as SQLite in-memory databases reject them
+            url = make_url(connectionString)
+            engineKw = {}
+            if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+                engineKw['pool_size'] = int(poolSize)
+                engineKw['max_overflow'] = int(maxOverflow)
+
+            self.__engine = create_engine(url,
+                                          pool_recycle=int(poolRecycle),
+                                          pool_pre_ping=True,
+                                          **engineKw)
+        except ImportError as e:
+            raise OpenIDStoreConfigError("Missing database engine for "
+                                         "SQLAlchemy: %s" % e)
+
+        metadata = MetaData()
+        self.__associations = Table(associationsTable, metadata,
+            Column('server_url', String(2047), primary_key=True),
+            Column('handle', String(255), primary_key=True),
+            Column('secret', LargeBinary(128), nullable=False),
+            Column('issued', Integer, nullable=False),
+            Column('lifetime', Integer, nullable=False),
+            Column('assoc_type', String(64), nullable=False))
+
+        self.__nonces = Table(noncesTable, metadata,
+            Column('server_url', String(2047), primary_key=True),
+            Column('timestamp', Integer, primary_key=True),
+            Column('salt', String(40), primary_key=True))
+
+        if isinstance(createTables, str):
+            createTables = str2Bool(createTables)
+
+        if createTables:
+            metadata.create_all(self.__engine)
+
+        self.startCleanup()
+
+    @property
+    def engine(self):
+        """SQLAlchemy engine"""
+        return self.__engine
+
+    def storeAssociation(self, server_url, association):
+        table = self.__associations
+        with self.__engine.begin() as connection:
+            connection.execute(table.delete().where(and_(
+                                    table.c.server_url == server_url,
+                                    table.c.handle == association.handle)))
+            connection.execute(table.insert().values(
+                                    server_url=server_url,
+                                    handle=association.handle,
+                                    secret=association.secret,
+                                    issued=association.issued,
+                                    lifetime=association.lifetime,
+                                    assoc_type=association.assoc_type))
+
+    def getAssociation(self, server_url, handle=None):
+        table = self.__associations
+        query = select(table).where(table.c.server_url == server_url)
+        if handle is not None:
+            query = query.where(table.c.handle == handle)
+
+        with self.__engine.connect() as connection:
+            rows = connection.execute(
+                            query.order_by(table.c.issued.desc())).fetchall()
+
+        for row in rows:
+            association = Association(row.handle, bytes(row.secret),
+                                      row.issued, row.lifetime,
+                                      row.assoc_type)
+            if association.expiresIn > 0:
+                return association
+
+        # Expired entries are left for cleanupAssociations
+        return None
+
+    def removeAssociation(self, server_url, handle):
+        table = self.__associations
+        with self.__engine.begin() as connection:
+            result = connection.execute(table.delete().where(and_(
+                                            table.c.server_url == server_url,
+                                            table.c.handle == handle)))
+        return result.rowcount > 0
+
+    def useNonce(self, server_url, timestamp, salt):
+        if abs(timestamp - time.time()) > nonce.SKEW:
+            return False
+
+        try:
+            with self.__engine.begin() as connection:
+                connection.execute(self.__nonces.insert().values(
+                                                server_url=server_url,
+                                                timestamp=int(timestamp),
+                                                salt=salt))
+        except exc.IntegrityError:
+            # Already used
+            return False
+
+        return True
+
+    def cleanupNonces(self):
+        table = self.__nonces
+        with self.__engine.begin() as connection:
+            result = connection.execute(table.delete().where(
+                            table.c.timestamp < int(time.time()) - nonce.SKEW))
+        return result.rowcount
+
+    def cleanupAssociations(self):
+        table = self.__associations
+        with self.__engine.begin() as connection:
+            result = connection.execute(table.delete().where(
+                    table.c.issued + table.c.lifetime < int(time.time())))
+        return result.rowcount
@@ -16,6 +16,8 @@ log = logging.getLogger(__name__)
 import urllib.request, urllib.parse, urllib.error
 from paste.request import parse_querystring
 
+from ndg.security.common.utils import str2Bool
+from ndg.security.server.utils import metrics
 from ndg.security.server.wsgi import (NDGSecurityMiddlewareBase,
                                       NDGSecurityMiddlewareError)
 
@@ -64,6 +66,10 @@ class SessionHandlerMiddleware(SessionMiddlewareBase):
     Party sign-in or SSL Client authentication
     - end session redirecting back to referrer URI following call to a logout
     URI as implemented in AuthKit
+    
+    If lazyAnonymousSession is set, requests with no REMOTE_USER and no 
+    session cookie are given a LazySession so that the session backend is 
+    only used if something downstream writes to the session.
     '''
     AX_SESSION_KEYNAME = 'openid.ax'
     ID_SESSION_KEYNAME = 'sessionId'
@@ -85,11 +91,15 @@ class SessionHandlerMiddleware(SessionMiddlewareBase):
     SIGNOUT_PATH_PARAMNAME = 'signoutPath'
     SESSION_KEY_PARAMNAME = 'sessionKey'
     DEFAULT_LOGOUT_RETURN2URI_PARAMNAME = 'defaultLogoutReturnToURI'
+    LAZY_ANONYMOUS_SESSION_PARAMNAME = 'lazyAnonymousSession'
+    SESSION_COOKIE_NAME_PARAMNAME = 'sessionCookieName'
     
     propertyDefaults = {
         SIGNOUT_PATH_PARAMNAME: None,
         SESSION_KEY_PARAMNAME: 'beaker.session.ndg.security',
-        DEFAULT_LOGOUT_RETURN2URI_PARAMNAME: '/'
+        DEFAULT_LOGOUT_RETURN2URI_PARAMNAME: '/',
+        LAZY_ANONYMOUS_SESSION_PARAMNAME: False,
+        SESSION_COOKIE_NAME_PARAMNAME: 'beaker.session.id'
     }
     
     AUTH_TKT_SET_USER_ENVIRON_KEYNAME = 'paste.auth_tkt.set_user'
@@ -136,11 +146,61 @@ class SessionHandlerMiddleware(SessionMiddlewareBase):
                 defaultLogoutReturnToURIParamName,
                 cls.propertyDefaults[cls.DEFAULT_LOGOUT_RETURN2URI_PARAMNAME])
         
+        self.__lazyAnonymousSession = False
+        self.__sessionCookieName = None
+        
         super(SessionHandlerMiddleware, self).__init__(app,
                                                        global_conf,
                                                        prefix=prefix, 
                                                        **app_conf)
         
+    def _getLazyAnonymousSession(self):
+        return self.__lazyAnonymousSession
+
+    def _setLazyAnonymousSession(self, value):
+        if isinstance(value, str):
+            self.__lazyAnonymousSession = str2Bool(value)
+        elif isinstance(value, bool):
+            self.__lazyAnonymousSession = value
+        else:
+            raise TypeError('Expecting bool/string type for '
+                            '"lazyAnonymousSession" attribute; got %r' % 
+                            type(value))
+        
+    lazyAnonymousSession = property(_getLazyAnonymousSession, 
+                                    _setLazyAnonymousSession, 
+                                    doc="Set to True to avoid loading or "
+                                        "deleting the session for anonymous "
+                                        "requests with no session cookie")
+    
+    def _getSessionCookieName(self):
+        return self.__sessionCookieName
+
+    def _setSessionCookieName(self, value):
+        if not isinstance(value, str):
+            raise TypeError('Expecting string type for "sessionCookieName" '
+                            'attribute; got %r' % type(value))
+        self.__sessionCookieName = value
+        
+    sessionCookieName = property(_getSessionCookieName, 
+                                 _setSessionCookieName, 
+                                 doc="Name of the beaker session cookie.  "
+                                     "Used with lazyAnonymousSession to "
+                                     "check whether a request could have a "
+                                     "session")
+    
+    def _hasSessionCookie(self, environ):
+        """Check for the session cookie.  This is a simple test of the cookie
+        header so it may give a false positive in which case the session is
+        checked as normal
+        
+        @type environ: dict
+        @param environ: WSGI environment variables dictionary
+        @rtype: bool
+        @return: True if the request may carry a session cookie
+        """
+        return self.sessionCookieName + '=' in environ.get('HTTP_COOKIE', '')
+        
     @NDGSecurityMiddlewareBase.initCall
     def __call__(self, environ, start_response):
         """Manage setting of session from AuthKit following OpenID Relying
@@ -159,10 +219,19 @@ class SessionHandlerMiddleware(SessionMiddlewareBase):
                    'SessionHandlerMiddleware.__call__: No beaker session key '
                    '"%s" found in environ' % self.sessionKey)
         
+        # An anonymous request with no session cookie has no session to check
+        # or delete.  Defer creating one until something writes to it
+        if (self.lazyAnonymousSession and 'REMOTE_USER' not in environ and
+            not self._hasSessionCookie(environ)):
+            log.debug('No "REMOTE_USER" set in environ and no session '
+                      'cookie: setting lazy session')
+            session = LazySession(session)
+            environ[self.sessionKey] = session
+            
         # Force session deletion if user not logged in - this allows detection
         # of logged in status simply by the presence/absence of the beaker
         # session cookie       
-        if 'REMOTE_USER' not in environ and not session.get('username'):
+        elif 'REMOTE_USER' not in environ and not session.get('username'):
             log.debug('No "REMOTE_USER" set in environ, deleting session: %s', 
                       session)
             session.delete()
@@ -371,3 +440,330 @@ class SessionHandlerMiddleware(SessionMiddlewareBase):
                                              axCount))
                                              
         return output
+
+
+class WriteBehindSession(object):
+    """Wrapper to a beaker session which defers calls to save and delete so
+    that the session is written at most once per request.  Reads and item
+    updates are made on the wrapped session directly; the keys updated are 
+    recorded so that the session can be written with a single call to 
+    flush.
+    
+    @ivar __session: wrapped beaker session
+    @type __session: beaker.session.SessionObject / beaker.session.Session
+    """
+    __slots__ = (
+        '__session',
+        '__dirtyKeys',
+        '__saveRequested',
+        '__deleteRequested',
+        '__nSaveRequests'
+    )
+    
+    SAVE_COUNTER_NAME = 'ndg_security_session_saves_total'
+    SAVE_COUNTER_DOC = ('Session save and delete calls made by the security '
+                        'middleware by whether they were written to the '
+                        'session or coalesced with another call in the same '
+                        'request')
+    
+    def __init__(self, session):
+        '''
+        @param session: beaker session to wrap
+        @type session: beaker.session.SessionObject / beaker.session.Session
+        '''
+        self.__session = session
+        self.__dirtyKeys = set()
+        self.__saveRequested = False
+        self.__deleteRequested = False
+        self.__nSaveRequests = 0
+        
+    @property
+    def session(self):
+        """Wrapped beaker session"""
+        return self.__session
+    
+    @property
+    def dirtyKeys(self):
+        """Keys updated since the session was last written"""
+        return frozenset(self.__dirtyKeys)
+    
+    @property
+    def dirty(self):
+        """True if the session needs to be written"""
+        return (bool(self.__dirtyKeys) or self.__saveRequested or 
+                self.__deleteRequested)
+        
+    def __getattr__(self, name):
+        return getattr(self.__session, name)
+    
+    def __getitem__(self, key):
+        return self.__session[key]
+    
+    def __setitem__(self, key, value):
+        self.__session[key] = value
+        self.__dirtyKeys.add(key)
+        
+    def __delitem__(self, key):
+        del self.__session[key]
+        self.__dirtyKeys.add(key)
+        
+    def __contains__(self, key):
+        return key in self.__session
+    
+    def __iter__(self):
+        return iter(self.__session)
+    
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.__session)
+    
+    def get(self, key, default=None):
+        return self.__session.get(key, default)
+    
+    def pop(self, key, *arg):
+        if key in self.__session:
+            self.__dirtyKeys.add(key)
+            
+        return self.__session.pop(key, *arg)
+    
+    def setdefault(self, key, default=None):
+        if key not in self.__session:
+            self.__dirtyKeys.add(key)
+            
+        return self.__session.setdefault(key, default)
+    
+    def update(self, *arg, **kw):
+        items = dict(*arg, **kw)
+        self.__session.update(items)
+        self.__dirtyKeys.update(items)
+        
+    def clear(self):
+        self.__dirtyKeys.update(self.__session)
+        self.__session.clear()
+        
+    def save(self):
+        """Record that the session is to be saved.  It is written by flush"""
+        self.__saveRequested = True
+        self.__nSaveRequests += 1
+        
+    def delete(self):
+        """Clear the session and record that it is to be deleted.  It is 
+        deleted by flush unless items are set again in the meantime"""
+        self.__session.clear()
+        self.__dirtyKeys.clear()
+        self.__saveRequested = False
+        self.__deleteRequested = True
+        self.__nSaveRequests += 1
+        
+    def flush(self, persist=False):
+        """Write the session if it has been updated or save or delete have 
+        been called since it was last written
+        
+        @param persist: set to True for a beaker SessionObject after 
+        start_response has been called.  SessionObject save and delete
+        only mark the session to be written by beaker's start_response so 
+        persist must be called explicitly to write it after that point
+        @type persist: bool
+        @return: True if the session was written
+        @rtype: bool
+        """
+        if not self.dirty:
+            return False
+        
+        if self.__dirtyKeys or self.__saveRequested:
+            self.__session.save()
+            result = 'saved'
+        else:
+            self.__session.delete()
+            result = 'deleted'
+        
+        if persist and hasattr(self.__session, 'persist'):
+            self.__session.persist()
+            
+        log.debug('WriteBehindSession.flush: session %s, keys updated = %r, '
+                  '%d save/delete call(s)', result, self.__dirtyKeys, 
+                  self.__nSaveRequests)
+        
+        metrics.registry.counter(self.__class__.SAVE_COUNTER_NAME,
+                                 self.__class__.SAVE_COUNTER_DOC,
+                                 result=result).inc()
+        if self.__nSaveRequests > 1:
+            metrics.registry.counter(self.__class__.SAVE_COUNTER_NAME,
+                                     self.__class__.SAVE_COUNTER_DOC,
+                                     result='coalesced'
+                                     ).inc(self.__nSaveRequests - 1)
+            
+        self.__dirtyKeys.clear()
+        self.__saveRequested = False
+        self.__deleteRequested = False
+        self.__nSaveRequests = 0
+        return True
+
+
+class LazySession(object):
+    """Stand in for a beaker session for a request known to have no stored 
+    session.  It reads as empty without touching the session so that the 
+    session backend isn't used.  The wrapped session is used from the first 
+    write onwards.
+    
+    @ivar __session: wrapped beaker session
+    @type __session: beaker.session.SessionObject / WriteBehindSession
+    """
+    __slots__ = ('__session', '__materialised')
+    
+    def __init__(self, session):
+        '''
+        @param session: beaker session to wrap
+        @type session: beaker.session.SessionObject / WriteBehindSession
+        '''
+        self.__session = session
+        self.__materialised = False
+        
+    @property
+    def materialised(self):
+        """True once the wrapped session has been written to"""
+        return self.__materialised
+    
+    def _materialise(self):
+        if not self.__materialised:
+            log.debug('LazySession: creating session on first write')
+            self.__materialised = True
+            
+        return self.__session
+    
+    def __getattr__(self, name):
+        return getattr(self._materialise(), name)
+    
+    def __getitem__(self, key):
+        if not self.__materialised:
+            raise KeyError(key)
+        return self.__session[key]
+    
+    def __setitem__(self, key, value):
+        self._materialise()[key] = value
+        
+    def __delitem__(self, key):
+        if not self.__materialised:
+            raise KeyError(key)
+        del self.__session[key]
+        
+    def __contains__(self, key):
+        return self.__materialised and key in self.__session
+    
+    def __iter__(self):
+        if not self.__materialised:
+            return iter(())
+        return iter(self.__session)
+    
+    def __len__(self):
+        return len(list(self))
+    
+    def __repr__(self):
+        if not self.__materialised:
+            return '<%s (not materialised)>' % self.__class__.__name__
+        return '<%s %r>' % (self.__class__.__name__, self.__session)
+    
+    def get(self, key, default=None):
+        if not self.__materialised:
+            return default
+        return self.__session.get(key, default)
+    
+    def pop(self, key, *arg):
+        if not self.__materialised:
+            if arg:
+                return arg[0]
+            raise KeyError(key)
+        return self.__session.pop(key, *arg)
+    
+    def setdefault(self, key, default=None):
+        return self._materialise().setdefault(key, default)
+    
+    def update(self, *arg, **kw):
+        self._materialise().update(*arg, **kw)
+        
+    def save(self):
+        """Save the session if it has been written to"""
+        if self.__materialised:
+            self.__session.save()
+            
+    def delete(self):
+        """Delete the session if it has been written to"""
+        if self.__materialised:
+            self.__session.delete()
+        
+
+class SessionWriteBehindMiddleware(SessionMiddlewareBase):
+    '''Middleware to replace the beaker session in environ with a 
+    WriteBehindSession so that the session is written once per request 
+    however many times downstream middleware calls save.  Place it 
+    immediately below the beaker SessionMiddleware so that it wraps the rest 
+    of the security stack.
+    
+    The session is written before start_response is called so that beaker
+    can still set the session cookie.  Any updates made while the response 
+    is iterated over are written when it is closed.
+    '''
+    SESSION_KEY_PARAMNAME = 'sessionKey'
+    propertyDefaults = {
+        SESSION_KEY_PARAMNAME: 'beaker.session.ndg.security'
+    }
+    PARAM_PREFIX = 'sessionWriteBehind.'
+    
+    def __init__(self, app, global_conf, prefix=PARAM_PREFIX, **app_conf):
+        '''
+        @type app: callable following WSGI interface
+        @param app: next middleware application in the chain      
+        @type global_conf: dict        
+        @param global_conf: PasteDeploy global configuration dictionary
+        @type prefix: basestring
+        @param prefix: prefix for configuration items
+        @type app_conf: dict        
+        @param app_conf: PasteDeploy application specific configuration 
+        dictionary
+        '''
+        super(SessionWriteBehindMiddleware, self).__init__(app,
+                                                           global_conf,
+                                                           prefix=prefix, 
+                                                           **app_conf)
+        
+    def __call__(self, environ, start_response):
+        """Wrap the session and write it at the end of the request
+        
+        @type environ: dict
+        @param environ: WSGI environment variables dictionary
+        @type start_response: function
+        @param start_response: standard WSGI start response function
+        """
+        session = environ.get(self.sessionKey)
+        if session is None or isinstance(session, WriteBehindSession):
+            return self._app(environ, start_response)
+        
+        session = WriteBehindSession(session)
+        environ[self.sessionKey] = session
+        
+        def _start_response(status, header, exc_info=None):
+            session.flush()
+            return start_response(status, header, exc_info)
+            
+        return _WriteBehindResponseIterator(
+                                    self._app(environ, _start_response),
+                                    session)
+    
+    
+class _WriteBehindResponseIterator(object):
+    """Write any session updates made while the response was iterated over
+    when it is closed"""
+    __slots__ = ('__appIter', '__session')
+    
+    def __init__(self, appIter, session):
+        self.__appIter = appIter
+        self.__session = session
+        
+    def __iter__(self):
+        return iter(self.__appIter)
+    
+    def close(self):
+        try:
+            if hasattr(self.__appIter, 'close'):
+                self.__appIter.close()
+        finally:
+            self.__session.flush(persist=True)
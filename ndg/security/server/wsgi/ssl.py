@@ -19,13 +19,54 @@ log = logging.getLogger(__name__)
 # Pattern matching to determine which URI paths to apply SSL AuthN to and to
 # parse SSL certificate environment variable
 import re     
+import hashlib
 from datetime import datetime
 
 from OpenSSL import crypto
 
+from ndg.security.server.utils.cache import LRUCache
 from ndg.security.server.wsgi import NDGSecurityMiddlewareBase
 
 
+class ClientCertInfo(object):
+    """Client certificate together with the fields used for authentication
+    parsed from it.  Instances are cached by ApacheSSLAuthnMiddleware so that
+    repeat requests with the same certificate skip the X.509 parsing
+    
+    @cvar CERT_TIME_FORMAT: format of certificate validity times
+    @type CERT_TIME_FORMAT: string
+    """
+    CERT_TIME_FORMAT = '%Y%m%d%H%M%SZ'
+    
+    __slots__ = ('cert', 'notAfter', 'subject', 'userId')
+    
+    def __init__(self, cert):
+        """
+        @param cert: X.509 certificate
+        @type cert: OpenSSL.crypto.X509
+        """
+        self.cert = cert
+        self.notAfter = self.parseNotAfter(cert)
+        
+        subject = cert.get_subject()
+        self.subject = ''.join(['/%s=%s' % (name.decode('UTF-8'), 
+                                            value.decode('UTF-8'))
+                                for name, value in subject.get_components()])
+        self.userId = subject.commonName
+        
+    @classmethod
+    def parseNotAfter(cls, cert):
+        """Get the expiry time of a certificate
+        
+        @param cert: X.509 certificate
+        @type cert: OpenSSL.crypto.X509
+        @return: expiry time (UTC)
+        @rtype: datetime.datetime
+        """
+        return datetime.strptime(cert.get_notAfter().decode('UTF-8'), 
+                                 cls.CERT_TIME_FORMAT)
+
+
 class ApacheSSLAuthnMiddleware(NDGSecurityMiddlewareBase):
     """Perform SSL peer certificate authentication making use of Apache
     SSL environment settings
@@ -53,11 +94,20 @@ class ApacheSSLAuthnMiddleware(NDGSecurityMiddlewareBase):
     RE_PATH_MATCH_LIST_OPTNAME = 'rePathMatchList'
     SSL_KEYNAME_OPTNAME = 'sslKeyName'
     SSL_CLIENT_CERT_KEYNAME_OPTNAME = 'sslClientCertKeyName'
+    CERT_CACHE_SIZE_OPTNAME = 'certCacheSize'
+    CERT_CACHE_TIMEOUT_OPTNAME = 'certCacheTimeout'
+    
+    # Parsed client certificates are cached until they expire or for the 
+    # timeout if it's set and shorter.  Set the size to zero to disable
+    DEFAULT_CERT_CACHE_SIZE = 1000
+    DEFAULT_CERT_CACHE_TIMEOUT = None
     
     propertyDefaults = {
         RE_PATH_MATCH_LIST_OPTNAME: [],
         SSL_KEYNAME_OPTNAME: SSL_KEYNAME,
-        SSL_CLIENT_CERT_KEYNAME_OPTNAME: SSL_CLIENT_CERT_KEYNAME
+        SSL_CLIENT_CERT_KEYNAME_OPTNAME: SSL_CLIENT_CERT_KEYNAME,
+        CERT_CACHE_SIZE_OPTNAME: DEFAULT_CERT_CACHE_SIZE,
+        CERT_CACHE_TIMEOUT_OPTNAME: DEFAULT_CERT_CACHE_TIMEOUT
     }
     propertyDefaults.update(NDGSecurityMiddlewareBase.propertyDefaults)
     
@@ -102,6 +152,15 @@ class ApacheSSLAuthnMiddleware(NDGSecurityMiddlewareBase):
                     ApacheSSLAuthnMiddleware.SSL_KEYNAME_OPTNAME   
         self.sslKeyName = app_conf.get(sslKeyNameParamName, 
                                        ApacheSSLAuthnMiddleware.SSL_KEYNAME)
+        
+        certCacheSize = app_conf.get(
+                prefix + ApacheSSLAuthnMiddleware.CERT_CACHE_SIZE_OPTNAME,
+                ApacheSSLAuthnMiddleware.DEFAULT_CERT_CACHE_SIZE)
+        certCacheTimeout = app_conf.get(
+                prefix + ApacheSSLAuthnMiddleware.CERT_CACHE_TIMEOUT_OPTNAME,
+                ApacheSSLAuthnMiddleware.DEFAULT_CERT_CACHE_TIMEOUT)
+        self.__certCache = LRUCache(maxSize=certCacheSize, 
+                                    timeout=certCacheTimeout)
 
     def _getSslClientCertKeyName(self):
         return self.__sslClientCertKeyName
@@ -137,6 +196,12 @@ class ApacheSSLAuthnMiddleware(NDGSecurityMiddlewareBase):
                           doc="Client certificate for verification set by "
                               "is_valid_client_cert()")
     
+    @property
+    def certCache(self):
+        """Cache of parsed client certificates keyed by a digest of the PEM
+        encoded certificate"""
+        return self.__certCache
+    
     @NDGSecurityMiddlewareBase.initCall         
     def __call__(self, environ, start_response):
         '''Check for peer certificate in environment and if present carry out
@@ -168,7 +233,7 @@ class ApacheSSLAuthnMiddleware(NDGSecurityMiddlewareBase):
                                           msg=b'No client SSL Certificate set')
             
         # Parse cert from environ keyword
-        client_cert = self._parse_cert()
+        client_cert = self._parse_cert_info()
         
         if self.is_valid_client_cert(client_cert):
             self._setUser()          
@@ -213,21 +278,51 @@ class ApacheSSLAuthnMiddleware(NDGSecurityMiddlewareBase):
 
     def _parse_cert(self):
         '''Parse client certificate from environ'''
+        return self._parse_cert_info().cert
+
+    def _parse_cert_info(self):
+        '''Get the client certificate from environ and its parsed fields.
+        Results are cached, keyed by a digest of the PEM encoded certificate,
+        until the certificate expires
+        
+        @return: client certificate and its parsed fields
+        @rtype: ClientCertInfo
+        '''
         pem_cert = self.environ[self.sslClientCertKeyName]
+        if isinstance(pem_cert, str):
+            pem_cert = pem_cert.encode('UTF-8')
+            
+        cacheKey = hashlib.sha256(pem_cert).digest()
+        certInfo = self.__certCache.get(cacheKey)
+        if certInfo is not None:
+            return certInfo
+        
         cert = crypto.load_certificate(crypto.FILETYPE_PEM, pem_cert)
-        return cert
+        certInfo = ClientCertInfo(cert)
+        
+        timeout = (certInfo.notAfter - datetime.utcnow()).total_seconds()
+        if self.__certCache.timeout is not None:
+            timeout = min(timeout, self.__certCache.timeout)
+            
+        if timeout > 0:
+            self.__certCache.set(cacheKey, certInfo, timeout=timeout)
+            
+        return certInfo
 
     @staticmethod
     def _is_cert_expired(cert):
         '''Check if input certificate has expired
-        @param cert: X.509 certificate
-        @type cert: OpenSSL.crypto.X509
+        @param cert: X.509 certificate or the certificate and its parsed
+        fields
+        @type cert: OpenSSL.crypto.X509 / ClientCertInfo
         @return: true if expired, false otherwise
         @rtype: bool
         '''
-        notAfter = cert.get_notAfter()
-        dtNotAfter = datetime.strptime(notAfter.decode('UTF-8'), 
-                                       '%Y%m%d%H%M%S%fZ')       
+        if isinstance(cert, ClientCertInfo):
+            dtNotAfter = cert.notAfter
+        else:
+            dtNotAfter = ClientCertInfo.parseNotAfter(cert)
+            
         dtNow = datetime.utcnow()
         
         return dtNotAfter < dtNow
@@ -237,6 +332,9 @@ class ApacheSSLAuthnMiddleware(NDGSecurityMiddlewareBase):
         
         TODO: allow verification against CA certs - current assumption is 
         that Apache config performs this task!
+        
+        @param cert: client certificate and its parsed fields
+        @type cert: ClientCertInfo
         '''
         if self.__class__._is_cert_expired(cert):
             return False
@@ -290,7 +388,7 @@ class AuthKitSSLAuthnMiddleware(ApacheSSLAuthnMiddleware):
                       "passing request to next middleware in the chain ...")
             
         else:
-            client_cert = self._parse_cert()
+            client_cert = self._parse_cert_info()
             if self.is_valid_client_cert(client_cert):
                 # Update session cookie with user ID
                 self._setUser(client_cert)
@@ -307,9 +405,11 @@ class AuthKitSSLAuthnMiddleware(ApacheSSLAuthnMiddleware):
 
     def _setUser(self, cert):
         """Set user ID in AuthKit cookie from client certificate submitted
+        
+        @param cert: client certificate and its parsed fields
+        @type cert: ClientCertInfo
         """
-        subject = cert.get_subject()
-        userId = subject.commonName
+        userId = cert.userId
         
         self.environ[
             AuthKitSSLAuthnMiddleware.USERNAME_ENVIRON_KEYNAME] = userId
@@ -11,26 +11,43 @@ __revision__ = "$Id$"
 import logging
 log = logging.getLogger(__name__)
 
+import io
+import uuid
+
 
 class FileObjResponseIterator(object):
     """Helper class creates iterable WSGI response based on a given block size
+    
+    Reads start at the given block size and double for each full block read
+    up to MAX_BLK_SIZE so that large downloads are streamed in a few large
+    blocks.  Single and multiple byte ranges are supported.  Multiple ranges 
+    are returned as a multipart/byteranges body.
     """
-    DEFAULT_BLK_SIZE = 1024
+    DEFAULT_BLK_SIZE = 65536
+    MAX_BLK_SIZE = 1048576
+    MAX_N_RANGES = 32
     BYTE_RANGE_PREFIX = 'bytes='
     BYTE_RANGE_SEP = '-'
+    BYTE_RANGE_SET_SEP = ','
     CONTENT_RANGE_FIELDNAME = 'Content-range'
     CONTENT_RANGE_FORMAT_STR = "bytes %d-%d/%d"
     INVALID_CONTENT_RANGE_FORMAT_STR = "bytes */%d"
+    CONTENT_TYPE_FIELDNAME = 'Content-type'
+    MULTIPART_CONTENT_TYPE_FORMAT_STR = 'multipart/byteranges; boundary=%s'
+    DEFAULT_CONTENT_TYPE = 'application/octet-stream'
     
     __slots__ = (
         'file_obj',
         'file_size',
         '__block_size',
-        'read_lengths',
+        '__max_block_size',
         'content_length',
         'content_range',
         'content_range_hdr',
-        'closed_method'
+        'content_ranges',
+        'content_type',
+        'content_type_hdr',
+        'boundary'
     )
     
     
@@ -54,61 +71,124 @@ class FileObjResponseIterator(object):
     
        
     def __init__(self, file_obj, file_size=-1, request_range=None, 
-                 block_size=DEFAULT_BLK_SIZE):
+                 block_size=DEFAULT_BLK_SIZE, max_block_size=MAX_BLK_SIZE,
+                 content_type=DEFAULT_CONTENT_TYPE):
         '''Open a file and set the blocks for reading, any input range set and
         the response size
+        
+        @param file_obj: file like object to read from
+        @type file_obj: file / http.client.HTTPResponse
+        @param file_size: size of file or -1 if not known.  Byte ranges are 
+        ignored if the size is not known
+        @type file_size: int
+        @param request_range: HTTP Range header value e.g. 'bytes=0-1023'
+        @type request_range: basestring / None
+        @param block_size: initial size of blocks to read
+        @type block_size: int
+        @param max_block_size: size blocks read may increase to
+        @type max_block_size: int
+        @param content_type: content type of file.  Used for the parts of a
+        multipart/byteranges response
+        @type content_type: basestring
         '''
         self.file_obj = file_obj
         self.file_size = file_size
-
-        # Find method of determining whether the file object is closed.
-        if hasattr(file_obj, 'closed'):
-            # Standard file interface has optional 'closed' attribute.
-            self.closed_method = lambda : self.file_obj.closed
-        elif hasattr(file_obj, 'isclosed'):
-            # httplib.HTTPResponse has a non-standard 'isclosed' method.
-            self.closed_method = self.file_obj.isclosed
-        elif hasattr(file_obj, 'fp'):
-            # urllib.addbase and derived classes returned by urllib and urllib2:
-            self.closed_method = lambda : self.fp is None
-        else:
-            self.closed_method = None
+        self.content_type = content_type
 
         # the length of the content to return - this will be different to the
         # file size if the client a byte range header field setting
         self.content_length = 0
         
-        # None unless a valid input range was given
+        # None unless a single valid input range was given
         self.content_range = None
         
         # Formatted for HTTP content range header field
         self.content_range_hdr = None
+        
+        # All the ranges requested
+        self.content_ranges = []
+        
+        # Set for a multipart response only
+        self.content_type_hdr = None
+        self.boundary = None
 
-        # This will call the relevant set property method
+        # This will call the relevant set property methods
+        self.max_block_size = max_block_size
         self.block_size = block_size
         
-        # Array of blocks lengths for iterator to use to read the file
-        self.read_lengths = []
+        if request_range is not None and self.file_size >= 0:
+            self.content_ranges = self._parse_range(request_range)
+            
+        if len(self.content_ranges) == 1:
+            start, end = self.content_range = self.content_ranges[0]
+            
+            # Set the total content length to return
+            self.content_length = end + 1 - start 
+            self.content_range_hdr = (
+                self.__class__.CONTENT_RANGE_FIELDNAME, 
+                self.__class__.CONTENT_RANGE_FORMAT_STR % 
+                                        (self.content_range + (self.file_size,))
+            )
+            try:
+                self.file_obj.seek(start)
+            except (AttributeError, io.UnsupportedOperation):
+                # File seek method is optional.
+                self._skip(start)
+                
+        elif len(self.content_ranges) > 1:
+            self.boundary = uuid.uuid4().hex
+            self.content_type_hdr = (
+                self.__class__.CONTENT_TYPE_FIELDNAME,
+                self.__class__.MULTIPART_CONTENT_TYPE_FORMAT_STR % 
+                                                                self.boundary)
+            self.content_length = sum([
+                len(self._make_part_header(start, end)) + end + 1 - start 
+                for start, end in self.content_ranges
+            ]) + len(self._make_multipart_trailer())
+        else:            
+            # Set the total content length to return
+            self.content_length = self.file_size
+            
+    def _parse_range(self, request_range):
+        '''Parse a HTTP Range header value
+        
+        @param request_range: HTTP Range header value
+        @type request_range: basestring
+        @return: start and end indices of each range
+        @rtype: list
+        @raise InvalidRangeRequestSyntax: invalid header value
+        @raise InvalidRangeRequest: range outside the content
+        '''
+        # Prepare a content range header in case the range specified is
+        # invalid
+        content_range_hdr = (self.__class__.CONTENT_RANGE_FIELDNAME,
+                             self.__class__.INVALID_CONTENT_RANGE_FORMAT_STR %
+                             self.file_size)
         
-        if request_range is not None:
+        # Remove 'bytes=' prefix
+        range_set = request_range.split(self.__class__.BYTE_RANGE_PREFIX)[-1]
+        range_vals = range_set.split(self.__class__.BYTE_RANGE_SET_SEP)
+        if len(range_vals) > self.__class__.MAX_N_RANGES:
+            # Ranges may be ignored - serve the whole content
+            log.warning('Ignoring request for %d byte ranges: maximum is %d',
+                        len(range_vals), self.__class__.MAX_N_RANGES)
+            return []
             
-            # Prepare a content range header in case the range specified is
-            # invalid
-            content_range_hdr = (self.__class__.CONTENT_RANGE_FIELDNAME,
-                               self.__class__.INVALID_CONTENT_RANGE_FORMAT_STR %
-                               self.file_size)
-                                
+        content_ranges = []
+        for range_val in range_vals:
             try:
-                # Remove 'bytes=' prefix
-                rangeVals = request_range.split(
-                                        self.__class__.BYTE_RANGE_PREFIX)[-1]
-                                        
-                # Convert into integers taking into account that a value may be
-                # absent
-                startStr, endStr = rangeVals.split(
+                # Convert into integers taking into account that a value may
+                # be absent
+                start_str, end_str = range_val.strip().split(
                                                 self.__class__.BYTE_RANGE_SEP)
-                start = int(startStr or 0)
-                end = int(endStr or self.file_size - 1)
+                if start_str:
+                    start = int(start_str)
+                    end = int(end_str or self.file_size - 1)
+                else:
+                    # Suffix range - return the last n bytes
+                    start = max(self.file_size - int(end_str), 0)
+                    end = self.file_size - 1
+                    
             except ValueError:
                 raise self.__class__.InvalidRangeRequestSyntax('Invalid format '
                     'for request range %r' % request_range)
@@ -123,6 +203,10 @@ class FileObjResponseIterator(object):
                                                          'is less than zero' % 
                                                          start,
                                                          content_range_hdr) 
+            elif start >= self.file_size:
+                raise self.__class__.InvalidRangeRequest('Range start index %r '
+                    'is beyond the end of the requested resource of length '
+                    '%r' % (start, self.file_size), content_range_hdr)
             elif end >= self.file_size:
                 # This is not an error - 
                 # http://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html#sec14.35.1
@@ -131,52 +215,100 @@ class FileObjResponseIterator(object):
                             end, self.file_size, self.file_size - 1)
                 end = self.file_size - 1
                 
-            # Set the total content length to return
-            self.content_length = end + 1 - start 
-            self.content_range = (start, end)
-            self.content_range_hdr = (
-                self.__class__.CONTENT_RANGE_FIELDNAME, 
-                self.__class__.CONTENT_RANGE_FORMAT_STR % 
-                                        (self.content_range + (self.file_size,))
-            )
-            try:
-                self.file_obj.seek(start)
-            except AttributeError:
-                # File seek method is optional.
-                pass
-        else:            
-            # Set the total content length to return
-            self.content_length = self.file_size
-                  
-        nReads = self.content_length / self.block_size
-        lastReadLen = self.content_length % self.block_size
-        self.read_lengths = [self.block_size] * nReads
-        if lastReadLen > 0:
-            nReads += 1
-            self.read_lengths.append(lastReadLen)
-        
-    def __iter__(self):
-        '''Read the file object a block at a time'''
+            content_ranges.append((start, end))
+            
+        return content_ranges
+    
+    def _make_part_header(self, start, end):
+        '''Make the boundary and headers preceding a part of a 
+        multipart/byteranges response'''
+        return ('\r\n--%s\r\n%s: %s\r\n%s: %s\r\n\r\n' % (
+                    self.boundary, 
+                    self.__class__.CONTENT_TYPE_FIELDNAME, 
+                    self.content_type,
+                    self.__class__.CONTENT_RANGE_FIELDNAME, 
+                    self.__class__.CONTENT_RANGE_FORMAT_STR % 
+                                                (start, end, self.file_size))
+                ).encode('ascii')
+    
+    def _make_multipart_trailer(self):
+        '''Make the closing boundary of a multipart/byteranges response'''
+        return ('\r\n--%s--\r\n' % self.boundary).encode('ascii')
         
-        # Leave read_lengths attribute intact
-        read_lengths = self.read_lengths[:]
-        while (self.content_length < 0) or (len(read_lengths) > 0):
-            if self.content_length < 0:
-                if self.closed_method():
-                    return
-                amt = self.block_size
+    def _read(self, length):
+        '''Read up to length bytes from the file object a block at a time.
+        Read all of it if length is negative.  The block size doubles each
+        time a full block is read up to the maximum block size'''
+        block_size = self.block_size
+        while length != 0:
+            if length > 0:
+                amt = min(block_size, length)
             else:
-                amt = read_lengths.pop()
+                amt = block_size
+                
             output = self.file_obj.read(amt)
             if not output:
-                self.close()
+                return
+            
+            if length > 0:
+                length -= len(output)
+                
+            if len(output) == amt and block_size < self.max_block_size:
+                block_size = min(block_size * 2, self.max_block_size)
+                
             yield output
+            
+    def _skip(self, length):
+        '''Read and discard length bytes from a file object which can't seek.
+        A single buffer is reused for the reads'''
+        buf = bytearray(min(length, self.max_block_size))
+        view = memoryview(buf)
+        readinto = getattr(self.file_obj, 'readinto', None)
+        while length > 0:
+            amt = min(length, len(buf))
+            if readinto is not None:
+                n_read = readinto(view[:amt])
+            else:
+                n_read = len(self.file_obj.read(amt))
+                
+            if not n_read:
+                return
+            
+            length -= n_read
+        
+    def __iter__(self):
+        '''Read the file object a block at a time'''
+        if len(self.content_ranges) < 2:
+            for output in self._read(self.content_length):
+                yield output
+            return
+        
+        pos = 0
+        for start, end in self.content_ranges:
+            yield self._make_part_header(start, end)
+            
+            try:
+                self.file_obj.seek(start)
+            except (AttributeError, io.UnsupportedOperation):
+                # Read forward to the start of the range if possible
+                if start < pos:
+                    raise self.__class__.IteratorError('Byte ranges must be '
+                        'in ascending order for a file object which does not '
+                        'support seek')
+                self._skip(start - pos)
+                
+            for output in self._read(end + 1 - start):
+                yield output
+                
+            pos = end + 1
+                
+        yield self._make_multipart_trailer()
 
     def close(self):
         """Closes the file object.
         """
         self.file_obj.close()
-
+        
     @property
     def block_size(self):
         """block size for reading the file in the iterator and returning a 
@@ -189,7 +321,27 @@ class FileObjResponseIterator(object):
         """block size for reading the file in the iterator and returning a 
         response
         """
-        self.__block_size = int(value)
-        if self.__block_size < 0:
+        block_size = int(value)
+        if block_size <= 0:
             raise ValueError('Expecting positive integer value for block size '
                              'attribute')
+        self.__block_size = block_size
+        
+        if self.__max_block_size < block_size:
+            self.__max_block_size = block_size
+
+    @property
+    def max_block_size(self):
+        """maximum block size blocks read may increase to
+        """
+        return self.__max_block_size
+    
+    @max_block_size.setter
+    def max_block_size(self, value):
+        """maximum block size blocks read may increase to
+        """
+        max_block_size = int(value)
+        if max_block_size <= 0:
+            raise ValueError('Expecting positive integer value for maximum '
+                             'block size attribute')
+        self.__max_block_size = max_block_size
@@ -0,0 +1,333 @@
+"""Per policy and per rule profiling of XACML policy evaluation
+
+The profiler records for each policy, policy set and rule the number of times
+it was evaluated, how often it applied to the request, its decisions,
+evaluation time and the PIP attribute queries made while it was being
+evaluated.  Statistics are aggregated over a fixed time window.  Times and PIP
+queries for a policy include those of the rules and policies it contains.
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import logging
+log = logging.getLogger(__name__)
+
+import json
+from datetime import datetime
+from os import path
+from threading import Lock, local
+from time import perf_counter, time
+
+from ndg.xacml.core.rule import Rule
+from ndg.xacml.core.policybase import PolicyBase
+from ndg.xacml.core.context.result import Decision
+
+
+class _ProfiledElementMixin(object):
+    """Mixin for policy, policy set and rule types to time evaluation.
+    Evaluation is profiled only if the request context handler has a profiler
+    set.  See PolicyProfiler.instrument
+    """
+    __slots__ = ()
+
+    def evaluate(self, context):
+        profiler = getattr(context.ctxHandler, 'profiler', None)
+        if profiler is None:
+            return super(_ProfiledElementMixin, self).evaluate(context)
+
+        frame = profiler.enter(self)
+        start = perf_counter()
+        try:
+            decision = super(_ProfiledElementMixin, self).evaluate(context)
+        except Exception:
+            profiler.exit(frame, Decision.INDETERMINATE_STR,
+                          perf_counter() - start)
+            raise
+
+        profiler.exit(frame, getattr(decision, 'value', str(decision)),
+                      perf_counter() - start)
+        return decision
+
+
+class _ElementStats(object):
+    """Statistics for a single policy, policy set or rule"""
+    __slots__ = (
+        'elementType',
+        'evaluations',
+        'decisions',
+        'totalTime',
+        'maxTime',
+        'pipQueries',
+        'pipTime'
+    )
+
+    def __init__(self, elementType):
+        self.elementType = elementType
+        self.evaluations = 0
+        self.decisions = {}
+        self.totalTime = 0.
+        self.maxTime = 0.
+        self.pipQueries = 0
+        self.pipTime = 0.
+
+    def summarise(self, elementPath):
+        '''Make a JSON serialisable summary
+
+        @param elementPath: identifiers of this element and its parents
+        @type elementPath: tuple
+        @rtype: dict
+        '''
+        return {
+            'type': self.elementType,
+            'path': ' / '.join(elementPath),
+            'evaluations': self.evaluations,
+            'matches': self.evaluations - self.decisions.get(
+                                                Decision.NOT_APPLICABLE_STR, 0),
+            'decisions': dict(self.decisions),
+            'total_ms': round(self.totalTime * 1e3, 3),
+            'mean_ms': round(self.totalTime * 1e3 / self.evaluations, 3),
+            'max_ms': round(self.maxTime * 1e3, 3),
+            'pip_queries': self.pipQueries,
+            'pip_ms': round(self.pipTime * 1e3, 3)
+        }
+
+
+class PolicyProfiler(object):
+    """Collect evaluation statistics for the policies and rules of a policy
+    tree over a time window.  When the window elapses, the statistics for it
+    are kept as the previous window and optionally written to a JSON file
+    before collection starts afresh
+
+    @cvar DEFAULT_WINDOW: default time window in seconds
+    @type DEFAULT_WINDOW: float
+    """
+    DEFAULT_WINDOW = 300.
+
+    __slots__ = (
+        '__window',
+        '__reportFilePath',
+        '__lock',
+        '__local',
+        '__windowStart',
+        '__stats',
+        '__previous',
+        '__profiledClasses'
+    )
+
+    def __init__(self, window=DEFAULT_WINDOW, reportFilePath=None):
+        '''
+        @param window: time window in seconds over which to aggregate
+        statistics
+        @type window: float
+        @param reportFilePath: file to write a JSON report to at the end of
+        each window.  Set to None to disable
+        @type reportFilePath: basestring / None
+        '''
+        self.__lock = Lock()
+        self.__local = local()
+        self.__windowStart = time()
+        self.__stats = {}
+        self.__previous = None
+        self.__profiledClasses = {}
+
+        self.__window = None
+        self.window = window
+        self.__reportFilePath = None
+        self.reportFilePath = reportFilePath
+
+    def _getWindow(self):
+        return self.__window
+
+    def _setWindow(self, value):
+        if isinstance(value, (int, float, str)):
+            self.__window = float(value)
+        else:
+            raise TypeError('Expecting int, float or string type for "window" '
+                            'attribute; got %r' % type(value))
+
+    window = property(_getWindow, _setWindow,
+                      doc="Time window in seconds over which statistics are "
+                          "aggregated")
+
+    def _getReportFilePath(self):
+        return self.__reportFilePath
+
+    def _setReportFilePath(self, value):
+        if value is None:
+            self.__reportFilePath = None
+
+        elif isinstance(value, str):
+            self.__reportFilePath = path.expandvars(value) or None
+        else:
+            raise TypeError('Expecting string or None type for '
+                            '"reportFilePath" attribute; got %r' % type(value))
+
+    reportFilePath = property(_getReportFilePath, _setReportFilePath,
+                              doc="File to write a JSON report to at the end "
+                                  "of each window or None to disable")
+
+    def instrument(self, policy):
+        '''Enable profiling for a policy or policy set and all the rules and
+        policies it contains.  The class of each element is replaced with a
+        derived type which times its evaluate method.  Elements are only
+        profiled when evaluated with a request whose context handler has a
+        profiler set
+
+        @param policy: policy or policy set
+        @type policy: ndg.xacml.core.policybase.PolicyBase
+        '''
+        if not isinstance(policy, PolicyBase):
+            raise TypeError('Expecting %r derived type for policy; got %r' %
+                            (PolicyBase, type(policy)))
+
+        self._instrumentElement(policy)
+
+        for rule in getattr(policy, 'rules', ()):
+            self._instrumentElement(rule)
+
+        for childPolicy in getattr(policy, 'policies', ()):
+            self.instrument(childPolicy)
+
+    def _instrumentElement(self, element):
+        elementClass = element.__class__
+        if issubclass(elementClass, _ProfiledElementMixin):
+            return
+
+        profiledClass = self.__profiledClasses.get(elementClass)
+        if profiledClass is None:
+            profiledClass = type('Profiled' + elementClass.__name__,
+                                 (_ProfiledElementMixin, elementClass),
+                                 {'__slots__': ()})
+            self.__profiledClasses[elementClass] = profiledClass
+
+        element.__class__ = profiledClass
+
+    @staticmethod
+    def _getIdentifier(element):
+        if isinstance(element, Rule):
+            return element.id
+        else:
+            return element.ident
+
+    def _getFrames(self):
+        try:
+            return self.__local.frames
+        except AttributeError:
+            self.__local.frames = []
+            return self.__local.frames
+
+    def enter(self, element):
+        '''Mark the start of evaluation of a policy or rule in this thread
+
+        @param element: policy, policy set or rule
+        @return: frame to pass to exit
+        @rtype: list
+        '''
+        frames = self._getFrames()
+        if frames:
+            elementPath = frames[-1][0] + (self._getIdentifier(element),)
+        else:
+            elementPath = (self._getIdentifier(element),)
+
+        # Path, element type, PIP query count and PIP query time
+        frame = [elementPath, element.ELEMENT_LOCAL_NAME, 0, 0.]
+        frames.append(frame)
+        return frame
+
+    def exit(self, frame, decision, elapsed):
+        '''Record the outcome of evaluation of a policy or rule
+
+        @param frame: frame returned from enter
+        @type frame: list
+        @param decision: decision value e.g. "Permit"
+        @type decision: basestring
+        @param elapsed: evaluation time in seconds
+        @type elapsed: float
+        '''
+        frames = self._getFrames()
+        if frames and frames[-1] is frame:
+            frames.pop()
+
+        elementPath, elementType, pipQueries, pipTime = frame
+        with self.__lock:
+            self._checkWindow()
+            stats = self.__stats.get(elementPath)
+            if stats is None:
+                stats = self.__stats[elementPath] = _ElementStats(elementType)
+
+            stats.evaluations += 1
+            stats.decisions[decision] = stats.decisions.get(decision, 0) + 1
+            stats.totalTime += elapsed
+            if elapsed > stats.maxTime:
+                stats.maxTime = elapsed
+            stats.pipQueries += pipQueries
+            stats.pipTime += pipTime
+
+    def recordPipQuery(self, elapsed):
+        '''Attribute a PIP query to the policies and rule currently being
+        evaluated in this thread
+
+        @param elapsed: query time in seconds
+        @type elapsed: float
+        '''
+        for frame in self._getFrames():
+            frame[2] += 1
+            frame[3] += elapsed
+
+    def _checkWindow(self):
+        '''Start a new window if the current one has elapsed.  Call with lock
+        acquired
+        '''
+        now = time()
+        if now - self.__windowStart < self.__window:
+            return
+
+        self.__previous = self._summarise(self.__windowStart, now)
+        self.__stats = {}
+        self.__windowStart = now
+
+        if self.__reportFilePath is not None:
+            try:
+                with open(self.__reportFilePath, 'w') as reportFile:
+                    json.dump(self.__previous, reportFile, indent=2)
+
+            except EnvironmentError:
+                log.exception('Error writing policy profile report to %r',
+                              self.__reportFilePath)
+
+    def _summarise(self, start, end):
+        elements = [stats.summarise(elementPath)
+                    for elementPath, stats in self.__stats.items()]
+        elements.sort(key=lambda element: element['total_ms'], reverse=True)
+
+        return {
+            'start': datetime.utcfromtimestamp(start).isoformat() + 'Z',
+            'end': datetime.utcfromtimestamp(end).isoformat() + 'Z',
+            'elements': elements
+        }
+
+    def report(self):
+        '''Make a report of statistics for the current and previous windows.
+        Elements are sorted by total evaluation time, most expensive first
+
+        @rtype: dict
+        '''
+        with self.__lock:
+            self._checkWindow()
+            return {
+                'window': self.__window,
+                'current': self._summarise(self.__windowStart, time()),
+                'previous': self.__previous
+            }
+
+    def reset(self):
+        '''Discard all statistics and start a new window'''
+        with self.__lock:
+            self.__stats = {}
+            self.__previous = None
+            self.__windowStart = time()
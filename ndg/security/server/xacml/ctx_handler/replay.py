@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+"""Replay authorisation traffic captured by the PEP against a SAML context
+handler built from a given policy and PIP mapping file.  Attribute Authorities
+are replaced with a stub serving the attributes recorded in the PIP capture
+log.  Replayed decisions are compared with those recorded and the evaluation
+time for each request is reported.
+
+Enable capture in the PEP with:
+
+pep.captureFilePath = /var/log/ndg/pep-capture.log
+pep.captureSubjectSalt = <secret>
+
+and in the authorisation service PIP with:
+
+authz.ctx_handler.pip.captureFilePath = /var/log/ndg/pip-capture.log
+authz.ctx_handler.pip.captureSubjectSalt = <same secret>
+
+then run e.g.
+
+ndg-security-authz-replay -p policy.xml -m pip-mapping.txt \\
+    -c pep-capture.log -a pip-capture.log -o replay.json
+
+NERC DataGrid Project
+"""
+__author__ = "P J Kershaw"
+__date__ = "19/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = '$Id$'
+import logging
+log = logging.getLogger(__name__)
+
+import json
+import optparse
+import sys
+from collections import Counter
+from datetime import datetime
+from time import perf_counter
+from uuid import uuid4
+
+from ndg.saml.common import SAMLVersion
+from ndg.saml.saml2.core import (Response, Assertion, AttributeStatement,
+                                 Attribute, XSStringAttributeValue, Issuer,
+                                 Status, StatusCode, StatusMessage)
+from ndg.saml.utils.factory import AuthzDecisionQueryFactory
+
+from ndg.security.common.saml_utils.esgf import ESGFGroupRoleAttributeValue
+from ndg.security.server.utils.capture import readCaptureLog
+from ndg.security.server.utils.metrics import summarise
+from ndg.security.server.xacml.ctx_handler.saml_ctx_handler import (
+                                                SamlCtxHandler, SamlPEPRequest)
+
+# Decisions made by the authorisation service.  Other captured outcomes
+# (NotApplicable from the PEP's local filter, Error) can't be replayed
+REPLAYABLE_DECISIONS = ('Permit', 'Deny', 'Indeterminate')
+
+DEFAULT_SUBJECT_ID_FORMAT = 'urn:esg:openid'
+DEFAULT_XACML_EXT_FUNC = \
+                    'ndg.security.server.xacml.esgf_ext:addEsgfXacmlSupport'
+ISSUER_NAME = '/O=NDG/OU=Security/CN=Replay'
+
+
+class StubAttributeQueryBinding(object):
+    """Stand-in for the PIP's Attribute Authority SOAP binding.  It serves
+    attributes recorded in a PIP capture log keyed by Attribute Authority URI
+    and subject hash
+    """
+    def __init__(self):
+        # (attribute authority URI, subject hash) -> {name: (format, values)}
+        self.attributes = {}
+
+    @classmethod
+    def fromCaptureLog(cls, filePath):
+        '''Create from a PIP capture log
+
+        @param filePath: capture log file path
+        @type filePath: basestring
+        @rtype: StubAttributeQueryBinding
+        '''
+        binding = cls()
+        for record in readCaptureLog(filePath):
+            binding.attributes.setdefault((record['aa'], record['s']), {})[
+                                        record['a']] = (record['f'], record['v'])
+        return binding
+
+    @staticmethod
+    def _makeAttributeValue(value):
+        if isinstance(value, list):
+            # ESGF Group/Role values are recorded as (group, role) pairs
+            attributeValue = ESGFGroupRoleAttributeValue()
+            attributeValue.value = tuple(value)
+        else:
+            attributeValue = XSStringAttributeValue()
+            attributeValue.value = str(value)
+
+        return attributeValue
+
+    def send(self, query, uri=None):
+        '''Respond to attribute query with recorded attributes
+
+        @param query: SAML attribute query
+        @type query: ndg.saml.saml2.core.AttributeQuery
+        @param uri: Attribute Authority URI
+        @type uri: basestring
+        @rtype: ndg.saml.saml2.core.Response
+        '''
+        response = Response()
+        response.issueInstant = datetime.utcnow()
+        response.id = str(uuid4())
+        response.inResponseTo = query.id
+        response.version = SAMLVersion(SAMLVersion.VERSION_20)
+        response.status = Status()
+        response.status.statusCode = StatusCode()
+        response.status.statusMessage = StatusMessage()
+
+        subjectAttributes = self.attributes.get(
+                                        (uri, query.subject.nameID.value))
+        if subjectAttributes is None:
+            response.status.statusCode.value = \
+                                            StatusCode.UNKNOWN_PRINCIPAL_URI
+            response.status.statusMessage.value = 'No recorded attributes'
+            return response
+
+        response.status.statusCode.value = StatusCode.SUCCESS_URI
+
+        assertion = Assertion()
+        assertion.version = SAMLVersion(SAMLVersion.VERSION_20)
+        assertion.id = str(uuid4())
+        assertion.issueInstant = response.issueInstant
+        assertion.issuer = Issuer()
+        assertion.issuer.format = Issuer.X509_SUBJECT
+        assertion.issuer.value = ISSUER_NAME
+
+        statement = AttributeStatement()
+        for queryAttribute in query.attributes:
+            recorded = subjectAttributes.get(queryAttribute.name)
+            if recorded is None:
+                continue
+
+            nameFormat, values = recorded
+            attribute = Attribute()
+            attribute.name = queryAttribute.name
+            attribute.nameFormat = nameFormat
+            for value in values:
+                attribute.attributeValues.append(
+                                            self._makeAttributeValue(value))
+
+            statement.attributes.append(attribute)
+
+        assertion.attributeStatements.append(statement)
+        response.assertions.append(assertion)
+        return response
+
+
+def makeCtxHandler(policyFilePath, mappingFilePath, attributeCaptureFilePath,
+                   subjectIdFormat=DEFAULT_SUBJECT_ID_FORMAT,
+                   xacmlExtFunc=DEFAULT_XACML_EXT_FUNC):
+    '''Create a context handler with a stub Attribute Authority binding
+
+    @param policyFilePath: XACML policy file
+    @type policyFilePath: basestring
+    @param mappingFilePath: PIP attribute ID to Attribute Authority mapping
+    @type mappingFilePath: basestring
+    @param attributeCaptureFilePath: PIP capture log
+    @type attributeCaptureFilePath: basestring
+    @param subjectIdFormat: subject identifier format as set in the PEP's
+    authorisation decision query
+    @type subjectIdFormat: basestring
+    @param xacmlExtFunc: XACML extension functions to load or empty string for
+    none
+    @type xacmlExtFunc: basestring
+    @rtype: ndg.security.server.xacml.ctx_handler.saml_ctx_handler.SamlCtxHandler
+    '''
+    handler = SamlCtxHandler.fromKeywords(prefix='', **{
+        'policyFilePath': policyFilePath,
+        'issuerName': ISSUER_NAME,
+        'issuerFormat': Issuer.X509_SUBJECT,
+        'xacmlExtFunc': xacmlExtFunc,
+        'pip.mappingFilePath': mappingFilePath,
+        'pip.cacheSessions': False,
+        'pip.attribute_query.subject.nameID.format': subjectIdFormat,
+        'pip.attribute_query.issuer.value': ISSUER_NAME,
+        'pip.attribute_query.issuer.format': Issuer.X509_SUBJECT
+    })
+    handler.pip.attribute_query_binding = \
+        StubAttributeQueryBinding.fromCaptureLog(attributeCaptureFilePath)
+
+    return handler
+
+
+def replay(handler, records, subjectIdFormat=DEFAULT_SUBJECT_ID_FORMAT):
+    '''Replay captured PEP records against a context handler
+
+    @param handler: context handler
+    @type handler: ndg.security.server.xacml.ctx_handler.saml_ctx_handler.SamlCtxHandler
+    @param records: PEP capture log records
+    @type records: iterable
+    @param subjectIdFormat: subject identifier format
+    @type subjectIdFormat: basestring
+    @return: generator of (record, replayed decision, evaluation time in
+    seconds) tuples.  Records which can't be replayed are skipped
+    '''
+    for record in records:
+        if record.get('d') not in REPLAYABLE_DECISIONS:
+            continue
+
+        query = AuthzDecisionQueryFactory.create()
+        query.subject.nameID.format = subjectIdFormat
+        query.subject.nameID.value = record['s']
+        query.issuer.format = Issuer.X509_SUBJECT
+        query.issuer.value = ISSUER_NAME
+        query.resource = record['r']
+
+        pepRequest = SamlPEPRequest()
+        pepRequest.authzDecisionQuery = query
+
+        start = perf_counter()
+        response = handler.handlePEPRequest(pepRequest)
+        elapsed = perf_counter() - start
+
+        decision = None
+        for assertion in response.assertions:
+            for statement in assertion.authzDecisionStatements:
+                decision = str(statement.decision)
+
+        yield record, decision, elapsed
+
+
+def main(argv=sys.argv[1:]):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option("-p",
+                      "--policy",
+                      dest="policyFilePath",
+                      help="XACML policy file")
+
+    parser.add_option("-m",
+                      "--pip-mapping",
+                      dest="mappingFilePath",
+                      help="PIP attribute ID to Attribute Authority mapping "
+                           "file")
+
+    parser.add_option("-c",
+                      "--capture",
+                      dest="captureFilePath",
+                      help="PEP capture log")
+
+    parser.add_option("-a",
+                      "--attributes",
+                      dest="attributeCaptureFilePath",
+                      help="PIP capture log of attributes to serve from stub "
+                           "Attribute Authorities")
+
+    parser.add_option("-f",
+                      "--subject-id-format",
+                      dest="subjectIdFormat",
+                      default=DEFAULT_SUBJECT_ID_FORMAT,
+                      help="subject identifier format [default: %default]")
+
+    parser.add_option("-x",
+                      "--xacml-ext-func",
+                      dest="xacmlExtFunc",
+                      default=DEFAULT_XACML_EXT_FUNC,
+                      help="XACML extension functions to load, set to an "
+                           "empty string for none [default: %default]")
+
+    parser.add_option("-o",
+                      "--output",
+                      dest="output",
+                      default=None,
+                      help="write summary and per request results as JSON to "
+                           "this file")
+
+    parser.add_option("-n",
+                      "--max-mismatches",
+                      dest="maxMismatches",
+                      default=20,
+                      type='int',
+                      help="maximum number of mismatches to print")
+
+    opt = parser.parse_args(argv)[0]
+    for name in ('policyFilePath', 'mappingFilePath', 'captureFilePath',
+                 'attributeCaptureFilePath'):
+        if not getattr(opt, name):
+            parser.error('Missing option for %s' % name)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    handler = makeCtxHandler(opt.policyFilePath, opt.mappingFilePath,
+                             opt.attributeCaptureFilePath,
+                             subjectIdFormat=opt.subjectIdFormat,
+                             xacmlExtFunc=opt.xacmlExtFunc)
+
+    results = []
+    transitions = Counter()
+    elapsedTimes = []
+    for record, decision, elapsed in replay(
+                                    handler,
+                                    readCaptureLog(opt.captureFilePath),
+                                    subjectIdFormat=opt.subjectIdFormat):
+        transitions[(record['d'], decision)] += 1
+        elapsedTimes.append(elapsed)
+        results.append({
+            'timestamp': record.get('t'),
+            'resource': record['r'],
+            'method': record.get('m'),
+            'recorded': record['d'],
+            'replayed': decision,
+            'recordedLatency_ms': record.get('l'),
+            'evaluation_ms': round(elapsed * 1e3, 3)
+        })
+
+    nMatches = sum([n for (recorded, replayed), n in transitions.items()
+                    if recorded == replayed])
+    summary = {
+        'requests': len(results),
+        'matches': nMatches,
+        'mismatches': len(results) - nMatches,
+        'transitions': dict([('%s->%s' % key, n)
+                             for key, n in transitions.items()]),
+        'evaluation': summarise(elapsedTimes)
+    }
+
+    print('Replayed %d requests: %d decisions match, %d differ' % (
+                    summary['requests'], nMatches, summary['mismatches']))
+    for key, n in sorted(summary['transitions'].items()):
+        print('  %-30s %d' % (key, n))
+
+    if elapsedTimes:
+        print('Evaluation time p50=%.2fms p95=%.2fms p99=%.2fms max=%.2fms' %
+              (summary['evaluation']['p50_ms'], summary['evaluation']['p95_ms'],
+               summary['evaluation']['p99_ms'], summary['evaluation']['max_ms']))
+
+    mismatches = [result for result in results
+                  if result['recorded'] != result['replayed']]
+    for result in mismatches[:opt.maxMismatches]:
+        print('  %(recorded)s -> %(replayed)s %(method)s %(resource)s' % result)
+
+    if opt.output:
+        with open(opt.output, 'w') as outputFile:
+            json.dump({'summary': summary, 'results': results}, outputFile,
+                      indent=2)
+
+    return summary['mismatches'] == 0 and 0 or 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,6 +12,7 @@ import logging
 log = logging.getLogger(__name__)
 
 from os import path
+from time import perf_counter
 from configparser import SafeConfigParser, ConfigParser
 from datetime import datetime, timedelta
 from uuid import uuid4
@@ -33,7 +34,10 @@ from ndg.xacml.parsers.etree.factory import ReaderFactory as \
 from ndg.xacml.utils.xpath_selector import EtreeXPathSelector
 
 from ndg.security.server.xacml.pip.saml_pip import PIP
+from ndg.security.server.xacml.ctx_handler.profiler import PolicyProfiler
+from ndg.security.common.utils import str2Bool
 from ndg.security.common.utils.factory import importModuleObject
+from ndg.security.server.utils import metrics
 
 
 class SamlPEPRequest(object):
@@ -80,11 +84,19 @@ class SamlCtxHandler(_xacmlContext.handler.CtxHandlerBase):
     DEFAULT_OPT_PREFIX = 'saml_ctx_handler.'
     PIP_OPT_PREFIX = 'pip.'
     
+    PHASE_TIMER_NAME = 'ndg_security_ctx_handler_phase_seconds'
+    PHASE_TIMER_DOC = ('Time spent in each phase of context handler request '
+                       'handling')
+    
     __slots__ = (
         '__policyFilePath',
         '__issuerProxy', 
         '__assertionLifetime',
-        '__xacmlExtFunc'
+        '__xacmlExtFunc',
+        '__profile',
+        '__profileWindow',
+        '__profileFilePath',
+        '__profiler'
     )
     
     def __init__(self):
@@ -99,6 +111,10 @@ class SamlCtxHandler(_xacmlContext.handler.CtxHandlerBase):
         self.__assertionLifetime = 0.
         self.__policyFilePath = None
         self.__xacmlExtFunc = None
+        self.__profile = False
+        self.__profileWindow = PolicyProfiler.DEFAULT_WINDOW
+        self.__profileFilePath = None
+        self.__profiler = None
 
     def _getXacmlExtFunc(self):
         """Get XACML extensions functions"""
@@ -151,6 +167,13 @@ class SamlCtxHandler(_xacmlContext.handler.CtxHandlerBase):
         
         if self.pip.mappingFilePath:
             self.pip.readMappingFile()
+            
+        if self.profile and self.pdp is not None:
+            self.__profiler = PolicyProfiler(window=self.profileWindow,
+                                             reportFilePath=self.profileFilePath)
+            self.__profiler.instrument(self.pdp.policy)
+        else:
+            self.__profiler = None
         
     @classmethod
     def fromConfig(cls, cfg, **kw):
@@ -331,6 +354,56 @@ class SamlCtxHandler(_xacmlContext.handler.CtxHandlerBase):
                                      "set assertion conditions notOnOrAfter "
                                      "time")
  
+    def _getProfile(self):
+        return self.__profile
+
+    def _setProfile(self, value):
+        if isinstance(value, bool):
+            self.__profile = value
+        elif isinstance(value, str):
+            self.__profile = str2Bool(value)
+        else:
+            raise TypeError('Expecting bool or string type for "profile" '
+                            'attribute; got %r' % type(value))
+
+    profile = property(_getProfile, _setProfile,
+                       doc="Set to True to record per policy and per rule "
+                           "evaluation statistics.  This takes effect when the "
+                           "policy is loaded")
+
+    def _getProfileWindow(self):
+        return self.__profileWindow
+
+    def _setProfileWindow(self, value):
+        if isinstance(value, (int, float, str)):
+            self.__profileWindow = float(value)
+        else:
+            raise TypeError('Expecting int, float or string type for '
+                            '"profileWindow" attribute; got %r' % type(value))
+
+    profileWindow = property(_getProfileWindow, _setProfileWindow,
+                             doc="Time window in seconds over which policy "
+                                 "evaluation statistics are aggregated")
+
+    def _getProfileFilePath(self):
+        return self.__profileFilePath
+
+    def _setProfileFilePath(self, value):
+        if not isinstance(value, str):
+            raise TypeError('Expecting string type for "profileFilePath" '
+                            'attribute; got %r' % type(value))
+        self.__profileFilePath = path.expandvars(value) or None
+
+    profileFilePath = property(_getProfileFilePath, _setProfileFilePath,
+                               doc="File to write a JSON policy evaluation "
+                                   "report to at the end of each profile "
+                                   "window")
+
+    @property
+    def profiler(self):
+        """Policy evaluation profiler or None if profiling is disabled"""
+        return self.__profiler
+
     def handlePEPRequest(self, pepRequest):
         """Handle request from Policy Enforcement Point
         
@@ -344,40 +417,45 @@ class SamlCtxHandler(_xacmlContext.handler.CtxHandlerBase):
 
         xacml_profile = isinstance(samlAuthzDecisionQuery,
                                    XACMLAuthzDecisionQuery)
-        if xacml_profile:
-            # Using XACML profile so the Request is passed in the query.
-            xacmlRequest = samlAuthzDecisionQuery.xacmlContextRequest
-        else:
-            xacmlRequest = self._createXacmlRequestCtx(samlAuthzDecisionQuery)
-        
-        # Add a reference to this context so that the PDP can invoke queries
-        # back to the PIP
-        xacmlRequest.ctxHandler = self
-
-        # Set XPath implementation for attribute selector.
-        ### TODO make this configurable?
-        if xacmlRequest.elem is not None:
-            xacmlRequest.attributeSelector = EtreeXPathSelector(
+        with self.phaseTimer('request_build').time():
+            if xacml_profile:
+                # Using XACML profile so the Request is passed in the query.
+                xacmlRequest = samlAuthzDecisionQuery.xacmlContextRequest
+            else:
+                xacmlRequest = self._createXacmlRequestCtx(
+                                                        samlAuthzDecisionQuery)
+            
+            # Add a reference to this context so that the PDP can invoke 
+            # queries back to the PIP
+            xacmlRequest.ctxHandler = self
+    
+            # Set XPath implementation for attribute selector.
+            ### TODO make this configurable?
+            if xacmlRequest.elem is not None:
+                xacmlRequest.attributeSelector = EtreeXPathSelector(
                                                             xacmlRequest.elem)
 
-        # Call the PDP
-        xacmlResponse = self.pdp.evaluate(xacmlRequest)
+        # Call the PDP.  Nb. this time includes any PIP queries made during 
+        # evaluation - these are also recorded separately under 'pip_query'
+        with self.phaseTimer('pdp_evaluate').time():
+            xacmlResponse = self.pdp.evaluate(xacmlRequest)
         
-        # Create the SAML Response
-        samlResponse, assertion = self._createSAMLResponseAssertion(
+        with self.phaseTimer('response_build').time():
+            # Create the SAML Response
+            samlResponse, assertion = self._createSAMLResponseAssertion(
                                     samlAuthzDecisionQuery, pepRequest.response)
-
-        # Add decision statement to assertion.
-        if xacml_profile:
-            # Using XACML profile so the Response is returned in the decision
-            # statement.
-            self._createXacmlAuthzDecisionStatement(assertion,
-                                                    samlAuthzDecisionQuery,
-                                                    xacmlResponse)
-        else:
-            self._createSamlAuthzDecisionStatement(assertion,
-                                                   samlAuthzDecisionQuery,
-                                                   xacmlResponse)
+    
+            # Add decision statement to assertion.
+            if xacml_profile:
+                # Using XACML profile so the Response is returned in the 
+                # decision statement.
+                self._createXacmlAuthzDecisionStatement(assertion,
+                                                        samlAuthzDecisionQuery,
+                                                        xacmlResponse)
+            else:
+                self._createSamlAuthzDecisionStatement(assertion,
+                                                       samlAuthzDecisionQuery,
+                                                       xacmlResponse)
 
         return samlResponse
         
@@ -403,7 +481,28 @@ class SamlCtxHandler(_xacmlContext.handler.CtxHandlerBase):
         if self.pip is None:
             return None
         else:
-            return self.pip.attributeQuery(request, designator)
+            with self.phaseTimer('pip_query').time():
+                if self.__profiler is None:
+                    return self.pip.attributeQuery(request, designator)
+                
+                start = perf_counter()
+                try:
+                    return self.pip.attributeQuery(request, designator)
+                finally:
+                    self.__profiler.recordPipQuery(perf_counter() - start)
+    
+    @classmethod
+    def phaseTimer(cls, phase):
+        '''Get the metrics timer for a given phase of request handling
+        
+        @param phase: name of phase e.g. 'pdp_evaluate'
+        @type phase: basestring
+        @return: timer for the given phase
+        @rtype: ndg.security.server.utils.metrics.Timer
+        '''
+        return metrics.registry.timer(cls.PHASE_TIMER_NAME, 
+                                      cls.PHASE_TIMER_DOC, 
+                                      phase=phase)
     
     def _createXacmlRequestCtx(self, samlAuthzDecisionQuery):
         """Translate SAML authorisation decision query into a XACML request
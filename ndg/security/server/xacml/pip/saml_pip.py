@@ -33,6 +33,8 @@ from ndg.saml.saml2.binding.soap.client.attributequery import \
 from ndg.security.common.utils import VettedDict, str2Bool
 from ndg.security.common.credentialwallet import SAMLAssertionWallet
 from ndg.security.server.utils.parsers import keyword_parser
+from ndg.security.server.utils import metrics
+from ndg.security.server.utils.capture import CaptureLog, hashSubject
 
 
 class SessionCache(object):
@@ -161,6 +163,15 @@ class PIP(PIPInterface):
 
     MAPPING_FILE_FIELD_SEP = ','
 
+    ATTRIBUTE_QUERY_TIMER_NAME = 'ndg_security_pip_attribute_query_seconds'
+    ATTRIBUTE_QUERY_TIMER_DOC = ('Time taken for attribute queries to each '
+                                 'Attribute Authority')
+    CACHE_COUNTER_NAME = 'ndg_security_pip_session_cache_total'
+    CACHE_COUNTER_DOC = ('PIP session cache lookups for each Attribute '
+                         'Authority by result')
+    ERROR_COUNTER_NAME = 'ndg_security_pip_attribute_query_errors_total'
+    ERROR_COUNTER_DOC = 'Failed attribute queries to each Attribute Authority'
+
     __slots__ = (
         '__subjectAttributeId',
         '__mappingFilePath',
@@ -170,7 +181,10 @@ class PIP(PIPInterface):
         '__cacheSessions',
         '__sessionCacheDataDir',
         '__sessionCacheTimeout',
-        '__sessionCacheAssertionClockSkewTol'
+        '__sessionCacheAssertionClockSkewTol',
+        '__captureFilePath',
+        '__captureSubjectSalt',
+        '__captureLog'
     )
 
     def __init__(self, sessionCacheDataDir=None, sessionCacheTimeout=None,
@@ -203,6 +217,10 @@ class PIP(PIPInterface):
 
         self.__cacheSessions = True
 
+        self.__captureFilePath = None
+        self.__captureSubjectSalt = ''
+        self.__captureLog = None
+
     def _getSessionCacheTimeout(self):
         return self.__sessionCacheTimeout
 
@@ -267,6 +285,45 @@ class PIP(PIPInterface):
                              doc="Cache attribute query results to optimise "
                                  "performance")
 
+    def _getCaptureFilePath(self):
+        return self.__captureFilePath
+
+    def _setCaptureFilePath(self, value):
+        if not isinstance(value, (str, type(None))):
+            raise TypeError('Expecting string/None type for '
+                            '"captureFilePath"; got %r' % type(value))
+
+        self.__captureFilePath = value
+        if value:
+            self.__captureLog = CaptureLog(value)
+        else:
+            self.__captureLog = None
+
+    captureFilePath = property(_getCaptureFilePath,
+                               _setCaptureFilePath,
+                               doc="Set to a file path to record attributes "
+                                   "returned from Attribute Authority queries "
+                                   "so that they can be served by stub "
+                                   "Attribute Authorities when replaying "
+                                   "captured traffic - see ndg.security."
+                                   "server.xacml.ctx_handler.replay")
+
+    def _getCaptureSubjectSalt(self):
+        return self.__captureSubjectSalt
+
+    def _setCaptureSubjectSalt(self, value):
+        if not isinstance(value, str):
+            raise TypeError('Expecting string type for "captureSubjectSalt"; '
+                            'got %r' % type(value))
+
+        self.__captureSubjectSalt = value
+
+    captureSubjectSalt = property(_getCaptureSubjectSalt,
+                                  _setCaptureSubjectSalt,
+                                  doc="Key for hash of subject identifiers in "
+                                      "the capture log.  This must match the "
+                                      "setting for the PEP capture log")
+
     def _getSessionCacheDataDir(self):
         return self.__sessionCacheDataDir
 
@@ -315,6 +372,16 @@ class PIP(PIPInterface):
         """SAML SOAP Attribute Query client binding object"""
         return self.__attribute_query_binding
 
+    @attribute_query_binding.setter
+    def attribute_query_binding(self, value):
+        """Set an alternative binding e.g. a stub for offline testing.  It must
+        implement send(query, uri=...) returning a SAML Response"""
+        if not callable(getattr(value, 'send', None)):
+            raise TypeError('Expecting object with a "send" method for '
+                            '"attribute_query_binding"; got %r' % type(value))
+
+        self.__attribute_query_binding = value
+
     def __setattr__(self, name, val):
         if '.' in name:
             obj_name, obj_attr_name = name.split('.', 1)
@@ -342,6 +409,35 @@ class PIP(PIPInterface):
                 self.__attributeId2AttributeAuthorityMap[attribute_id.strip()
                                             ] = attribute_authority_uri.strip()
 
+    def _captureAttributes(self, subjectId, attributeAuthorityURI,
+                           assertions):
+        '''Record attributes returned from an Attribute Authority in the
+        capture log
+
+        @param subjectId: subject of the attribute query
+        @type subjectId: basestring
+        @param attributeAuthorityURI: Attribute Authority queried
+        @type attributeAuthorityURI: basestring
+        @param assertions: assertions returned
+        @type assertions: iterable
+        '''
+        subjectHash = hashSubject(subjectId, salt=self.captureSubjectSalt)
+        for assertion in assertions:
+            for statement in assertion.attributeStatements:
+                for attribute in statement.attributes:
+                    values = []
+                    for samlAttrVal in attribute.attributeValues:
+                        value = samlAttrVal.value
+                        if isinstance(value, (tuple, list)):
+                            value = list(value)
+                        values.append(value)
+
+                    self.__captureLog.write(s=subjectHash,
+                                            aa=attributeAuthorityURI,
+                                            a=attribute.name,
+                                            f=attribute.nameFormat,
+                                            v=values)
+
     def attributeQuery(self, context, attributeDesignator):
         """Query this PIP for the given request context attribute specified by
         the attribute designator.  Nb. this implementation is only intended to
@@ -432,6 +528,12 @@ class PIP(PIPInterface):
                                 attributeIdFoundInCache = True
                                 break
 
+            metrics.registry.counter(
+                    self.__class__.CACHE_COUNTER_NAME,
+                    self.__class__.CACHE_COUNTER_DOC,
+                    attributeAuthority=attributeAuthorityURI,
+                    result=attributeIdFoundInCache and 'hit' or 'miss').inc()
+
         if not attributeIdFoundInCache:
             # No cached assertions are available for this Attribute Authority,
             # for the required attribute ID - make a fresh call to the
@@ -454,12 +556,20 @@ class PIP(PIPInterface):
 
             # Dispatch query
             try:
-                response = self.attribute_query_binding.send(query,
+                with metrics.registry.timer(
+                        self.__class__.ATTRIBUTE_QUERY_TIMER_NAME,
+                        self.__class__.ATTRIBUTE_QUERY_TIMER_DOC,
+                        attributeAuthority=attributeAuthorityURI).time():
+                    response = self.attribute_query_binding.send(query,
                                                     uri=attributeAuthorityURI)
 
                 log.debug('Retrieved response from attribute service %r',
                           attributeAuthorityURI)
             except Exception:
+                metrics.registry.counter(
+                        self.__class__.ERROR_COUNTER_NAME,
+                        self.__class__.ERROR_COUNTER_DOC,
+                        attributeAuthority=attributeAuthorityURI).inc()
                 log.exception('Error querying Attribute service %r with '
                               'subject %r', attributeAuthorityURI, subjectId)
                 raise
@@ -472,6 +582,10 @@ class PIP(PIPInterface):
             if self.cacheSessions:
                 sessionCache.add(assertions, attributeAuthorityURI)
 
+            if self.__captureLog is not None:
+                self._captureAttributes(subjectId, attributeAuthorityURI,
+                                        response.assertions)
+
         # Unpack SAML assertion attribute corresponding to the name
         # format specified and copy into XACML attributes
         xacmlAttribute = XacmlAttribute()
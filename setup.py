@@ -22,6 +22,7 @@ except ImportError:
 _ENTRY_POINTS = """
     [console_scripts]
     myproxy-saml-assertion-cert-ext-app=ndg.security.server.myproxy.certificate_extapp.saml_attribute_assertion:CertExtConsoleApp.run
+    ndg-security-authz-replay=ndg.security.server.xacml.ctx_handler.replay:main
 
     [paste.app_factory]
     main=ndg.security.server.pylons.container.config.middleware:make_app